@@ -2,7 +2,13 @@ from django.contrib import admin
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 
-from accounts.models import Account, AccountTeam, AccountTier, AccountUser
+from accounts.models import (
+    Account,
+    AccountTeam,
+    AccountTier,
+    AccountUsage,
+    AccountUser,
+)
 from accounts.tasks import set_image_from_socialaccounts
 
 
@@ -74,6 +80,23 @@ class AccountTeamAdmin(admin.ModelAdmin):
     search_fields = ["account__name", "name"]
 
 
+@admin.register(AccountUsage)
+class AccountUsageAdmin(admin.ModelAdmin):
+    """Admin interface for account usage."""
+
+    list_display = [
+        "account",
+        "month",
+        "storage_working",
+        "storage_snapshots",
+        "file_downloads",
+        "job_runtime",
+        "dois_created",
+    ]
+    list_filter = ["month"]
+    search_fields = ["account__name"]
+
+
 @admin.register(AccountTier)
 class AccountTierAdmin(admin.ModelAdmin):
     """Admin interface for account tiers."""
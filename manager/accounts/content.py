@@ -0,0 +1,134 @@
+"""
+Cache of the resolutions of requests for account content.
+
+Each request for account content (see `accounts.ui.views.content`) needs
+to resolve the account, project, snapshot and file to serve. These resolutions
+are cached, keyed by the account name, project name, version and file path in the URL,
+so that repeated requests for the same content do not need to query the database.
+
+Because there may be many cached resolutions for a project, rather than deleting
+each of them, they are invalidated by deleting the "generation" of the
+account or project. A resolution is only used if the generations that it was
+cached with are still current. The `invalidate_account_content` and
+`invalidate_project_content` functions are called when accounts, projects,
+snapshots and files change (see the `post_save` and `post_delete` signal handlers
+on those models) and when files are changed in bulk (e.g. see `File.decurrent`
+and `Source.pull_callback`).
+
+Generations must be shared by all processes serving content, so in production
+the cache is the `cache` service (see `manager.cache`).
+"""
+
+import hashlib
+import uuid
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+def generation_key(kind: str, id: int) -> str:
+    """Get the cache key for the generation of an account or project."""
+    return "content-{kind}-{id}-generation".format(kind=kind, id=id)
+
+
+def resolution_key(
+    account_name: str,
+    project_name: str,
+    version: Optional[str],
+    file_path: Optional[str],
+) -> str:
+    """
+    Get the cache key for a resolution.
+
+    The parts of the URL are hashed because file paths can
+    contain characters that are not allowed in some cache backends.
+    """
+    parts = "\n".join([account_name, project_name, version or "", file_path or ""])
+    return "content-resolution-{hash}".format(
+        hash=hashlib.sha1(parts.encode()).hexdigest()
+    )
+
+
+def get_generations(account_id: int, project_id: int) -> List[str]:
+    """
+    Get the current generations of an account and a project.
+
+    Should be called before the resolution is done so that
+    any invalidation during the resolution is not missed.
+    """
+    keys = [
+        generation_key("account", account_id),
+        generation_key("project", project_id),
+    ]
+    generations = cache.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            cache.add(key, uuid.uuid4().hex, None)
+            generations[key] = cache.get(key)
+    return [generations[key] for key in keys]
+
+
+def get_resolution(
+    account_name: str,
+    project_name: str,
+    version: Optional[str],
+    file_path: Optional[str],
+) -> Optional[Dict]:
+    """
+    Get a cached resolution if it is still current.
+    """
+    resolution = cache.get(
+        resolution_key(account_name, project_name, version, file_path)
+    )
+    if resolution is None:
+        return None
+
+    keys = [
+        generation_key("account", resolution["account"].id),
+        generation_key("project", resolution["project"].id),
+    ]
+    generations = cache.get_many(keys)
+    if [generations.get(key) for key in keys] != resolution["generations"]:
+        return None
+
+    return resolution
+
+
+def set_resolution(
+    account_name: str,
+    project_name: str,
+    version: Optional[str],
+    file_path: Optional[str],
+    generations: List[str],
+    **resolution,
+):
+    """
+    Cache a resolution for `CONTENT_CACHE_SECONDS`.
+    """
+    cache.set(
+        resolution_key(account_name, project_name, version, file_path),
+        dict(generations=generations, **resolution),
+        settings.CONTENT_CACHE_SECONDS,
+    )
+
+
+def invalidate_account_content(account_id: int):
+    """
+    Invalidate all cached resolutions for an account.
+    """
+    cache.delete(generation_key("account", account_id))
+
+
+def invalidate_project_content(project_id: int):
+    """
+    Invalidate all cached resolutions for a project.
+
+    The generation is deleted immediately, and again when the current transaction
+    is committed (so that resolutions done, using the old files, while the
+    transaction is in progress are not used).
+    """
+    key = generation_key("project", project_id)
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
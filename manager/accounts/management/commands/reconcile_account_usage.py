@@ -0,0 +1,159 @@
+from collections import defaultdict
+from typing import Dict, Tuple
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+from accounts.models import AccountUsage
+from dois.models import Doi
+from jobs.models import Job
+from projects.models.files import File, FileDownloads
+
+# Usage amounts keyed by account id and month
+Usage = Dict[Tuple[int, str], Dict[str, float]]
+
+
+def calculate_usage() -> Usage:
+    """
+    Calculate the usage of all accounts from scratch.
+    """
+    usage: Usage = defaultdict(dict)
+
+    for account_id, size in (
+        File.objects.filter(current=True, snapshot__isnull=True)
+        .values_list("project__account_id")
+        .annotate(size=Sum("size"))
+        .order_by()
+    ):
+        usage[(account_id, "")]["storage_working"] = size or 0
+
+    for account_id, size in (
+        File.objects.filter(snapshot__isnull=False)
+        .values_list("project__account_id")
+        .annotate(size=Sum("size"))
+        .order_by()
+    ):
+        usage[(account_id, "")]["storage_snapshots"] = size or 0
+
+    for account_id, month, downloads in (
+        FileDownloads.objects.values_list("file__project__account_id", "month")
+        .annotate(downloads=Sum(F("count") * F("file__size")))
+        .order_by()
+    ):
+        usage[(account_id, month)]["file_downloads"] = downloads or 0
+
+    for account_id, month, runtime in (
+        Job.objects.filter(runtime__isnull=False, project__isnull=False)
+        .annotate(month=TruncMonth(Coalesce("ended", "updated")))
+        .values_list("project__account_id", "month")
+        .annotate(runtime=Sum("runtime"))
+        .order_by()
+    ):
+        usage[(account_id, month.strftime("%Y-%m"))]["job_runtime"] = runtime or 0
+
+    for account_id, month, dois in (
+        Doi.objects.filter(node__project__isnull=False)
+        .annotate(month=TruncMonth("created"))
+        .values_list("node__project__account_id", "month")
+        .annotate(dois=Count("id"))
+        .order_by()
+    ):
+        usage[(account_id, month.strftime("%Y-%m"))]["dois_created"] = dois
+
+    return usage
+
+
+FIELDS = (
+    "storage_working",
+    "storage_snapshots",
+    "file_downloads",
+    "job_runtime",
+    "dois_created",
+)
+
+
+class Command(BaseCommand):
+    """
+    A management command to reconcile the `AccountUsage` ledger.
+
+    Recalculates the usage of each account from scratch and reports any
+    differences from the running totals in `AccountUsage` (e.g. due to
+    a failure between changing files and updating usage). Use `--fix` to
+    update the running totals to the recalculated values. Existing usage
+    is calculated by the `0013_backfill_account_usage` migration.
+
+    Example usage:
+
+    # Report any drift
+    ./venv/bin/python3 manage.py reconcile_account_usage
+
+    # Report and fix any drift
+    ./venv/bin/python3 manage.py reconcile_account_usage --fix
+    """
+
+    help = "Reconciles account usage with a recalculation from scratch."
+
+    def add_arguments(self, parser):
+        """
+        Add arguments for this command.
+        """
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Update account usage to the recalculated values.",
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        """
+        Handle the command (ie. execute it).
+        """
+        fix = options["fix"]
+        expected = calculate_usage()
+        existing = dict(
+            ((usage.account_id, usage.month), usage)
+            for usage in AccountUsage.objects.select_for_update()
+        )
+
+        drifted = 0
+        for key in set(expected.keys()) | set(existing.keys()):
+            amounts = expected.get(key, {})
+            usage = existing.get(key) or AccountUsage(account_id=key[0], month=key[1])
+            changes = dict(
+                (field, (getattr(usage, field), amounts.get(field, 0)))
+                for field in FIELDS
+                if getattr(usage, field) != amounts.get(field, 0)
+            )
+            if not changes:
+                continue
+
+            drifted += 1
+            self.stdout.write(
+                "Account {account} {month}: {changes}".format(
+                    account=key[0],
+                    month=key[1] or "(all time)",
+                    changes=", ".join(
+                        "{field} {old} -> {new}".format(field=field, old=old, new=new)
+                        for field, (old, new) in changes.items()
+                    ),
+                )
+            )
+            if fix:
+                for field, (old, new) in changes.items():
+                    setattr(usage, field, new)
+                usage.save()
+
+        if drifted == 0:
+            self.stdout.write(self.style.SUCCESS("No drift found."))
+        elif fix:
+            self.stdout.write(
+                self.style.SUCCESS("Fixed drift for {} rows.".format(drifted))
+            )
+        else:
+            self.stdout.write(
+                self.style.WARNING(
+                    "Found drift for {} rows. Use --fix to fix.".format(drifted)
+                )
+            )
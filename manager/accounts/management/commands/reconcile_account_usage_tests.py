@@ -0,0 +1,38 @@
+from io import StringIO
+
+import pytest
+from django.core.management import call_command
+
+from accounts.models import AccountTier, AccountUsage
+from projects.models.files import File
+from projects.models.projects import Project
+from users.models import User
+
+
+@pytest.mark.django_db
+def test_reconcile_account_usage():
+    AccountTier.objects.create()
+    user = User.objects.create(username="user")
+    account = user.personal_account
+    project = Project.objects.create(account=account, creator=user, name="project")
+
+    # Usage is maintained incrementally
+    File.create(project, "a.txt", dict(size=100))
+    File.create(project, "b.txt", dict(size=1000))
+    File.create(project, "a.txt", dict(size=200))
+    assert AccountUsage.get(account.id).storage_working == 1200
+
+    def reconcile(*args):
+        out = StringIO()
+        call_command("reconcile_account_usage", *args, stdout=out)
+        return out.getvalue()
+
+    assert "No drift found" in reconcile()
+
+    AccountUsage.objects.filter(account=account, month="").update(storage_working=42)
+    assert "storage_working 42 -> 1200" in reconcile()
+    assert AccountUsage.get(account.id).storage_working == 42
+
+    assert "Fixed drift for 1 rows" in reconcile("--fix")
+    assert AccountUsage.get(account.id).storage_working == 1200
+    assert "No drift found" in reconcile()
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.7 on 2026-10-18 03:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_auto_20210210_2340'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountUsage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.CharField(blank=True, help_text='The calendar month, in YYYY-MM format, that the usage is for. Empty for usage that is not per month.', max_length=7)),
+                ('storage_working', models.BigIntegerField(default=0, help_text="Total size, in bytes, of the current files in the working directories of the account's projects.")),
+                ('storage_snapshots', models.BigIntegerField(default=0, help_text="Total size, in bytes, of the files in the snapshots of the account's projects.")),
+                ('file_downloads', models.BigIntegerField(default=0, help_text="Total size, in bytes, of downloads of the account's files.")),
+                ('job_runtime', models.FloatField(default=0, help_text="Total runtime, in seconds, of jobs for the account's projects.")),
+                ('dois_created', models.IntegerField(default=0, help_text="Number of DOIs created for the account's projects.")),
+                ('account', models.ForeignKey(help_text='Account that the usage is for.', on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='accounts.account')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='accountusage',
+            constraint=models.UniqueConstraint(fields=('account', 'month'), name='accountusage_unique_account_month'),
+        ),
+    ]
@@ -0,0 +1,85 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+
+
+def backfill_account_usage(apps, schema_editor):
+    """
+    Calculate the usage of existing accounts.
+
+    The same calculation as done by the `reconcile_account_usage`
+    management command but using the historical models.
+    """
+    AccountUsage = apps.get_model("accounts", "AccountUsage")
+    File = apps.get_model("projects", "File")
+    FileDownloads = apps.get_model("projects", "FileDownloads")
+    Job = apps.get_model("jobs", "Job")
+    Doi = apps.get_model("dois", "Doi")
+
+    usage = defaultdict(dict)
+
+    for account_id, size in (
+        File.objects.filter(current=True, snapshot__isnull=True)
+        .values_list("project__account_id")
+        .annotate(size=Sum("size"))
+        .order_by()
+    ):
+        usage[(account_id, "")]["storage_working"] = size or 0
+
+    for account_id, size in (
+        File.objects.filter(snapshot__isnull=False)
+        .values_list("project__account_id")
+        .annotate(size=Sum("size"))
+        .order_by()
+    ):
+        usage[(account_id, "")]["storage_snapshots"] = size or 0
+
+    for account_id, month, downloads in (
+        FileDownloads.objects.values_list("file__project__account_id", "month")
+        .annotate(downloads=Sum(F("count") * F("file__size")))
+        .order_by()
+    ):
+        usage[(account_id, month)]["file_downloads"] = downloads or 0
+
+    for account_id, month, runtime in (
+        Job.objects.filter(runtime__isnull=False, project__isnull=False)
+        .annotate(month=TruncMonth(Coalesce("ended", "updated")))
+        .values_list("project__account_id", "month")
+        .annotate(runtime=Sum("runtime"))
+        .order_by()
+    ):
+        usage[(account_id, month.strftime("%Y-%m"))]["job_runtime"] = runtime or 0
+
+    for account_id, month, dois in (
+        Doi.objects.filter(node__project__isnull=False)
+        .annotate(month=TruncMonth("created"))
+        .values_list("node__project__account_id", "month")
+        .annotate(dois=Count("id"))
+        .order_by()
+    ):
+        usage[(account_id, month.strftime("%Y-%m"))]["dois_created"] = dois
+
+    AccountUsage.objects.all().delete()
+    AccountUsage.objects.bulk_create(
+        [
+            AccountUsage(account_id=account_id, month=month, **amounts)
+            for (account_id, month), amounts in usage.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0012_account_usage'),
+        ('dois', '0001_initial'),
+        ('jobs', '0015_auto_20261018_0318'),
+        ('projects', '0035_flush_source_events'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_account_usage, migrations.RunPython.noop),
+    ]
@@ -11,13 +11,15 @@ import stripe
 from allauth.socialaccount.models import SocialAccount
 from django.conf import settings
 from django.core.files.base import ContentFile
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, post_save
 from django.shortcuts import reverse
+from django.utils import timezone
 from imagefield.fields import ImageField
 from meta.views import Meta
 
 import accounts.webhooks  # noqa
+from accounts.content import invalidate_account_content
 from manager.helpers import EnumChoice, unique_slugify
 from manager.storage import media_storage
 from users.models import User
@@ -444,6 +446,20 @@ def make_account_creator_an_owner(
 post_save.connect(make_account_creator_an_owner, sender=Account)
 
 
+def invalidate_content_for_account(sender, instance: Account, *args, **kwargs):
+    """
+    Invalidate the cached resolutions of content for an account.
+
+    Makes sure that changes to an account (e.g. to its name or
+    extra content) are reflected in the content served for it.
+    """
+    invalidate_account_content(instance.id)
+
+
+post_save.connect(invalidate_content_for_account, sender=Account)
+post_delete.connect(invalidate_content_for_account, sender=Account)
+
+
 def create_personal_account_for_user(
     sender, instance: User, created: bool, *args, **kwargs
 ):
@@ -734,3 +750,112 @@ class AccountTeam(models.Model):
             queryset=AccountTeam.objects.filter(account=self.account),
         )
         return super().save(*args, **kwargs)
+
+
+class AccountUsage(models.Model):
+    """
+    Usage of resources by an account.
+
+    A ledger of running totals used for account quotas (see `accounts.quotas`)
+    so that checking a quota is a single row read rather than an aggregation
+    over all of an account's files, jobs etc. Totals are updated incrementally,
+    using `AccountUsage.add`, as usage changes (e.g. when files are created or
+    made non-current, jobs end, downloads are flushed, and DOIs are created).
+
+    Usage that is limited per month (e.g. `file_downloads`) is recorded in a row
+    for the month. Usage that is not (e.g. `storage_working`) is recorded in a
+    row with an empty `month`. The `reconcile_account_usage` management command
+    recalculates usage from scratch to detect, and correct, any drift.
+    """
+
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name="usage",
+        help_text="Account that the usage is for.",
+    )
+
+    month = models.CharField(
+        max_length=7,
+        blank=True,
+        help_text="The calendar month, in YYYY-MM format, that the usage is for. "
+        "Empty for usage that is not per month.",
+    )
+
+    storage_working = models.BigIntegerField(
+        default=0,
+        help_text="Total size, in bytes, of the current files in the working "
+        "directories of the account's projects.",
+    )
+
+    storage_snapshots = models.BigIntegerField(
+        default=0,
+        help_text="Total size, in bytes, of the files in the snapshots "
+        "of the account's projects.",
+    )
+
+    file_downloads = models.BigIntegerField(
+        default=0,
+        help_text="Total size, in bytes, of downloads of the account's files.",
+    )
+
+    job_runtime = models.FloatField(
+        default=0,
+        help_text="Total runtime, in seconds, of jobs for the account's projects.",
+    )
+
+    dois_created = models.IntegerField(
+        default=0, help_text="Number of DOIs created for the account's projects.",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "month"], name="%(class)s_unique_account_month"
+            )
+        ]
+
+    @staticmethod
+    def current_month() -> str:
+        """Get the current month in YYYY-MM format."""
+        return timezone.now().isoformat()[:7]
+
+    @staticmethod
+    def get(account_id: int, month: str = "") -> "AccountUsage":
+        """
+        Get the usage for an account (for a month).
+
+        Returns an unsaved instance, with zero usage, if there is none.
+        """
+        try:
+            return AccountUsage.objects.get(account_id=account_id, month=month)
+        except AccountUsage.DoesNotExist:
+            return AccountUsage(account_id=account_id, month=month)
+
+    @staticmethod
+    def add(account_id: int, month: str = "", **amounts: float):
+        """
+        Add amounts to the usage for an account (for a month).
+
+        Uses an atomic update, and only creates the row if
+        necessary, so that concurrent additions are not lost.
+        """
+        amounts = dict((field, amount) for field, amount in amounts.items() if amount)
+        if not amounts:
+            return
+
+        usage = AccountUsage.objects.filter(account_id=account_id, month=month)
+        updates = dict(
+            (field, models.F(field) + amount) for field, amount in amounts.items()
+        )
+        if usage.update(**updates):
+            return
+
+        try:
+            with transaction.atomic():
+                AccountUsage.objects.create(
+                    account_id=account_id, month=month, **amounts
+                )
+        except IntegrityError:
+            # Created concurrently, so update that instead
+            usage.update(**updates)
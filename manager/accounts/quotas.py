@@ -1,15 +1,9 @@
-from datetime import datetime
 from typing import Callable, Dict, NamedTuple
 
 from django.core.cache import cache
-from django.db.models import F, Sum
-from django.utils import timezone
 
-from accounts.models import Account, AccountTeam, AccountTier, AccountUser
-from dois.models import Doi
-from jobs.models import Job
+from accounts.models import Account, AccountTeam, AccountTier, AccountUsage, AccountUser
 from manager.api.exceptions import AccountQuotaExceeded
-from projects.models.files import File, FileDownloads
 from projects.models.projects import Project
 
 
@@ -71,7 +65,12 @@ def bytes_to_gigabytes(value: float) -> float:
 
 
 class AccountQuotas:
-    """List of account quotas."""
+    """
+    List of account quotas.
+
+    Quotas for storage, downloads, job runtime and DOIs are read from
+    the running totals in `AccountUsage` rather than being aggregated.
+    """
 
     ORGS_CREATED = AccountQuota(
         "orgs_created",
@@ -111,10 +110,7 @@ class AccountQuotas:
     STORAGE_WORKING = AccountQuota(
         "storage_working",
         lambda account: bytes_to_gigabytes(
-            File.objects.filter(
-                project__account=account, snapshot__isnull=True
-            ).aggregate(storage=Sum("size"))["storage"]
-            or 0
+            AccountUsage.get(account.id).storage_working
         ),
         "Storage limit for project working directories has been reached."
         "Please upgrade the plan for the account.",
@@ -123,10 +119,7 @@ class AccountQuotas:
     STORAGE_SNAPSHOTS = AccountQuota(
         "storage_snapshots",
         lambda account: bytes_to_gigabytes(
-            File.objects.filter(
-                project__account=account, snapshot__isnull=False
-            ).aggregate(storage=Sum("size"))["storage"]
-            or 0
+            AccountUsage.get(account.id).storage_snapshots
         ),
         "Snapshot storage limit has been reached."
         "Please upgrade the plan for the account.",
@@ -135,35 +128,25 @@ class AccountQuotas:
     FILE_DOWNLOADS_MONTH = AccountQuota(
         "file_downloads_month",
         lambda account: bytes_to_gigabytes(
-            FileDownloads.objects.filter(
-                file__project__account=account, month=timezone.now().isoformat()[:7]
-            ).aggregate(downloads=Sum(F("count") * F("file__size")))["downloads"]
-            or 0
+            AccountUsage.get(account.id, AccountUsage.current_month()).file_downloads
         ),
         "Download limit has been reached. Please upgrade the plan for the account.",
     )
 
     JOB_RUNTIME_MONTH = AccountQuota(
         "job_runtime_month",
-        lambda account: (
-            Job.objects.filter(project__account=account).aggregate(
-                runtime=Sum("runtime")
-            )["runtime"]
-            or 0
-        )
+        lambda account: AccountUsage.get(
+            account.id, AccountUsage.current_month()
+        ).job_runtime
         / 60000,
         "Job minutes has been exceeded. Please upgrade the plan for the account.",
     )
 
     DOIS_CREATED_MONTH = AccountQuota(
         "dois_created_month",
-        lambda account: (
-            Doi.objects.filter(
-                node__project__account=account,
-                created__year=datetime.utcnow().year,
-                created__month=datetime.utcnow().month,
-            ).count()
-        ),
+        lambda account: AccountUsage.get(
+            account.id, AccountUsage.current_month()
+        ).dois_created,
         "The number of DOIs created has been exceeded. Please upgrade the plan for the account.",
     )
 
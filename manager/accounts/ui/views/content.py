@@ -1,19 +1,21 @@
+import hashlib
 import re
 from typing import Optional
 
 from django.conf import settings
-from django.db import transaction
-from django.db.models import F
+from django.core.cache import cache
 from django.http import HttpRequest, HttpResponse
 from django.shortcuts import redirect, render, reverse
-from django.utils import timezone
+from django.utils.cache import get_conditional_response, quote_etag
 
+from accounts.content import get_generations, get_resolution, set_resolution
 from accounts.models import Account
 from accounts.quotas import AccountQuotas
 from jobs.models import JobStatus
 from manager import components, themes
 from manager.version import __version__
-from projects.models.files import File, FileDownloads
+from projects.downloads import record_download
+from projects.models.files import File
 from projects.models.projects import Project, ProjectLiveness
 from projects.models.snapshots import Snapshot
 
@@ -31,6 +33,10 @@ def content(
     This view is designed to handle all the serving of account content.
     It's the Hub's equivalent of Github Pages which serves content from
     https://<account>.stencila.io/<project>.
+
+    The resolution of the account, project, snapshot and file to serve
+    is cached (see `accounts.content`) so that repeated requests for the
+    same content do not need to query the database to do that.
     """
     host = request.get_host()
     prod = True
@@ -92,131 +98,170 @@ def content(
     def invalid_file():
         return render_404("accounts/content/404_invalid_file.html")
 
-    # Get the account
-    try:
-        account = Account.objects.get(name=account_name)
-    except Account.DoesNotExist:
-        return invalid_account()
-
-    # If no project is specified then redirect to the account's page
-    # on the Hub (rather than 404ing).
-    # In the future we may allow accounts to specify a default project
-    # to serve as a "home" project.
-    if not project_name:
-        return redirect(
-            primary_domain_url(
-                request, name="ui-accounts-retrieve", kwargs=dict(account=account_name)
-            ),
-            permanent=False,
-        )
-
-    # If the request is for a project folder, rather than a specific file,
-    # then redirect to slash appended URL is necessary to ensure that
-    # relative links work OK.
-    # Do this here before progressing with any more DB queries
-    if not file_path and not request.path.endswith("/"):
-        path = request.get_full_path(force_append_slash=True)
-        # In prod need to remove the prefix added by Nginx
-        if prod and path.startswith("/content/"):
-            path = re.sub(r"^/content/", "/", path)
-        return redirect(path)
-
-    # Check for project
-    try:
-        project = Project.objects.get(account=account, name=project_name)
-    except Project.DoesNotExist:
-        return unavailable_project()
-
-    # Authorize the request
-    # This is being served on a domain where we do not know the user.
-    # So if the project is not public then a key must be provided in the URL.
-    # The key is part of the URL, not a query parameter, so that relative links
-    # media files etc do not need to be rewritten.
-    if not project.public:
-        if key != project.key:
+    # Use the cached resolution for the request, if any. Authorization is
+    # still done for each request in case the key in the URL is different.
+    resolution_args = (account_name, project_name, version, file_path)
+    resolution = (
+        get_resolution(*resolution_args)
+        if project_name and (file_path or request.path.endswith("/"))
+        else None
+    )
+    if resolution:
+        account = resolution["account"]
+        project = resolution["project"]
+        snapshot = resolution["snapshot"]
+        file = resolution["file"]
+        if not project.public and key != project.key:
             return unavailable_project()
+    else:
+        # Get the account
+        try:
+            account = Account.objects.get(name=account_name)
+        except Account.DoesNotExist:
+            return invalid_account()
+
+        # If no project is specified then redirect to the account's page
+        # on the Hub (rather than 404ing).
+        # In the future we may allow accounts to specify a default project
+        # to serve as a "home" project.
+        if not project_name:
+            return redirect(
+                primary_domain_url(
+                    request,
+                    name="ui-accounts-retrieve",
+                    kwargs=dict(account=account_name),
+                ),
+                permanent=False,
+            )
 
-    # If the URL does not have an explicit version then fallback to project defaults
-    if version is None:
-        version = project.liveness
-
-    # Default to serving index.html
-    if not file_path:
-        file_path = "index.html"
-
-    # Should the file be served from the working directory or a snapshot?
-    snapshot = None
-    if version == ProjectLiveness.LIVE.value:
+        # If the request is for a project folder, rather than a specific file,
+        # then redirect to slash appended URL is necessary to ensure that
+        # relative links work OK.
+        # Do this here before progressing with any more DB queries
+        if not file_path and not request.path.endswith("/"):
+            path = request.get_full_path(force_append_slash=True)
+            # In prod need to remove the prefix added by Nginx
+            if prod and path.startswith("/content/"):
+                path = re.sub(r"^/content/", "/", path)
+            return redirect(path)
+
+        # Check for project
         try:
-            file = File.get_latest(project=project, path=file_path, current=True)
-        except IndexError:
-            return invalid_file()
-    else:
-        if version == ProjectLiveness.LATEST.value:
-            snapshots = project.snapshots.filter(
-                job__status=JobStatus.SUCCESS.value
-            ).order_by("-created")
-            if snapshots:
-                snapshot = snapshots[0]
-            else:
-                return no_snapshots()
-        elif version == ProjectLiveness.PINNED.value:
-            # Elsewhere there should be checks to ensure the data
-            # does not break the following asserts. But these serve as
-            # a final check.
-            snapshot = project.pinned
-            assert (
-                snapshot is not None
-            ), "Project has liveness `pinned` but is not pinned to a snapshot"
-            assert (
-                snapshot.project_id == project.id
-            ), "Project is pinned to a snapshot for a different project!"
-        elif version.startswith("v"):
-            match = re.match(r"v(\d+)$", version)
-            if match is None:
-                return invalid_snapshot()
-            number = match.group(1)
+            project = Project.objects.get(account=account, name=project_name)
+        except Project.DoesNotExist:
+            return unavailable_project()
+
+        # Authorize the request
+        # This is being served on a domain where we do not know the user.
+        # So if the project is not public then a key must be provided in the URL.
+        # The key is part of the URL, not a query parameter, so that relative links
+        # media files etc do not need to be rewritten.
+        if not project.public:
+            if key != project.key:
+                return unavailable_project()
+
+        # Get the generations of the account and project before resolving
+        # anything else so that changes during resolution invalidate it
+        generations = get_generations(account.id, project.id)
+
+        # If the URL does not have an explicit version then fallback to project defaults
+        if version is None:
+            version = project.liveness
+
+        # Default to serving index.html
+        if not file_path:
+            file_path = "index.html"
+
+        # Should the file be served from the working directory or a snapshot?
+        snapshot = None
+        if version == ProjectLiveness.LIVE.value:
             try:
-                snapshot = Snapshot.objects.get(project=project, number=number)
-            except Snapshot.DoesNotExist:
-                return invalid_snapshot()
+                file = File.get_latest(project=project, path=file_path, current=True)
+            except IndexError:
+                return invalid_file()
         else:
-            raise ValueError("Invalid version value: " + version)
+            if version == ProjectLiveness.LATEST.value:
+                snapshots = project.snapshots.filter(
+                    job__status=JobStatus.SUCCESS.value
+                ).order_by("-created")
+                if snapshots:
+                    snapshot = snapshots[0]
+                else:
+                    return no_snapshots()
+            elif version == ProjectLiveness.PINNED.value:
+                # Elsewhere there should be checks to ensure the data
+                # does not break the following asserts. But these serve as
+                # a final check.
+                snapshot = project.pinned
+                assert (
+                    snapshot is not None
+                ), "Project has liveness `pinned` but is not pinned to a snapshot"
+                assert (
+                    snapshot.project_id == project.id
+                ), "Project is pinned to a snapshot for a different project!"
+            elif version.startswith("v"):
+                match = re.match(r"v(\d+)$", version)
+                if match is None:
+                    return invalid_snapshot()
+                number = match.group(1)
+                try:
+                    snapshot = Snapshot.objects.get(project=project, number=number)
+                except Snapshot.DoesNotExist:
+                    return invalid_snapshot()
+            else:
+                raise ValueError("Invalid version value: " + version)
 
-        # Check that the file exists in the snapshot
-        try:
-            file = File.get_latest(snapshot=snapshot, path=file_path)
-        except IndexError:
-            return invalid_file()
+            # Check that the file exists in the snapshot
+            try:
+                file = File.get_latest(snapshot=snapshot, path=file_path)
+            except IndexError:
+                return invalid_file()
+
+        # Set related objects so that they are cached along with the file
+        # and do not need to be fetched when it is served
+        project.account = account
+        file.project = project
+        file.snapshot = snapshot
+        set_resolution(
+            *resolution_args,
+            generations=generations,
+            account=account,
+            project=project,
+            snapshot=snapshot,
+            file=file,
+        )
 
     # Limit the download rate if the account is over it's download
-    # quota for the current month
-    if AccountQuotas.FILE_DOWNLOADS_MONTH.reached(account):
-        limit_rate = "1000"  # bytes/second
-    else:
-        limit_rate = "off"
-
-    # Update the download metrics
-    month = timezone.now().isoformat()[:7]
-    with transaction.atomic():
-        if FileDownloads.objects.filter(file=file, month=month).count() == 0:
-            FileDownloads.objects.create(file=file, month=month, count=1)
+    # quota for the current month. Because calculating the quota
+    # is expensive, the limit is cached for `CONTENT_CACHE_SECONDS`.
+    limit_rate_key = "content-account-{id}-limit-rate".format(id=account.id)
+    limit_rate = cache.get(limit_rate_key)
+    if limit_rate is None:
+        if AccountQuotas.FILE_DOWNLOADS_MONTH.reached(account):
+            limit_rate = "1000"  # bytes/second
         else:
-            FileDownloads.objects.filter(file=file, month=month).update(
-                count=F("count") + 1
-            )
+            limit_rate = "off"
+        cache.set(limit_rate_key, limit_rate, settings.CONTENT_CACHE_SECONDS)
 
     # Handle the index.html file specially
     if file.path == "index.html":
-        html = file.get_content()
         if snapshot:
-            return snapshot_index_html(
-                html, request, account=account, project=project, snapshot=snapshot
+            response = snapshot_index_html(
+                request, account=account, project=project, snapshot=snapshot, file=file
             )
         else:
-            return working_index_html(html, request, account=account, project=project)
+            html = file.get_content()
+            response = working_index_html(
+                html, request, account=account, project=project
+            )
     else:
-        return file.get_response(limit_rate=limit_rate)
+        response = file.get_response(limit_rate=limit_rate)
+
+    # Update the download metrics (unless the client already has the file)
+    if response.status_code != 304:
+        record_download(file)
+
+    return response
 
 
 def working_index_html(
@@ -241,32 +286,82 @@ def working_index_html(
 
 
 def snapshot_index_html(
-    html: bytes,
     request: HttpRequest,
     account: Account,
     project: Project,
     snapshot: Snapshot,
+    file: File,
 ) -> HttpResponse:
     """
     Get an index.html from a snapshot.
+
+    Because snapshots are immutable, the augmented index.html is only
+    generated once and is then cached for `CONTENT_INDEX_CACHE_SECONDS`.
+    The cache key, which is also used as the response's `ETag`, is a hash of
+    everything that the augmented HTML depends upon (e.g. the account and
+    project `extra_*` fields) so that changes to those are reflected.
+    Conditional requests with a matching `If-None-Match` header get a
+    `304 Not Modified` response without the HTML being fetched or generated
+    (but with the same security headers as the full response).
     """
-    return index_html(
-        account,
-        project,
-        html,
-        source_url=primary_domain_url(
-            request,
-            name="ui-projects-snapshots-retrieve",
-            kwargs=dict(
-                account=account.name, project=project.name, snapshot=snapshot.number,
-            ),
-        ),
-        session_provider_url=primary_domain_url(
-            request,
-            name="api-projects-snapshots-session",
-            kwargs=dict(project=project.id, snapshot=snapshot.number),
+    source_url = primary_domain_url(
+        request,
+        name="ui-projects-snapshots-retrieve",
+        kwargs=dict(
+            account=account.name, project=project.name, snapshot=snapshot.number,
         ),
     )
+    session_provider_url = primary_domain_url(
+        request,
+        name="api-projects-snapshots-session",
+        kwargs=dict(project=project.id, snapshot=snapshot.number),
+    )
+
+    version = hashlib.sha1(
+        "\n".join(
+            [
+                str(part)
+                for part in (
+                    snapshot.id,
+                    file.id,
+                    file.fingerprint,
+                    source_url,
+                    session_provider_url,
+                    account.hosts,
+                    account.extra_head,
+                    account.extra_top,
+                    account.extra_bottom,
+                    project.extra_head,
+                    project.extra_top,
+                    project.extra_bottom,
+                    themes.version,
+                    components.version,
+                    settings.STATIC_URL,
+                    settings.SENTRY_DSN,
+                    __version__,
+                )
+            ]
+        ).encode()
+    ).hexdigest()
+    etag = quote_etag(version)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return set_security_headers(response, account)
+
+    key = "content-index-html-{version}".format(version=version)
+    response = cache.get(key)
+    if response is None:
+        response = index_html(
+            account,
+            project,
+            file.get_content(),
+            source_url=source_url,
+            session_provider_url=session_provider_url,
+        )
+        response["ETag"] = etag
+        cache.set(key, response, settings.CONTENT_INDEX_CACHE_SECONDS)
+    return response
 
 
 def index_html(
@@ -355,9 +450,16 @@ def index_html(
     # Modify external links
     html = index_html_links(html)
 
-    response = HttpResponse(html)
+    return set_security_headers(HttpResponse(html), account)
+
 
-    # Add security headers to response
+def set_security_headers(response: HttpResponse, account: Account) -> HttpResponse:
+    """
+    Add security headers to an index.html response.
+
+    Restricts the sites that are allowed to embed the page
+    to Stencila and the account's `hosts`.
+    """
     hosts = account.hosts or ""
 
     # CSP for modern browers
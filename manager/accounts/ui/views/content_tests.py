@@ -1,4 +1,18 @@
+from unittest import mock
+
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
+
+from accounts.content import get_generations
+from accounts.models import AccountTier
 from accounts.ui.views.content import index_html_links
+from projects.models.files import File
+from projects.models.projects import Project
+from projects.models.snapshots import Snapshot
+from users.models import User
 
 
 def test_index_html_links():
@@ -19,3 +33,134 @@ def test_index_html_links():
         index_html_links(b'<a href="://example.org/page.html?foo=bar">')
         == b'<a href="://example.org/page.html?foo=bar" target="_blank" rel="noreferrer noopener">'
     )
+
+
+@pytest.fixture
+def content_project():
+    """Create a public project with a file in its working directory."""
+    cache.clear()
+    AccountTier.objects.create()
+    user = User.objects.create(username="user")
+    project = Project.objects.create(
+        account=user.personal_account, creator=user, name="project", public=True
+    )
+    File.create(project, "data.csv", {})
+    yield project
+    cache.clear()
+
+
+def get_content(client, project, path):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(
+            "/content/{project}/live/{path}?account={account}".format(
+                project=project.name, path=path, account=project.account.name
+            ),
+            HTTP_HOST="localhost",
+        )
+    return response, [query["sql"] for query in queries]
+
+
+@pytest.mark.django_db
+def test_content_resolution_cached(client, content_project):
+    with mock.patch(
+        "projects.models.files.File.get_response",
+        autospec=True,
+        side_effect=lambda file, limit_rate: HttpResponse(file.id),
+    ):
+        response, queries = get_content(client, content_project, "data.csv")
+        assert response.status_code == 200
+        assert any('ORDER BY "projects_file"."created"' in query for query in queries)
+        file_id = response.content
+
+        # Second request is resolved from the cache
+        response, queries = get_content(client, content_project, "data.csv")
+        assert response.status_code == 200
+        assert response.content == file_id
+        assert not any('FROM "accounts_account"' in query for query in queries)
+        assert not any('FROM "projects_project"' in query for query in queries)
+        assert not any(
+            'ORDER BY "projects_file"."created"' in query for query in queries
+        )
+
+        # Changing the file invalidates the cache
+        File.create(content_project, "data.csv", {})
+        response, queries = get_content(client, content_project, "data.csv")
+        assert response.content != file_id
+
+        # Changing the project invalidates the cache
+        content_project.save()
+        response, queries = get_content(client, content_project, "data.csv")
+        assert any('FROM "projects_project"' in query for query in queries)
+
+
+@pytest.mark.django_db
+def test_content_invalidated_in_bulk(content_project):
+    def generations():
+        return get_generations(content_project.account_id, content_project.id)
+
+    # Making files non-current in bulk (e.g. when cleaning the project)
+    # invalidates the project's content
+    current = generations()
+    File.decurrent(content_project)
+    assert generations() != current
+
+    # As does deleting a file
+    file = File.create(content_project, "data.csv", {})
+    current = generations()
+    file.delete()
+    assert generations() != current
+
+
+@pytest.mark.django_db
+def test_content_snapshot_index_html_cached(client, content_project):
+    snapshot = Snapshot.objects.create(
+        project=content_project, creator=content_project.creator
+    )
+    File.create(content_project, "index.html", {}, snapshot=snapshot)
+
+    def get_index(**headers):
+        return client.get(
+            "/content/{project}/v{number}/index.html?account={account}".format(
+                project=content_project.name,
+                number=snapshot.number,
+                account=content_project.account.name,
+            ),
+            HTTP_HOST="localhost",
+            **headers
+        )
+
+    with mock.patch(
+        "projects.models.files.File.get_content",
+        return_value=b"<html><head></head><body></body></html>",
+    ) as get_content, mock.patch(
+        "accounts.ui.views.content.record_download"
+    ) as record_download:
+        response = get_index()
+        assert response.status_code == 200
+        assert b"errorHandler.js" in response.content
+        etag = response["ETag"]
+        csp = response["Content-Security-Policy"]
+
+        # Second request does not refetch or regenerate the HTML
+        response = get_index()
+        assert response.status_code == 200
+        assert response["ETag"] == etag
+        assert get_content.call_count == 1
+
+        # Conditional request gets a 304, with the same security headers,
+        # which is not counted as a download
+        assert record_download.call_count == 2
+        response = get_index(HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response["Content-Security-Policy"] == csp
+        assert "X-Frame-Options" in response
+        assert record_download.call_count == 2
+
+        # Changing the project's extra content changes the version
+        content_project.extra_head = "<style></style>"
+        content_project.save()
+        response = get_index(HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response["ETag"] != etag
+        assert b"<style></style>" in response.content
+        assert get_content.call_count == 2
@@ -6,9 +6,11 @@ from typing import Optional
 
 from django.conf import settings
 from django.db import models
+from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
+from accounts.models import AccountUsage
 from jobs.models import Job, JobMethod
 from manager.signals import email_received
 from projects.models.nodes import Node
@@ -190,6 +192,21 @@ class Doi(models.Model):
                 logger.error("Error depositing DOI", extra={"id": self.id})
 
 
+@receiver(post_save, sender=Doi)
+def record_doi_created(sender, instance: Doi, created: bool, **kwargs):
+    """
+    Add a created DOI to the usage of the account of its node's project.
+    """
+    if created:
+        account_id = (
+            Doi.objects.filter(id=instance.id)
+            .values_list("node__project__account_id", flat=True)
+            .first()
+        )
+        if account_id:
+            AccountUsage.add(account_id, AccountUsage.current_month(), dois_created=1)
+
+
 @receiver(email_received)
 def receive_registration_email(sender, email, **kwargs):
     """
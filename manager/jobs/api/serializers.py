@@ -155,6 +155,10 @@ class JobCreateSerializer(JobRetrieveSerializer):
             "users",
             "retries",
             "worker",
+            "children_active",
+            "children_succeeded",
+            "children_failed",
+            "children_status",
         ]
 
     project = serializers.HiddenField(
@@ -3,6 +3,7 @@ import os
 import re
 from typing import List, Optional
 
+from django.db import transaction
 from django.utils import timezone
 from drf_yasg.utils import swagger_auto_schema
 from rest_framework import (
@@ -31,6 +32,7 @@ from jobs.api.serializers import (
     ZoneCreateSerializer,
     ZoneSerializer,
 )
+from jobs.jobs import invalidate_routing_queues
 from jobs.models import Job, JobStatus, Queue, Worker, WorkerHeartbeat, Zone
 from manager.api.helpers import (
     HtmxCreateMixin,
@@ -279,6 +281,88 @@ class JobsViewSet(mixins.UpdateModelMixin, viewsets.GenericViewSet):
         job.update(data=request.data)
         return Response()
 
+    @swagger_auto_schema(responses={200: "OK"})
+    @action(detail=False, methods=["POST"])
+    def events(self, request: Request) -> Response:
+        """
+        Update several jobs.
+
+        This action is intended only to be used by the `overseer` service
+        for it to update jobs in batches, rather than making one
+        request per event. Receives an ordered array of objects, each having
+        the `id` of the job and the same fields as for `partial_update`.
+        All the jobs are fetched in a single query and updated
+        within a single transaction, each event in its own savepoint so that
+        an event that fails is logged and skipped without losing the others.
+        """
+        events = request.data
+        if not isinstance(events, list):
+            raise exceptions.ValidationError("Expected an array of events")
+
+        with transaction.atomic():
+            jobs = {
+                job.id: job
+                for job in Job.objects.select_for_update()
+                .filter(id__in=[event.get("id") for event in events])
+                .order_by("id")
+            }
+            for event in events:
+                data = dict(event)
+                job_id = data.pop("id", None)
+                try:
+                    job = jobs[int(job_id)]
+                except (KeyError, TypeError, ValueError):
+                    logger.warning("Event for unknown job", extra=dict(id=job_id))
+                    continue
+                try:
+                    with transaction.atomic():
+                        job.update(data=data)
+                except Exception:
+                    logger.exception("Error updating job", extra=dict(id=job.id))
+                    # Discard any changes to the instance that were rolled back
+                    job.refresh_from_db()
+
+        return Response()
+
+
+def record_worker_event(type: str, event: dict) -> Optional[WorkerHeartbeat]:
+    """
+    Record a worker event.
+
+    Updates the worker that the event is for. For heartbeats, returns
+    an unsaved `WorkerHeartbeat` so that callers can create them in bulk.
+    """
+    worker = Worker.get_or_create(event)
+    now = timezone.now()
+
+    heartbeat = None
+    if type == "worker-online":
+        worker.started = now
+    elif type == "worker-heartbeat":
+        worker.updated = now
+        heartbeat = WorkerHeartbeat(
+            worker=worker,
+            time=now,
+            clock=event.get("clock", 0),
+            active=event.get("active", 0),
+            processed=event.get("processed", 0),
+            load=event.get("loadavg", []),
+        )
+    elif type == "worker-offline":
+        worker.finished = now
+    else:
+        logger.warning("Unhandled worker event type", extra=dict(type=type))
+        return None
+
+    worker.save()
+
+    # Workers coming online or going offline changes which
+    # queues jobs can be routed to
+    if type != "worker-heartbeat":
+        invalidate_routing_queues()
+
+    return heartbeat
+
 
 class WorkersViewSet(viewsets.GenericViewSet):
     """
@@ -305,12 +389,7 @@ class WorkersViewSet(viewsets.GenericViewSet):
         An internal route, intended primarily for the `overseer` service.
         Receives event data. Returns an empty response.
         """
-        event = request.data
-
-        worker = Worker.get_or_create(event)
-        worker.started = timezone.now()
-        worker.save()
-
+        record_worker_event("worker-online", request.data)
         return Response()
 
     def partial_update(self, request: Request, hostname: str) -> Response:
@@ -351,6 +430,8 @@ class WorkersViewSet(viewsets.GenericViewSet):
         worker.updated = timezone.now()
         worker.save()
 
+        invalidate_routing_queues()
+
         return Response()
 
     @swagger_auto_schema(responses={200: "OK"})
@@ -363,21 +444,9 @@ class WorkersViewSet(viewsets.GenericViewSet):
         Receives event data.
         Returns an empty response.
         """
-        event = request.data
-
-        worker = Worker.get_or_create(event)
-        worker.updated = timezone.now()
-        worker.save()
-
-        WorkerHeartbeat.objects.create(
-            worker=worker,
-            time=timezone.now(),
-            clock=event.get("clock", 0),
-            active=event.get("active", 0),
-            processed=event.get("processed", 0),
-            load=event.get("loadavg", []),
-        )
-
+        heartbeat = record_worker_event("worker-heartbeat", request.data)
+        if heartbeat:
+            heartbeat.save()
         return Response()
 
     @swagger_auto_schema(responses={200: "OK"})
@@ -390,11 +459,41 @@ class WorkersViewSet(viewsets.GenericViewSet):
         Receives event data.
         Returns an empty response.
         """
-        event = request.data
+        record_worker_event("worker-offline", request.data)
+        return Response()
 
-        worker = Worker.get_or_create(event)
-        worker.finished = timezone.now()
-        worker.save()
+    @swagger_auto_schema(responses={200: "OK"})
+    @action(detail=False, methods=["POST"])
+    def events(self, request: Request) -> Response:
+        """
+        Record several worker events.
+
+        An internal route, intended primarily for the `overseer` service.
+        Receives an ordered array of event data, each having a `type` of
+        `worker-online`, `worker-heartbeat` or `worker-offline`.
+        Events are recorded within a single transaction, each event in its
+        own savepoint so that an event that fails is logged and skipped, and
+        heartbeats are created in bulk. Returns an empty response.
+        """
+        events = request.data
+        if not isinstance(events, list):
+            raise exceptions.ValidationError("Expected an array of events")
+
+        with transaction.atomic():
+            heartbeats = []
+            for event in events:
+                try:
+                    with transaction.atomic():
+                        heartbeat = record_worker_event(event.get("type"), event)
+                except Exception:
+                    logger.exception(
+                        "Error recording worker event",
+                        extra=dict(type=event.get("type")),
+                    )
+                    continue
+                if heartbeat:
+                    heartbeats.append(heartbeat)
+            WorkerHeartbeat.objects.bulk_create(heartbeats)
 
         return Response()
 
@@ -464,7 +563,7 @@ class ProjectsJobsViewSet(
         """
         return get_project(
             self.kwargs,
-            self.request.user,
+            self.request,
             [
                 ProjectRole.AUTHOR,
                 ProjectRole.EDITOR,
@@ -1,6 +1,10 @@
+from unittest import mock
+
 from rest_framework import status
 
+from jobs.models import Job, JobStatus, Worker
 from manager.testing import DatabaseTestCase
+from users.models import User
 
 
 class ProjectsJobsViewsTest(DatabaseTestCase):
@@ -55,3 +59,124 @@ class ProjectsJobsViewsTest(DatabaseTestCase):
                 # can't get job with bad key
                 response = self.retrieve_job(user, project, job_id, "foo")
                 assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+class JobsEventsViewsTest(DatabaseTestCase):
+    """Test the batch event endpoints used by the `overseer`."""
+
+    def setUp(self):
+        self.staff = User.objects.create_user("overseer", is_staff=True)
+        self.client.force_authenticate(user=self.staff)
+
+    def test_jobs_events(self):
+        one = Job.objects.create(
+            method="sleep", is_active=True, status=JobStatus.DISPATCHED.value
+        )
+        two = Job.objects.create(
+            method="sleep", is_active=True, status=JobStatus.DISPATCHED.value
+        )
+
+        response = self.client.post(
+            "/api/jobs/events",
+            [
+                dict(id=one.id, status="STARTED", worker="worker-1"),
+                dict(id=two.id, status="RUNNING", log=[dict(message="a")], log_seq=0),
+                dict(id=one.id, status="TERMINATED"),
+                dict(id=123456789, status="STARTED"),
+            ],
+            format="json",
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+        one.refresh_from_db()
+        assert one.status == JobStatus.TERMINATED.value
+        assert one.worker == "worker-1"
+        assert not one.is_active
+
+        two.refresh_from_db()
+        assert two.status == JobStatus.RUNNING.value
+        assert two.log == [dict(message="a")]
+
+    def test_jobs_events_failure(self):
+        one = Job.objects.create(
+            method="sleep", is_active=True, status=JobStatus.DISPATCHED.value
+        )
+        two = Job.objects.create(
+            method="sleep", is_active=True, status=JobStatus.DISPATCHED.value
+        )
+
+        update = Job.update
+
+        def failing_update(job, data):
+            if data.get("status") == "FAIL":
+                job.worker = "worker-failed"
+                job.save()
+                raise RuntimeError("Failed to update job")
+            return update(job, data=data)
+
+        with mock.patch.object(Job, "update", new=failing_update):
+            response = self.client.post(
+                "/api/jobs/events",
+                [
+                    dict(id=one.id, status="STARTED"),
+                    dict(id=one.id, status="FAIL"),
+                    dict(id=two.id, status="RUNNING"),
+                    dict(id=one.id, status="RUNNING"),
+                ],
+                format="json",
+            )
+        assert response.status_code == status.HTTP_200_OK
+
+        # Changes made by the failed event are rolled back, others are not
+        one.refresh_from_db()
+        assert one.status == JobStatus.RUNNING.value
+        assert one.worker is None
+
+        two.refresh_from_db()
+        assert two.status == JobStatus.RUNNING.value
+
+    def test_jobs_events_not_staff(self):
+        self.client.force_authenticate(user=self.ada)
+        response = self.client.post("/api/jobs/events", [], format="json")
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_workers_events(self):
+        worker = dict(hostname="worker@host", pid=1, freq=2.0)
+
+        response = self.client.post(
+            "/api/workers/events",
+            [
+                dict(type="worker-online", **worker),
+                dict(type="worker-heartbeat", active=2, processed=3, **worker),
+                dict(type="worker-heartbeat", active=1, processed=4, **worker),
+                dict(type="worker-offline", **worker),
+            ],
+            format="json",
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+        assert Worker.objects.count() == 1
+        instance = Worker.objects.get()
+        assert instance.started is not None
+        assert instance.finished is not None
+        assert [
+            heartbeat.processed for heartbeat in instance.heartbeats.order_by("id")
+        ] == [3, 4]
+
+    def test_workers_events_failure(self):
+        worker = dict(hostname="worker@host", pid=1, freq=2.0)
+
+        response = self.client.post(
+            "/api/workers/events",
+            [
+                dict(type="worker-online", **worker),
+                dict(type="worker-heartbeat", hostname=None),
+                dict(type="worker-heartbeat", active=1, processed=4, **worker),
+            ],
+            format="json",
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+        instance = Worker.objects.get()
+        assert instance.started is not None
+        assert [heartbeat.processed for heartbeat in instance.heartbeats.all()] == [4]
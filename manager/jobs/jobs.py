@@ -8,21 +8,46 @@ Defines three functions involved in a job's lifecycle:
 - `check_job` - for a parent job, trigger any child jobs, and / or update it's status
 - `cancel_job` - remove job from the queue, or terminate it if already started
 
+a function for updating the parent of a job, without rescanning all of its children:
+
+- `update_parent` - update the counts and status of a compound job when a child changes
+
+and two functions, used by the `fetch_job_result` task, for finishing
+a job once it has succeeded:
+
+- `fetch_result` - get the result of the job from the result backend
+- `fail_result` - mark the job as failed if its result could not be fetched
+
 """
 import datetime
 import logging
-import time
+from typing import List, Optional
 
 from celery import Celery, signature
 from celery.result import AsyncResult
 from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
+from django.db import transaction
 from django.utils import timezone
+from prometheus_client import Histogram
 
+from accounts.models import AccountUsage
 from jobs.models import Job, JobMethod, JobStatus, Queue, Worker
 
 logger = logging.getLogger(__name__)
 
+# Placeholder for log entries that have not been received from the worker
+# (the level is that of a warning in the worker's log levels)
+MISSING_LOG_ENTRY = dict(level=1, message="Log entries not yet received")
+
+# Metrics on getting job results
+result_fetch_duration = Histogram(
+    "manager_job_result_fetch_seconds",
+    "Duration of attempts to fetch job results from the result backend.",
+    ["outcome"],
+)
+
 # Setup the Celery app
 app = Celery("manager", broker=settings.BROKER_URL, backend=settings.CACHE_URL)
 app.conf.update(
@@ -41,6 +66,83 @@ app.conf.update(
 )
 
 
+ROUTING_QUEUES_CACHE_KEY = "jobs-routing-queues"
+
+
+def get_routing_queues() -> List[Queue]:
+    """
+    Get the queues that jobs can be routed to.
+
+    Returns the queues that have active workers on them,
+    ordered by descending priority. To avoid database queries for every
+    job dispatched, the list is cached for `JOB_ROUTING_CACHE_SECONDS`
+    and is invalidated when workers come online or go offline
+    (see `invalidate_routing_queues`).
+    """
+    queues = cache.get(ROUTING_QUEUES_CACHE_KEY)
+    if queues is not None:
+        return queues
+
+    # Find queues that have active workers on them
+    # order by descending priority
+    queues = list(
+        Queue.objects.filter(
+            workers__in=Worker.objects.filter(
+                # Has not finished
+                finished__isnull=True,
+                # Has been updated in the last x minutes
+                updated__gte=timezone.now() - datetime.timedelta(minutes=15),
+            ),
+        ).order_by("priority")
+    )
+
+    # Fallback to the default Stencila queue
+    # Apart from anything else having this fallback is useful in development
+    # because if means that the `overseer` service does not need to be running
+    # in order keep track of the numbers of workers listening on each queue
+    # (during development `worker`s listen to the default queue)
+    if len(queues) == 0:
+        logger.warning("No queues found with active workers")
+        queue, _ = Queue.get_or_create(account_name="stencila", queue_name="default")
+        queues = [queue]
+
+    cache.set(ROUTING_QUEUES_CACHE_KEY, queues, settings.JOB_ROUTING_CACHE_SECONDS)
+    return queues
+
+
+def invalidate_routing_queues():
+    """
+    Invalidate the cached list of queues that jobs can be routed to.
+
+    Should be called when a worker comes online, goes offline, or
+    changes the queues that it is listening to.
+    """
+    cache.delete(ROUTING_QUEUES_CACHE_KEY)
+
+
+def get_job_priority(job: Job) -> int:
+    """
+    Get the priority of the queue that a job should be routed to.
+
+    The account tier of the job's project is cached, for the same duration as
+    the routing queues, so that dispatching the many child jobs of a
+    compound job does not require a query for each.
+    """
+    if job.creator_id is None or job.project_id is None:
+        # Jobs created by anonymous users go on the lowest
+        # priority queue
+        return 1
+
+    # The priority of other jobs is determined by the
+    # account tier of the project
+    key = "jobs-routing-project-{id}-tier".format(id=job.project_id)
+    tier = cache.get(key)
+    if tier is None:
+        tier = job.project.account.tier_id
+        cache.set(key, tier, settings.JOB_ROUTING_CACHE_SECONDS)
+    return tier
+
+
 def dispatch_job(job: Job) -> Job:
     """
     Send a job to a queue.
@@ -67,64 +169,51 @@ def dispatch_job(job: Job) -> Job:
             job.is_active = False
             job.status = JobStatus.SUCCESS.value
         else:
+            job.is_active = True
+            job.status = JobStatus.DISPATCHED.value
+            job.children_active = len(children)
+            job.children_succeeded = 0
+            job.children_failed = 0
+            job.children_status = None
+
             if job.method == JobMethod.parallel.value:
                 # Dispatch all child jobs simultaneously
-                for child in children:
-                    dispatch_job(child)
+                dispatch = list(children)
             else:
                 # Dispatch the first child; subsequent children
                 # will be status WAITING and will get dispatched later
-                # on update of the parent.
-                for index, child in enumerate(children):
-                    if index == 0:
-                        dispatch_job(child)
-                    else:
-                        child.is_active = True
-                        child.status = JobStatus.WAITING.value
-                        child.save()
+                # on update of the parent (see `update_parent`).
+                dispatch = list(children[:1])
+                Job.objects.filter(id__in=[child.id for child in children[1:]]).update(
+                    is_active=True,
+                    status=JobStatus.WAITING.value,
+                    updated=timezone.now(),
+                )
 
-            job.is_active = True
-            job.status = JobStatus.DISPATCHED.value
+            # Save before dispatching children so that the counts are
+            # available to any child that ends immediately
+            job.save()
+            for child in dispatch:
+                dispatch_job(child)
+
+            # Children that ended immediately because they have no children
+            # need to be counted (others that ended immediately have
+            # already updated this job)
+            ended = [child for child in dispatch if ended_on_dispatch(child)]
+            if ended:
+                for child in ended:
+                    update_parent(child, ended=True)
+                job.refresh_from_db()
+            return job
     else:
-        # Find queues that have active workers on them
-        # order by descending priority
-        queues = list(
-            Queue.objects.filter(
-                workers__in=Worker.objects.filter(
-                    # Has not finished
-                    finished__isnull=True,
-                    # Has been updated in the last x minutes
-                    updated__gte=timezone.now() - datetime.timedelta(minutes=15),
-                ),
-            ).order_by("priority")
-        )
-
-        # Fallback to the default Stencila queue
-        # Apart from anything else having this fallback is useful in development
-        # because if means that the `overseer` service does not need to be running
-        # in order keep track of the numbers of workers listening on each queue
-        # (during development `worker`s listen to the default queue)
-        if len(queues) == 0:
-            logger.warning("No queues found with active workers")
-            queue, _ = Queue.get_or_create(
-                account_name="stencila", queue_name="default"
-            )
-        else:
-            if job.creator is None or job.project is None:
-                # Jobs created by anonymous users go on the lowest
-                # priority queue
-                priority = 1
-            else:
-                # The priority of other jobs is determined by the
-                # account tier of the project
-                priority = job.project.account.tier.id
-            queue = queues[min(len(queues), priority) - 1]
+        queues = get_routing_queues()
+        queue = queues[min(len(queues), get_job_priority(job)) - 1]
 
         # Add the job's project id, key and secrets to it's kwargs.
         # Doing this here ensures it is done for all jobs
         # and avoids putting the secrets in the job's `params` field.
         kwargs = dict(**job.params) if job.params else {}
-        kwargs["project"] = job.project.id if job.project else None
+        kwargs["project"] = job.project_id
         kwargs["key"] = job.key
         kwargs["secrets"] = job.secrets
 
@@ -142,6 +231,62 @@ def dispatch_job(job: Job) -> Job:
     return job
 
 
+def ended_on_dispatch(job: Job) -> bool:
+    """
+    Did a job end, when it was dispatched, without updating its parent?
+
+    Compound jobs with no children end immediately when they are dispatched
+    (without their counts of children being set) and their parent
+    needs to be updated. Compound jobs whose children all ended immediately
+    also end, but will have already updated their parent.
+    """
+    return (
+        not job.is_active
+        and JobMethod.is_compound(job.method)
+        and job.children_active is None
+    )
+
+
+def claim_end(job: Job, **fields) -> bool:
+    """
+    Mark a job as inactive, if it is still active in the database.
+
+    Returns `True` if the job was marked as inactive by this call. Because
+    this is done using a single, conditional, update, a job that is ended
+    concurrently (e.g. cancelled while its result is being fetched) is only
+    ended once (and its parent updated once).
+    """
+    return (
+        Job.objects.filter(id=job.id, is_active=True).update(
+            is_active=False, updated=timezone.now(), **fields
+        )
+        > 0
+    )
+
+
+def merge_log(log: Optional[List], entries: List, seq: Optional[int]) -> List:
+    """
+    Merge log entries sent by a worker into a job's log.
+
+    Workers send only the entries that have not yet been sent (a "delta")
+    along with the sequence number of the first of those entries.
+    Entries are placed at their sequence number so that re-delivered
+    deltas do not result in duplicated entries.
+    If there is no sequence number then the entries are assumed to be
+    the entire log (as sent by older versions of workers). Gaps, due to a
+    missing delta, are filled with placeholder entries so that later entries
+    are still placed correctly. The placeholders are replaced if the
+    missing delta is re-delivered, or by the complete log in the job's
+    result if it succeeds.
+    """
+    if seq is None:
+        return entries
+    log = log or []
+    gap = [MISSING_LOG_ENTRY] * (seq - len(log))
+    return log[:seq] + gap + entries + log[seq + len(entries) :]
+
+
+@transaction.atomic
 def update_job(job: Job, data={}, force: bool = False) -> Job:
     """
     Update a job.
@@ -150,9 +295,24 @@ def update_job(job: Job, data={}, force: bool = False) -> Job:
     `overseer` service. It updates the status, and other fields of
     the job, and if the job has a parent, updates it's status too.
 
+    The result of a successful job is fetched separately
+    (see `fetch_result`).
     See https://stackoverflow.com/a/38267978 for important considerations
     in using AsyncResult.
+
+    The job is locked, and its current state used, so that it is not ended
+    by a concurrent update (e.g. it being cancelled) as well.
     """
+    current = (
+        Job.objects.select_for_update()
+        .only("is_active", "status", "log", "result")
+        .get(id=job.id)
+    )
+    job.is_active = current.is_active
+    job.status = current.status
+    job.log = current.log
+    job.result = current.result
+
     # Avoid unnecessary update
     if not job.is_active and not force:
         return job
@@ -160,11 +320,18 @@ def update_job(job: Job, data={}, force: bool = False) -> Job:
     was_active = job.is_active
 
     if JobMethod.is_compound(job.method):
-        # Update the status of compound jobs based on children
+        # Update the status, and counts, of compound jobs based on all children.
+        # This is only necessary to reconcile compound jobs (e.g. those dispatched
+        # before counts were maintained). Usually, compound jobs are updated
+        # incrementally as each child changes (see `update_parent`).
         status = job.status
         is_active = False
         all_previous_succeeded = True
         any_previous_failed = False
+        children_active = 0
+        children_succeeded = 0
+        children_failed = 0
+        children_status = None
         for child in job.get_children():
             # If the child has a 'higher' status then update the
             # status of the compound job
@@ -177,9 +344,11 @@ def update_job(job: Job, data={}, force: bool = False) -> Job:
                     dispatch_job(child)
                 # If any previous have failed, cancel it
                 elif any_previous_failed:
-                    cancel_job(child)
+                    cancel_job(child, notify_parent=False)
 
-            if child.status != JobStatus.SUCCESS.value:
+            # A child that has succeeded, but is still active, is
+            # waiting for its result and callback
+            if child.status != JobStatus.SUCCESS.value or child.is_active:
                 all_previous_succeeded = False
             if child.status == JobStatus.FAILURE.value:
                 any_previous_failed = True
@@ -187,7 +356,20 @@ def update_job(job: Job, data={}, force: bool = False) -> Job:
             # If the child is still active then the compound job is active
             if child.is_active:
                 is_active = True
-
+                children_active += 1
+            else:
+                children_status = JobStatus.highest(
+                    [status for status in (children_status, child.status) if status]
+                )
+                if child.status == JobStatus.SUCCESS.value:
+                    children_succeeded += 1
+                elif child.status == JobStatus.FAILURE.value:
+                    children_failed += 1
+
+        job.children_active = children_active
+        job.children_succeeded = children_succeeded
+        job.children_failed = children_failed
+        job.children_status = children_status
         job.is_active = is_active
         job.status = JobStatus.RUNNING.value if is_active else status
 
@@ -200,75 +382,258 @@ def update_job(job: Job, data={}, force: bool = False) -> Job:
         # terminated (the SUCCESS state is sent after TERMINATED)
         if JobStatus.rank(status) < JobStatus.rank(job.status):
             return job
+        previous_status = job.status
 
         # Update fields sent by `overseer` service, including `status`
+        # (the log is merged separately)
         for key, value in data.items():
-            setattr(job, key, value)
+            if key not in ("log", "log_seq"):
+                setattr(job, key, value)
 
-        def async_result():
-            return AsyncResult(str(job.id), app=app)
+        if "log" in data:
+            job.log = merge_log(job.log, data["log"], data.get("log_seq"))
 
-        # If job succeeded then get the result if we haven't already
+        # If job succeeded then get the result if we haven't already.
+        # Because getting the result can be slow, it is done in the
+        # background by the `assistant` and, until then, the job remains active
+        # (so that its callback, and those of any parent, are not run prematurely).
         if status == JobStatus.SUCCESS.value and job.result is None:
-            response = None
-            attempts = 0
-            while not response and attempts < 5:
-                try:
-                    response = async_result().get(timeout=30)
-                except Exception:
-                    # Catch all errors, but log them. Occasional
-                    # errors encountered in prod include ResponseError and TimeoutError
-                    logger.warning(
-                        "Error getting async result",
-                        exc_info=True,
-                        extra=dict(id=job.id, method=job.method, attempts=attempts),
-                    )
-                    time.sleep(1)
-                    attempts += 1
-
-            if response:
-                job.result = response.get("result")
-                job.log = response.get("log")
-            else:
-                logger.error(
-                    "Unable to get async result",
-                    extra=dict(id=job.id, method=job.method, attempts=attempts),
-                )
-                job.status = JobStatus.FAILURE.value
-                job.error = dict(
-                    type="RuntimeError", message="Unable to get result of job"
-                )
+            if previous_status != JobStatus.SUCCESS.value:
+                from jobs.tasks import fetch_job_result
+
+                job_id = job.id
+                transaction.on_commit(lambda: fetch_job_result.delay(job_id))
 
         # If job failed then get the error
         # For FAILURE, `info` is the raised Exception
         elif status == JobStatus.FAILURE.value:
-            info = async_result().info
+            info = AsyncResult(str(job.id), app=app).info
             if info:
                 job.error = dict(type=type(info).__name__, message=str(info))
+            job.is_active = False
 
         # If the job has just ended then mark it as inactive
-        if JobStatus.has_ended(status):
+        elif JobStatus.has_ended(status):
             job.is_active = False
 
-    # If the job is no longer active clear its secrets and run its callback
+    # If the job is no longer active clear its secrets, run its callback
+    # and record its runtime
     if was_active and not job.is_active:
         job.secrets = None
         job.run_callback()
+        record_runtime(job)
 
-    # Save before updating parent (and then this again)
+    # Save before updating parent
     job.save()
 
     # If the job has a parent then update it too
-    if job.parent:
-        update_job(job.parent)
+    update_parent(job, ended=was_active and not job.is_active)
 
     return job
 
 
-def cancel_job(job: Job) -> Job:
+def update_parent(job: Job, ended: bool) -> None:
+    """
+    Update the parent of a job after the job has been updated.
+
+    Rather than rescanning all of the parent's children, the parent's
+    counts of children (`children_active` etc) are updated incrementally,
+    with the parent locked, when a child ends. This keeps updates, and
+    the decision to dispatch the next `WAITING` child of a series job,
+    independent of the number of children. If the parent ends as a result,
+    then its own parent is updated, and so on.
+    """
+    if job.parent_id is None:
+        return
+
+    if not ended:
+        # Mark active ancestors as running. Stops at the first ancestor that
+        # is already running so that, usually, this is a single query.
+        parent_id = job.parent_id
+        while parent_id is not None:
+            updated = (
+                Job.objects.filter(id=parent_id, is_active=True)
+                .exclude(status=JobStatus.RUNNING.value)
+                .update(status=JobStatus.RUNNING.value, updated=timezone.now())
+            )
+            if not updated:
+                break
+            parent_id = Job.objects.values_list("parent_id", flat=True).get(
+                id=parent_id
+            )
+        return
+
+    with transaction.atomic():
+        parent = Job.objects.select_for_update().get(id=job.parent_id)
+        if not parent.is_active:
+            return
+
+        if parent.children_active is None:
+            # Parent was dispatched before counts were maintained
+            # so fallback to a full update
+            update_job(parent)
+            return
+
+        dispatched = child_ended(parent, job)
+
+        parent.is_active = parent.children_active > 0
+        if parent.is_active:
+            parent.status = JobStatus.RUNNING.value
+        else:
+            parent.status = JobStatus.highest(
+                [
+                    status
+                    for status in (parent.status, parent.children_status)
+                    if status
+                ]
+            )
+            parent.secrets = None
+            parent.run_callback()
+        parent.save()
+
+    # Children that were dispatched, but ended immediately without
+    # updating the parent, need to be counted
+    for child in dispatched:
+        if ended_on_dispatch(child):
+            update_parent(child, ended=True)
+
+    if not parent.is_active:
+        update_parent(parent, ended=True)
+
+
+def child_ended(parent: Job, child: Job) -> List[Job]:
+    """
+    Update the counts of a compound job when one of its children has ended.
+
+    For series jobs, dispatches the next `WAITING` child if the child succeeded,
+    or cancels all `WAITING` children if it did not. Returns the list of
+    children that were dispatched.
+    """
+    parent.children_active = max(parent.children_active - 1, 0)
+    parent.children_status = JobStatus.highest(
+        [status for status in (parent.children_status, child.status) if status]
+    )
+    if child.status == JobStatus.SUCCESS.value:
+        parent.children_succeeded = (parent.children_succeeded or 0) + 1
+    elif child.status == JobStatus.FAILURE.value:
+        parent.children_failed = (parent.children_failed or 0) + 1
+
+    if parent.method != JobMethod.series.value:
+        return []
+
+    waiting = parent.children.filter(status=JobStatus.WAITING.value).order_by("id")
+    if child.status == JobStatus.SUCCESS.value:
+        next_child = waiting.first()
+        if next_child:
+            return [dispatch_job(next_child)]
+    else:
+        for waiting_child in waiting:
+            cancel_job(waiting_child, notify_parent=False)
+            parent.children_active = max(parent.children_active - 1, 0)
+    return []
+
+
+def fetch_result(job: Job, timeout: Optional[float] = None) -> Job:
+    """
+    Fetch the result of a job that has succeeded and then end the job.
+
+    This is called by the `fetch_job_result` task, rather than during the
+    `overseer`'s request, so that a slow result backend does not
+    block the updating of other jobs. Raises an exception if the result
+    could not be fetched so that the task can retry.
+    """
+    if not job.is_active or job.status != JobStatus.SUCCESS.value:
+        return job
+
+    timeout = timeout or settings.JOB_RESULT_FETCH_TIMEOUT
+    start = timezone.now()
+    try:
+        # Celery prohibits waiting for a result within a task, to avoid
+        # deadlocks, but this result is of a task on another queue
+        response = AsyncResult(str(job.id), app=app).get(
+            timeout=timeout, disable_sync_subtasks=False
+        )
+        if not response:
+            raise RuntimeError("Job result was empty")
+    except Exception:
+        result_fetch_duration.labels("error").observe(
+            (timezone.now() - start).total_seconds()
+        )
+        raise
+    result_fetch_duration.labels("success").observe(
+        (timezone.now() - start).total_seconds()
+    )
+
+    job.result = response.get("result")
+    # Results stored by the worker's session controller do not include
+    # the log (it has already been sent in events) so keep the existing one
+    if response.get("log") is not None:
+        job.log = response.get("log")
+    return end_job(job)
+
+
+def fail_result(job: Job) -> Job:
+    """
+    Mark a job as failed because its result could not be fetched.
+    """
+    if not job.is_active or job.status != JobStatus.SUCCESS.value:
+        return job
+
+    logger.error(
+        "Unable to get async result", extra=dict(id=job.id, method=job.method),
+    )
+    job.status = JobStatus.FAILURE.value
+    job.error = dict(type="RuntimeError", message="Unable to get result of job")
+    return end_job(job)
+
+
+def end_job(job: Job) -> Job:
+    """
+    End a job which has been waiting for its result.
+
+    Marks the job as inactive, clears its secrets, runs its callback,
+    records its runtime and updates its parent. If the job has already ended
+    (e.g. it was cancelled while its result was being fetched) then
+    it is left unchanged.
+    """
+    if not claim_end(job):
+        job.refresh_from_db()
+        return job
+
+    job.is_active = False
+    job.secrets = None
+    job.run_callback()
+    record_runtime(job)
+    job.save()
+
+    update_parent(job, ended=True)
+
+    return job
+
+
+def record_runtime(job: Job):
+    """
+    Add the runtime of a job that has ended to the usage of its project's account.
+    """
+    if job.runtime and job.project_id:
+        account_id = (
+            Job.objects.filter(id=job.id)
+            .values_list("project__account_id", flat=True)
+            .first()
+        )
+        AccountUsage.add(
+            account_id, AccountUsage.current_month(), job_runtime=job.runtime
+        )
+
+
+def cancel_job(job: Job, notify_parent: bool = True) -> Job:
     """
     Cancel a job.
 
+    Unless `notify_parent` is false (i.e. the job is being cancelled by its parent,
+    which is updating its own counts of children), the job's parent is updated
+    as for any other job that has ended.
+
     This uses Celery's terminate options which will kill the worker child process.
     This is not normally recommended but in this case is OK because there is only
     one task per process.
@@ -276,13 +641,20 @@ def cancel_job(job: Job) -> Job:
     See https://docs.celeryproject.org/en/stable/userguide/workers.html#revoke-revoking-tasks
     """
     if job.is_active:
+        if not claim_end(job, status=JobStatus.CANCELLED.value, secrets=None):
+            # Job has already ended (e.g. concurrently)
+            job.refresh_from_db()
+            return job
+
         if JobMethod.is_compound(job.method):
             for child in job.children.all():
-                cancel_job(child)
+                cancel_job(child, notify_parent=False)
         else:
             app.control.revoke(str(job.id), terminate=True, signal="SIGUSR1")
         job.status = JobStatus.CANCELLED.value
         job.is_active = False
         job.secrets = None
-        job.save()
+
+        if notify_parent:
+            update_parent(job, ended=True)
     return job
@@ -1,8 +1,35 @@
+from unittest import mock
+
 import pytest
+from celery import Celery
+from celery.exceptions import Retry
+from django.core.cache import cache
+from django.utils import timezone
+
+from accounts.models import Account, AccountTier
+from jobs.jobs import (
+    MISSING_LOG_ENTRY,
+    cancel_job,
+    dispatch_job,
+    end_job,
+    get_job_priority,
+    get_routing_queues,
+    invalidate_routing_queues,
+    merge_log,
+    update_job,
+)
+from jobs.models import Job, JobStatus, Queue, Worker
+from jobs.tasks import fetch_job_result
+from projects.models.projects import Project
+from users.models import User
 
-from accounts.models import Account
-from jobs.jobs import dispatch_job
-from jobs.models import Job, JobStatus
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Avoid cached routing queues etc leaking between tests."""
+    cache.clear()
+    yield
+    cache.clear()
 
 
 @pytest.mark.skip(reason="in flux")
@@ -47,3 +74,395 @@ def test_dispatch_series():
     assert children[0].status == JobStatus.DISPATCHED.value
     assert children[1].status is None
     assert children[2].status is None
+
+
+def test_merge_log():
+    entries = [dict(message=str(index)) for index in range(5)]
+
+    # Without a sequence number, entries are the entire log
+    assert merge_log(entries[:2], entries[2:], None) == entries[2:]
+
+    # Deltas are appended
+    log = merge_log(None, entries[:2], 0)
+    assert log == entries[:2]
+    log = merge_log(log, entries[2:], 2)
+    assert log == entries
+
+    # Re-delivered deltas are not duplicated
+    assert merge_log(log, entries[2:4], 2) == entries
+
+    # Deltas after a gap are placed at their sequence number, and the
+    # gap is filled if the missing delta is re-delivered
+    log = merge_log(entries[:1], entries[3:], 3)
+    assert log == entries[:1] + [MISSING_LOG_ENTRY] * 2 + entries[3:]
+    assert merge_log(log, entries[1:3], 1) == entries
+
+
+@pytest.mark.django_db
+def test_update_job_log_deltas():
+    job = Job.objects.create(
+        method="sleep", is_active=True, status=JobStatus.RUNNING.value
+    )
+
+    update_job(
+        job,
+        data=dict(
+            status="RUNNING", log=[dict(message="a"), dict(message="b")], log_seq=0
+        ),
+    )
+    update_job(job, data=dict(status="RUNNING", log=[dict(message="c")], log_seq=2))
+
+    job.refresh_from_db()
+    assert [entry["message"] for entry in job.log] == ["a", "b", "c"]
+
+
+@pytest.mark.django_db
+def test_update_job_success_does_not_wait_for_result():
+    parent = Job.objects.create(
+        method="series", is_active=True, status=JobStatus.RUNNING.value
+    )
+    job = Job.objects.create(
+        method="sleep", parent=parent, is_active=True, status=JobStatus.RUNNING.value
+    )
+
+    with mock.patch("jobs.jobs.AsyncResult") as async_result:
+        update_job(job, data=dict(status="SUCCESS"))
+        async_result.assert_not_called()
+
+    # Job and its parent remain active until the result is fetched
+    job.refresh_from_db()
+    assert job.status == JobStatus.SUCCESS.value
+    assert job.is_active
+    parent.refresh_from_db()
+    assert parent.is_active
+
+    with mock.patch("jobs.jobs.AsyncResult") as async_result:
+        async_result.return_value.get.return_value = dict(result=42, log=[])
+        fetch_job_result.apply(args=[job.id])
+
+    job.refresh_from_db()
+    assert job.result == 42
+    assert not job.is_active
+    parent.refresh_from_db()
+    assert parent.status == JobStatus.SUCCESS.value
+    assert not parent.is_active
+
+
+@pytest.mark.django_db
+def test_fetch_job_result_from_backend():
+    job = Job.objects.create(
+        method="sleep", is_active=True, status=JobStatus.SUCCESS.value
+    )
+
+    # Use an in-memory result backend, and behave as in a worker process
+    # where Celery prohibits blocking on results within a task
+    backend_app = Celery("test", backend="cache+memory://", set_as_current=False)
+    backend_app.backend.store_result(str(job.id), dict(result=42, log=[]), "SUCCESS")
+    with mock.patch("jobs.jobs.app", backend_app), mock.patch(
+        "celery.result.task_join_will_block", return_value=True
+    ):
+        fetch_job_result.apply(args=[job.id])
+
+    job.refresh_from_db()
+    assert job.result == 42
+    assert job.status == JobStatus.SUCCESS.value
+    assert not job.is_active
+
+
+@pytest.mark.django_db
+def test_fetch_job_result_without_log():
+    """
+    Test that the log already received is kept if the result has none
+    (as for results stored by a worker's session controller).
+    """
+    log = [dict(level=2, message="Launching pod")]
+    job = Job.objects.create(
+        method="session", is_active=True, status=JobStatus.SUCCESS.value, log=log
+    )
+
+    with mock.patch("jobs.jobs.AsyncResult") as async_result:
+        async_result.return_value.get.return_value = dict(result=None)
+        fetch_job_result.apply(args=[job.id])
+
+    job.refresh_from_db()
+    assert job.log == log
+    assert not job.is_active
+
+
+@pytest.mark.django_db
+def test_fetch_job_result_retries_then_fails(settings):
+    settings.JOB_RESULT_FETCH_RETRIES = 2
+    job = Job.objects.create(
+        method="sleep", is_active=True, status=JobStatus.SUCCESS.value
+    )
+
+    with mock.patch("jobs.jobs.AsyncResult") as async_result, mock.patch(
+        "jobs.tasks.fetch_job_result.retry", side_effect=Retry
+    ) as retry:
+        async_result.return_value.get.side_effect = TimeoutError
+        for retries in range(3):
+            fetch_job_result.apply(args=[job.id], retries=retries)
+
+        assert retry.call_count == 2
+
+    job.refresh_from_db()
+    assert job.status == JobStatus.FAILURE.value
+    assert job.error["message"] == "Unable to get result of job"
+    assert not job.is_active
+
+
+@pytest.mark.django_db
+def test_get_routing_queues_cached(django_assert_num_queries):
+    AccountTier.objects.create()
+    Account.objects.create(name="stencila")
+
+    queues = get_routing_queues()
+    assert [queue.name for queue in queues] == ["default"]
+
+    with django_assert_num_queries(0):
+        assert get_routing_queues() == queues
+
+    worker = Worker.objects.create(hostname="worker", updated=timezone.now())
+    queue, _ = Queue.get_or_create(account_name="stencila", queue_name="north:1")
+    worker.queues.add(queue)
+
+    invalidate_routing_queues()
+    assert [queue.name for queue in get_routing_queues()] == ["north:1"]
+
+
+@pytest.mark.django_db
+def test_dispatch_parallel_routing(django_assert_max_num_queries):
+    tier = AccountTier.objects.create()
+    account = Account.objects.create(name="stencila", tier=tier)
+    user = User.objects.create(username="user")
+    project = Project.objects.create(account=account, creator=user, name="project")
+
+    parent = Job.objects.create(method="parallel", project=project, creator=user)
+    for index in range(10):
+        Job.objects.create(method="sleep", project=project, creator=user, parent=parent)
+
+    # Warm the cache
+    get_routing_queues()
+    get_job_priority(parent)
+
+    # One query for the children, and one to save each job
+    with mock.patch("jobs.jobs.signature") as signature:
+        with django_assert_max_num_queries(1 + 11):
+            dispatch_job(parent)
+        assert signature.call_count == 10
+        assert signature.call_args[1]["queue"] == "default"
+        assert signature.call_args[1]["kwargs"]["project"] == project.id
+
+    for child in parent.children.all():
+        assert child.status == JobStatus.DISPATCHED.value
+
+
+@pytest.mark.django_db
+def test_update_parent_parallel_counts(django_assert_max_num_queries):
+    AccountTier.objects.create()
+    Account.objects.create(name="stencila")
+    parent = Job.objects.create(method="parallel")
+    for index in range(20):
+        Job.objects.create(method="sleep", parent=parent)
+
+    with mock.patch("jobs.jobs.signature"):
+        dispatch_job(parent)
+    assert parent.children_active == 20
+    assert parent.children_succeeded == 0
+
+    children = list(parent.get_children())
+
+    # Updating, or ending, a child does not depend on the number of children
+    # (the job is locked, in a savepoint, before it is updated)
+    with django_assert_max_num_queries(6):
+        update_job(children[0], data=dict(status="RUNNING"))
+    parent.refresh_from_db()
+    assert parent.status == JobStatus.RUNNING.value
+
+    with mock.patch("jobs.jobs.AsyncResult") as async_result:
+        async_result.return_value.info = None
+        with django_assert_max_num_queries(8):
+            update_job(children[0], data=dict(status="FAILURE"))
+    parent.refresh_from_db()
+    assert parent.is_active
+    assert parent.children_active == 19
+    assert parent.children_failed == 1
+    assert parent.children_status == JobStatus.FAILURE.value
+
+    for child in children[1:]:
+        child.status = JobStatus.SUCCESS.value
+        end_job(child)
+
+    parent.refresh_from_db()
+    assert not parent.is_active
+    assert parent.status == JobStatus.FAILURE.value
+    assert parent.children_active == 0
+    assert parent.children_succeeded == 19
+    assert parent.children_failed == 1
+
+
+@pytest.mark.django_db
+def test_update_parent_series():
+    AccountTier.objects.create()
+    Account.objects.create(name="stencila")
+    grandparent = Job.objects.create(method="parallel")
+    parent = Job.objects.create(method="series", parent=grandparent)
+    for index in range(3):
+        Job.objects.create(method="sleep", parent=parent)
+
+    with mock.patch("jobs.jobs.signature"):
+        dispatch_job(grandparent)
+    first, second, third = parent.get_children()
+    assert first.status == JobStatus.DISPATCHED.value
+    assert second.status == JobStatus.WAITING.value
+    assert third.status == JobStatus.WAITING.value
+
+    # Next child is dispatched when the previous one succeeds
+    first.status = JobStatus.SUCCESS.value
+    with mock.patch("jobs.jobs.signature") as signature:
+        end_job(first)
+        assert signature.call_args[1]["task_id"] == str(second.id)
+    second.refresh_from_db()
+    assert second.status == JobStatus.DISPATCHED.value
+
+    # Remaining children are cancelled when a child fails
+    with mock.patch("jobs.jobs.AsyncResult") as async_result, mock.patch(
+        "jobs.jobs.app.control"
+    ):
+        async_result.return_value.info = None
+        update_job(second, data=dict(status="FAILURE"))
+
+    third.refresh_from_db()
+    assert third.status == JobStatus.CANCELLED.value
+    parent.refresh_from_db()
+    assert not parent.is_active
+    assert parent.status == JobStatus.FAILURE.value
+    assert parent.children_succeeded == 1
+    assert parent.children_failed == 1
+
+    # And the parent's parent is updated too
+    grandparent.refresh_from_db()
+    assert not grandparent.is_active
+    assert grandparent.status == JobStatus.FAILURE.value
+    assert grandparent.children_failed == 1
+
+
+@pytest.mark.django_db
+def test_cancel_child_updates_parent():
+    AccountTier.objects.create()
+    Account.objects.create(name="stencila")
+    grandparent = Job.objects.create(method="parallel")
+    parent = Job.objects.create(method="series", parent=grandparent)
+    for index in range(3):
+        Job.objects.create(method="sleep", parent=parent)
+    other = Job.objects.create(method="sleep", parent=grandparent)
+
+    with mock.patch("jobs.jobs.signature"):
+        dispatch_job(grandparent)
+    first, second, third = parent.get_children()
+
+    # Cancelling a child of a series job cancels the remaining children
+    # and ends the parent
+    with mock.patch("jobs.jobs.app.control"):
+        cancel_job(first)
+
+    second.refresh_from_db()
+    assert second.status == JobStatus.CANCELLED.value
+    parent.refresh_from_db()
+    assert not parent.is_active
+    assert parent.status == JobStatus.CANCELLED.value
+    assert parent.children_active == 0
+
+    # The grandparent ends when its other child does
+    grandparent.refresh_from_db()
+    assert grandparent.is_active
+    assert grandparent.children_active == 1
+
+    other.refresh_from_db()
+    other.status = JobStatus.SUCCESS.value
+    end_job(other)
+
+    grandparent.refresh_from_db()
+    assert not grandparent.is_active
+    assert grandparent.children_active == 0
+    assert grandparent.children_succeeded == 1
+
+
+@pytest.mark.django_db
+def test_dispatch_series_empty_child():
+    parent = Job.objects.create(method="series")
+    Job.objects.create(method="series", parent=parent)
+    Job.objects.create(method="series", parent=parent)
+
+    # Compound children with no children of their own end immediately
+    dispatch_job(parent)
+
+    assert not parent.is_active
+    assert parent.status == JobStatus.SUCCESS.value
+    assert parent.children_succeeded == 2
+
+
+@pytest.mark.django_db
+def test_dispatch_nested_empty_child_with_running_sibling():
+    AccountTier.objects.create()
+    Account.objects.create(name="stencila")
+    grandparent = Job.objects.create(method="parallel")
+    parent = Job.objects.create(method="series", parent=grandparent)
+    Job.objects.create(method="series", parent=parent)
+    sibling = Job.objects.create(method="sleep", parent=grandparent)
+
+    # The parent ends immediately, because its only child has no children,
+    # and updates the grandparent only once
+    with mock.patch("jobs.jobs.signature"):
+        dispatch_job(grandparent)
+
+    parent.refresh_from_db()
+    assert not parent.is_active
+    grandparent.refresh_from_db()
+    assert grandparent.is_active
+    assert grandparent.children_active == 1
+    assert grandparent.children_succeeded == 1
+
+    sibling.refresh_from_db()
+    assert sibling.is_active
+    sibling.status = JobStatus.SUCCESS.value
+    end_job(sibling)
+
+    grandparent.refresh_from_db()
+    assert not grandparent.is_active
+    assert grandparent.children_active == 0
+    assert grandparent.children_succeeded == 2
+
+
+@pytest.mark.django_db
+def test_end_job_after_cancel():
+    AccountTier.objects.create()
+    Account.objects.create(name="stencila")
+    parent = Job.objects.create(method="parallel")
+    job = Job.objects.create(method="sleep", parent=parent)
+    Job.objects.create(method="sleep", parent=parent)
+
+    with mock.patch("jobs.jobs.signature"):
+        dispatch_job(parent)
+    job.refresh_from_db()
+
+    # The job is cancelled while its result is being fetched (using
+    # another instance of it)
+    job.status = JobStatus.SUCCESS.value
+    with mock.patch("jobs.jobs.app.control"):
+        cancel_job(Job.objects.get(id=job.id))
+    end_job(job)
+
+    assert job.status == JobStatus.CANCELLED.value
+    job.refresh_from_db()
+    assert job.status == JobStatus.CANCELLED.value
+    parent.refresh_from_db()
+    assert parent.is_active
+    assert parent.children_active == 1
+
+    # Updates using a stale instance do not end the job again
+    with mock.patch("jobs.jobs.app.control"):
+        cancel_job(job)
+    update_job(job, data=dict(status="FAILURE"))
+    parent.refresh_from_db()
+    assert parent.children_active == 1
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.7 on 2026-10-18 03:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0014_job_secrets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='children_active',
+            field=models.IntegerField(blank=True, help_text='For compound jobs, the number of child jobs that are active.', null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='children_failed',
+            field=models.IntegerField(blank=True, help_text='For compound jobs, the number of child jobs that have failed.', null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='children_status',
+            field=models.CharField(blank=True, choices=[('WAITING', 'WAITING'), ('DISPATCHED', 'DISPATCHED'), ('PENDING', 'PENDING'), ('RECEIVED', 'RECEIVED'), ('STARTED', 'STARTED'), ('RUNNING', 'RUNNING'), ('SUCCESS', 'SUCCESS'), ('FAILURE', 'FAILURE'), ('CANCELLED', 'CANCELLED'), ('REVOKED', 'REVOKED'), ('TERMINATED', 'TERMINATED'), ('REJECTED', 'REJECTED'), ('RETRY', 'RETRY')], help_text='For compound jobs, the highest ranked status of child jobs that have ended.', max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='children_succeeded',
+            field=models.IntegerField(blank=True, help_text='For compound jobs, the number of child jobs that have succeeded.', null=True),
+        ),
+    ]
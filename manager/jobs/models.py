@@ -722,6 +722,32 @@ class Job(models.Model):
         null=True, blank=True, help_text="The running time of the job."
     )
 
+    children_active = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="For compound jobs, the number of child jobs that are active.",
+    )
+
+    children_succeeded = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="For compound jobs, the number of child jobs that have succeeded.",
+    )
+
+    children_failed = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text="For compound jobs, the number of child jobs that have failed.",
+    )
+
+    children_status = models.CharField(
+        max_length=32,
+        choices=JobStatus.as_choices(),
+        null=True,
+        blank=True,
+        help_text="For compound jobs, the highest ranked status of child jobs that have ended.",
+    )
+
     urls = models.JSONField(
         null=True,
         blank=True,
@@ -0,0 +1,41 @@
+import logging
+
+from celery import shared_task
+from django.conf import settings
+
+from jobs.jobs import fail_result, fetch_result
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(bind=True, acks_late=True)
+def fetch_job_result(self, job_id: int):
+    """
+    Fetch the result of a job that has succeeded.
+
+    Called after a job's status is updated to `SUCCESS`.
+    Retries, with exponential backoff, if the result can not be fetched
+    and marks the job as failed if it still can not be after
+    `JOB_RESULT_FETCH_RETRIES`. The number of results being fetched
+    at any one time is bounded by the concurrency of the `assistant`.
+    """
+    try:
+        job = Job.objects.get(id=job_id)
+    except Job.DoesNotExist:
+        return
+
+    try:
+        fetch_result(job)
+    except Exception as exc:
+        # Catch all errors, but log them. Occasional
+        # errors encountered in prod include ResponseError and TimeoutError
+        attempts = self.request.retries + 1
+        logger.warning(
+            "Error getting async result",
+            exc_info=True,
+            extra=dict(id=job.id, method=job.method, attempts=attempts),
+        )
+        if self.request.retries < settings.JOB_RESULT_FETCH_RETRIES:
+            raise self.retry(exc=exc, countdown=2 ** self.request.retries)
+        fail_result(job)
@@ -39,6 +39,9 @@ class HtmxMixin(GenericAPIView):  # noqa: D101
             viewset = AccountsViewSet.init("create", request, args, kwargs)
             serializer.get_serializer()
 
+        View sets initialized for the same request share anything memoized
+        on it (e.g. the project and the user's role for it, see `projects.access`)
+        so that these are only resolved once when a view uses several view sets.
         """
         vs = cls()
         vs.action = action
@@ -0,0 +1,127 @@
+"""
+A Django cache backend using Redis (the `cache` service).
+
+Django 3.1 does not include a Redis cache backend. This one is used, instead of
+the per-process, in-memory, cache when there is a `CACHE_URL` (see `post_setup`
+in `manager.settings`) so that cached values, including the "generations" used
+for invalidation (e.g. see `accounts.content`) and locks (e.g. see
+`users.socialaccount.tokens`), are shared by all processes of the `manager`
+and the `assistant`.
+"""
+
+import pickle
+from typing import Dict, Optional
+
+import redis
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+# Redis clients (which each have a connection pool) for each location.
+# Django creates a cache instance for each thread, so these are shared between them.
+_clients: Dict[str, redis.Redis] = {}
+
+
+class RedisCache(BaseCache):
+    """
+    A cache backend which stores pickled values in Redis.
+    """
+
+    def __init__(self, location: str, params: Dict):
+        super().__init__(params)
+        if location not in _clients:
+            _clients[location] = redis.Redis.from_url(location)
+        self.client = _clients[location]
+
+    def key(self, key: str, version: Optional[int] = None) -> str:
+        """Make, and validate, the Redis key for a cache key."""
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def expiry(self, timeout=DEFAULT_TIMEOUT) -> Optional[int]:
+        """
+        Get the expiry, in milliseconds, for a timeout.
+
+        Returns `None` if the value should never expire.
+        """
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return None if timeout is None else int(timeout * 1000)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None) -> bool:
+        key = self.key(key, version)
+        expiry = self.expiry(timeout)
+        if expiry is not None and expiry <= 0:
+            # The value would expire immediately so is not stored
+            return not self.client.exists(key)
+        return bool(
+            self.client.set(
+                key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), px=expiry, nx=True
+            )
+        )
+
+    def get(self, key, default=None, version=None):
+        value = self.client.get(self.key(key, version))
+        return default if value is None else pickle.loads(value)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.key(key, version)
+        expiry = self.expiry(timeout)
+        if expiry is not None and expiry <= 0:
+            self.client.delete(key)
+        else:
+            self.client.set(
+                key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), px=expiry
+            )
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None) -> bool:
+        key = self.key(key, version)
+        expiry = self.expiry(timeout)
+        if expiry is None:
+            self.client.persist(key)
+            return bool(self.client.exists(key))
+        if expiry <= 0:
+            return bool(self.client.delete(key))
+        return bool(self.client.pexpire(key, expiry))
+
+    def delete(self, key, version=None) -> bool:
+        return bool(self.client.delete(self.key(key, version)))
+
+    def has_key(self, key, version=None) -> bool:
+        return bool(self.client.exists(self.key(key, version)))
+
+    def get_many(self, keys, version=None) -> Dict:
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self.client.mget([self.key(key, version) for key in keys])
+        return {
+            key: pickle.loads(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        pipeline = self.client.pipeline(transaction=False)
+        expiry = self.expiry(timeout)
+        for key, value in data.items():
+            key = self.key(key, version)
+            if expiry is not None and expiry <= 0:
+                pipeline.delete(key)
+            else:
+                pipeline.set(
+                    key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), px=expiry
+                )
+        pipeline.execute()
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self.key(key, version) for key in keys]
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        # Only delete keys made by this cache, since the `cache` service
+        # is also used for other things (e.g. Celery results)
+        keys = list(self.client.scan_iter(match=self.make_key("*", version="*")))
+        if keys:
+            self.client.delete(*keys)
@@ -246,6 +246,8 @@ class Prod(Configuration):
 
     # Caching
     # See https://docs.djangoproject.com/en/3.0/topics/cache
+    # If there is a `CACHE_URL` then the `cache` service is used instead
+    # (see `post_setup` below)
 
     CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
 
@@ -544,6 +546,52 @@ class Prod(Configuration):
     # A list of job methods restricted to staff members
     JOB_METHODS_STAFF_ONLY: List[str] = []
 
+    # Number of seconds that the table of queues that jobs are routed to
+    # is cached for (it is also invalidated when workers come online or go offline)
+    JOB_ROUTING_CACHE_SECONDS = values.IntegerValue(60)
+
+    # Timeout (in seconds) for each attempt to fetch the result of a job
+    # from the result backend, and the maximum number of retries
+    # (see `jobs.tasks.fetch_job_result`)
+    JOB_RESULT_FETCH_TIMEOUT = values.FloatValue(10)
+    JOB_RESULT_FETCH_RETRIES = values.IntegerValue(5)
+
+    # Number of seconds that the resolution of requests for account content
+    # (and whether the account is over its download quota) is cached for
+    # (resolutions are also invalidated when accounts, projects, snapshots
+    # or files change)
+    CONTENT_CACHE_SECONDS = values.IntegerValue(300)
+
+    # Number of seconds that the resolution of a project, and the user's role for it,
+    # is cached for (resolutions are also invalidated when roles, accounts or projects
+    # change, see `projects.access`)
+    PROJECT_ACCESS_CACHE_SECONDS = values.IntegerValue(60)
+
+    # Maximum number of seconds that users' OAuth tokens are cached for (tokens are
+    # only cached until shortly before they expire, see `users.socialaccount.tokens`)
+    SOCIAL_TOKEN_CACHE_SECONDS = values.IntegerValue(3600)
+
+    # Tokens which have been used within `SOCIAL_TOKEN_USED_SECONDS` and which
+    # expire within `SOCIAL_TOKEN_REFRESH_SECONDS` are refreshed by a periodic task
+    # (which should run more often than the latter)
+    SOCIAL_TOKEN_USED_SECONDS = values.IntegerValue(86400)
+    SOCIAL_TOKEN_REFRESH_SECONDS = values.IntegerValue(600)
+
+    # Maximum number of seconds to wait for a token to be refreshed by another process
+    SOCIAL_TOKEN_REFRESH_TIMEOUT = values.IntegerValue(30)
+
+    # Number of seconds that the augmented index.html of a snapshot is cached for
+    # (see `accounts.ui.views.content.snapshot_index_html`)
+    CONTENT_INDEX_CACHE_SECONDS = values.IntegerValue(86400)
+
+    # Source events are buffered until no more events have been received for
+    # `SOURCE_EVENTS_QUIET_SECONDS`, or the first was received more than
+    # `SOURCE_EVENTS_MAX_SECONDS` ago, and duplicates received within
+    # `SOURCE_EVENTS_SEEN_SECONDS` are ignored (see `projects.events`)
+    SOURCE_EVENTS_QUIET_SECONDS = values.IntegerValue(30)
+    SOURCE_EVENTS_MAX_SECONDS = values.IntegerValue(300)
+    SOURCE_EVENTS_SEEN_SECONDS = values.IntegerValue(3600)
+
     @classmethod
     def post_setup(cls):
         """Do additional configuration after initial setup."""
@@ -555,6 +603,14 @@ class Prod(Configuration):
         if cls.UI_BASIC_AUTH:
             cls.MIDDLEWARE += ("manager.middleware.basic_auth",)
 
+        # Use the `cache` service, if any, so that the cache is shared
+        # by all processes (rather than each process having its own)
+        if cls.CACHE_URL:
+            cls.CACHES["default"] = {
+                "BACKEND": "manager.cache.RedisCache",
+                "LOCATION": cls.CACHE_URL,
+            }
+
         # Set default API throttling rates
         cls.REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"] = {
             "anon": cls.DEFAULT_THROTTLE_RATE_ANON,
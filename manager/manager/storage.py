@@ -48,11 +48,11 @@ class FileSystemStorage(BaseFileSystemStorage):
         with self.open(path) as file:
             return file.read()
 
-    def generate_post_policy(self, path: str) -> Optional[dict]:
+    def generate_upload_url(self, path: str) -> Optional[str]:
         """
-        Generate a URL that can be used to POST a file.
+        Generate a URL that can be used to start a resumable upload of a file.
 
-        Not available for this tpe of storage.
+        Not available for this type of storage.
         """
         return None
 
@@ -86,15 +86,25 @@ class GoogleCloudStorage(BaseGoogleCloudStorage):
                 return response.content
         raise RuntimeError("Unable to fetch file from Google Cloud Storage")
 
-    def generate_post_policy(self, path: str) -> Optional[dict]:
+    def generate_upload_url(self, path: str) -> Optional[str]:
         """
-        Generate a URL that can be used to POST a file to the bucket.
+        Generate a URL that can be used to start a resumable upload of a file to the bucket.
 
-        See `generate_signed_post_policy_v4` in https://googleapis.dev/python/storage/latest/client.html
+        Resumable uploads allow large files, of unknown size, to be uploaded in chunks
+        and for the upload to be resumed if a request fails.
+        See https://cloud.google.com/storage/docs/access-control/signed-urls#signing-resumable
         """
         client = google.cloud.storage.Client()
-        return client.generate_signed_post_policy_v4(
-            self.bucket_name, path, expiration=datetime.timedelta(hours=1)
+        return (
+            client.bucket(self.bucket_name)
+            .blob(path)
+            .generate_signed_url(
+                version="v4",
+                expiration=datetime.timedelta(hours=1),
+                method="POST",
+                content_type="application/zip",
+                headers={"x-goog-resumable": "start"},
+            )
         )
 
 
@@ -0,0 +1,160 @@
+"""
+Cache of the resolution of projects, and the user's role for them, for requests.
+
+Most views for a project (e.g. its files, sources, snapshots and jobs) need to
+resolve the project from the account and project identifiers in the URL
+and check the role of the user for it (see `projects.api.views.projects.get_project`).
+Within a request this may be done several times (e.g. by `get_queryset` and
+`get_response_context`, or by several view sets initialized with `HtmxMixin.init`)
+and the HTMX partials of a page make several requests, each doing the same
+resolution.
+
+So that a resolution is only done once, resolutions are:
+
+- memoized on the request (all view sets initialized for a request share the
+  same underlying `HttpRequest`)
+
+- cached, for `PROJECT_ACCESS_CACHE_SECONDS`, keyed by the user and the identifiers
+  (for safe requests only, so that a project is never updated using a cached
+  instance)
+
+Like the cache of account content (see `accounts.content`) cached resolutions are
+invalidated by deleting the "generation" of the account, project or user that
+they were cached with. Because an invalidation must be seen by all processes
+(otherwise a user could continue to access a project after their role for it
+was removed), resolutions are only cached when there is a `CACHE_URL` (i.e.
+the cache is shared, see `manager.cache`). Otherwise (e.g. during development)
+they are only memoized on the request. The `invalidate_project_access` function is called when
+effective roles are refreshed (see `ProjectAccess.refresh`) and when accounts and
+projects are changed (e.g. renamed, or made private).
+"""
+
+import hashlib
+import uuid
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpRequest
+
+# Kinds of generations that a cached resolution depends upon
+KINDS = ("all", "account", "project", "user")
+
+# Methods for which cached resolutions are used
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def generation_key(kind: str, id: Optional[int] = None) -> str:
+    """Get the cache key for the generation of an account, project or user."""
+    return "access-{kind}-{id}-generation".format(kind=kind, id=id or "")
+
+
+def resolution_key(user_id: Optional[int], account: str, project: str) -> str:
+    """
+    Get the cache key for a resolution.
+
+    The identifiers are hashed because they are user supplied and
+    can contain characters that are not allowed in some cache backends.
+    """
+    parts = "\n".join([str(user_id or ""), account or "", project])
+    return "access-resolution-{hash}".format(
+        hash=hashlib.sha1(parts.encode()).hexdigest()
+    )
+
+
+def get_memo(request: HttpRequest) -> Dict[Tuple[str, str], object]:
+    """
+    Get the resolutions memoized on a request.
+
+    A Django Rest Framework `Request` wraps a Django `HttpRequest`, which is the
+    one shared by view sets, so the memo is stored on the latter.
+    """
+    request = getattr(request, "_request", request)
+    if not hasattr(request, "_project_access"):
+        request._project_access = {}
+    return request._project_access
+
+
+def generation_keys(
+    user_id: Optional[int], account_id: int, project_id: int
+) -> List[str]:
+    """Get the keys of the generations that a resolution depends upon."""
+    return [
+        generation_key("all"),
+        generation_key("account", account_id),
+        generation_key("project", project_id),
+        generation_key("user", user_id),
+    ]
+
+
+def get_resolution(request: HttpRequest, account: str, project: str):
+    """
+    Get a cached resolution if the request is safe and it is still current.
+    """
+    if not settings.CACHE_URL or request.method not in SAFE_METHODS:
+        return None
+
+    resolution = cache.get(resolution_key(request.user.id, account, project))
+    if resolution is None:
+        return None
+
+    keys = generation_keys(
+        request.user.id, resolution["project"].account_id, resolution["project"].id
+    )
+    generations = cache.get_many(keys)
+    if [generations.get(key) for key in keys] != resolution["generations"]:
+        return None
+
+    return resolution["project"]
+
+
+def set_resolution(request: HttpRequest, account: str, project: str, instance):
+    """
+    Cache a resolution for `PROJECT_ACCESS_CACHE_SECONDS`.
+
+    Generations that are missing (because they have never been set, or have just
+    been invalidated) are added but the resolution is not cached. This avoids
+    caching a resolution which was done before an invalidation.
+    """
+    if not settings.CACHE_URL:
+        return
+
+    keys = generation_keys(request.user.id, instance.account_id, instance.id)
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        return
+
+    cache.set(
+        resolution_key(request.user.id, account, project),
+        dict(generations=[generations[key] for key in keys], project=instance),
+        settings.PROJECT_ACCESS_CACHE_SECONDS,
+    )
+
+
+def invalidate_project_access(
+    users: Optional[Iterable[int]] = None,
+    projects: Optional[Iterable[int]] = None,
+    accounts: Optional[Iterable[int]] = None,
+):
+    """
+    Invalidate the cached resolutions for projects, accounts or users.
+
+    If none are specified then all cached resolutions are invalidated.
+    Generations are deleted immediately, and again when the current transaction
+    is committed (so that resolutions done, using the old roles, while the
+    transaction is in progress are not used).
+    """
+    keys = (
+        [generation_key("project", id) for id in projects or []]
+        + [generation_key("account", id) for id in accounts or []]
+        + [generation_key("user", id) for id in users or []]
+    )
+    if projects is None and accounts is None and users is None:
+        keys = [generation_key("all")]
+
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -19,7 +19,7 @@ from manager.api.helpers import get_help_text, get_object_from_ident
 from manager.api.validators import FromContextDefault
 from manager.helpers import unique_slugify
 from manager.themes import Themes
-from projects.models.files import File
+from projects.models.files import Directory, File
 from projects.models.nodes import Node
 from projects.models.projects import Project, ProjectAgent, ProjectLiveness, ProjectRole
 from projects.models.providers import GithubRepo
@@ -588,23 +588,34 @@ class FileListSerializer(FileSerializer):
 
     def get_name(self, obj) -> str:
         """Get the name of the file / dir."""
-        return str(obj.get("name")) if isinstance(obj, dict) else obj.name
+        return obj.name
 
     def get_is_directory(self, obj) -> bool:
         """Is the entry a directory."""
-        return bool(obj.get("is_directory")) if isinstance(obj, dict) else False
+        return isinstance(obj, Directory)
 
     def get_count(self, obj) -> int:
         """Get the number of files in a dir."""
-        return int(str(obj.get("count"))) if isinstance(obj, dict) else 1
+        return obj.count if isinstance(obj, Directory) else 1
 
     def get_source(self, obj):
         """Get the list of sources. Always just a single source for a file."""
-        if isinstance(obj, dict):
-            return [source.id for source in obj["source"]]
+        if isinstance(obj, Directory):
+            return obj.source
         else:
             return [obj.source_id]
 
+    def to_representation(self, instance):
+        """
+        Serialize a file or directory.
+
+        Directories are not files and so do not have a file `id`.
+        """
+        data = super().to_representation(instance)
+        if isinstance(instance, Directory):
+            del data["id"]
+        return data
+
     class Meta:
         model = File
         exclude = ["upstreams"]
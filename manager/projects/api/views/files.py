@@ -1,6 +1,6 @@
-from typing import Any, Dict, List, Optional, Union
+from typing import List, Optional, Union
 
-from django.db.models import QuerySet, TextField, Value
+from django.db.models import BooleanField, QuerySet, TextField, Value
 from django.db.models.functions import Concat, StrIndex, Substr
 from django.http import Http404
 from rest_framework import permissions, viewsets
@@ -10,12 +10,53 @@ from rest_framework.response import Response
 from manager.api.helpers import HtmxDestroyMixin, HtmxListMixin, HtmxRetrieveMixin
 from projects.api.serializers import FileListSerializer, FileSerializer
 from projects.api.views.projects import get_project
-from projects.models.files import File
+from projects.models.files import Directory, File
 from projects.models.projects import Project
 from projects.models.snapshots import Snapshot
 from projects.models.sources import Source
 
 
+class FileListing:
+    """
+    A listing of the directories, and then files, within a directory.
+
+    Supports `len()` and slicing (as used by pagination and templates)
+    so that only the directories and files for the requested page are fetched.
+    """
+
+    def __init__(self, directories: QuerySet, files: QuerySet):
+        self.directories = directories
+        self.files = files
+
+    def count(self) -> int:
+        """Get the total number of directories and files."""
+        if not hasattr(self, "directories_count"):
+            self.directories_count = self.directories.count()
+            self.files_count = self.files.count()
+        return self.directories_count + self.files_count
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key: slice) -> List[Union[Directory, File]]:
+        assert isinstance(key, slice) and key.step is None
+        self.count()
+        start = key.start or 0
+        stop = self.count() if key.stop is None else key.stop
+
+        items: List[Union[Directory, File]] = []
+        if start < self.directories_count:
+            items += self.directories[start : min(stop, self.directories_count)]
+        if stop > self.directories_count:
+            items += self.files[
+                max(start - self.directories_count, 0) : stop - self.directories_count
+            ]
+        return items
+
+
 class ProjectsFilesViewSet(
     HtmxListMixin, HtmxRetrieveMixin, HtmxDestroyMixin, viewsets.GenericViewSet,
 ):
@@ -43,7 +84,7 @@ class ProjectsFilesViewSet(
         Requires that user has read access to the project.
         """
         if not hasattr(self, "project"):
-            self.project = get_project(self.kwargs, self.request.user)
+            self.project = get_project(self.kwargs, self.request)
         return self.project
 
     def get_prefix(self) -> str:
@@ -71,23 +112,31 @@ class ProjectsFilesViewSet(
           - using path prefix (e.g for subdirectory listing)
           - using a mimetype
 
-        Allows for aggregation (the default) by directory.
+        Allows for aggregation (the default) by directory. Directories are
+        listed from the `Directory` index, followed by the files directly within
+        the prefix. Directories are not filtered by mimetype.
         """
         project = project or self.get_project()
 
         # Avoid using select_related and prefetch_related here
         # as it can slow down queries significantly
         queryset = File.objects.filter(project=project).order_by("path")
+        directories = Directory.objects.filter(project=project).order_by("name")
 
         source = source or self.request.GET.get("source")
         if source:
             queryset = queryset.filter(source=source)
+            directories = directories.filter(
+                sources__has_key=str(getattr(source, "id", source))
+            )
 
         snapshot = snapshot or self.request.GET.get("snapshot")
         if snapshot:
             queryset = queryset.filter(snapshot=snapshot)
+            directories = directories.filter(snapshot=snapshot)
         else:
             queryset = queryset.filter(snapshot__isnull=True, current=True)
+            directories = directories.filter(snapshot__isnull=True)
 
         prefix = self.get_prefix()
         if prefix:
@@ -96,65 +145,36 @@ class ProjectsFilesViewSet(
         search = self.request.GET.get("search", "").strip()
         if search:
             queryset = queryset.filter(path__istartswith=prefix + search)
+            directories = directories.filter(name__istartswith=search)
 
         mimetype = self.request.GET.get("mimetype", "").strip()
         if mimetype:
             queryset = queryset.filter(mimetype__startswith=mimetype)
 
-        queryset = queryset.annotate(
-            name=Substr(
-                "path",
-                pos=len(prefix) + 1,
-                length=StrIndex(
-                    # Add a trailing slash to ensure all paths
-                    # will have a length
-                    Concat(Substr("path", len(prefix) + 1), Value("/")),
-                    Value("/"),
-                )
-                - 1,
-                output_field=TextField(),
-            )
-        )
-
         expand = self.request.GET.get("expand")
         if expand is not None:
-            return queryset
-
-        # Fetch the files, limiting to 10,000 so the following grouping
-        # does not take forever
-        # TODO: Put a message in the result if this limit is reached
-        files = list(queryset.all()[:10000])
-
-        groups: Dict[str, Dict[str, Any]] = {}
-        for file in files:
-            if "/" in file.path[len(prefix) + 1 :]:
-                name = file.name
-                info = groups.get(name)
-                if not info:
-                    groups[name] = dict(
-                        path=prefix + name,
-                        name=file.name,
-                        is_directory=True,
-                        count=1,
-                        source=[file.source_id],
-                        size=file.size,
-                        modified=file.modified,
-                    )
-                else:
-                    info["count"] += 1
-                    info["size"] += file.size
-                    info["source"] += [file.source_id]
-                    info["modified"] = (
-                        file.modified
-                        if file.modified > info["modified"]
-                        else info["modified"]
+            return queryset.annotate(
+                name=Substr(
+                    "path",
+                    pos=len(prefix) + 1,
+                    length=StrIndex(
+                        # Add a trailing slash to ensure all paths
+                        # will have a length
+                        Concat(Substr("path", len(prefix) + 1), Value("/")),
+                        Value("/"),
                     )
-            else:
-                file.is_directory = False
-                groups[file.path] = file
+                    - 1,
+                    output_field=TextField(),
+                )
+            )
 
-        # Return items sorted by path again
-        return [value for key, value in sorted(groups.items())]
+        return FileListing(
+            directories.filter(parent=prefix),
+            queryset.filter(parent=prefix).annotate(
+                name=Substr("path", len(prefix) + 1, output_field=TextField()),
+                is_directory=Value(False, output_field=BooleanField()),
+            ),
+        )
 
     def get_object(self, project: Optional[Project] = None) -> File:
         """
@@ -0,0 +1,36 @@
+from rest_framework import status
+
+from manager.testing import DatabaseTestCase
+from projects.models.files import File
+
+
+class ProjectsFilesViewsTest(DatabaseTestCase):
+    """Test listing project files using API."""
+
+    def test_list(self):
+        """
+        Test listing files by directory, with pagination
+        """
+        project = self.ada_public
+        for path in ["a.txt", "b.txt", "c/d.txt", "c/e/f.txt", "g/h.txt"]:
+            File.create(project, path, dict(size=10))
+
+        def list(**data):
+            response = self.list(
+                self.ada, "api-projects-files-list", data, {"project": project.id},
+            )
+            assert response.status_code == status.HTTP_200_OK
+            return [
+                (item["name"], item["is_directory"], item["count"], item["size"])
+                for item in response.data["results"]
+            ]
+
+        assert list() == [
+            ("c", True, 2, 20),
+            ("g", True, 1, 10),
+            ("a.txt", False, 1, 10),
+            ("b.txt", False, 1, 10),
+        ]
+        assert list(limit=2, offset=1) == [("g", True, 1, 10), ("a.txt", False, 1, 10)]
+        assert list(prefix="c") == [("e", True, 1, 10), ("d.txt", False, 1, 10)]
+        assert list(prefix="c", search="E") == [("e", True, 1, 10)]
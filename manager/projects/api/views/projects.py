@@ -21,6 +21,7 @@ from manager.api.helpers import (
     HtmxUpdateMixin,
     filter_from_ident,
 )
+from projects import access
 from projects.api.serializers import (
     ProjectAgentCreateSerializer,
     ProjectAgentSerializer,
@@ -34,34 +35,47 @@ from projects.api.serializers import (
 )
 from projects.models.projects import Project, ProjectAgent, ProjectRole
 from projects.models.sources import Source
-from users.models import AnonUser, User, get_projects
+from users.models import AnonUser, get_projects
 
 
 def get_project(
-    identifiers: Dict[str, str], user: User, roles: Optional[List[ProjectRole]] = None,
+    identifiers: Dict[str, str],
+    request: Request,
+    roles: Optional[List[ProjectRole]] = None,
 ):
     """
     Get a project for the user, optionally requiring one or more roles.
 
     Like GitHub, raises a `NotFound` exception if the user does not have permission
     to avoid leaking the existence of a private project.
-    """
-    filter = filter_from_ident(identifiers["project"])
 
+    The project (annotated with the user's role for it) is memoized on the
+    request, and cached for safe requests, so that it is only resolved once
+    for the view sets used by a page (see `projects.access`).
+    """
     account = identifiers.get("account")
-    if account:
-        filter.update(**filter_from_ident(account, prefix="account"))
-    elif "id" not in filter:
-        filter.update({"account__name": "temp"})
-
-    try:
-        project = get_projects(user).get(**filter)
-    except Project.DoesNotExist:
+    key = (account or "", identifiers["project"])
+    memo = access.get_memo(request)
+    project = memo.get(key)
+    if project is None:
+        project = access.get_resolution(request, *key)
+        if project is None:
+            filter = filter_from_ident(identifiers["project"])
+            if account:
+                filter.update(**filter_from_ident(account, prefix="account"))
+            elif "id" not in filter:
+                filter.update({"account__name": "temp"})
+
+            try:
+                project = get_projects(request.user).get(**filter)
+            except Project.DoesNotExist:
+                raise exceptions.NotFound
+            access.set_resolution(request, *key, project)
+        memo[key] = project
+
+    if roles and project.role not in [role.name for role in roles]:
         raise exceptions.NotFound
-    else:
-        if roles and project.role not in [role.name for role in roles]:
-            raise exceptions.NotFound
-        return project
+    return project
 
 
 class ProjectsCreateAnonThrottle(throttling.AnonRateThrottle):
@@ -243,7 +257,7 @@ class ProjectsViewSet(
         if hasattr(self, "project"):
             return self.project
 
-        project = get_project(self.kwargs, self.request.user)
+        project = get_project(self.kwargs, self.request)
 
         if project.temporary is True:
             if "name" not in filter_from_ident(self.kwargs["project"]):
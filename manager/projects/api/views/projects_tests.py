@@ -1,6 +1,17 @@
-from rest_framework import status
+from unittest import mock
 
+import pytest
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework import exceptions, status
+
+from accounts.models import AccountTier
 from manager.testing import DatabaseTestCase
+from projects.api.views.projects import get_project
+from projects.models.projects import Project, ProjectAgent, ProjectRole
+from users.models import User
 
 
 class ProjectsViewsTest(DatabaseTestCase):
@@ -135,3 +146,96 @@ class ProjectsViewsTest(DatabaseTestCase):
         )
         assert response.status_code == status.HTTP_200_OK
         assert response.data["count"] == 0
+
+
+def resolve(user, project, method="get", roles=None):
+    """
+    Get a project for a new request by a user, returning it and the number
+    of database queries made.
+    """
+    request = getattr(RequestFactory(), method)("/")
+    request.user = user
+    with CaptureQueriesContext(connection) as queries:
+        for index in range(3):
+            instance = get_project({"project": str(project.id)}, request, roles)
+    return instance, len(queries)
+
+
+@pytest.mark.django_db
+def test_get_project_cached(settings):
+    """
+    Test that the resolution of a project is memoized for a request and cached
+    across requests until roles or the project change.
+    """
+    # Behave as if the cache is shared between processes
+    settings.CACHE_URL = "redis://cache"
+    cache.clear()
+    AccountTier.objects.create()
+    ada = User.objects.create(username="ada")
+    bob = User.objects.create(username="bob")
+    project = Project.objects.create(
+        account=ada.personal_account, creator=ada, name="project", public=False
+    )
+
+    # Resolved once per request, until cached
+    instance, queries = resolve(ada, project)
+    assert instance.role == "OWNER"
+    assert queries == 1
+    instance, queries = resolve(ada, project)
+    assert queries == 1
+    instance, queries = resolve(ada, project)
+    assert instance.role == "OWNER"
+    assert queries == 0
+
+    # Not cached for unsafe requests
+    instance, queries = resolve(ada, project, "post")
+    assert queries == 1
+
+    # Roles are still checked for cached resolutions
+    with pytest.raises(exceptions.NotFound):
+        resolve(ada, project, roles=[ProjectRole.READER])
+
+    # Changes to roles invalidate the cache
+    with pytest.raises(exceptions.NotFound):
+        resolve(bob, project)
+    agent = ProjectAgent.objects.create(
+        project=project, user=bob, role=ProjectRole.READER.name
+    )
+    for index in range(2):
+        resolve(bob, project)
+    assert resolve(bob, project) == (mock.ANY, 0)
+    agent.role = ProjectRole.AUTHOR.name
+    agent.save()
+    instance, queries = resolve(bob, project)
+    assert instance.role == "AUTHOR"
+    assert queries == 1
+
+    # Changes to the project invalidate the cache
+    project.name = "renamed"
+    project.save()
+    instance, queries = resolve(ada, project)
+    assert instance.name == "renamed"
+    assert queries == 1
+
+    agent.delete()
+    with pytest.raises(exceptions.NotFound):
+        resolve(bob, project)
+
+
+@pytest.mark.django_db
+def test_get_project_not_cached_without_shared_cache():
+    """
+    Test that, unless there is a shared cache, resolutions are only memoized
+    for a request (so that invalidations are seen by all processes).
+    """
+    cache.clear()
+    AccountTier.objects.create()
+    ada = User.objects.create(username="ada")
+    project = Project.objects.create(
+        account=ada.personal_account, creator=ada, name="project", public=False
+    )
+
+    for index in range(3):
+        instance, queries = resolve(ada, project)
+        assert instance.role == "OWNER"
+        assert queries == 1
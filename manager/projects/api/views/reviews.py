@@ -52,7 +52,7 @@ class ProjectsReviewsViewSet(
         if not hasattr(self, "project"):
             self.project = get_project(
                 self.kwargs,
-                self.request.user,
+                self.request,
                 ProjectRole.and_above(ProjectRole.EDITOR)
                 if self.action in ["create", "partial_update", "extract"]
                 else None,
@@ -65,7 +65,7 @@ class ProjectsSnapshotsViewSet(
         """
         return get_project(
             self.kwargs,
-            self.request.user,
+            self.request,
             [
                 ProjectRole.AUTHOR,
                 ProjectRole.EDITOR,
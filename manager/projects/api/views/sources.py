@@ -60,7 +60,7 @@ class ProjectsSourcesViewSet(
         if not hasattr(self, "project"):
             self.project = get_project(
                 self.kwargs,
-                self.request.user,
+                self.request,
                 [ProjectRole.AUTHOR, ProjectRole.MANAGER, ProjectRole.OWNER]
                 if self.action in ["create", "partial_update", "destroy"]
                 else None,
@@ -0,0 +1,140 @@
+"""
+Metering of file downloads.
+
+Rather than writing to the `FileDownloads` table on each request for account
+content, downloads are counted in Redis (the `cache` service) and periodically
+flushed to the table, in bulk, by the `flush_file_downloads` task.
+When flushing, the number of bytes downloaded is added to the `AccountUsage` of
+each account. That running total is used for the `FILE_DOWNLOADS_MONTH` quota
+and so enforcement of that quota lags by, at most, the interval between flushes.
+
+When there is no `CACHE_URL` (e.g. during development and testing), downloads
+are written to the table immediately.
+
+Redis keys used:
+
+- `file-downloads-months`: set of months with downloads that have not been flushed
+- `file-downloads:<month>`: hash of file id to count of downloads not yet flushed
+"""
+
+from collections import defaultdict
+from typing import Dict, Optional
+
+import redis
+from django.conf import settings
+from django.db import transaction
+
+from accounts.models import AccountUsage
+from projects.models.files import File, FileDownloads
+
+MONTHS_KEY = "file-downloads-months"
+
+_redis: Optional[redis.Redis] = None
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """
+    Get the Redis client used for counting downloads.
+
+    Returns `None` if there is no `CACHE_URL`.
+    """
+    global _redis
+    if _redis is None and settings.CACHE_URL:
+        _redis = redis.Redis.from_url(settings.CACHE_URL)
+    return _redis
+
+
+def record_download(file: File):
+    """
+    Record a download of a file.
+    """
+    month = AccountUsage.current_month()
+
+    client = get_redis()
+    if client is None:
+        add_file_downloads(month, {file.id: 1})
+        return
+
+    pipeline = client.pipeline(transaction=False)
+    pipeline.hincrby("file-downloads:{month}".format(month=month), file.id, 1)
+    pipeline.sadd(MONTHS_KEY, month)
+    pipeline.execute()
+
+
+def flush_downloads() -> int:
+    """
+    Flush downloads counted in Redis to the `FileDownloads` table.
+
+    For each month with downloads, the hash of counts is renamed (so
+    that downloads recorded during the flush are not lost) before being
+    added to the table. If a previous flush failed part way through
+    then the renamed hash is flushed first. Returns the number of
+    files that had downloads.
+    """
+    client = get_redis()
+    if client is None:
+        return 0
+
+    month_now = AccountUsage.current_month()
+    files = 0
+    for month in sorted(client.smembers(MONTHS_KEY)):
+        month = month.decode()
+        key = "file-downloads:{month}".format(month=month)
+        flushing = key + ":flushing"
+        if not client.exists(flushing):
+            try:
+                client.rename(key, flushing)
+            except redis.ResponseError:
+                # No downloads since the last flush
+                if month != month_now:
+                    client.srem(MONTHS_KEY, month)
+                continue
+
+        counts = {
+            int(file_id): int(count)
+            for file_id, count in client.hgetall(flushing).items()
+        }
+        add_file_downloads(month, counts)
+        client.delete(flushing)
+        files += len(counts)
+
+    return files
+
+
+@transaction.atomic
+def add_file_downloads(month: str, counts: Dict[int, int]):
+    """
+    Add counts of downloads of files to the `FileDownloads` table.
+
+    Also adds the number of bytes downloaded to the usage of the
+    accounts that the files belong to. Files that no longer exist are ignored.
+    """
+    files = File.objects.filter(id__in=counts.keys()).values_list(
+        "id", "size", "project__account_id"
+    )
+    file_ids = set()
+    account_bytes: Dict[int, int] = defaultdict(int)
+    for file_id, size, account_id in files:
+        file_ids.add(file_id)
+        account_bytes[account_id] += counts[file_id] * (size or 0)
+
+    existing = list(
+        FileDownloads.objects.select_for_update().filter(
+            month=month, file_id__in=file_ids
+        )
+    )
+    for downloads in existing:
+        downloads.count += counts[downloads.file_id]
+    FileDownloads.objects.bulk_update(existing, ["count"])
+
+    existing_ids = set(downloads.file_id for downloads in existing)
+    FileDownloads.objects.bulk_create(
+        [
+            FileDownloads(file_id=file_id, month=month, count=counts[file_id])
+            for file_id in file_ids
+            if file_id not in existing_ids
+        ]
+    )
+
+    for account_id, amount in account_bytes.items():
+        AccountUsage.add(account_id, month, file_downloads=amount)
@@ -0,0 +1,55 @@
+import pytest
+
+from accounts.models import AccountTier, AccountUsage
+from accounts.quotas import AccountQuotas
+from projects.downloads import add_file_downloads, record_download
+from projects.models.files import File, FileDownloads
+from projects.models.projects import Project
+from users.models import User
+
+
+@pytest.fixture
+def files():
+    """Create a project with two files."""
+    AccountTier.objects.create()
+    user = User.objects.create(username="user")
+    project = Project.objects.create(
+        account=user.personal_account, creator=user, name="project"
+    )
+    return [
+        File.create(project, "a.txt", dict(size=100)),
+        File.create(project, "b.txt", dict(size=1000)),
+    ]
+
+
+@pytest.mark.django_db
+def test_add_file_downloads(files):
+    a, b = files
+
+    add_file_downloads("2021-01", {a.id: 2})
+    add_file_downloads("2021-01", {a.id: 3, b.id: 1, 123456: 1})
+    add_file_downloads("2021-02", {a.id: 1})
+
+    assert dict(
+        FileDownloads.objects.filter(month="2021-01").values_list("file_id", "count")
+    ) == {a.id: 5, b.id: 1}
+    assert FileDownloads.objects.get(month="2021-02").count == 1
+
+    account_id = a.project.account_id
+    assert AccountUsage.get(account_id, "2021-01").file_downloads == 5 * 100 + 1000
+    assert AccountUsage.get(account_id, "2021-02").file_downloads == 100
+
+
+@pytest.mark.django_db
+def test_record_download(files):
+    a, b = files
+    account = a.project.account
+
+    record_download(a)
+    record_download(a)
+    record_download(b)
+
+    month = AccountUsage.current_month()
+    assert FileDownloads.objects.get(file=a, month=month).count == 2
+    assert AccountUsage.get(account.id, month).file_downloads == 2 * 100 + 1000
+    assert not AccountQuotas.FILE_DOWNLOADS_MONTH.reached(account)
@@ -0,0 +1,193 @@
+"""
+Buffering, debouncing and coalescing of source event notifications.
+
+Source providers (e.g. Google Drive) send event notifications for changes to
+sources, often in bursts (e.g. several notifications for a single edit, and
+retries of the same notification). Rather than recording each notification,
+and acting on it, as it is received, events are buffered in Redis (the `cache`
+service) for each source. A source's buffered events are flushed by the
+`flush_source_events` task once no more events have been received for
+`SOURCE_EVENTS_QUIET_SECONDS` (or the first buffered event is older than
+`SOURCE_EVENTS_MAX_SECONDS`, so that a continuous stream of events is not
+deferred indefinitely).
+
+When flushed, duplicate events (having the same `resourceId` and `messageNumber`)
+are removed, the remaining events are written to the `ProjectEvent` table in bulk
+and, if any of them is a change to the source, a single pull job is created for it.
+
+Because pull jobs are created (using the credentials of the source's creator),
+only events that have been verified by the source (e.g. a Google source whose
+subscription token matched) should be recorded using `record_source_event`.
+
+When there is no `CACHE_URL` (e.g. during development and testing), events are
+processed immediately.
+
+Redis keys used:
+
+- `source-events:<source>`: list of buffered events (as JSON) for a source
+- `source-events-seen:<source>:<resource>:<message>`: expiring key for deduplication
+- `source-events-last`: sorted set of sources, scored by the time of their last event
+- `source-events-first`: sorted set of sources, scored by the time of their first event
+"""
+
+import json
+import logging
+import time
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from jobs.models import Job
+from projects.downloads import get_redis
+from projects.models.projects import ProjectEvent
+from projects.models.sources import Source
+
+logger = logging.getLogger(__name__)
+
+LAST_KEY = "source-events-last"
+FIRST_KEY = "source-events-first"
+
+# Resource states of notifications that are not changes to the source
+# e.g. the `sync` notification sent by Google when a subscription is created.
+# Notifications without a resource state are also not considered changes.
+NOT_CHANGES = ("sync",)
+
+
+def event_id(data: Dict) -> Optional[str]:
+    """
+    Get the identifier of an event used for deduplication.
+
+    Returns `None` if the event does not have a message number.
+    """
+    message = data.get("messageNumber")
+    if message is None:
+        return None
+    return "{resource}:{message}".format(
+        resource=data.get("resourceId") or "", message=message
+    )
+
+
+def record_source_event(source: Source, data: Dict):
+    """
+    Record a verified event for a source.
+
+    Events already seen for the source, within `SOURCE_EVENTS_SEEN_SECONDS`,
+    are ignored.
+    """
+    client = get_redis()
+    if client is None:
+        process_source_events(source, [data])
+        return
+
+    id = event_id(data)
+    if id is not None and not client.set(
+        "source-events-seen:{source}:{id}".format(source=source.id, id=id),
+        1,
+        nx=True,
+        ex=settings.SOURCE_EVENTS_SEEN_SECONDS,
+    ):
+        return
+
+    now = time.time()
+    pipeline = client.pipeline(transaction=False)
+    pipeline.rpush("source-events:{source}".format(source=source.id), json.dumps(data))
+    pipeline.zadd(LAST_KEY, {source.id: now})
+    pipeline.zadd(FIRST_KEY, {source.id: now}, nx=True)
+    pipeline.execute()
+
+
+def flush_source_events() -> int:
+    """
+    Flush the buffered events of sources that are due.
+
+    The events of each source are removed from Redis, in a transaction, before
+    being processed. Returns the number of sources that had events flushed.
+    """
+    client = get_redis()
+    if client is None:
+        return 0
+
+    now = time.time()
+    quiet = client.zrangebyscore(
+        LAST_KEY, 0, now - settings.SOURCE_EVENTS_QUIET_SECONDS
+    )
+    overdue = client.zrangebyscore(
+        FIRST_KEY, 0, now - settings.SOURCE_EVENTS_MAX_SECONDS
+    )
+    due = set(quiet) | set(overdue)
+    if not due:
+        return 0
+
+    sources = Source.objects.select_related("project").in_bulk(
+        [int(id) for id in due]
+    )
+
+    flushed = 0
+    for id in due:
+        key = "source-events:{source}".format(source=id.decode())
+        pipeline = client.pipeline(transaction=True)
+        pipeline.lrange(key, 0, -1)
+        pipeline.delete(key)
+        pipeline.zrem(LAST_KEY, id)
+        pipeline.zrem(FIRST_KEY, id)
+        events = [json.loads(event) for event in pipeline.execute()[0]]
+
+        source = sources.get(int(id))
+        if source is None or not events:
+            continue
+        try:
+            process_source_events(source, events)
+        except Exception:
+            logger.warning(
+                "Error processing source events",
+                exc_info=True,
+                extra={"source": source.id},
+            )
+        flushed += 1
+
+    return flushed
+
+
+def coalesce_events(events: List[Dict]) -> List[Dict]:
+    """
+    Remove duplicate events, keeping the first of each.
+    """
+    seen = set()
+    coalesced = []
+    for data in events:
+        id = event_id(data)
+        if id is not None:
+            if id in seen:
+                continue
+            seen.add(id)
+        coalesced.append(data)
+    return coalesced
+
+
+def process_source_events(source: Source, events: List[Dict]) -> Optional[Job]:
+    """
+    Process events for a source.
+
+    Writes the events to the `ProjectEvent` table and, if any of them are
+    changes to the source, creates and dispatches a job to pull it.
+    Returns the pull job, if any.
+    """
+    events = coalesce_events(events)
+    ProjectEvent.objects.bulk_create(
+        [
+            ProjectEvent(project_id=source.project_id, source=source, data=data)
+            for data in events
+        ]
+    )
+
+    if not any(
+        data.get("resourceState") and data.get("resourceState") not in NOT_CHANGES
+        for data in events
+    ):
+        return None
+
+    with transaction.atomic():
+        job = source.pull()
+    job.dispatch()
+    return job
@@ -0,0 +1,133 @@
+from unittest import mock
+
+import pytest
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from accounts.models import AccountTier
+from jobs.models import JobMethod
+from projects.events import coalesce_events, process_source_events
+from projects.models.projects import Project, ProjectEvent
+from projects.models.sources import GithubSource, GoogleDocsSource, UrlSource
+from users.models import User
+
+
+@pytest.fixture
+def source():
+    """Create a project with a source."""
+    AccountTier.objects.create()
+    user = User.objects.create(username="user")
+    project = Project.objects.create(
+        account=user.personal_account, creator=user, name="project", public=False
+    )
+    return UrlSource.objects.create(
+        project=project, url="https://example.org", path="data", creator=user
+    )
+
+
+def test_coalesce_events():
+    events = [
+        dict(resourceId="a", messageNumber="1"),
+        dict(resourceId="a", messageNumber="2"),
+        dict(resourceId="a", messageNumber="1"),
+        dict(resourceId="b", messageNumber="1"),
+        dict(other="no message number"),
+        dict(other="no message number"),
+    ]
+    assert coalesce_events(events) == [
+        events[0],
+        events[1],
+        events[3],
+        events[4],
+        events[5],
+    ]
+
+
+@pytest.mark.django_db
+def test_process_source_events(source):
+    with mock.patch("jobs.models.Job.dispatch") as dispatch:
+        # A burst of events results in one pull
+        job = process_source_events(
+            source,
+            [
+                dict(
+                    resourceId="a",
+                    messageNumber=str(number % 5),
+                    resourceState="update",
+                )
+                for number in range(20)
+            ],
+        )
+        assert job.method == JobMethod.pull.value
+        assert list(source.jobs.all()) == [job]
+        dispatch.assert_called_once()
+        assert ProjectEvent.objects.filter(source=source).count() == 5
+
+        # Events that are not changes are recorded but do not result in a pull
+        assert process_source_events(source, [dict(resourceState="sync")]) is None
+        assert process_source_events(source, [dict(other="no state")]) is None
+        assert dispatch.call_count == 1
+        assert ProjectEvent.objects.filter(source=source).count() == 7
+
+
+def post_event(source, **headers):
+    """Post an unauthenticated event notification for a source."""
+    return APIClient().post(
+        reverse(
+            "api-projects-sources-event",
+            kwargs=dict(project=source.project.id, source=source.id),
+        ),
+        dict(state="update"),
+        format="json",
+        **headers
+    )
+
+
+@pytest.mark.django_db
+def test_source_event_unverified(source):
+    """
+    Unauthenticated events for sources that can not verify them
+    are recorded but do not result in a pull.
+    """
+    github = GithubSource.objects.create(
+        project=source.project, repo="org/repo", path="repo", creator=source.creator
+    )
+    with mock.patch("jobs.models.Job.dispatch") as dispatch:
+        for each in (source, github):
+            assert post_event(each).status_code == 200
+            assert ProjectEvent.objects.get(source=each).data == dict(state="update")
+            assert each.jobs.count() == 0
+    dispatch.assert_not_called()
+
+
+@pytest.mark.django_db
+def test_source_event_verified(source):
+    """
+    Events for Google sources are verified using their subscription token
+    and, without a cache, are processed immediately.
+    """
+    google = GoogleDocsSource.objects.create(
+        project=source.project,
+        doc_id="doc",
+        path="doc",
+        creator=source.creator,
+        subscription=dict(token="secret"),
+    )
+    with mock.patch("jobs.models.Job.dispatch"):
+        response = post_event(
+            google,
+            HTTP_X_GOOG_CHANNEL_TOKEN="wrong",
+            HTTP_X_GOOG_RESOURCE_STATE="update",
+        )
+        assert response.status_code == 403
+        assert google.jobs.count() == 0
+
+        response = post_event(
+            google,
+            HTTP_X_GOOG_CHANNEL_TOKEN="secret",
+            HTTP_X_GOOG_RESOURCE_STATE="update",
+        )
+        assert response.status_code == 200
+        event = ProjectEvent.objects.get(source=google)
+        assert event.data["resourceState"] == "update"
+        assert google.jobs.count() == 1
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_periodic_task(apps, *args):
+    """
+    Create a periodic task to flush counts of file downloads to the database.
+
+    See `projects.downloads`. The interval can be changed in the admin.
+    """
+    IntervalSchedule = apps.get_model("django_celery_beat", "IntervalSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    interval, _ = IntervalSchedule.objects.get_or_create(every=60, period="seconds")
+    PeriodicTask.objects.get_or_create(
+        name="Flush file downloads",
+        defaults=dict(task="projects.tasks.flush_file_downloads", interval=interval),
+    )
+
+
+def delete_periodic_task(apps, *args):
+    """
+    Delete the periodic task to flush counts of file downloads.
+    """
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTask.objects.filter(name="Flush file downloads").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_celery_beat", "0012_periodictask_expire_seconds"),
+        ("projects", "0030_auto_20210315_2230"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_periodic_task, delete_periodic_task),
+    ]
@@ -0,0 +1,136 @@
+# Generated by Django 3.1.7 on 2026-10-18 03:42
+
+from itertools import groupby
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def get_parent(path):
+    """
+    Get the path of the directory that a file, or directory, is in.
+
+    A copy of `projects.models.files.get_parent` as at this migration.
+    """
+    return path[: path.rfind("/") + 1]
+
+
+def aggregate_directories(files):
+    """
+    Aggregate files by the directories that they are in.
+
+    A copy of `projects.models.files.aggregate_directories` as at this migration.
+    """
+    dirs = {}
+    for file in files:
+        names = file.path.split("/")[:-1]
+        for depth in range(1, len(names) + 1):
+            path = "/".join(names[:depth])
+            info = dirs.get(path)
+            if info is None:
+                info = dirs[path] = dict(count=0, size=0, modified=None, sources={})
+            info["count"] += 1
+            info["size"] += file.size or 0
+            if file.modified and (
+                info["modified"] is None or file.modified > info["modified"]
+            ):
+                info["modified"] = file.modified
+            if file.source_id:
+                source_id = str(file.source_id)
+                info["sources"][source_id] = info["sources"].get(source_id, 0) + 1
+    return dirs
+
+
+def index_directories(apps, schema_editor):
+    """
+    Set the `parent` of existing files and create the directories of projects and snapshots.
+    """
+    File = apps.get_model("projects", "File")
+    Directory = apps.get_model("projects", "Directory")
+
+    batch = []
+    for file in File.objects.only("path").iterator():
+        file.parent = get_parent(file.path)
+        batch.append(file)
+        if len(batch) >= 1000:
+            File.objects.bulk_update(batch, ["parent"])
+            batch = []
+    File.objects.bulk_update(batch, ["parent"])
+
+    files = (
+        File.objects.filter(models.Q(current=True) | models.Q(snapshot__isnull=False))
+        .only("project_id", "snapshot_id", "path", "size", "modified", "source_id")
+        .order_by("project_id", "snapshot_id")
+    )
+    for (project_id, snapshot_id), group in groupby(
+        files.iterator(), lambda file: (file.project_id, file.snapshot_id)
+    ):
+        Directory.objects.bulk_create(
+            [
+                Directory(
+                    project_id=project_id,
+                    snapshot_id=snapshot_id,
+                    path=path,
+                    parent=get_parent(path),
+                    name=path.split("/")[-1],
+                    **info
+                )
+                for path, info in aggregate_directories(group).items()
+            ],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0031_flush_file_downloads'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Directory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.TextField(help_text='The path of the directory within the project (without a trailing slash).')),
+                ('parent', models.TextField(blank=True, help_text='The path of the directory that this directory is in, with a trailing slash (or empty for directories at the root of the project).')),
+                ('name', models.TextField(help_text='The name of the directory.')),
+                ('count', models.IntegerField(default=0, help_text='The number of files in the directory, including those in sub-directories.')),
+                ('size', models.BigIntegerField(default=0, help_text='The total size of the files in the directory, in bytes.')),
+                ('modified', models.DateTimeField(blank=True, help_text='The latest modification time of the files in the directory. Not updated when files are removed from the directory.', null=True)),
+                ('sources', models.JSONField(default=dict, help_text='The number of files in the directory from each source, keyed by source id.')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='parent',
+            field=models.TextField(blank=True, help_text='The path of the directory that the file is in, with a trailing slash (or empty for files at the root of the project). Used for listing files by directory.', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['project', 'parent'], name='projects_fi_project_e98619_idx'),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='project',
+            field=models.ForeignKey(help_text='The project that the directory is in.', on_delete=django.db.models.deletion.CASCADE, related_name='directories', to='projects.project'),
+        ),
+        migrations.AddField(
+            model_name='directory',
+            name='snapshot',
+            field=models.ForeignKey(blank=True, help_text="The snapshot that the directory is in (if any). If not set, the directory is in the project's working directory.", null=True, on_delete=django.db.models.deletion.CASCADE, related_name='directories', to='projects.snapshot'),
+        ),
+        migrations.AddIndex(
+            model_name='directory',
+            index=models.Index(fields=['project', 'snapshot', 'parent', 'name'], name='projects_di_project_4755ae_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='directory',
+            constraint=models.UniqueConstraint(condition=models.Q(snapshot__isnull=True), fields=('project', 'path'), name='directory_unique_project_path'),
+        ),
+        migrations.AddConstraint(
+            model_name='directory',
+            constraint=models.UniqueConstraint(condition=models.Q(snapshot__isnull=False), fields=('snapshot', 'path'), name='directory_unique_snapshot_path'),
+        ),
+        migrations.RunPython(index_directories, migrations.RunPython.noop),
+    ]
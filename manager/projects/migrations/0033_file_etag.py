@@ -0,0 +1,18 @@
+# Generated by Django 3.1.7 on 2026-10-18 03:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0032_directory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='etag',
+            field=models.CharField(blank=True, help_text='An identifier for the version of the file at its source e.g. a HTTP ETag, or checksum. Used to avoid pulling unchanged files.', max_length=512, null=True),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 3.1.7 on 2026-10-18 04:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def effective_role(account_role, project_role):
+    """
+    Get the effective role of a user from their account and project roles.
+
+    A copy of `ProjectAccess.effective_role` at the time of this migration.
+    """
+    if account_role == "OWNER":
+        return "OWNER"
+    if account_role == "MANAGER":
+        return "OWNER" if project_role == "OWNER" else "MANAGER"
+    return project_role
+
+
+def create_project_access(apps, schema_editor):
+    """
+    Create the effective roles of users for existing projects.
+    """
+    Project = apps.get_model("projects", "Project")
+    ProjectAgent = apps.get_model("projects", "ProjectAgent")
+    ProjectAccess = apps.get_model("projects", "ProjectAccess")
+    AccountUser = apps.get_model("accounts", "AccountUser")
+
+    roles = {}
+    for user, account, role in AccountUser.objects.values_list(
+        "user_id", "account_id", "role"
+    ).iterator():
+        for project in Project.objects.filter(account_id=account).values_list(
+            "id", flat=True
+        ):
+            roles[(user, project)] = (role, None)
+    for user, project, role in (
+        ProjectAgent.objects.filter(user__isnull=False)
+        .values_list("user_id", "project_id", "role")
+        .iterator()
+    ):
+        roles[(user, project)] = (roles.get((user, project), (None, None))[0], role)
+
+    ProjectAccess.objects.bulk_create(
+        [
+            ProjectAccess(
+                user_id=user,
+                project_id=project,
+                role=effective_role(account_role, project_role),
+            )
+            for (user, project), (account_role, project_role) in roles.items()
+            if effective_role(account_role, project_role)
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounts', '0012_account_usage'),
+        ('projects', '0033_file_etag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectAccess',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('READER', 'Reader'), ('REVIEWER', 'Reviewer'), ('EDITOR', 'Editor'), ('AUTHOR', 'Author'), ('MANAGER', 'Manager'), ('OWNER', 'Owner')], help_text='The effective role of the user for the project.', max_length=32)),
+                ('project', models.ForeignKey(help_text='The project that the user has access to.', on_delete=django.db.models.deletion.CASCADE, related_name='access', to='projects.project')),
+                ('user', models.ForeignKey(help_text='The user that has access to the project.', on_delete=django.db.models.deletion.CASCADE, related_name='project_access', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='projectaccess',
+            constraint=models.UniqueConstraint(fields=('user', 'project'), name='projectaccess_unique_user_project'),
+        ),
+        migrations.RunPython(create_project_access, migrations.RunPython.noop),
+    ]
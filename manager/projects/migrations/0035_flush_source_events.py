@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_periodic_task(apps, *args):
+    """
+    Create a periodic task to flush buffered source events.
+
+    See `projects.events`. The interval can be changed in the admin.
+    """
+    IntervalSchedule = apps.get_model("django_celery_beat", "IntervalSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    interval, _ = IntervalSchedule.objects.get_or_create(every=10, period="seconds")
+    PeriodicTask.objects.get_or_create(
+        name="Flush source events",
+        defaults=dict(task="projects.tasks.flush_source_events", interval=interval),
+    )
+
+
+def delete_periodic_task(apps, *args):
+    """
+    Delete the periodic task to flush buffered source events.
+    """
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTask.objects.filter(name="Flush source events").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_celery_beat", "0012_periodictask_expire_seconds"),
+        ("projects", "0034_project_access"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_periodic_task, delete_periodic_task),
+    ]
@@ -1,12 +1,14 @@
 import enum
 import mimetypes
 from datetime import datetime
-from typing import Dict, List, NamedTuple, Optional, Tuple
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 
 import pygments
 import pygments.lexer
 import pygments.lexers
 from django.db import models, transaction
+from django.db.models import Q, Sum
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.http import HttpResponse
 from django.shortcuts import reverse
 from django.utils import timezone
@@ -14,6 +16,8 @@ from pygments.lexers.data import JsonLexer
 from pygments.lexers.markup import MarkdownLexer
 from pygments.lexers.special import TextLexer
 
+from accounts.content import invalidate_project_content
+from accounts.models import AccountUsage
 from jobs.models import Job, JobMethod
 from projects.models.projects import Project
 from projects.models.sources import GoogleSourceMixin, Source, SourceAddress
@@ -285,6 +289,13 @@ class File(models.Model):
         help_text="The path of the file within the project.",
     )
 
+    parent = models.TextField(
+        null=True,
+        blank=True,
+        help_text="The path of the directory that the file is in, with a trailing slash "
+        "(or empty for files at the root of the project). Used for listing files by directory.",
+    )
+
     job = models.ForeignKey(
         Job,
         on_delete=models.SET_NULL,
@@ -361,6 +372,17 @@ class File(models.Model):
         max_length=128, null=True, blank=True, help_text="The fingerprint of the file",
     )
 
+    etag = models.CharField(
+        max_length=512,
+        null=True,
+        blank=True,
+        help_text="An identifier for the version of the file at its source "
+        "e.g. a HTTP ETag, or checksum. Used to avoid pulling unchanged files.",
+    )
+
+    class Meta:
+        indexes = [models.Index(fields=["project", "parent"])]
+
     @staticmethod
     @transaction.atomic
     def create(
@@ -385,15 +407,16 @@ class File(models.Model):
         """
         if snapshot:
             current = False
+            AccountUsage.add(project.account_id, storage_snapshots=info.get("size"))
         else:
-            File.objects.filter(project=project, path=path, current=True).update(
-                current=False, updated=timezone.now()
-            )
+            File.decurrent(project, path=path)
             current = True
+            AccountUsage.add(project.account_id, storage_working=info.get("size"))
 
         file = File.objects.create(
             project=project,
             path=path,
+            parent=get_parent(path),
             current=current,
             job=job,
             source=source,
@@ -403,6 +426,7 @@ class File(models.Model):
             mimetype=info.get("mimetype"),
             encoding=info.get("encoding"),
             fingerprint=info.get("fingerprint"),
+            etag=info.get("etag"),
         )
 
         if upstreams:
@@ -412,6 +436,8 @@ class File(models.Model):
             for other in downstreams:
                 other.upstreams.add(file)
 
+        Directory.update(project, [file], snapshot=snapshot)
+
         return file
 
     @staticmethod
@@ -429,10 +455,57 @@ class File(models.Model):
 
         return File.objects.filter(**kwargs).order_by("-created")[0]
 
+    @staticmethod
+    def decurrent(project: Project, **kwargs):
+        """
+        Make the current files in a project, matching filter criteria, non-current.
+
+        Also updates the working storage usage of the project's account, and
+        the project's directories, and invalidates the project's cached content
+        (since `update()` does not send the `post_save` signal).
+        """
+        files = File.objects.filter(project=project, current=True, **kwargs)
+        size = files.aggregate(size=Sum("size"))["size"]
+        if kwargs:
+            Directory.update(
+                project, list(files.only(*Directory.FILE_FIELDS)), remove=True
+            )
+        else:
+            Directory.objects.filter(project=project, snapshot__isnull=True).delete()
+        files.update(current=False, updated=timezone.now())
+        AccountUsage.add(project.account_id, storage_working=-(size or 0))
+        invalidate_project_content(project.id)
+
+    def delete(self, *args, **kwargs):
+        """
+        Delete the file.
+
+        Removes the file's storage usage from the account's usage, and the file
+        from the project's, or snapshot's, directories. Not called for files deleted
+        along with their project, source or snapshot (see `remove_usage_for_files`
+        and `remove_directories_for_source`).
+        """
+        if self.snapshot_id:
+            AccountUsage.add(
+                self.project.account_id, storage_snapshots=-(self.size or 0)
+            )
+            Directory.update(self.project, [self], snapshot=self.snapshot, remove=True)
+        elif self.current:
+            AccountUsage.add(
+                self.project.account_id, storage_working=-(self.size or 0)
+            )
+            Directory.update(self.project, [self], remove=True)
+        return super().delete(*args, **kwargs)
+
     def remove(self):
         """
         To keep the file history we do not actually remove the file but make it not current.
         """
+        if self.current and not self.snapshot_id:
+            AccountUsage.add(
+                self.project.account_id, storage_working=-(self.size or 0)
+            )
+            Directory.update(self.project, [self], remove=True)
         self.current = False
         self.updated = timezone.now()
         self.save()
@@ -586,7 +659,7 @@ class File(models.Model):
         not want a file entry for those at present).
         """
         if self.mimetype:
-            options["from"] = self.mimetype
+            options = {**options, "from": self.mimetype}
 
         return Job.objects.create(
             project=self.project,
@@ -667,6 +740,284 @@ class FileDownloads(models.Model):
         ]
 
 
+class Directory(models.Model):
+    """
+    A directory of files within a project, or one of its snapshots.
+
+    Directories only exist implicitly, in the paths of files. This table is
+    an index of them, maintained as files are added to, and removed from, a
+    project (see `Directory.update`), so that a project's files can be listed
+    by directory without fetching, and grouping, all the files below it.
+    """
+
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        related_name="directories",
+        help_text="The project that the directory is in.",
+    )
+
+    snapshot = models.ForeignKey(
+        "Snapshot",
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="directories",
+        help_text="The snapshot that the directory is in (if any). "
+        "If not set, the directory is in the project's working directory.",
+    )
+
+    path = models.TextField(
+        help_text="The path of the directory within the project (without a trailing slash).",
+    )
+
+    parent = models.TextField(
+        blank=True,
+        help_text="The path of the directory that this directory is in, with a trailing slash "
+        "(or empty for directories at the root of the project).",
+    )
+
+    name = models.TextField(help_text="The name of the directory.")
+
+    count = models.IntegerField(
+        default=0,
+        help_text="The number of files in the directory, including those in sub-directories.",
+    )
+
+    size = models.BigIntegerField(
+        default=0,
+        help_text="The total size of the files in the directory, in bytes.",
+    )
+
+    modified = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="The latest modification time of the files in the directory. "
+        "Not updated when files are removed from the directory.",
+    )
+
+    sources = models.JSONField(
+        default=dict,
+        help_text="The number of files in the directory from each source, keyed by source id.",
+    )
+
+    # Fields of `File` used to update directories
+    FILE_FIELDS = ("path", "size", "modified", "source_id")
+
+    # So that directories can be listed alongside files
+    is_directory = True
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["project", "path"],
+                condition=Q(snapshot__isnull=True),
+                name="%(class)s_unique_project_path",
+            ),
+            models.UniqueConstraint(
+                fields=["snapshot", "path"],
+                condition=Q(snapshot__isnull=False),
+                name="%(class)s_unique_snapshot_path",
+            ),
+        ]
+        indexes = [models.Index(fields=["project", "snapshot", "parent", "name"])]
+
+    @property
+    def source(self) -> List[int]:
+        """Get the ids of the sources of the files in the directory."""
+        return sorted(int(source_id) for source_id in self.sources)
+
+    @staticmethod
+    @transaction.atomic
+    def update(
+        project: Project, files: Iterable[File], snapshot=None, remove: bool = False
+    ):
+        """
+        Update the directories of a project, or snapshot, for added or removed files.
+
+        Directories are created, and their counts incremented, for the
+        added files. For removed files, counts are decremented and
+        directories that no longer have any files are deleted. The rows are
+        created (if necessary) before being locked so that concurrent updates
+        to the same directories are serialized.
+        """
+        dirs = aggregate_directories(files)
+        if not dirs:
+            return
+
+        Directory.objects.bulk_create(
+            [
+                Directory(
+                    project=project,
+                    snapshot=snapshot,
+                    path=path,
+                    parent=get_parent(path),
+                    name=path.split("/")[-1],
+                )
+                for path in dirs.keys()
+            ],
+            ignore_conflicts=True,
+        )
+
+        sign = -1 if remove else 1
+        directories = list(
+            Directory.objects.select_for_update().filter(
+                project=project, snapshot=snapshot, path__in=dirs.keys()
+            )
+        )
+        for directory in directories:
+            info = dirs[directory.path]
+            directory.count += sign * info["count"]
+            directory.size += sign * info["size"]
+            for source_id, count in info["sources"].items():
+                count = directory.sources.get(source_id, 0) + sign * count
+                if count > 0:
+                    directory.sources[source_id] = count
+                else:
+                    directory.sources.pop(source_id, None)
+            if not remove and info["modified"]:
+                directory.modified = (
+                    max(directory.modified, info["modified"])
+                    if directory.modified
+                    else info["modified"]
+                )
+        Directory.objects.bulk_update(
+            directories, ["count", "size", "modified", "sources"]
+        )
+
+        if remove:
+            Directory.objects.filter(
+                project=project, snapshot=snapshot, path__in=dirs.keys(), count__lte=0
+            ).delete()
+
+
+def aggregate_directories(files: Iterable[File]) -> Dict[str, Dict]:
+    """
+    Aggregate files by the directories that they are in.
+
+    Returns a dictionary of the path of each directory (including all
+    ancestors of a file) to the number, total size, latest modification time,
+    and number from each source, of the files in it.
+    """
+    dirs: Dict[str, Dict] = {}
+    for file in files:
+        names = file.path.split("/")[:-1]
+        for depth in range(1, len(names) + 1):
+            path = "/".join(names[:depth])
+            info = dirs.get(path)
+            if info is None:
+                info = dirs[path] = dict(count=0, size=0, modified=None, sources={})
+            info["count"] += 1
+            info["size"] += file.size or 0
+            if file.modified and (
+                info["modified"] is None or file.modified > info["modified"]
+            ):
+                info["modified"] = file.modified
+            if file.source_id:
+                source_id = str(file.source_id)
+                info["sources"][source_id] = info["sources"].get(source_id, 0) + 1
+    return dirs
+
+
+def invalidate_content_for_file(sender, instance: File, *args, **kwargs):
+    """
+    Invalidate the cached resolutions of content for the project of a file.
+
+    Makes sure that new, or removed, files in the working directory
+    are reflected in the content served for the project.
+    """
+    invalidate_project_content(instance.project_id)
+
+
+post_save.connect(invalidate_content_for_file, sender=File)
+post_delete.connect(invalidate_content_for_file, sender=File)
+
+
+def remove_usage_for_files(account_id: int, files: models.QuerySet):
+    """
+    Remove the storage usage of files, about to be deleted, from an account's usage.
+
+    When a project, source or snapshot is deleted its files are deleted too (by cascade,
+    which does not call `File.delete`) so this is called, before the deletion, to
+    remove their usage in bulk. So that no file is counted twice, when deleting a
+    project (which also deletes its sources and snapshots), each handler removes the
+    usage of a disjoint set of files.
+    """
+    usage = files.aggregate(
+        working=Sum("size", filter=Q(current=True, snapshot__isnull=True)),
+        snapshots=Sum("size", filter=Q(snapshot__isnull=False)),
+    )
+    AccountUsage.add(
+        account_id,
+        storage_working=-(usage["working"] or 0),
+        storage_snapshots=-(usage["snapshots"] or 0),
+    )
+
+
+def remove_usage_for_project(sender, instance: Project, *args, **kwargs):
+    """
+    Remove the storage usage of a project's files from its account's usage.
+
+    Only files that are not from a source or in a snapshot (see
+    `remove_usage_for_source` and `remove_usage_for_snapshot` for those).
+    """
+    remove_usage_for_files(
+        instance.account_id,
+        File.objects.filter(
+            project=instance, source__isnull=True, snapshot__isnull=True
+        ),
+    )
+
+
+def remove_usage_for_source(sender, instance: Source, *args, **kwargs):
+    """
+    Remove the storage usage of a source's working files from the account's usage.
+
+    The signal is sent for both the derived class (e.g. `UrlSource`) and `Source`,
+    so this is only connected for the latter.
+    """
+    remove_usage_for_files(
+        instance.project.account_id,
+        File.objects.filter(source=instance, snapshot__isnull=True),
+    )
+
+
+pre_delete.connect(remove_usage_for_project, sender=Project)
+pre_delete.connect(remove_usage_for_source, sender=Source)
+
+
+def remove_directories_for_source(sender, instance: Source, *args, **kwargs):
+    """
+    Remove the current files of a source from the project's directories.
+
+    Done before the source (and therefore its files) is deleted. The signal
+    is sent for both the derived class (e.g. `UrlSource`) and `Source`, so
+    this is only connected for the latter.
+    """
+    Directory.update(
+        instance.project,
+        list(
+            File.objects.filter(source=instance, current=True).only(
+                *Directory.FILE_FIELDS
+            )
+        ),
+        remove=True,
+    )
+
+
+pre_delete.connect(remove_directories_for_source, sender=Source)
+
+
+def get_parent(path: str) -> str:
+    """
+    Get the path of the directory that a file, or directory, is in.
+
+    Has a trailing slash, consistent with the `prefix` used when listing
+    files, or is empty for paths at the root of the project.
+    """
+    return path[: path.rfind("/") + 1]
+
+
 def get_modified(info: Dict) -> Optional[datetime]:
     """
     Get the modified data as a timezone aware datetime object.
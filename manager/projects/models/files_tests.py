@@ -0,0 +1,207 @@
+from unittest import mock
+
+import pytest
+
+from accounts.models import AccountTier, AccountUsage
+from jobs.models import Job
+from projects.models.files import Directory, File
+from projects.models.projects import Project
+from projects.models.snapshots import Snapshot
+from projects.models.sources import UrlSource
+from users.models import User
+
+
+@pytest.fixture
+def project():
+    """Create a project."""
+    AccountTier.objects.create()
+    user = User.objects.create(username="user")
+    return Project.objects.create(
+        account=user.personal_account, creator=user, name="project"
+    )
+
+
+def directories(project, **kwargs):
+    """Get a dictionary of directory paths to count, size and sources."""
+    return dict(
+        (directory.path, (directory.count, directory.size, directory.source))
+        for directory in Directory.objects.filter(project=project, **kwargs)
+    )
+
+
+@pytest.mark.django_db
+def test_directories_file_create_and_remove(project):
+    File.create(project, "a.txt", dict(size=1))
+    File.create(project, "a/b.txt", dict(size=10))
+    File.create(project, "a/b/c.txt", dict(size=100))
+    assert directories(project) == {"a": (2, 110, []), "a/b": (1, 100, [])}
+
+    # Replacing a file updates size but not count
+    File.create(project, "a/b.txt", dict(size=20))
+    assert directories(project) == {"a": (2, 120, []), "a/b": (1, 100, [])}
+
+    File.get_latest(project=project, path="a/b/c.txt").remove()
+    assert directories(project) == {"a": (1, 20, [])}
+
+    File.decurrent(project)
+    assert directories(project) == {}
+
+
+@pytest.mark.django_db
+def test_directories_source_pull_and_delete(project):
+    source = UrlSource.objects.create(
+        project=project, url="https://example.org", path="data"
+    )
+    File.create(project, "data/other.txt", dict(size=1))
+
+    job = Job.objects.create(
+        project=project,
+        result={"data/a.csv": dict(size=10), "data/b/c.csv": dict(size=100)},
+    )
+    source.pull_callback(job)
+    assert directories(project) == {
+        "data": (3, 111, [source.id]),
+        "data/b": (1, 100, [source.id]),
+    }
+
+    # Pulling again replaces the files from the source
+    job = Job.objects.create(project=project, result={"data/a.csv": dict(size=20)})
+    source.pull_callback(job)
+    assert directories(project) == {"data": (2, 21, [source.id])}
+    assert File.objects.get(path="data/a.csv", current=True).parent == "data/"
+
+    source.delete()
+    assert directories(project) == {"data": (1, 1, [])}
+
+
+@pytest.mark.django_db
+def test_directories_file_delete(project):
+    File.create(project, "a/b.txt", dict(size=1))
+    file = File.create(project, "a/c.txt", dict(size=10))
+    snapshot = Snapshot.objects.create(project=project)
+    snapshot.archive_callback(
+        Job.objects.create(project=project, result={"a/b.txt": dict(size=1)})
+    )
+    assert directories(project, snapshot=None) == {"a": (2, 11, [])}
+    assert directories(project, snapshot=snapshot) == {"a": (1, 1, [])}
+
+    file.delete()
+    assert directories(project, snapshot=None) == {"a": (1, 1, [])}
+
+    File.objects.get(snapshot=snapshot).delete()
+    assert directories(project, snapshot=snapshot) == {}
+
+
+@pytest.mark.django_db
+def test_source_pull_with_manifest(project):
+    source = UrlSource.objects.create(
+        project=project, url="https://example.org", path="data"
+    )
+    job = Job.objects.create(
+        project=project,
+        result={
+            "data/a.csv": dict(size=10, fingerprint="a", modified=1600000000),
+            "data/b.csv": dict(size=20, fingerprint="b", etag="1"),
+        },
+    )
+    source.pull_callback(job)
+
+    job = source.pull()
+    assert job.params["manifest"] == {
+        "data/a.csv": dict(size=10, fingerprint="a", modified=1600000000, etag=None),
+        "data/b.csv": dict(size=20, fingerprint="b", modified=None, etag="1"),
+    }
+
+    # Only changed, and removed, files are updated
+    unchanged = File.objects.get(path="data/a.csv", current=True)
+    job.result = {"data/b.csv": None, "data/c.csv": dict(size=30, etag="2")}
+    source.pull_callback(job)
+    assert File.objects.get(path="data/a.csv", current=True) == unchanged
+    assert not File.objects.filter(path="data/b.csv", current=True).exists()
+    assert File.objects.get(path="data/c.csv", current=True).etag == "2"
+    assert directories(project) == {"data": (2, 40, [source.id])}
+
+
+@pytest.mark.django_db
+def test_source_pull_for_snapshot(project):
+    source = UrlSource.objects.create(
+        project=project, url="https://example.org", path="data"
+    )
+    result = {"data/a.csv": dict(size=10), "data/b.csv": dict(size=20)}
+    source.pull_callback(Job.objects.create(project=project, result=result))
+
+    with mock.patch("jobs.models.Job.dispatch"):
+        snapshot = Snapshot.create(project, project.creator)
+    cleanup, pull = snapshot.job.children.order_by("id")[:2]
+
+    # The pull follows a cleanup so is not sent a manifest and, after the
+    # cleanup, all of the source's files are current again
+    assert "manifest" not in pull.params
+    project.cleanup_callback(cleanup)
+    pull.result = result
+    source.pull_callback(pull)
+    assert set(
+        File.objects.filter(project=project, current=True).values_list(
+            "path", flat=True
+        )
+    ) == {"data/a.csv", "data/b.csv"}
+    assert directories(project, snapshot=None) == {"data": (2, 30, [source.id])}
+
+
+@pytest.mark.django_db
+def test_directories_snapshot_archive(project):
+    File.create(project, "a/b.txt", dict(size=10))
+    snapshot = Snapshot.objects.create(project=project)
+
+    job = Job.objects.create(
+        project=project, result={"a/b.txt": dict(size=10), "c/d.txt": dict(size=1)}
+    )
+    snapshot.archive_callback(job)
+    assert directories(project, snapshot=snapshot) == {
+        "a": (1, 10, []),
+        "c": (1, 1, []),
+    }
+    assert directories(project, snapshot=None) == {"a": (1, 10, [])}
+
+
+@pytest.mark.django_db
+def test_usage_file_source_snapshot_and_project_delete(project):
+    def usage():
+        ledger = AccountUsage.get(project.account_id)
+        return (ledger.storage_working, ledger.storage_snapshots)
+
+    def create():
+        source = UrlSource.objects.create(
+            project=project, url="https://example.org", path="data"
+        )
+        source.pull_callback(
+            Job.objects.create(project=project, result={"data/a.csv": dict(size=10)})
+        )
+        snapshot = Snapshot.objects.create(project=project)
+        snapshot.archive_callback(
+            Job.objects.create(
+                project=project,
+                result={"data/a.csv": dict(size=10), "b.txt": dict(size=1)},
+            )
+        )
+        return source, snapshot
+
+    File.create(project, "b.txt", dict(size=1))
+    other = File.create(project, "c.txt", dict(size=2))
+    source, snapshot = create()
+    assert usage() == (13, 11)
+
+    other.delete()
+    assert usage() == (11, 11)
+
+    snapshot.delete()
+    assert usage() == (11, 0)
+
+    source.delete()
+    assert usage() == (1, 0)
+
+    create()
+    assert usage() == (11, 11)
+
+    project.delete()
+    assert usage() == (0, 0)
@@ -1,20 +1,21 @@
 import datetime
 import os
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, List, Optional, Tuple
 from urllib.parse import urlencode
 
 import shortuuid
 from django.conf import settings
 from django.core.files.base import ContentFile
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.http import HttpRequest
 from django.shortcuts import reverse
 from django.utils import timezone
 from meta.views import Meta
 
-from accounts.models import Account, AccountTeam
+from accounts.content import invalidate_project_content
+from accounts.models import Account, AccountRole, AccountTeam, AccountUser
 from jobs.models import Job, JobMethod
 from manager.helpers import EnumChoice
 from manager.storage import (
@@ -23,6 +24,7 @@ from manager.storage import (
     snapshots_storage,
     working_storage,
 )
+from projects.access import invalidate_project_access
 from users.models import User
 
 
@@ -418,16 +420,16 @@ class Project(StorageUsageMixin, models.Model):
         """
         from projects.models.files import File
 
-        File.objects.filter(project=self, current=True).update(current=False)
+        File.decurrent(self)
 
-    def pull(self, user: User) -> Job:
+    def pull(self, user: User, manifest: bool = True) -> Job:
         """
         Pull all the project's sources into its working directory.
 
         Groups sources by `order` (with `null` order first i.e. can be overridden).
         If there are more than one source in each group creates a `parallel` job
         having children jobs that `pull`s each source. Groups are then placed in a
-        series job (if there is more than one).
+        series job (if there is more than one). See `Source.pull` for `manifest`.
         """
         # Do not create individual pull jobs here because series job children
         # are run in order of their ids; so we need to sort into groups first.
@@ -443,7 +445,7 @@ class Project(StorageUsageMixin, models.Model):
         for order in sorted(groups.keys()):
             sources = groups[order]
             if len(sources) == 1:
-                steps.append(sources[0].pull(user))
+                steps.append(sources[0].pull(user, manifest=manifest))
             else:
                 parallel = Job.objects.create(
                     project=self,
@@ -451,7 +453,9 @@ class Project(StorageUsageMixin, models.Model):
                     method=JobMethod.parallel.name,
                     description="Pull sources in parallel",
                 )
-                parallel.children.set([source.pull(user) for source in sources])
+                parallel.children.set(
+                    [source.pull(user, manifest=manifest) for source in sources]
+                )
                 steps.append(parallel)
 
         if len(steps) == 1:
@@ -466,7 +470,7 @@ class Project(StorageUsageMixin, models.Model):
             series.children.set(steps)
             return series
 
-    def reflow(self, user: User) -> Optional[Job]:
+    def reflow(self, user: User, skip_unchanged: bool = True) -> Optional[Job]:
         """
         Reflow the dependencies between the project's files by rerunning jobs.
 
@@ -476,44 +480,133 @@ class Project(StorageUsageMixin, models.Model):
         we go through the `File` method e.g. `File.convert`. This more safely enables
         project forking etc.
 
-        In the future should do a topological sort so that the
-        jobs get executed in parallel if possible, and in series if necessary.
-        """
-        subjobs = []
-        for file in self.files.filter(
-            current=True,
-            upstreams__isnull=False,
-            # Currently limited to convert jobs but in future there
-            # may be other jobs that create a derived file
-            # e.g. running a script that create files.
-            job__method=JobMethod.convert.name,
-        ).exclude(
-            # Currently exclude index.html files because dealt with
-            # in an explicit step in snapshot
-            Q(path="index.html")
-            # Exclude .bib and image files which are created
-            # as children of a parent file's generation
-            # See https://github.com/stencila/hub/issues/1024#issuecomment-799128207
-            | Q(path__endswith=".bib")
-            | Q(path__endswith=".png")
-            | Q(path__endswith=".jpg"),
+        The dependencies between files form a graph (e.g. `a.md` is converted to
+        `a.docx` which is converted to `a.gdoc`) which is built using a single query.
+        Files are reflowed in topological order: a `series` job with a step for each
+        level of the graph, and the jobs within each level run in `parallel`.
+
+        If `skip_unchanged` is true, then a file is only reflowed if the file that it
+        was derived from has changed since (i.e. has a different fingerprint), or is
+        itself being reflowed. This should be false if the project's sources are going
+        to be pulled, or its working directory cleaned, before the reflow.
+        """
+        from projects.models.files import File
+
+        # Get the current files, and their upstreams, with one row per upstream
+        current: Dict[str, Tuple[int, Optional[str]]] = {}
+        derived: Dict[str, Tuple[str, int, Optional[str]]] = {}
+        for (
+            id,
+            path,
+            fingerprint,
+            source_id,
+            method,
+            params,
+            upstream_id,
+            upstream_path,
+            upstream_fingerprint,
+        ) in self.files.filter(current=True).values_list(
+            "id",
+            "path",
+            "fingerprint",
+            "source_id",
+            "job__method",
+            "job__params",
+            "upstreams__id",
+            "upstreams__path",
+            "upstreams__fingerprint",
         ):
-            # Convert jobs only have one upstream
-            upstream = file.upstreams.first()
-            subjob = upstream.convert(user, file.path)
-            subjobs.append(subjob)
+            current[path] = (id, fingerprint)
+            if (
+                upstream_id is None
+                or source_id is not None
+                # Currently limited to convert jobs but in future there
+                # may be other jobs that create a derived file
+                # e.g. running a script that create files.
+                or method != JobMethod.convert.name
+                # Currently exclude index.html files because dealt with
+                # in an explicit step in snapshot
+                or path == "index.html"
+                # Exclude .bib and image files which are created
+                # as children of a parent file's generation
+                # See https://github.com/stencila/hub/issues/1024#issuecomment-799128207
+                or path.endswith((".bib", ".png", ".jpg"))
+            ):
+                continue
+            # Convert jobs have one input but a file may have other upstreams
+            # (e.g. a source created from it) so prefer the job's input
+            if path not in derived or upstream_path == (params or {}).get("input"):
+                derived[path] = (upstream_path, upstream_id, upstream_fingerprint)
+
+        # Get the level of each file to be reflowed in the graph
+        levels: Dict[str, int] = {}
+
+        def visit(path: str, visiting: Tuple[str, ...] = ()) -> Optional[int]:
+            if path in levels:
+                return levels[path]
+            if path not in derived or path in visiting:
+                return None
+
+            upstream_path, upstream_id, upstream_fingerprint = derived[path]
+            if upstream_path not in current:
+                # The upstream file has been removed
+                return None
+
+            upstream_level = visit(upstream_path, visiting + (path,))
+            if upstream_level is not None:
+                level = upstream_level + 1
+            else:
+                id, fingerprint = current[upstream_path]
+                if skip_unchanged and (
+                    id == upstream_id
+                    or (fingerprint is not None and fingerprint == upstream_fingerprint)
+                ):
+                    return None
+                level = 0
+
+            levels[path] = level
+            return level
 
-        if len(subjobs) > 0:
-            parallel = Job.objects.create(
+        for path in derived:
+            visit(path)
+
+        if not levels:
+            return None
+
+        upstreams = File.objects.in_bulk(
+            [current[derived[path][0]][0] for path in levels]
+        )
+
+        steps: List[Job] = []
+        for level in range(max(levels.values()) + 1):
+            subjobs = [
+                upstreams[current[derived[path][0]][0]].convert(user, path)
+                for path in sorted(levels)
+                if levels[path] == level
+            ]
+            if len(subjobs) == 1:
+                steps.append(subjobs[0])
+            else:
+                parallel = Job.objects.create(
+                    project=self,
+                    creator=user,
+                    method=JobMethod.parallel.name,
+                    description="Update derived files in parallel",
+                )
+                parallel.children.set(subjobs)
+                steps.append(parallel)
+
+        if len(steps) == 1:
+            return steps[0]
+        else:
+            series = Job.objects.create(
                 project=self,
                 creator=user,
-                method=JobMethod.parallel.name,
+                method=JobMethod.series.name,
                 description="Update derived files",
             )
-            parallel.children.set(subjobs)
-            return parallel
-        else:
-            return None
+            series.children.set(steps)
+            return series
 
     def pin(self, user: User, **callback) -> Job:
         """
@@ -539,17 +632,16 @@ class Project(StorageUsageMixin, models.Model):
         Creates a copy of the project's working directory
         on the `snapshots` storage.
         """
-        # Get the upload policy
-        policy = snapshots_storage().generate_post_policy(path)
-        url = policy.get("url") if policy else None
-        secrets = policy.get("fields") if policy else None
+        # Get the URL for starting a resumable upload of the archive. This is
+        # a secret because it is signed (i.e. anyone with it can upload)
+        url = snapshots_storage().generate_upload_url(path)
 
         return Job.objects.create(
             project=self,
             creator=user,
             method=JobMethod.archive.name,
-            params=dict(project=self.id, snapshot=snapshot, path=path, url=url,),
-            secrets=secrets,
+            params=dict(project=self.id, snapshot=snapshot, path=path),
+            secrets=dict(url=url) if url else None,
             description=f"Archive project '{self.name}'",
             **callback,
         )
@@ -586,6 +678,20 @@ def make_project_creator_an_owner(
 post_save.connect(make_project_creator_an_owner, sender=Project)
 
 
+def invalidate_content_for_project(sender, instance: Project, *args, **kwargs):
+    """
+    Invalidate the cached resolutions of content for a project.
+
+    Makes sure that changes to a project (e.g. to its liveness or
+    pinned snapshot) are reflected in the content served for it.
+    """
+    invalidate_project_content(instance.id)
+
+
+post_save.connect(invalidate_content_for_project, sender=Project)
+post_delete.connect(invalidate_content_for_project, sender=Project)
+
+
 class ProjectRole(EnumChoice):
     """
     A user or team role within an account.
@@ -687,6 +793,225 @@ class ProjectAgent(models.Model):
         ]
 
 
+class ProjectAccess(models.Model):
+    """
+    The effective role of a user for a project.
+
+    The effective role is the "greater" of the user's role for the project and
+    their role in the account that owns the project. It is maintained when project
+    agents, account users, or the account of a project, change (see the signal
+    handlers below) so that getting a project for a user is an indexed lookup
+    and listing their projects is a join (see `users.models.get_projects`).
+
+    Team roles are not (yet) included in the effective role.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="project_access",
+        help_text="The user that has access to the project.",
+    )
+
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        related_name="access",
+        help_text="The project that the user has access to.",
+    )
+
+    role = models.CharField(
+        max_length=32,
+        choices=ProjectRole.as_choices(),
+        help_text="The effective role of the user for the project.",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "project"], name="%(class)s_unique_user_project"
+            )
+        ]
+
+    @staticmethod
+    def effective_role(
+        account_role: Optional[str], project_role: Optional[str]
+    ) -> Optional[str]:
+        """
+        Get the effective role of a user from their account and project roles.
+
+        Account owners are project owners, and account managers are at
+        least project managers.
+        """
+        if account_role == AccountRole.OWNER.name:
+            return ProjectRole.OWNER.name
+        if account_role == AccountRole.MANAGER.name:
+            return (
+                ProjectRole.OWNER.name
+                if project_role == ProjectRole.OWNER.name
+                else ProjectRole.MANAGER.name
+            )
+        return project_role
+
+    @staticmethod
+    def refresh(
+        users: Optional[Iterable[int]] = None,
+        projects: Optional[Iterable[int]] = None,
+        accounts: Optional[Iterable[int]] = None,
+        insert: bool = True,
+    ):
+        """
+        Refresh the effective roles of users for projects.
+
+        Only the roles of the `users` for the `projects` (or projects of
+        the `accounts`) are refreshed. Pass no arguments to refresh all roles.
+        If `insert` is false, then roles are only updated or deleted (used
+        when agents or account users are deleted, which may be because
+        the project is being deleted). Cached resolutions of projects for the
+        users, projects or accounts are invalidated (see `projects.access`).
+        """
+        agents = ProjectAgent.objects.filter(user__isnull=False)
+        account_users = AccountUser.objects.all()
+        account_projects = Project.objects.all()
+        access = ProjectAccess.objects.all()
+        if users is not None:
+            agents = agents.filter(user_id__in=users)
+            account_users = account_users.filter(user_id__in=users)
+            access = access.filter(user_id__in=users)
+        if projects is not None:
+            agents = agents.filter(project_id__in=projects)
+            account_users = account_users.filter(
+                account_id__in=Project.objects.filter(id__in=projects).values(
+                    "account_id"
+                )
+            )
+            account_projects = account_projects.filter(id__in=projects)
+            access = access.filter(project_id__in=projects)
+        if accounts is not None:
+            agents = agents.filter(project__account_id__in=accounts)
+            account_users = account_users.filter(account_id__in=accounts)
+            account_projects = account_projects.filter(account_id__in=accounts)
+            access = access.filter(project__account_id__in=accounts)
+
+        project_roles: Dict[Tuple[int, int], str] = dict(
+            ((user, project), role)
+            for user, project, role in agents.values_list(
+                "user_id", "project_id", "role"
+            )
+        )
+
+        account_roles: Dict[Tuple[int, int], str] = {}
+        users_by_account: Dict[int, List[Tuple[int, str]]] = {}
+        for user, account, role in account_users.values_list(
+            "user_id", "account_id", "role"
+        ):
+            users_by_account.setdefault(account, []).append((user, role))
+        if users_by_account:
+            for project, account in account_projects.filter(
+                account_id__in=users_by_account.keys()
+            ).values_list("id", "account_id"):
+                for user, role in users_by_account[account]:
+                    account_roles[(user, project)] = role
+
+        roles = {}
+        for key in set(project_roles.keys()) | set(account_roles.keys()):
+            role = ProjectAccess.effective_role(
+                account_roles.get(key), project_roles.get(key)
+            )
+            if role:
+                roles[key] = role
+
+        with transaction.atomic():
+            existing = dict(
+                ((user, project), (id, role))
+                for id, user, project, role in access.values_list(
+                    "id", "user_id", "project_id", "role"
+                )
+            )
+            delete = [id for key, (id, role) in existing.items() if key not in roles]
+            if delete:
+                ProjectAccess.objects.filter(id__in=delete).delete()
+            for key, (id, role) in existing.items():
+                if key in roles and roles[key] != role:
+                    ProjectAccess.objects.filter(id=id).update(role=roles[key])
+            if insert:
+                ProjectAccess.objects.bulk_create(
+                    [
+                        ProjectAccess(user_id=user, project_id=project, role=role)
+                        for (user, project), role in roles.items()
+                        if (user, project) not in existing
+                    ],
+                    batch_size=1000,
+                    # Another refresh (e.g. for a project being created while
+                    # a user is being added to its account) may have inserted
+                    # the same rows concurrently
+                    ignore_conflicts=True,
+                )
+
+        invalidate_project_access(users=users, projects=projects, accounts=accounts)
+
+
+def refresh_project_access_for_project(sender, instance: Project, *args, **kwargs):
+    """
+    Refresh the effective roles for a project when it is created or saved
+    (e.g. because its account has changed).
+    """
+    ProjectAccess.refresh(projects=[instance.id])
+
+
+def refresh_project_access_for_agent(sender, instance: ProjectAgent, *args, **kwargs):
+    """
+    Refresh the effective role of a user for a project when their project role changes.
+    """
+    if instance.user_id:
+        ProjectAccess.refresh(
+            users=[instance.user_id],
+            projects=[instance.project_id],
+            insert=kwargs.get("signal") is post_save,
+        )
+
+
+def refresh_project_access_for_account_user(
+    sender, instance: AccountUser, *args, **kwargs
+):
+    """
+    Refresh the effective roles of a user for the projects of an
+    account when their account role changes.
+    """
+    ProjectAccess.refresh(
+        users=[instance.user_id],
+        accounts=[instance.account_id],
+        insert=kwargs.get("signal") is post_save,
+    )
+
+
+def invalidate_access_for_project(sender, instance: Project, *args, **kwargs):
+    """
+    Invalidate the cached resolutions of a project when it is changed or deleted
+    (e.g. renamed or made private).
+    """
+    invalidate_project_access(projects=[instance.id])
+
+
+def invalidate_access_for_account(sender, instance: Account, *args, **kwargs):
+    """
+    Invalidate the cached resolutions of the projects of an account
+    when it is changed or deleted (e.g. renamed).
+    """
+    invalidate_project_access(accounts=[instance.id])
+
+
+post_save.connect(refresh_project_access_for_project, sender=Project)
+post_save.connect(refresh_project_access_for_agent, sender=ProjectAgent)
+post_delete.connect(refresh_project_access_for_agent, sender=ProjectAgent)
+post_save.connect(refresh_project_access_for_account_user, sender=AccountUser)
+post_delete.connect(refresh_project_access_for_account_user, sender=AccountUser)
+post_save.connect(invalidate_access_for_project, sender=Project)
+post_delete.connect(invalidate_access_for_project, sender=Project)
+post_save.connect(invalidate_access_for_account, sender=Account)
+post_delete.connect(invalidate_access_for_account, sender=Account)
+
+
 class ProjectEvent(models.Model):
     """
     A project event.
@@ -1,6 +1,17 @@
+from unittest import mock
+
 import pytest
 
-from projects.models.projects import ProjectRole
+from accounts.models import Account, AccountRole, AccountTier, AccountUser
+from jobs.models import Job, JobMethod
+from projects.models.files import File
+from projects.models.projects import (
+    Project,
+    ProjectAccess,
+    ProjectAgent,
+    ProjectRole,
+)
+from users.models import User, get_projects
 
 
 def test_project_role_from_string():
@@ -24,3 +35,151 @@ def test_project_role_and_above():
     assert ProjectRole.and_above(ProjectRole.OWNER) == [
         ProjectRole.OWNER,
     ]
+
+
+def roles(project):
+    """Get a dictionary of usernames to effective role for a project."""
+    return dict(
+        ProjectAccess.objects.filter(project=project).values_list(
+            "user__username", "role"
+        )
+    )
+
+
+@pytest.mark.django_db
+def test_project_access():
+    """
+    Test that the effective roles of users are maintained as
+    project and account roles change.
+    """
+    AccountTier.objects.create()
+    owner = User.objects.create(username="owner")
+    manager = User.objects.create(username="manager")
+    member = User.objects.create(username="member")
+    org = Account.objects.create(name="org", creator=owner)
+    manager_account_user = AccountUser.objects.create(
+        account=org, user=manager, role=AccountRole.MANAGER.name
+    )
+    AccountUser.objects.create(account=org, user=member, role=AccountRole.MEMBER.name)
+
+    project = Project.objects.create(account=org, creator=owner, name="project")
+    assert roles(project) == {"owner": "OWNER", "manager": "MANAGER"}
+
+    # Project roles are combined with account roles
+    agent = ProjectAgent.objects.create(
+        project=project, user=member, role=ProjectRole.AUTHOR.name
+    )
+    ProjectAgent.objects.create(
+        project=project, user=manager, role=ProjectRole.READER.name
+    )
+    assert roles(project) == {
+        "owner": "OWNER",
+        "manager": "MANAGER",
+        "member": "AUTHOR",
+    }
+    assert get_projects(member).get(id=project.id).role == "AUTHOR"
+
+    agent.role = ProjectRole.EDITOR.name
+    agent.save()
+    assert roles(project)["member"] == "EDITOR"
+
+    agent.delete()
+    assert "member" not in roles(project)
+    assert get_projects(member, include_public=False).count() == 0
+
+    # Account roles apply to all the projects of the account
+    manager_account_user.role = AccountRole.OWNER.name
+    manager_account_user.save()
+    assert roles(project)["manager"] == "OWNER"
+
+    manager_account_user.delete()
+    assert roles(project)["manager"] == "READER"
+
+    # Roles are removed with the project
+    project.delete()
+    assert ProjectAccess.objects.count() == 0
+
+
+@pytest.mark.django_db
+def test_project_access_concurrent_refresh():
+    """
+    Test that a refresh does not fail if roles are inserted concurrently
+    (i.e. after it has read the existing roles).
+    """
+    AccountTier.objects.create()
+    owner = User.objects.create(username="owner")
+    project = Project.objects.create(
+        account=owner.personal_account, creator=owner, name="project"
+    )
+    assert roles(project) == {"owner": "OWNER"}
+
+    with mock.patch.object(
+        ProjectAccess.objects, "all", return_value=ProjectAccess.objects.none()
+    ):
+        ProjectAccess.refresh(projects=[project.id])
+    assert roles(project) == {"owner": "OWNER"}
+
+
+@pytest.mark.django_db
+def test_reflow():
+    """
+    Test that derived files are reflowed in topological order, skipping those
+    that are unchanged.
+    """
+    AccountTier.objects.create()
+    user = User.objects.create(username="user")
+    project = Project.objects.create(
+        account=user.personal_account, creator=user, name="project"
+    )
+
+    def convert(input, output, fingerprint):
+        """Create a file as if it was converted from another."""
+        job = Job.objects.create(
+            project=project,
+            method=JobMethod.convert.name,
+            params=dict(input=input.path, output=output),
+        )
+        return File.create(
+            project,
+            output,
+            dict(fingerprint=fingerprint),
+            job=job,
+            upstreams=[input],
+        )
+
+    # a.md -> a.docx -> a.gdoc and a.md -> a.html
+    md = File.create(project, "a.md", dict(fingerprint="md1"))
+    docx = convert(md, "a.docx", "docx1")
+    convert(docx, "a.gdoc", "gdoc1")
+    convert(md, "a.html", "html1")
+
+    def plan(job):
+        """Get the plan of a reflow job as nested lists of conversion outputs."""
+        if job.method == JobMethod.convert.name:
+            return job.params["output"]
+        return [plan(child) for child in job.children.order_by("id")]
+
+    # Nothing has changed so there is nothing to reflow
+    assert project.reflow(user) is None
+
+    # Unless all files are reflowed
+    job = project.reflow(user, skip_unchanged=False)
+    assert job.method == JobMethod.series.name
+    assert plan(job) == [["a.docx", "a.html"], "a.gdoc"]
+
+    # A new version of a file with the same fingerprint is not a change
+    File.create(project, "a.md", dict(fingerprint="md1"))
+    assert project.reflow(user) is None
+
+    # Files downstream of a changed file are reflowed, and the current
+    # version of the upstream file is converted
+    md = File.create(project, "a.md", dict(fingerprint="md2"))
+    job = project.reflow(user)
+    assert plan(job) == [["a.docx", "a.html"], "a.gdoc"]
+    first = job.children.order_by("id")[0].children.order_by("id")[0]
+    assert first.callback_object == md
+
+    # Only files downstream of the changed file are reflowed
+    docx = convert(md, "a.docx", "docx2")
+    convert(md, "a.html", "html2")
+    assert plan(project.reflow(user)) == "a.gdoc"
@@ -2,13 +2,22 @@ import os
 from typing import Optional
 
 import shortuuid
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.http import HttpRequest
 from django.utils import timezone
 
+from accounts.content import invalidate_project_content
+from accounts.models import AccountUsage
 from jobs.models import Job, JobMethod
 from manager.storage import StorageUsageMixin, snapshots_storage
-from projects.models.files import File, get_modified
+from projects.models.files import (
+    Directory,
+    File,
+    get_modified,
+    get_parent,
+    remove_usage_for_files,
+)
 from projects.models.projects import Project
 from users.models import User
 
@@ -146,11 +155,13 @@ class Snapshot(StorageUsageMixin, models.Model):
         # Clean the project's working directory
         subjobs.append(project.cleanup(user))
 
-        # Pull the project's sources
-        subjobs.append(project.pull(user))
+        # Pull the project's sources. All files are pulled, rather than only
+        # those that have changed, because the working directory has been cleaned.
+        subjobs.append(project.pull(user, manifest=False))
 
-        # "Reflow" the project (regenerate derived files)
-        reflow = project.reflow(user)
+        # "Reflow" the project (regenerate derived files). All derived files
+        # are regenerated because the working directory has been cleaned.
+        reflow = project.reflow(user, skip_unchanged=False)
         if reflow:
             subjobs.append(reflow)
 
@@ -188,6 +199,7 @@ class Snapshot(StorageUsageMixin, models.Model):
             description="Snapshot project '{0}'".format(project.name),
             project=project,
             creator=user,
+            **Job.create_callback(snapshot, "complete_callback"),
         )
         job.children.set(subjobs)
         job.dispatch()
@@ -218,11 +230,12 @@ class Snapshot(StorageUsageMixin, models.Model):
 
         # Do a batch insert of files. This is much faster when there are a lot of file
         # than inserting each file individually.
-        File.objects.bulk_create(
+        files = File.objects.bulk_create(
             [
                 File(
                     project=self.project,
                     path=path,
+                    parent=get_parent(path),
                     current=False,
                     job=job,
                     snapshot=self,
@@ -236,6 +249,22 @@ class Snapshot(StorageUsageMixin, models.Model):
                 for path, info in result.items()
             ]
         )
+        AccountUsage.add(
+            self.project.account_id,
+            storage_snapshots=sum(file.size or 0 for file in files),
+        )
+        Directory.update(self.project, files, snapshot=self)
+
+    def complete_callback(self, job: Job):
+        """
+        Invalidate the cached resolutions of content for the project.
+
+        Called when the snapshot job is complete so that, if it succeeded,
+        this snapshot is served as the project's latest. Done on commit
+        so that the job's status has been saved.
+        """
+        project_id = self.project_id
+        transaction.on_commit(lambda: invalidate_project_content(project_id))
 
     def session(self, request: HttpRequest) -> Job:
         """
@@ -290,3 +319,26 @@ class Snapshot(StorageUsageMixin, models.Model):
         Get the location of one of the snapshot's files relative to the root of the storage volume.
         """
         return os.path.join(self.path, file)
+
+
+def invalidate_content_for_snapshot(sender, instance: Snapshot, *args, **kwargs):
+    """
+    Invalidate the cached resolutions of content for the project of a snapshot.
+    """
+    invalidate_project_content(instance.project_id)
+
+
+def remove_usage_for_snapshot(sender, instance: Snapshot, *args, **kwargs):
+    """
+    Remove the storage usage of a snapshot's files from the account's usage.
+
+    Done before the snapshot (and therefore its files) is deleted.
+    """
+    remove_usage_for_files(
+        instance.project.account_id, File.objects.filter(snapshot=instance)
+    )
+
+
+post_save.connect(invalidate_content_for_snapshot, sender=Snapshot)
+post_delete.connect(invalidate_content_for_snapshot, sender=Snapshot)
+pre_delete.connect(remove_usage_for_snapshot, sender=Snapshot)
@@ -22,6 +22,8 @@ from oauth2client.client import GoogleCredentials
 from polymorphic.managers import PolymorphicManager
 from polymorphic.models import PolymorphicModel
 
+from accounts.content import invalidate_project_content
+from accounts.models import AccountUsage
 from jobs.models import Job, JobMethod
 from manager.api import exceptions
 from manager.helpers import EnumChoice
@@ -346,11 +348,14 @@ class Source(PolymorphicModel):
             )
         )
 
-    def pull(self, user: Optional[User] = None) -> Job:
+    def pull(self, user: Optional[User] = None, manifest: bool = True) -> Job:
         """
         Pull the source to the filesystem.
 
-        Creates a job, and adds it to the source's `jobs` list.
+        Creates a job, and adds it to the source's `jobs` list. Unless `manifest`
+        is false, the job is sent a manifest of the source's current files (see
+        `get_manifest`). That should not be done if those files are going to be made
+        non-current before the job is run (e.g. when snapshotting a project).
         """
         source = self.to_address()
         source["type"] = source.type_name
@@ -360,11 +365,15 @@ class Source(PolymorphicModel):
             description = "Collect {0}"
         description = description.format(self.address)
 
+        params = dict(source=source, path=self.path)
+        if manifest:
+            params["manifest"] = self.get_manifest()
+
         job = Job.objects.create(
             project=self.project,
             creator=user or self.creator,
             method=JobMethod.pull.value,
-            params=dict(source=source, path=self.path),
+            params=params,
             description=description,
             secrets=self.get_secrets(user),
             **Job.create_callback(self, "pull_callback"),
@@ -372,30 +381,58 @@ class Source(PolymorphicModel):
         self.jobs.add(job)
         return job
 
+    def get_manifest(self) -> Dict[str, Dict]:
+        """
+        Get a manifest of the current files pulled from this source.
+
+        Sent with pull jobs so that the worker can avoid pulling files
+        that are unchanged, and only return those that have changed.
+        """
+        from projects.models.files import File
+
+        return {
+            path: dict(
+                size=size,
+                fingerprint=fingerprint,
+                modified=modified.timestamp() if modified else None,
+                etag=etag,
+            )
+            for path, size, fingerprint, modified, etag in File.objects.filter(
+                project=self.project, source=self, current=True
+            ).values_list("path", "size", "fingerprint", "modified", "etag")
+        }
+
     @transaction.atomic
     def pull_callback(self, job: Job):
         """
         Update the files associated with this source.
+
+        If the job was sent a manifest of the source's files, then the result
+        only includes the files that have changed (with `None` for those that
+        have been removed) and only those files are updated.
         """
         result = job.result
         if not result:
             return
 
-        from projects.models.files import File, get_modified
+        from projects.models.files import Directory, File, get_modified, get_parent
 
-        # All existing files for the source are made "non-current" (i.e. will not
+        # Existing files for the source are made "non-current" (i.e. will not
         # be displayed in project working directory but are retained for history)
-        File.objects.filter(project=self.project, source=self).update(
-            current=False, updated=timezone.now()
-        )
+        if job.params and "manifest" in job.params:
+            File.decurrent(self.project, source=self, path__in=list(result.keys()))
+            result = {path: info for path, info in result.items() if info is not None}
+        else:
+            File.decurrent(self.project, source=self)
 
         # Do a batch insert of files. This is much faster when there are a lot of file
         # than inserting each file individually.
-        File.objects.bulk_create(
+        files = File.objects.bulk_create(
             [
                 File(
                     project=self.project,
                     path=path,
+                    parent=get_parent(path),
                     job=job,
                     source=self,
                     updated=timezone.now(),
@@ -404,10 +441,19 @@ class Source(PolymorphicModel):
                     mimetype=info.get("mimetype"),
                     encoding=info.get("encoding"),
                     fingerprint=info.get("fingerprint"),
+                    etag=info.get("etag"),
                 )
                 for path, info in result.items()
             ]
         )
+        AccountUsage.add(
+            self.project.account_id,
+            storage_working=sum(file.size or 0 for file in files),
+        )
+        Directory.update(self.project, files)
+
+        # Files created in bulk do not send the `post_save` signal
+        invalidate_project_content(self.project_id)
 
         # Asynchronously check whether the project's image needs to be updated given
         # that there are updated files.
@@ -472,7 +518,9 @@ class Source(PolymorphicModel):
         Handle an event notification.
 
         Passes on the event to the project's event handler with
-        this source added to the context.
+        this source added to the context. Event notifications are not
+        authenticated so the event is only recorded. Derived classes that
+        can verify events (e.g. `GoogleSourceMixin`) may act on them.
         """
         self.project.event(data=data, source=self)
 
@@ -884,8 +932,16 @@ class GoogleSourceMixin:
         Override of `Source.event` to check add information in the request header
         to the data.
 
+        Events having the token of the source's subscription are verified,
+        so they are recorded such that bursts of events can be coalesced
+        into a single pull of the source (see `projects.events`). Others
+        (for subscriptions made without a token) are only recorded.
+
         See https://developers.google.com/drive/api/v3/push#receiving-notifications
         """
+        # Imported here to avoid a circular import
+        from projects.events import record_source_event
+
         if not self.subscription:
             raise PermissionError("This source has no subscription.")
 
@@ -899,12 +955,15 @@ class GoogleSourceMixin:
                 channelId=headers.get("X-Goog-Channel-ID"),
                 messageNumber=headers.get("X-Goog-Message-Number"),
                 resourceId=headers.get("X-Goog-Resource-ID"),
-                resourceState=headers.get("X-Goog-Resource-Sate"),
+                resourceState=headers.get("X-Goog-Resource-State"),
                 resourceUri=headers.get("X-Goog-Resource-URI"),
                 changed=headers.get("X-Goog-Changed"),
             )
         )
-        Source.event(self, data=data)  # type: ignore
+        if token:
+            record_source_event(self, data)  # type: ignore
+        else:
+            Source.event(self, data=data)  # type: ignore
 
 
 class GoogleDocsSource(GoogleSourceMixin, Source):
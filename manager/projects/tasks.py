@@ -49,3 +49,33 @@ def refresh_github_repos_for_user(user_id: int):
     """
     user = User.objects.get(id=user_id)
     GithubRepo.refresh_for_user(user)
+
+
+@shared_task
+def flush_file_downloads():
+    """
+    Flush counts of file downloads to the database.
+
+    Called on a regular basis (every minute by default)
+    by a periodic task (see `projects.downloads`).
+    """
+    # Imported here to avoid a circular import (`projects.models.sources`
+    # imports this module)
+    from projects.downloads import flush_downloads
+
+    return flush_downloads()
+
+
+@shared_task
+def flush_source_events():
+    """
+    Flush buffered source events, pulling sources that have changed.
+
+    Called on a regular basis (every ten seconds by default)
+    by a periodic task (see `projects.events`).
+    """
+    # Imported here to avoid a circular import (`projects.models.sources`
+    # imports this module)
+    from projects.events import flush_source_events
+
+    return flush_source_events()
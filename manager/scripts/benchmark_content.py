@@ -0,0 +1,83 @@
+"""
+Load test of serving account content.
+
+Compares the requests per second for serving a file from a project's
+working directory with, and without, the cache of content resolutions
+(see `accounts.content`). The view is called directly, rather than
+via the test client, so that middleware is not included in timings.
+Files are not actually read from storage and all database changes
+are rolled back.
+
+Usage:
+
+    ./manage.py runscript benchmark_content --script-args 500
+"""
+
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from accounts.ui.views.content import content
+from projects.models.files import File
+from projects.models.projects import Project
+from users.models import User
+
+
+def measure(requests: int, cached: bool):
+    """Measure the requests per second, and queries per request, to serve a file."""
+    with transaction.atomic():
+        user = User.objects.create(username="benchmark-content-user")
+        project = Project.objects.create(
+            account=user.personal_account,
+            creator=user,
+            name="benchmark-content-project",
+            public=True,
+        )
+        File.create(project, "data.csv", dict(size=1000))
+        cache.clear()
+
+        request = RequestFactory().get(
+            "/content/{project}/live/data.csv".format(project=project.name),
+            dict(account=user.personal_account.name),
+            HTTP_HOST="localhost",
+        )
+        backend = cache if cached else DummyCache("dummy", {})
+        with mock.patch(
+            "projects.models.files.File.get_response", return_value=HttpResponse()
+        ), mock.patch("accounts.content.cache", backend), mock.patch(
+            "accounts.ui.views.content.cache", backend
+        ), CaptureQueriesContext(
+            connection
+        ) as queries:
+            start = time.perf_counter()
+            for index in range(requests):
+                response = content(
+                    request,
+                    project_name=project.name,
+                    version="live",
+                    file_path="data.csv",
+                )
+                assert response.status_code == 200
+            duration = time.perf_counter() - start
+
+        transaction.set_rollback(True)
+
+    cache.clear()
+    return requests / duration, len(queries) / requests
+
+
+def run(*args):
+    """Run the benchmark and print a table of results."""
+    requests = int(args[0]) if args else 500
+
+    print("Serving a file {} times".format(requests))
+    print("{:<12}{:>16}{:>20}".format("", "requests/sec", "queries/request"))
+    for name, cached in (("uncached", False), ("cached", True)):
+        rate, queries = measure(requests, cached)
+        print("{:<12}{:>16.0f}{:>20.1f}".format(name, rate, queries))
@@ -0,0 +1,82 @@
+"""
+Benchmark dispatching a parallel job with many children.
+
+Compares dispatching with, and without, the cached routing table
+of queues (see `jobs.jobs.get_routing_queues`). Jobs are not actually
+sent to the broker and all database changes are rolled back.
+
+Usage:
+
+    ./manage.py runscript benchmark_dispatch --script-args 100
+"""
+
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.cache.backends.dummy import DummyCache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import Account
+from jobs.jobs import dispatch_job
+from jobs.models import Job, Queue, Worker
+from projects.models.projects import Project
+from users.models import User
+
+
+def create_job(children: int) -> Job:
+    """Create a parallel job with children."""
+    user = User.objects.create(username="benchmark-dispatch-user")
+    account = Account.objects.get_or_create(name="stencila")[0]
+    project = Project.objects.create(
+        account=account, creator=user, name="benchmark-dispatch-project"
+    )
+    parent = Job.objects.create(method="parallel", project=project, creator=user)
+    Job.objects.bulk_create(
+        [
+            Job(method="sleep", project=project, creator=user, parent=parent)
+            for child in range(children)
+        ]
+    )
+    return parent
+
+
+def measure(children: int, cached: bool):
+    """Measure the duration and number of queries to dispatch a job."""
+    with transaction.atomic():
+        for index in range(5):
+            worker = Worker.objects.create(
+                hostname="benchmark-worker-{}".format(index), updated=timezone.now()
+            )
+            queue, _ = Queue.get_or_create(
+                account_name="stencila", queue_name="benchmark:{}".format(index + 1)
+            )
+            worker.queues.add(queue)
+
+        parent = create_job(children)
+        cache.clear()
+
+        with mock.patch("jobs.jobs.signature"), mock.patch(
+            "jobs.jobs.cache", cache if cached else DummyCache("dummy", {})
+        ), CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            dispatch_job(parent)
+            duration = time.perf_counter() - start
+
+        transaction.set_rollback(True)
+
+    cache.clear()
+    return len(queries), duration
+
+
+def run(*args):
+    """Run the benchmark and print a table of results."""
+    children = int(args[0]) if args else 100
+
+    print("Dispatching parallel job with {} children".format(children))
+    print("{:<12}{:>12}{:>12}".format("", "queries", "seconds"))
+    for name, cached in (("uncached", False), ("cached", True)):
+        queries, duration = measure(children, cached)
+        print("{:<12}{:>12}{:>12.3f}".format(name, queries, duration))
@@ -0,0 +1,162 @@
+"""
+Benchmark of permission checks for projects.
+
+Compares the time, and number of queries, to check the role of a user for
+a single project, and to list (count and get the first page of) their
+projects, using the table of effective roles (see `ProjectAccess`) and using
+the previous correlated subquery which combined project and account roles for
+every row. The user is a member of many organizations, each with many
+projects. All database changes are rolled back.
+
+Usage:
+
+    ./manage.py runscript benchmark_permissions --script-args 50 100
+"""
+
+import time
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Account, AccountRole, AccountUser
+from projects.models.projects import Project, ProjectAccess, ProjectAgent, ProjectRole
+from users.models import User, get_projects
+
+
+def get_projects_subquery(user: User):
+    """
+    Get a queryset of projects for the user using the previous subquery.
+    """
+    return Project.objects.annotate(
+        role=RawSQL(
+            """
+SELECT
+CASE account_role.role
+WHEN 'OWNER' THEN 'OWNER'
+WHEN 'MANAGER' THEN
+    CASE project_role.role
+    WHEN 'OWNER' THEN 'OWNER'
+    ELSE 'MANAGER' END
+ELSE project_role.role END AS "role"
+FROM projects_project AS project
+LEFT JOIN
+    (SELECT project_id, "role" FROM projects_projectagent WHERE user_id = %s) AS project_role
+    ON project.id = project_role.project_id
+LEFT JOIN
+    (SELECT account_id, "role" FROM accounts_accountuser WHERE user_id = %s) AS account_role
+    ON project.account_id = account_role.account_id
+WHERE project.id = projects_project.id""",
+            [user.id, user.id],
+        )
+    ).filter(Q(public=True) | Q(role__isnull=False))
+
+
+def create(accounts: int, projects: int) -> User:
+    """
+    Create a user who is a member of `accounts` organizations, each with `projects`.
+    """
+    user = User.objects.create(username="benchmark-permissions-user")
+    creator = User.objects.create(username="benchmark-permissions-creator")
+    for index in range(accounts):
+        account = Account.objects.create(
+            name="benchmark-permissions-{}".format(index), creator=creator
+        )
+        AccountUser.objects.create(
+            account=account,
+            user=user,
+            role=(AccountRole.MANAGER if index % 10 == 0 else AccountRole.MEMBER).name,
+        )
+        Project.objects.bulk_create(
+            [
+                Project(
+                    account=account,
+                    creator=creator,
+                    name="project-{}".format(number),
+                    public=number % 4 == 0,
+                )
+                for number in range(projects)
+            ]
+        )
+        # Primary keys are not set by `bulk_create` for all databases so fetch them
+        ProjectAgent.objects.bulk_create(
+            [
+                ProjectAgent(
+                    project_id=project, user=user, role=ProjectRole.AUTHOR.name
+                )
+                for project in Project.objects.filter(account=account)
+                .order_by("id")
+                .values_list("id", flat=True)[::3]
+            ]
+        )
+    # Bulk creation does not send signals so refresh roles for the user
+    ProjectAccess.refresh(users=[user.id])
+    return user
+
+
+def measure(queryset, project_ids, repeats: int):
+    """
+    Measure the mean time (ms) and queries for checking the role for a project,
+    and for counting and getting the first page of projects.
+    """
+    results = []
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        for index in range(repeats):
+            queryset.get(id=project_ids[index % len(project_ids)]).role
+        results.append(
+            ((time.perf_counter() - start) * 1000 / repeats, len(queries) / repeats)
+        )
+
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        for index in range(repeats):
+            queryset.count()
+            list(queryset.order_by("-created")[:50])
+        results.append(
+            ((time.perf_counter() - start) * 1000 / repeats, len(queries) / repeats)
+        )
+    return results
+
+
+def run(*args):
+    """Run the benchmark and print a table of results."""
+    accounts = int(args[0]) if len(args) > 0 else 50
+    projects = int(args[1]) if len(args) > 1 else 100
+    repeats = int(args[2]) if len(args) > 2 else 20
+
+    with transaction.atomic():
+        user = create(accounts, projects)
+        subquery = get_projects_subquery(user)
+        access = get_projects(user)
+        project_ids = list(
+            access.filter(role__isnull=False)
+            .order_by("?")
+            .values_list("id", flat=True)[:repeats]
+        )
+
+        # Check that both methods give the same roles
+        assert dict(subquery.values_list("id", "role")) == dict(
+            access.values_list("id", "role")
+        )
+
+        print(
+            "User in {} organizations with {} projects each".format(accounts, projects)
+        )
+        print(
+            "{:<12}{:>16}{:>20}{:>16}{:>20}".format(
+                "", "check (ms)", "queries/check", "list (ms)", "queries/list"
+            )
+        )
+        for name, queryset in (("subquery", subquery), ("access", access)):
+            (check, check_queries), (listing, list_queries) = measure(
+                queryset, project_ids, repeats
+            )
+            print(
+                "{:<12}{:>16.2f}{:>20.1f}{:>16.2f}{:>20.1f}".format(
+                    name, check, check_queries, listing, list_queries
+                )
+            )
+
+        transaction.set_rollback(True)
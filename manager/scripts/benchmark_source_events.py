@@ -0,0 +1,121 @@
+"""
+Replay benchmark of a burst of source event notifications.
+
+Replays a burst of Google Drive change notifications for a source
+(one `sync` notification followed by `update` notifications, with about
+one in five being a redelivery of an earlier message) and compares recording
+each notification as it is received (the previous behaviour of `Project.event`)
+with buffering, coalescing and flushing them (see `projects.events`).
+
+If there is a `CACHE_URL` the notifications are buffered in Redis and then
+flushed, otherwise the flush of the buffered burst is measured on its own.
+Jobs are not dispatched and all database changes are rolled back.
+
+Usage:
+
+    ./manage.py runscript benchmark_source_events --script-args 1000
+"""
+
+import random
+import time
+from typing import Dict, List
+from unittest import mock
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from projects.downloads import get_redis
+from projects.events import (
+    flush_source_events,
+    process_source_events,
+    record_source_event,
+)
+from projects.models.projects import Project, ProjectEvent
+from projects.models.sources import Source, UrlSource
+from users.models import User
+
+
+def burst(notifications: int) -> List[Dict]:
+    """
+    Generate a burst of notifications, including redeliveries.
+    """
+    rand = random.Random(42)
+    events = [dict(resourceId="resource", messageNumber="1", resourceState="sync")]
+    message = 1
+    while len(events) < notifications:
+        if rand.random() < 0.2:
+            number = rand.randint(2, message) if message > 1 else 1
+        else:
+            message += 1
+            number = message
+        events.append(
+            dict(
+                resourceId="resource",
+                messageNumber=str(number),
+                resourceState="sync" if number == 1 else "update",
+                changed="content",
+            )
+        )
+    return events
+
+
+def measure(name: str, events: List[Dict], replay):
+    """Measure the time, queries, rows and jobs to replay events for a source."""
+    with transaction.atomic():
+        user = User.objects.create(username="benchmark-source-events-user")
+        project = Project.objects.create(
+            account=user.personal_account,
+            creator=user,
+            name="benchmark-source-events-project",
+        )
+        source = UrlSource.objects.create(
+            project=project, url="https://example.org", path="data", creator=user
+        )
+
+        with mock.patch("jobs.models.Job.dispatch"), CaptureQueriesContext(
+            connection
+        ) as queries:
+            start = time.perf_counter()
+            replay(source, events)
+            duration = time.perf_counter() - start
+
+        print(
+            "{:<12}{:>12.1f}{:>12}{:>12}{:>12}".format(
+                name,
+                duration * 1000,
+                len(queries),
+                ProjectEvent.objects.filter(project=project).count(),
+                source.jobs.count(),
+            )
+        )
+        transaction.set_rollback(True)
+
+
+def per_event(source: Source, events: List[Dict]):
+    """Record each event as it is received."""
+    for data in events:
+        source.project.event(data=dict(data), source=source)
+
+
+def buffered(source: Source, events: List[Dict]):
+    """Buffer each event as it is received and then flush them."""
+    for data in events:
+        record_source_event(source, dict(data))
+    with mock.patch("django.conf.settings.SOURCE_EVENTS_QUIET_SECONDS", -1):
+        flush_source_events()
+
+
+def run(*args):
+    """Run the benchmark and print a table of results."""
+    notifications = int(args[0]) if args else 1000
+    events = burst(notifications)
+
+    print("Replaying a burst of {} notifications".format(notifications))
+    print(
+        "{:<12}{:>12}{:>12}{:>12}{:>12}".format("", "ms", "queries", "events", "jobs")
+    )
+    measure("per-event", events, per_event)
+    if get_redis():
+        measure("buffered", events, buffered)
+    else:
+        measure("flush", events, process_source_events)
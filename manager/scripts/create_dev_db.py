@@ -499,13 +499,15 @@ def create_main_file_for_project(project):
         f.write(content)
 
     # The file object that was created by pulling the file
-    File.objects.create(
-        project=project,
+    File.create(
+        project,
+        "main.md",
+        dict(
+            size=len(content),
+            mimetype="text/markdown",
+            modified=timezone.now().timestamp(),
+        ),
         source=upload,
-        path="main.md",
-        size=len(content),
-        mimetype="text/markdown",
-        modified=timezone.now(),
     )
 
     # Make it the main file
@@ -517,14 +519,16 @@ def create_files_for_source(source, paths):
     """Create files for a project source (i.e. simulate a pull)."""
     for path in paths:
         mimetype, encoding = mimetypes.guess_type(path)
-        File.objects.create(
-            project=source.project,
+        File.create(
+            source.project,
+            path,
+            dict(
+                size=int(random.lognormvariate(10, 2)),
+                mimetype=mimetype,
+                encoding=encoding,
+                modified=timezone.now().timestamp(),
+            ),
             source=source,
-            path=path,
-            size=random.lognormvariate(10, 2),
-            mimetype=mimetype,
-            encoding=encoding,
-            modified=timezone.now(),
         )
 
 
@@ -0,0 +1,37 @@
+from django.db import migrations
+
+
+def create_periodic_task(apps, *args):
+    """
+    Create a periodic task to refresh users' OAuth tokens before they expire.
+
+    See `users.socialaccount.tokens`. The interval can be changed in the admin.
+    """
+    IntervalSchedule = apps.get_model("django_celery_beat", "IntervalSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    interval, _ = IntervalSchedule.objects.get_or_create(every=300, period="seconds")
+    PeriodicTask.objects.get_or_create(
+        name="Refresh social tokens",
+        defaults=dict(task="users.tasks.refresh_social_tokens", interval=interval),
+    )
+
+
+def delete_periodic_task(apps, *args):
+    """
+    Delete the periodic task to refresh users' OAuth tokens.
+    """
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+    PeriodicTask.objects.filter(name="Refresh social tokens").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("django_celery_beat", "0012_periodictask_expire_seconds"),
+        ("users", "0004_features"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_periodic_task, delete_periodic_task),
+    ]
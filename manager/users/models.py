@@ -16,8 +16,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.db import connection, models
-from django.db.models import Count, F, Max, Q
-from django.db.models.expressions import RawSQL
+from django.db.models import Count, F, FilteredRelation, Max, Q
 from django.http import HttpRequest
 from django.shortcuts import reverse
 from django.utils import timezone
@@ -143,33 +142,20 @@ def get_projects(user: User, include_public=True):
     from projects.models.projects import Project
 
     if user.is_authenticated:
-        # Annotate the queryset with the role of the user
-        # Role is the "greater" of the project role and the
-        # account role (for the account that owns the project).
+        # Annotate the queryset with the effective role of the user
+        # (the "greater" of the project role and the account role, see
+        # `ProjectAccess`) by joining to their row in the access table.
         # Authenticated users can see public projects and those in
         # which they have a role
-        return Project.objects.annotate(
-            role=RawSQL(
-                """
-SELECT
-CASE account_role.role
-WHEN 'OWNER' THEN 'OWNER'
-WHEN 'MANAGER' THEN
-    CASE project_role.role
-    WHEN 'OWNER' THEN 'OWNER'
-    ELSE 'MANAGER' END
-ELSE project_role.role END AS "role"
-FROM projects_project AS project
-LEFT JOIN
-    (SELECT project_id, "role" FROM projects_projectagent WHERE user_id = %s) AS project_role
-    ON project.id = project_role.project_id
-LEFT JOIN
-    (SELECT account_id, "role" FROM accounts_accountuser WHERE user_id = %s) AS account_role
-    ON project.account_id = account_role.account_id
-WHERE project.id = projects_project.id""",
-                [user.id, user.id],
+        return (
+            Project.objects.annotate(
+                user_access=FilteredRelation(
+                    "access", condition=Q(access__user_id=user.id)
+                )
             )
-        ).filter((Q(public=True) if include_public else Q()) | Q(role__isnull=False))
+            .annotate(role=F("user_access__role"))
+            .filter((Q(public=True) if include_public else Q()) | Q(role__isnull=False))
+        )
     else:
         # Unauthenticated users can only see public projects
         return Project.objects.filter(public=True).extra(select={"role": "NULL"})
@@ -1,15 +1,34 @@
+"""
+Social account tokens of users, including the caching and refreshing of Google tokens.
+
+The locks used to make refreshes of a Google token "single-flight", and the
+markers of tokens that have been used recently (which are read by the
+`refresh_google_tokens` task, run by the `assistant`), are stored in the `cache`.
+So that they are seen by all processes of the `manager` and the `assistant`,
+the cache must be shared (i.e. there must be a `CACHE_URL`, see `manager.cache`).
+Otherwise (e.g. during development) refreshes are only coalesced within a process,
+and tokens are only refreshed when they are needed.
+"""
+
+import logging
+import time
 from enum import Enum, unique
 from typing import Dict, Optional, Tuple
 
 from allauth.socialaccount.models import SocialAccount, SocialApp, SocialToken
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
 from django.utils import timezone
 from oauth2client import transport
 from oauth2client.client import GoogleCredentials
 
 from manager.api.exceptions import SocialTokenMissing
 
+logger = logging.getLogger(__name__)
+
 
 @unique
 class Provider(Enum):
@@ -70,6 +89,58 @@ def get_user_social_token(
     )
 
 
+def token_key(user_id: int, provider: Provider) -> str:
+    """Get the cache key for the token of a user for a provider."""
+    return "social-token-{user}-{provider}".format(user=user_id, provider=provider.name)
+
+
+def used_key(token_id: int) -> str:
+    """Get the cache key recording that a token has recently been used."""
+    return "social-token-{id}-used".format(id=token_id)
+
+
+def app_key(provider: Provider) -> str:
+    """Get the cache key for the `SocialApp` of a provider."""
+    return "social-app-{provider}".format(provider=provider.name)
+
+
+def get_social_app(provider: Provider) -> Optional[SocialApp]:
+    """
+    Get the `SocialApp` for a provider (from the cache if possible).
+
+    Returns `None` if there is no app for the provider (e.g. during development).
+    """
+    app = cache.get(app_key(provider))
+    if app is None:
+        app = SocialApp.objects.filter(provider=provider.name).first()
+        if app is not None:
+            cache.set(app_key(provider), app, settings.SOCIAL_TOKEN_CACHE_SECONDS)
+    return app
+
+
+def is_expiring(token: SocialToken, seconds: float = 90) -> bool:
+    """
+    Check whether a token has expired, or will within `seconds`.
+    """
+    return (
+        token.expires_at is not None
+        and token.expires_at < timezone.now() + timezone.timedelta(seconds=seconds)
+    )
+
+
+def cache_token(user_id: int, provider: Provider, token: SocialToken):
+    """
+    Cache a token until shortly before it expires.
+    """
+    timeout = settings.SOCIAL_TOKEN_CACHE_SECONDS
+    if token.expires_at is not None:
+        timeout = min(
+            timeout, (token.expires_at - timezone.now()).total_seconds() - 90
+        )
+    if timeout > 0:
+        cache.set(token_key(user_id, provider), token, timeout)
+
+
 def get_user_google_token(
     user: User,
 ) -> Tuple[Optional[SocialToken], Optional[SocialApp]]:
@@ -81,51 +152,132 @@ def get_user_google_token(
     need to be done again within the next hour (at time of writing
     the expiry time for tokens).
 
+    Tokens are cached until shortly before they expire so that they
+    are not queried from the database for each Google source of a project.
+    Tokens that have been used recently are refreshed before they
+    expire by the `refresh_google_tokens` task.
+
     In most contexts that this function is used the Google `SocialApp`
     is also needed (e.g. for it's client_id etc) so we return that too.
     To avoid exceptions during development where there might not be a
     Google `SocialApp` we return None.
     """
-    token = get_user_social_token(user, Provider.google)
+    app = get_social_app(Provider.google)
+    if user.is_anonymous:
+        return None, app
+
+    token = cache.get(token_key(user.id, Provider.google))
+    if token is None or is_expiring(token):
+        token = get_user_social_token(user, Provider.google)
+        if token is None:
+            return None, app
+
+        if is_expiring(token):
+            # The folowing are all required for a token refresh so if any
+            # are missing, and the token has expired, return no token.
+            if not (app and token.token and token.token_secret):
+                return None, app
+            token = refresh_google_token(token, app)
+            if token is None:
+                return None, app
+
+        cache_token(user.id, Provider.google, token)
+
+    cache.add(used_key(token.id), True, settings.SOCIAL_TOKEN_USED_SECONDS)
+    return token, app
+
+
+def refresh_google_token(
+    token: SocialToken, app: SocialApp, wait: bool = True
+) -> Optional[SocialToken]:
+    """
+    Refresh a Google OAuth2 access token and save it to the database.
+
+    Refreshes are "single-flight": if the token is already being refreshed
+    (e.g. by another request, or job, for the same user) then this waits for that
+    refresh to finish and returns the refreshed token from the database
+    (or `None` if `wait` is false). The token is also not refreshed if it
+    has been by another process since it was read.
+    """
+    lock = "social-token-{id}-refresh".format(id=token.id)
+    if not cache.add(lock, True, settings.SOCIAL_TOKEN_REFRESH_TIMEOUT):
+        if not wait:
+            return None
+        deadline = time.time() + settings.SOCIAL_TOKEN_REFRESH_TIMEOUT
+        while cache.get(lock) and time.time() < deadline:
+            time.sleep(0.1)
+        token.refresh_from_db()
+        return None if is_expiring(token) else token
 
     try:
-        app = SocialApp.objects.get(provider=Provider.google.name)
-    except SocialApp.DoesNotExist:
-        app = None
+        expires_at = token.expires_at
+        token.refresh_from_db()
+        if token.expires_at != expires_at:
+            return token
 
-    if token is None:
-        return None, app
+        credentials = GoogleCredentials(
+            access_token=token.token,
+            client_id=app.client_id,
+            client_secret=app.secret,
+            refresh_token=token.token_secret,
+            token_expiry=token.expires_at,
+            token_uri="https://accounts.google.com/o/oauth2/token",
+            user_agent="Stencila Hub Client",
+        )
+        credentials.refresh(http=transport.get_http_object())
+        info = credentials.get_access_token()
 
-    # If the token has not expired just return it
-    if token.expires_at is None or token.expires_at > timezone.now() - timezone.timedelta(
-        seconds=90
-    ):
-        return token, app
+        # Save the new access token and expiry time
+        token.token = info.access_token
+        token.expires_at = timezone.now() + timezone.timedelta(
+            seconds=info.expires_in
+        )
+        token.save()
+    finally:
+        cache.delete(lock)
 
-    # The folowing are all required for a token refresh so if any
-    # are missing, and the token has expired, return no token.
-    if not (token.token and token.token_secret and token.expires_at):
-        return None, app
+    return token
 
-    # Refresh the token
-    credentials = GoogleCredentials(
-        access_token=token.token,
-        client_id=app.client_id,
-        client_secret=app.secret,
-        refresh_token=token.token_secret,
-        token_expiry=token.expires_at,
-        token_uri="https://accounts.google.com/o/oauth2/token",
-        user_agent="Stencila Hub Client",
-    )
-    credentials.refresh(http=transport.get_http_object())
-    info = credentials.get_access_token()
 
-    # Save the new access token and expiry time
-    token.token = info.access_token
-    token.expires_at = timezone.now() + timezone.timedelta(seconds=info.expires_in)
-    token.save()
+def refresh_google_tokens() -> int:
+    """
+    Refresh Google tokens that have been used recently and will expire soon.
 
-    return token, app
+    Called on a regular basis by a periodic task so that tokens are refreshed
+    in the background, rather than when they are needed (e.g. in a request).
+    Tokens expiring within `SOCIAL_TOKEN_REFRESH_SECONDS` are refreshed, so the
+    task should be run at least that often. Returns the number of tokens refreshed.
+    """
+    app = get_social_app(Provider.google)
+    if app is None:
+        return 0
+
+    tokens = list(
+        SocialToken.objects.filter(
+            app__provider=Provider.google.name,
+            expires_at__lt=timezone.now()
+            + timezone.timedelta(seconds=settings.SOCIAL_TOKEN_REFRESH_SECONDS),
+        )
+        .exclude(token_secret="")
+        .select_related("account")
+    )
+    used = cache.get_many([used_key(token.id) for token in tokens])
+
+    refreshed = 0
+    for token in tokens:
+        if used_key(token.id) not in used:
+            continue
+        try:
+            if refresh_google_token(token, app, wait=False):
+                cache_token(token.account.user_id, Provider.google, token)
+                refreshed += 1
+        except Exception:
+            logger.warning(
+                "Error refreshing Google token",
+                exc_info=True,
+                extra={"token": token.id},
+            )
+    return refreshed
 
 
 def get_user_social_tokens(user: User) -> Dict[Provider, SocialToken]:
@@ -172,3 +324,34 @@ def refresh_user_access_token(user: User, provider: str, token: str):
 
         # Create the token
         SocialToken.objects.create(account=account, app=app, token=token)
+
+
+def invalidate_cached_tokens(sender, instance: SocialToken, *args, **kwargs):
+    """
+    Remove the cached tokens of a user when one of their tokens is changed or deleted.
+    """
+    # Query the user id, rather than using `instance.account`, in case the account
+    # has already been deleted
+    cache.delete_many(
+        [
+            token_key(user_id, provider)
+            for user_id in SocialAccount.objects.filter(
+                id=instance.account_id
+            ).values_list("user_id", flat=True)
+            for provider in Provider
+        ]
+    )
+
+
+def invalidate_cached_app(sender, instance: SocialApp, *args, **kwargs):
+    """
+    Remove the cached `SocialApp` of a provider when it is changed or deleted.
+    """
+    if Provider.has(instance.provider):
+        cache.delete(app_key(Provider(instance.provider)))
+
+
+post_save.connect(invalidate_cached_tokens, sender=SocialToken)
+post_delete.connect(invalidate_cached_tokens, sender=SocialToken)
+post_save.connect(invalidate_cached_app, sender=SocialApp)
+post_delete.connect(invalidate_cached_app, sender=SocialApp)
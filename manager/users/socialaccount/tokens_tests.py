@@ -1,4 +1,8 @@
+from unittest import mock
+
 from allauth.socialaccount.models import SocialAccount, SocialApp, SocialToken
+from django.core.cache import cache
+from django.utils import timezone
 
 from manager.testing import DatabaseTestCase
 from users.socialaccount.tokens import (
@@ -6,6 +10,8 @@ from users.socialaccount.tokens import (
     get_user_google_token,
     get_user_social_token,
     get_user_social_tokens,
+    refresh_google_token,
+    refresh_google_tokens,
     refresh_user_access_token,
 )
 
@@ -55,3 +61,99 @@ class TokensTestCase(DatabaseTestCase):
         token = get_user_social_token(self.bob, Provider.twitter)
         assert token.token == "new-access-token"
         assert token.token_secret == "existing-refresh-token"
+
+
+class GoogleTokensTestCase(DatabaseTestCase):
+    def setUp(self):
+        cache.clear()
+        self.app = SocialApp.objects.create(
+            provider=Provider.google.name, client_id="client-id", secret="secret"
+        )
+        account = SocialAccount.objects.create(
+            user=self.ada, provider=Provider.google.name, uid="ada"
+        )
+        self.token = SocialToken.objects.create(
+            account=account,
+            app=self.app,
+            token="access-token",
+            token_secret="refresh-token",
+            expires_at=timezone.now() + timezone.timedelta(hours=1),
+        )
+
+    def expire(self, seconds=0):
+        """Set the token to expire in `seconds`."""
+        self.token.expires_at = timezone.now() + timezone.timedelta(seconds=seconds)
+        self.token.save()
+
+    def credentials(self):
+        """Mock Google credentials which refresh to a new access token."""
+        credentials = mock.patch("users.socialaccount.tokens.GoogleCredentials")
+        GoogleCredentials = credentials.start()
+        self.addCleanup(credentials.stop)
+        info = GoogleCredentials.return_value.get_access_token.return_value
+        info.access_token = "new-access-token"
+        info.expires_in = 3600
+        return GoogleCredentials
+
+    def test_cached(self):
+        """
+        Tokens are cached until they are changed or about to expire.
+        """
+        token, app = get_user_google_token(self.ada)
+        assert token.token == "access-token"
+        with self.assertNumQueries(0):
+            token, app = get_user_google_token(self.ada)
+        assert token.token == "access-token"
+        assert app == self.app
+
+        self.token.token = "changed-access-token"
+        self.token.save()
+        token, app = get_user_google_token(self.ada)
+        assert token.token == "changed-access-token"
+
+    def test_refresh(self):
+        """
+        Expired tokens are refreshed, but only once for concurrent requests.
+        """
+        GoogleCredentials = self.credentials()
+        self.expire()
+
+        token, app = get_user_google_token(self.ada)
+        assert token.token == "new-access-token"
+        assert GoogleCredentials.return_value.refresh.call_count == 1
+        token, app = get_user_google_token(self.ada)
+        assert GoogleCredentials.return_value.refresh.call_count == 1
+
+        # If the token is being refreshed elsewhere then wait for that
+        self.expire()
+        cache.add("social-token-{id}-refresh".format(id=self.token.id), True)
+        assert refresh_google_token(self.token, self.app, wait=False) is None
+        with mock.patch("django.conf.settings.SOCIAL_TOKEN_REFRESH_TIMEOUT", 0.1):
+            assert refresh_google_token(self.token, self.app) is None
+        assert GoogleCredentials.return_value.refresh.call_count == 1
+
+        # If the token was refreshed elsewhere, after it was read, then use that
+        cache.delete("social-token-{id}-refresh".format(id=self.token.id))
+        stale = SocialToken.objects.get(id=self.token.id)
+        self.expire(3600)
+        token = refresh_google_token(stale, self.app)
+        assert token.expires_at == self.token.expires_at
+        assert GoogleCredentials.return_value.refresh.call_count == 1
+
+    def test_refresh_google_tokens(self):
+        """
+        Tokens that have been used, and are about to expire, are refreshed.
+        """
+        GoogleCredentials = self.credentials()
+
+        self.expire(300)
+        assert refresh_google_tokens() == 0
+
+        get_user_google_token(self.ada)
+        assert refresh_google_tokens() == 1
+        assert GoogleCredentials.return_value.refresh.call_count == 1
+        with self.assertNumQueries(0):
+            token, app = get_user_google_token(self.ada)
+        assert token.token == "new-access-token"
+
+        assert refresh_google_tokens() == 0
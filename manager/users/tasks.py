@@ -8,10 +8,22 @@ from django import conf
 
 from users.api.serializers import MeSerializer
 from users.models import User, get_email
+from users.socialaccount.tokens import refresh_google_tokens
 
 logger = logging.getLogger(__name__)
 
 
+@shared_task
+def refresh_social_tokens():
+    """
+    Refresh users' OAuth tokens that have been used recently and will expire soon.
+
+    Called on a regular basis (every five minutes by default)
+    by a periodic task (see `users.socialaccount.tokens`).
+    """
+    return refresh_google_tokens()
+
+
 @shared_task
 def update_services_all_users(services=["userflow"]):
     """
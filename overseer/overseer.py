@@ -25,7 +25,7 @@ for this purpose (the results should be used for that, which is what
 `update_job` does; see https://github.com/celery/celery/issues/2190#issuecomment-51609500).
 """
 from datetime import datetime
-from typing import cast, Dict, List, Set, Union
+from typing import cast, Dict, List, Optional, Set, Union
 import asyncio
 import json
 import logging
@@ -57,14 +57,134 @@ client = httpx.AsyncClient(
 )
 
 
+Event = Dict[str, Union[str, int, float]]
+
+# The rank of job statuses.
+# This should be consistent with `JobStatus.rank` in the `manager`.
+STATUS_RANKS = {
+    "WAITING": 0,
+    "DISPATCHED": 1,
+    "PENDING": 2,
+    "RECEIVED": 3,
+    "STARTED": 4,
+    "RUNNING": 5,
+    "SUCCESS": 6,
+    "CANCELLED": 7,
+    "REVOKED": 8,
+    "TERMINATED": 9,
+    "FAILURE": 10,
+}
+
+
+def coalesce_job_data(current: dict, data: dict) -> Optional[dict]:
+    """
+    Coalesce the data from two consecutive events for the same job.
+
+    The status is the one with the highest rank, log deltas are
+    concatenated, and other fields are from the latest event.
+    Returns `None` if the data can not be coalesced (i.e. if the log
+    deltas are not contiguous).
+    """
+    coalesced = {**current, **data}
+
+    coalesced["status"] = max(
+        current.get("status"),
+        data.get("status"),
+        key=lambda status: STATUS_RANKS.get(cast(str, status), 0),
+    )
+
+    if "log" in current and "log" in data:
+        seq = current.get("log_seq")
+        if seq is None or data.get("log_seq") != seq + len(current["log"]):
+            return None
+        coalesced["log"] = current["log"] + data["log"]
+        coalesced["log_seq"] = seq
+
+    return coalesced
+
+
 class Sender(threading.Thread):
-    """A thread with an event loop to send requests to the `manager` service."""
+    """
+    A thread with an event loop to send requests to the `manager` service.
+
+    Job and worker events are batched so that, rather than making a request for
+    each event, a single request for each type is made every `batch_seconds`
+    (or sooner if there are `batch_size` events). Events for the
+    same job within a batch are coalesced into one.
+    """
+
+    # Maximum number of seconds to wait before sending a batch of events
+    batch_seconds = float(os.getenv("OVERSEER_BATCH_SECONDS", 0.5))
+
+    # Maximum number of events in a batch
+    batch_size = int(os.getenv("OVERSEER_BATCH_SIZE", 500))
+
+    def __init__(self):
+        super().__init__()
+        self.loop = asyncio.new_event_loop()
+        self.jobs: Dict[str, dict] = {}
+        self.workers: List[Event] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
 
     def run(self):
         """Run the thread."""
-        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
         self.loop.run_forever()
 
+    def send(self, method: str, url: str, **kwargs):
+        """Send a request to the `manager` (must be called in this thread)."""
+        request = client.build_request(method=method, url=url, **kwargs)
+        self.loop.create_task(client.send(request))
+
+    def add_job_event(self, id: str, data: dict):
+        """Add a job event to the batch (may be called from any thread)."""
+        self.loop.call_soon_threadsafe(self._add_job_event, id, data)
+
+    def add_worker_event(self, event: Event):
+        """Add a worker event to the batch (may be called from any thread)."""
+        self.loop.call_soon_threadsafe(self._add_worker_event, event)
+
+    def _add_job_event(self, id: str, data: dict):
+        current = self.jobs.get(id)
+        if current is not None:
+            coalesced = coalesce_job_data(current, data)
+            if coalesced is None:
+                self.flush()
+            else:
+                self.jobs[id] = coalesced
+                return
+        self.jobs[id] = data
+        self.schedule()
+
+    def _add_worker_event(self, event: Event):
+        self.workers.append(event)
+        self.schedule()
+
+    def schedule(self):
+        """Schedule a flush of the batch, or flush now if the batch is full."""
+        if len(self.jobs) + len(self.workers) >= self.batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.batch_seconds, self.flush)
+
+    def flush(self):
+        """Send batched events to the `manager`."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if self.jobs:
+            events = [dict(id=id, **data) for id, data in self.jobs.items()]
+            self.jobs = {}
+            event_batch_size.labels("jobs").observe(len(events))
+            self.send("POST", "jobs/events", json=events)
+
+        if self.workers:
+            events = self.workers
+            self.workers = []
+            event_batch_size.labels("workers").observe(len(events))
+            self.send("POST", "workers/events", json=events)
+
 
 # Start the sender
 sender = Sender()
@@ -79,11 +199,7 @@ def request(method: str, url: str, **kwargs):
     To maximize throughput of events, and because it is not necessary to
     get the respone, this is "fire and forget".
     """
-    request = client.build_request(method=method, url=url, **kwargs)
-    asyncio.run_coroutine_threadsafe(client.send(request), sender.loop)
-
-
-Event = Dict[str, Union[str, int, float]]
+    sender.loop.call_soon_threadsafe(lambda: sender.send(method, url, **kwargs))
 
 
 def get_event_time(event: Event):
@@ -100,10 +216,11 @@ def update_job(id, data: dict):
     """
     Update a job.
 
-    Sends a PATCH request to the `manager` to update the
-    state of the job. Reused below for individual task event handlers.
+    Adds the event to the batch of job events that is
+    sent to the `manager` to update the state of jobs.
+    Reused below for individual task event handlers.
     """
-    request("PATCH", "jobs/{}".format(id), json=data)
+    sender.add_job_event(id, data)
 
 
 def task_sent(event: Event):
@@ -169,6 +286,19 @@ def task_updated(event: Event):
         if value:
             data.update({field: value})
 
+    # The log is sent as a delta with a sequence number
+    # which may be zero so check for existence
+    if "log" in data and event.get("log_seq") is not None:
+        data.update({"log_seq": event["log_seq"]})
+
+    # Sessions report how long they took to be ready, and whether
+    # a warm pod was claimed from the pool
+    ready_seconds = event.get("session_ready_seconds")
+    if ready_seconds is not None:
+        session_ready_seconds.labels(event.get("session_pool") or "miss").observe(
+            ready_seconds
+        )
+
     update_job(event["task_id"], data)
 
 
@@ -219,40 +349,43 @@ def worker_online(event: Event):
     """
     Sent when a worker has connected to the broker.
 
-    Sends a POST request to the `manager` to mark the
-    worker as started. Additional information on the worker,
-    such as the queues it is listening to are sent by the
+    Adds the event to the batch of worker events that is
+    sent to the `manager` to mark the worker as started.
+    Additional information on the worker, such as the queues it is
+    listening to are sent by the
     `Collector` thread because they can take some time and
     we do not want to block this main event handling thread.
     Ignores events from other types of Celery workers e.g. `assistant`.
     """
     if "worker" in cast(str, event.get("hostname")):
-        request("POST", "workers/online", json=event)
+        sender.add_worker_event(event)
 
 
 def worker_heartbeat(event: Event):
     """
     Sent by a worker every `event.freq` seconds.
 
-    Sends a POST request to the `manager` to create a heartbeat.
+    Adds the event to the batch of worker events that is
+    sent to the `manager` to create a heartbeat.
     Because of the intricacies of uniquely identifying workers,
     rather trying to resolve which worker this heartbeat is for here,
     we sent the entire event to the `manager` and do it over there.
     Ignores events from other types of Celery workers e.g. `assistant`.
     """
     if "worker" in cast(str, event.get("hostname")):
-        request("POST", "workers/heartbeat", json=event)
+        sender.add_worker_event(event)
 
 
 def worker_offline(event: Event):
     """
     Sent when a worker has disconnected from the broker.
 
-    Sends a POST request to the `manager` to mark the worker as finished.
+    Adds the event to the batch of worker events that is
+    sent to the `manager` to mark the worker as finished.
     Ignores events from other types of Celery workers e.g. `assistant`.
     """
     if "worker" in cast(str, event.get("hostname")):
-        request("POST", "workers/offline", json=event)
+        sender.add_worker_event(event)
 
 
 class Receiver(EventReceiver):
@@ -295,6 +428,12 @@ event_processing = Summary(
     "overseer_event_processing", "Summary of event processing duration"
 )
 
+event_batch_size = Summary(
+    "overseer_event_batch_size",
+    "Summary of the number of events sent to the manager in each batch.",
+    ["type"],
+)
+
 queue_length = Gauge("overseer_queue_length", "Number of jobs in the queue.", ["queue"])
 
 workers_total = Gauge("overseer_workers_total", "Number of workers.")
@@ -309,6 +448,12 @@ queue_length_worker_ratio = Gauge(
     ["queue"],
 )
 
+session_ready_seconds = Summary(
+    "overseer_session_ready_seconds",
+    "Summary of the time for sessions to be ready, by warm pool hit or miss.",
+    ["pool"],
+)
+
 
 class Collector(threading.Thread):
     """
@@ -102,6 +102,9 @@ do
     TMP_CFILE=`echo "$TMP_STATS" | sed s/\.$BUCKET\.stat/$BUCKET/`
 
     if [ `stat -c %X "$TMP_STATS"` -eq $TMP_ATIME ]; then
+        # Keep a running total of the cache size, rather than re-running `du`
+        # (which walks the whole cache) after each file is removed
+        TMP_SIZE=`stat -c %s "$TMP_CFILE" 2>/dev/null || echo 0`
         rm -f "$TMP_STATS" "$TMP_CFILE" > /dev/null 2>&1
         if [ $? -ne 0 ]; then
             if [ $SILENT -ne 1 ]; then
@@ -112,9 +115,10 @@ do
             if [ $SILENT -ne 1 ]; then
                 echo "Removed file $TMP_CFILE"
             fi
+            CURRENT_CACHE_SIZE=`expr $CURRENT_CACHE_SIZE - $TMP_SIZE`
         fi
     fi
-    if [ $LIMIT -ge `du -sb "$FILES_CDIR" | awk '{print $1}'` ]; then
+    if [ $LIMIT -ge $CURRENT_CACHE_SIZE ]; then
         if [ $SILENT -ne 1 ]; then
             echo "Finished removing files"
         fi
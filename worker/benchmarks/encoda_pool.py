@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Benchmark of small conversions with, and without, the pool of Encoda servers.
+
+Converts a short Markdown document to JSON (as done for each review
+body by `extract/github.py`) using the Encoda CLI for each conversion,
+and then using a server from the pool (see `jobs/convert_pool.py`).
+Requires that Encoda is installed in the configured `node_modules`.
+
+Run from the `worker` directory:
+
+    python3 -m benchmarks.encoda_pool [conversions]
+"""
+
+import sys
+import time
+from unittest import mock
+
+from jobs.convert import Convert
+from jobs.convert_pool import EncodaPool
+
+MARKDOWN = "# Title\n\nA paragraph with some *emphasis* and a [link](https://stenci.la).\n"
+
+
+def run(pool: EncodaPool, conversions: int) -> float:
+    """Do a number of conversions and return the duration."""
+    with mock.patch("jobs.convert.get_pool", return_value=pool):
+        start = time.perf_counter()
+        for index in range(conversions):
+            result = Convert().do(MARKDOWN, "-", {"from": "md", "to": "json"})
+            assert result and result.startswith("{"), "Conversion failed"
+        duration = time.perf_counter() - start
+    assert pool.size == 0 or pool.failed is None, "Encoda server failed"
+    pool.stop()
+    return duration
+
+
+def main(conversions: int = 200):
+    """Run the benchmark and print a table of results."""
+    print("Converting Markdown to JSON {} times".format(conversions))
+    print("{:<12}{:>12}{:>16}".format("", "seconds", "conversions/sec"))
+    for name, size in (("cli", 0), ("pool", 1)):
+        duration = run(EncodaPool(size=size), conversions)
+        print(
+            "{:<12}{:>12.2f}{:>16.1f}".format(name, duration, conversions / duration)
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the number of events, and bytes, sent when a job logs.
+
+Compares the previous behaviour, in which the entire log was sent on
+every log entry, with the current behaviour, in which log entries are
+buffered and only new entries are sent.
+
+Run from the `worker` directory:
+
+    python3 -m benchmarks.log_shipping [lines]
+"""
+
+import json
+import sys
+import time
+from unittest import mock
+
+from jobs.base.job import Job
+
+
+class Counter:
+    """Counts the number of events, and their size, sent by a job."""
+
+    def __init__(self):
+        self.events = 0
+        self.bytes = 0
+
+    def send_event(self, job, event, **kwargs):
+        """Replacement for `Task.send_event` that counts instead of sending."""
+        self.events += 1
+        self.bytes += len(json.dumps(kwargs))
+
+
+class UnbufferedJob(Job):
+    """A job that sends the entire log on every entry (the previous behaviour)."""
+
+    def flush(self, force: bool = True):
+        """Send the entire log."""
+        if len(self.log_entries):
+            self.notify(log=self.log_entries)
+
+
+def run(job: Job, lines: int):
+    """Log a number of lines and return counts and duration."""
+    counter = Counter()
+    with mock.patch(
+        "celery.Task.send_event",
+        new=lambda job, event, **kwargs: counter.send_event(job, event, **kwargs),
+    ):
+        start = time.perf_counter()
+        job.begin(task_id="benchmark")
+        for line in range(lines):
+            job.info("Log line {}".format(line))
+        job.flush()
+        duration = time.perf_counter() - start
+    return counter, duration
+
+
+def main(lines: int = 10000):
+    """Run the benchmark and print a table of results."""
+    print("{:<12}{:>12}{:>16}{:>12}".format("", "events", "bytes", "seconds"))
+    for name, job in (("before", UnbufferedJob()), ("after", Job())):
+        counter, duration = run(job, lines)
+        print(
+            "{:<12}{:>12}{:>16}{:>12.2f}".format(
+                name, counter.events, counter.bytes, duration
+            )
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
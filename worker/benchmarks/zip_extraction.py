@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark of extracting files from a repository Zip archive.
+
+Compares the previous behaviour of `pull_zip`, in which entries were
+extracted serially and then read back from disk to generate their
+fingerprint, with the current behaviour, in which each entry is
+fingerprinted as it is written, using one or more threads.
+
+Uses a synthetic archive of (by default) 20,000 files of varying size.
+
+Run from the `worker` directory:
+
+    python3 -m benchmarks.zip_extraction [files]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from zipfile import ZIP_DEFLATED, ZipFile
+
+from jobs.pull.github import pull_zip
+from util.files import Files, file_info
+
+
+def create_archive(path: str, files: int):
+    """Create a Zip archive with a similar structure to a GitHub zipball."""
+    rand = random.Random(42)
+    words = [
+        "".join(rand.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(6))
+        for _ in range(1000)
+    ]
+    with ZipFile(path, "w", ZIP_DEFLATED) as archive:
+        for index in range(files):
+            size = int(rand.paretovariate(1.2) * 200)
+            content = " ".join(rand.choice(words) for _ in range(size // 7 + 1))
+            archive.writestr(
+                "repo-abc123/dir{}/sub{}/file{}.txt".format(
+                    index % 50, index % 7, index
+                ),
+                content,
+            )
+
+
+def pull_zip_serial(zip_file: str, path: str) -> Files:
+    """Extract all files and then read them back to get their info."""
+    files = {}
+    with ZipFile(zip_file, "r") as zip_archive:
+        for zip_info in zip_archive.infolist():
+            if zip_info.filename[-1] == "/":
+                continue
+            inner_path = os.path.join(*(zip_info.filename.split("/")[1:]))
+            zip_info.filename = inner_path
+            files[inner_path] = file_info(zip_archive.extract(zip_info, path))
+    return files
+
+
+def run(func, zip_file: str, dest: str) -> float:
+    """Run an extraction function into an empty directory and return the duration."""
+    shutil.rmtree(dest, ignore_errors=True)
+    start = time.perf_counter()
+    func(zip_file, dest)
+    return time.perf_counter() - start
+
+
+def main(files: int = 20000):
+    """Run the benchmark and print a table of results."""
+    tempdir = tempfile.mkdtemp()
+    try:
+        zip_file = os.path.join(tempdir, "archive.zip")
+        create_archive(zip_file, files)
+        dest = os.path.join(tempdir, "dest")
+
+        print(
+            "Extracting {} files ({:.1f} MB Zip archive)".format(
+                files, os.path.getsize(zip_file) / 1e6
+            )
+        )
+        print("{:<16}{:>12}{:>12}".format("", "seconds", "files/sec"))
+        variants = [("serial", pull_zip_serial)] + [
+            (
+                "threads={}".format(threads),
+                lambda zip_file, dest, threads=threads: pull_zip(
+                    zip_file, path=dest, threads=threads
+                ),
+            )
+            for threads in (1, 2, 4, 8)
+        ]
+        for name, func in variants:
+            duration = run(func, zip_file, dest)
+            print("{:<16}{:>12.2f}{:>12.0f}".format(name, duration, files / duration))
+    finally:
+        shutil.rmtree(tempdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -1,6 +1,7 @@
 """Module for worker and job configuration."""
 
 import os
+import tempfile
 
 STORAGE_ROOT = os.environ.get(
     "STORAGE_ROOT", os.path.join(os.path.dirname(__file__), "..", "storage", "data")
@@ -50,6 +51,21 @@ def get_content_root() -> str:
     return os.environ.get("CONTENT_ROOT", os.path.join(STORAGE_ROOT, "content"))
 
 
+def get_cache_root() -> str:
+    """
+    Get the root of the worker's local cache storage.
+
+    Unlike other storage, the cache does not need to be shared
+    between workers and its contents can be removed at any time.
+    So, by default, it is on the worker's local disk (in the temporary
+    directory) rather than on shared storage. The size of each cache
+    is limited (see `util.file_cache`).
+    """
+    return os.environ.get(
+        "CACHE_ROOT", os.path.join(tempfile.gettempdir(), "stencila-cache")
+    )
+
+
 def get_node_modules_bin(name: str) -> str:
     """
     Get the path to a "bin" script installed in the configured `node_modules`.
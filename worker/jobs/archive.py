@@ -1,17 +1,35 @@
+import hashlib
 import logging
 import os
 import shutil
-import tempfile
-from typing import Optional
+import time
+from typing import Iterator, Optional
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
 
 import httpx
 
 from config import get_snapshot_dir
 from jobs.base.job import Job
-from util.files import Files, ensure_dir, list_files
+from util.files import Files, ensure_dir, file_info
 
 logger = logging.getLogger(__name__)
 
+# Size of chunks read from files
+CHUNK_SIZE = 1024 * 1024
+
+# Size of chunks uploaded in each request to a resumable upload session
+# (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Number of seconds to wait for each upload request
+UPLOAD_TIMEOUT = 60
+
+# Number of times that a failed upload request is retried
+UPLOAD_RETRIES = 5
+
+# Response status codes for which upload requests are retried
+UPLOAD_RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
 
 class Archive(Job):
     """
@@ -20,6 +38,10 @@ class Archive(Job):
     Previously, we copied all files to the snapshot dir. However, because there were
     performance and reliability issues with that, we now only copy `index.html` and
     related files. This is a temporary measure until we place these in a separate bucket.
+
+    The Zip archive of the working directory is streamed directly to the snapshot
+    storage (rather than being written to a temporary file first) and each file's
+    fingerprint is generated as it is added to the archive.
     """
 
     name = "archive"
@@ -29,16 +51,13 @@ class Archive(Job):
         project: int,
         snapshot: str,
         path: str,
-        url: Optional[str],
-        secrets: Optional[dict],
+        secrets: Optional[dict] = None,
         **kwargs,
     ) -> Files:
         assert isinstance(project, int)
         assert isinstance(snapshot, str)
         assert isinstance(path, str)
 
-        files = list_files()
-
         # This section is temporary, in future index.html will be
         # placed in content storage.
         snapshot_dir = get_snapshot_dir(project, snapshot)
@@ -50,20 +69,172 @@ class Archive(Job):
                 "index.html.media", os.path.join(snapshot_dir, "index.html.media")
             )
 
-        temp_zip_base_name = tempfile.NamedTemporaryFile().name
-        shutil.make_archive(temp_zip_base_name, "zip", ".")
-        temp_zip_file_name = temp_zip_base_name + ".zip"
+        files: Files = {}
+        chunks = zip_stream(".", files)
 
+        url = (secrets or {}).get("url")
         if url:
-            response = httpx.post(
-                url, data=secrets, files={"file": open(temp_zip_file_name, "rb")}
-            )
-            response.raise_for_status()
+            resumable_upload(url, chunks)
         else:
-            # In development simulate POSTing by copying to the snapshot storage
-            logger.warning("No URL was supplied, copying to snapshot dir")
+            # In development simulate uploading by writing to the snapshot storage
+            logger.warning("No URL was supplied, writing to snapshot dir")
             from config import get_snapshots_root
 
-            shutil.copy(temp_zip_file_name, os.path.join(get_snapshots_root(), path))
+            with open(os.path.join(get_snapshots_root(), path), "wb") as file:
+                for chunk in chunks:
+                    file.write(chunk)
 
         return files
+
+
+class ChunkSink:
+    """
+    A write-only file that collects chunks of bytes written to it.
+
+    Used as the output of a `ZipFile` so that the archive can be
+    streamed as it is written.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> Iterator[bytes]:
+        chunks, self.chunks = self.chunks, []
+        return iter(chunks)
+
+
+def zip_stream(directory: str, files: Files) -> Iterator[bytes]:
+    """
+    Generate a Zip archive of a directory as a stream of chunks.
+
+    Each file in the directory is only read once, with its fingerprint
+    generated as it is added to the archive. The info on each file
+    is added to `files` (which is complete once the stream is consumed).
+    """
+    sink = ChunkSink()
+    with ZipFile(sink, "w", ZIP_DEFLATED) as zip_file:  # type: ignore
+        for (dirpath, dirnames, filenames) in os.walk(directory):
+            dirnames.sort()
+            relative_dir = os.path.relpath(dirpath, directory)
+            if relative_dir != ".":
+                zip_file.write(dirpath, relative_dir)
+
+            for filename in sorted(filenames):
+                absolute_path = os.path.join(dirpath, filename)
+                relative_path = os.path.relpath(absolute_path, directory)
+
+                zip_info = ZipInfo.from_file(absolute_path, relative_path)
+                zip_info.compress_type = ZIP_DEFLATED
+                h = hashlib.sha256()
+                with open(absolute_path, "rb") as source, zip_file.open(
+                    zip_info, "w"
+                ) as dest:
+                    for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                        h.update(chunk)
+                        dest.write(chunk)
+                        yield from sink.drain()
+
+                files[relative_path] = file_info(
+                    absolute_path, fingerprint=h.hexdigest()
+                )
+                yield from sink.drain()
+
+    yield from sink.drain()
+
+
+def resumable_upload(url: str, chunks: Iterator[bytes]):
+    """
+    Upload a stream of chunks using a resumable upload session.
+
+    The `url` is a signed URL for starting the session (see `generate_upload_url`
+    in the `manager`). The stream is uploaded in chunks of `UPLOAD_CHUNK_SIZE`,
+    so that only the chunk being uploaded needs to be kept in memory, and, if a
+    request fails, the upload is resumed from the last byte that was persisted.
+    See https://cloud.google.com/storage/docs/performing-resumable-uploads
+    """
+    with httpx.Client(timeout=UPLOAD_TIMEOUT) as client:
+        response = client.post(
+            url,
+            headers={"Content-Type": "application/zip", "x-goog-resumable": "start"},
+        )
+        response.raise_for_status()
+        session = response.headers["Location"]
+
+        # The bytes that have not yet been persisted, starting at `offset`
+        buffer = bytearray()
+        offset = 0
+        finished = False
+        while True:
+            while not finished and len(buffer) < UPLOAD_CHUNK_SIZE:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    finished = True
+                else:
+                    buffer.extend(chunk)
+
+            if finished:
+                data, total = bytes(buffer), offset + len(buffer)
+            else:
+                data, total = bytes(buffer[:UPLOAD_CHUNK_SIZE]), None
+
+            persisted = upload_chunk(client, session, offset, data, total)
+            if persisted is None:
+                return
+            del buffer[: persisted - offset]
+            offset = persisted
+
+
+def upload_chunk(
+    client: httpx.Client,
+    session: str,
+    offset: int,
+    data: bytes,
+    total: Optional[int],
+) -> Optional[int]:
+    """
+    Upload a chunk, starting at `offset`, to a resumable upload session.
+
+    The `total` size of the upload should only be supplied with the last chunk.
+    Returns the number of bytes of the upload that have been persisted,
+    or `None` if the upload is complete. Failed requests are retried, with
+    exponential backoff, by asking the session how many bytes it has persisted
+    (which may be fewer than the chunk).
+    """
+    size = "*" if total is None else str(total)
+    content_range = (
+        "bytes {}-{}/{}".format(offset, offset + len(data) - 1, size)
+        if data
+        else "bytes */{}".format(size)
+    )
+    for attempt in range(UPLOAD_RETRIES + 1):
+        if attempt > 0:
+            time.sleep(2 ** (attempt - 1))
+        try:
+            response = client.put(
+                session, content=data, headers={"Content-Range": content_range}
+            )
+        except httpx.TransportError as exc:
+            logger.warning("Error uploading chunk: {}".format(exc))
+        else:
+            if response.status_code in (200, 201):
+                return None
+            if response.status_code == 308:
+                # Persisted bytes are indicated by e.g. `Range: bytes=0-1048575`
+                persisted = response.headers.get("Range")
+                return int(persisted.split("-")[1]) + 1 if persisted else 0
+            if response.status_code not in UPLOAD_RETRY_STATUSES:
+                response.raise_for_status()
+            logger.warning("Error uploading chunk: {}".format(response.status_code))
+
+        # Ask for the status of the upload, rather than resending the chunk
+        data = b""
+        content_range = "bytes */{}".format(size)
+    raise RuntimeError("Unable to upload to storage")
+
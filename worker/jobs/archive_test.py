@@ -0,0 +1,114 @@
+import io
+import os
+from unittest import mock
+from zipfile import ZipFile
+
+import httpx
+import pytest
+
+from util.files import list_files
+
+from .archive import resumable_upload, zip_stream
+
+
+def create_files(tempdir):
+    tempdir.write("a.txt", b"A")
+    tempdir.write("b/c.txt", b"C" * 3000000)
+    tempdir.makedir("d")
+
+
+def test_zip_stream(tempdir):
+    """The stream is a valid Zip archive and files are fingerprinted."""
+    create_files(tempdir)
+
+    files = {}
+    content = b"".join(zip_stream(tempdir.path, files))
+
+    with ZipFile(io.BytesIO(content)) as zip_file:
+        assert sorted(zip_file.namelist()) == ["a.txt", "b/", "b/c.txt", "d/"]
+        assert zip_file.read("b/c.txt") == b"C" * 3000000
+
+    expected = list_files(tempdir.path)
+    assert sorted(files.keys()) == ["a.txt", "b/c.txt"]
+    for path, info in files.items():
+        assert info == expected[path]
+
+
+class FakeUploadSession:
+    """
+    A fake resumable upload session which can fail some requests.
+    """
+
+    def __init__(self, failures=[]):
+        self.content = bytearray()
+        self.complete = False
+        self.failures = list(failures)
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            assert request.headers["x-goog-resumable"] == "start"
+            return httpx.Response(201, headers={"Location": "https://example.org/up"})
+
+        failure = self.failures.pop(0) if self.failures else None
+        if failure == "disconnect":
+            raise httpx.ConnectError("Connection reset", request=request)
+        if failure == "unavailable":
+            return httpx.Response(503)
+
+        range_, total = request.headers["Content-Range"].split(" ")[1].split("/")
+        if range_ != "*":
+            assert int(range_.split("-")[0]) == len(self.content)
+            data = request.read()
+            if failure == "partial":
+                data = data[: len(data) // 2]
+            self.content.extend(data)
+
+        if total != "*" and int(total) == len(self.content):
+            self.complete = True
+            return httpx.Response(200)
+        return httpx.Response(
+            308,
+            headers={"Range": "bytes=0-{}".format(len(self.content) - 1)}
+            if self.content
+            else {},
+        )
+
+
+def upload(session, chunks):
+    """Do a resumable upload to a fake session."""
+    Client = httpx.Client
+    with mock.patch(
+        "jobs.archive.httpx.Client",
+        lambda **kwargs: Client(transport=httpx.MockTransport(session), **kwargs),
+    ), mock.patch("jobs.archive.UPLOAD_CHUNK_SIZE", 256 * 1024), mock.patch(
+        "jobs.archive.time.sleep"
+    ):
+        resumable_upload("https://example.org/start", iter(chunks))
+
+
+def test_resumable_upload():
+    """Content is uploaded in chunks."""
+    chunks = [os.urandom(100000) for index in range(10)]
+    session = FakeUploadSession()
+    upload(session, chunks)
+    assert session.complete
+    assert session.content == b"".join(chunks)
+
+
+def test_resumable_upload_resumes():
+    """Uploads are resumed after failed requests, and partially persisted chunks."""
+    chunks = [os.urandom(100000) for index in range(10)]
+    session = FakeUploadSession(
+        [None, "disconnect", None, "unavailable", "partial", None, "partial"]
+    )
+    upload(session, chunks)
+    assert session.failures == []
+    assert session.complete
+    assert session.content == b"".join(chunks)
+
+
+def test_resumable_upload_fails():
+    """Uploads fail after too many failed requests."""
+    session = FakeUploadSession(["unavailable"] * 10)
+    with pytest.raises(RuntimeError, match="Unable to upload"):
+        upload(session, [b"a"])
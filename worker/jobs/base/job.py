@@ -1,4 +1,6 @@
 import os
+import threading
+import time
 import traceback
 from datetime import datetime
 from typing import Any, Optional
@@ -46,6 +48,14 @@ class Job(celery.Task):
     termination of jobs.
     """
 
+    # Maximum number of seconds that a log entry is buffered
+    # before it is sent to the `overseer`
+    log_flush_interval = float(os.getenv("JOB_LOG_FLUSH_INTERVAL", 0.25))
+
+    # Maximum number of log entries that are buffered
+    # before they are sent to the `overseer`
+    log_flush_entries = int(os.getenv("JOB_LOG_FLUSH_ENTRIES", 100))
+
     def begin(self, task_id=None):
         """
         Begin the job.
@@ -56,6 +66,21 @@ class Job(celery.Task):
         """
         self.task_id = task_id
         self.log_entries = []
+        # The number of entries in `log_entries` that have been sent
+        self.log_sent = 0
+        # The time of the last flush and any timer for the next flush
+        self.log_flushed = time.monotonic()
+        self.log_timer: Optional[threading.Timer] = None
+        # Lock to avoid the timer thread and the job thread
+        # sending the same entries
+        self.log_lock = threading.RLock()
+        # Celery's `request` is thread local, so capture the parts of it
+        # needed to send events from the timer thread (see `flush_later`)
+        self.log_request = (
+            dict(id=self.request.id, hostname=self.request.hostname)
+            if self.request_stack is not None
+            else None
+        )
 
     def notify(self, state="RUNNING", **kwargs):
         """
@@ -68,16 +93,64 @@ class Job(celery.Task):
                 "task-updated", task_id=self.task_id, state=state, **kwargs,
             )
 
-    def flush(self):
+    def flush(self, force: bool = True):
         """
         Flush the log.
 
-        In the future this may be more intelligent and buffer
-        sending of log events to reduce the number
-        of requests.
+        Sends only the entries that have not yet been sent (a "delta")
+        along with their sequence number (the index of the first entry in the
+        job's log) so that the `manager` can append them to the log
+        it already has (see `update_job` there).
+
+        Unless `force` is true, entries are buffered until there are
+        `log_flush_entries` of them, or `log_flush_interval` seconds
+        have passed since the last flush, to reduce the number of events.
+        """
+        with self.log_lock:
+            pending = len(self.log_entries) - self.log_sent
+            if pending <= 0:
+                return
+
+            if (
+                not force
+                and pending < self.log_flush_entries
+                and time.monotonic() - self.log_flushed < self.log_flush_interval
+            ):
+                # Ensure that buffered entries get sent even if
+                # there are no more log entries
+                if self.log_timer is None:
+                    self.log_timer = threading.Timer(
+                        self.log_flush_interval, self.flush_later
+                    )
+                    self.log_timer.daemon = True
+                    self.log_timer.start()
+                return
+
+            if self.log_timer is not None:
+                self.log_timer.cancel()
+                self.log_timer = None
+
+            seq = self.log_sent
+            self.log_sent = len(self.log_entries)
+            self.log_flushed = time.monotonic()
+            self.notify(log=self.log_entries[seq:], log_seq=seq)
+
+    def flush_later(self):
+        """
+        Flush the log from the timer thread.
+
+        Pushes the job's request onto this thread's request stack so that
+        events are sent with the job's task id and the worker's hostname.
         """
-        if len(self.log_entries):
-            self.notify(log=self.log_entries)
+        if self.log_request is None:
+            self.flush()
+            return
+
+        self.push_request(**self.log_request)
+        try:
+            self.flush()
+        finally:
+            self.pop_request()
 
     def log(self, level: int, message: str):
         """
@@ -87,9 +160,10 @@ class Job(celery.Task):
 
         - Emits to the Python logger, and
 
-        - Appends an entry to the job's log and updates the
-          state with the log as metadata thereby making the
-          log and any extra details available to the `manager`.
+        - Appends an entry to the job's log and (possibly after
+          buffering, see `flush`) updates the state with the new entries
+          as metadata thereby making the log and any extra details
+          available to the `manager`.
           (see the `update_job` there for how these are extracted)
         """
         log_message = "Job {0}: {1}".format(self.name, message)
@@ -103,10 +177,11 @@ class Job(celery.Task):
         else:
             logger.error(log_message, extra=log_extra)
 
-        self.log_entries.append(
-            dict(time=datetime.utcnow().isoformat(), level=level, message=message)
-        )
-        self.flush()
+        with self.log_lock:
+            self.log_entries.append(
+                dict(time=datetime.utcnow().isoformat(), level=level, message=message)
+            )
+            self.flush(force=False)
 
     def error(self, message: str):
         """Log an error message."""
@@ -197,6 +272,8 @@ class Job(celery.Task):
         except Exception as exc:
             raise self.failure(exc)
         finally:
+            # Send any buffered log entries before the job ends
+            self.flush()
             os.chdir(current_dir)
 
     def do(self, *args, **kwargs):
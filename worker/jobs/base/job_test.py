@@ -1,26 +1,27 @@
+import threading
 from unittest import mock
 
 import pytest
 from celery.exceptions import Ignore
+from celery.utils.threads import LocalStack
 
 from .job import DEBUG, ERROR, INFO, WARN, Job
 
 
 def test_logging():
-    """On each log entry send_event is called with the log."""
+    """Log entries are sent as deltas, with a sequence number."""
     job = Job()
     job.begin(task_id=4321)
 
-    current = {}
+    events = []
 
     def send_event(self, event, **kwargs):
         assert event == "task-updated"
-        current["state"] = kwargs.get("state")
-        current["log"] = kwargs.get("log")
+        events.append(kwargs)
 
     with mock.patch(
         "celery.Task.send_event", new=send_event,
-    ):
+    ), mock.patch.object(job, "log_flush_interval", 0):
 
         for index, level in enumerate(["error", "warn", "info", "debug"]):
             getattr(job, level)("{} message".format(level))
@@ -29,8 +30,90 @@ def test_logging():
             assert "time" in log
             assert log["level"] == index
             assert log["message"] == "{} message".format(level)
+
+            current = events[-1]
             assert current["state"] == "RUNNING"
-            assert current["log"] == job.log_entries
+            assert current["log"] == [log]
+            assert current["log_seq"] == index
+
+
+def test_logging_buffered():
+    """Log entries are buffered and sent in batches."""
+    job = Job()
+    job.begin(task_id=4321)
+
+    events = []
+
+    def send_event(self, event, **kwargs):
+        events.append(kwargs)
+
+    with mock.patch("celery.Task.send_event", new=send_event,), mock.patch.object(
+        job, "log_flush_interval", 60
+    ), mock.patch.object(job, "log_flush_entries", 10):
+        for index in range(25):
+            job.info("message {}".format(index))
+
+        # Two full batches have been sent
+        assert len(events) == 2
+        assert [event["log_seq"] for event in events] == [0, 10]
+        assert [len(event["log"]) for event in events] == [10, 10]
+
+        # Remaining entries are sent when forced
+        job.flush()
+        assert len(events) == 3
+        assert events[2]["log_seq"] == 20
+        assert [entry["message"] for entry in events[2]["log"]] == [
+            "message {}".format(index) for index in range(20, 25)
+        ]
+
+        # Nothing to send, so no more events
+        job.flush()
+        assert len(events) == 3
+
+
+def test_logging_timer():
+    """Buffered log entries are sent after the flush interval."""
+    job = Job()
+    job.begin(task_id=4321)
+
+    sent = threading.Event()
+    events = []
+
+    def send_event(self, event, **kwargs):
+        events.append(kwargs)
+        sent.set()
+
+    with mock.patch("celery.Task.send_event", new=send_event,), mock.patch.object(
+        job, "log_flush_interval", 0.5
+    ):
+        job.info("one")
+        job.info("two")
+        assert sent.wait(5)
+        assert len(events) == 1
+        assert events[0]["log_seq"] == 0
+        assert len(events[0]["log"]) == 2
+
+
+def test_logging_timer_request():
+    """Buffered log entries are sent from the timer thread using the job's request."""
+    job = Job()
+    job.request_stack = LocalStack()
+    job.push_request(id="task-id", hostname="worker-hostname")
+    job.begin(task_id=4321)
+
+    sent = threading.Event()
+    requests = []
+
+    def send_event(self, event, **kwargs):
+        requests.append((self.request.id, self.request.hostname))
+        sent.set()
+
+    with mock.patch("celery.Task.send_event", new=send_event,), mock.patch.object(
+        job, "log_flush_interval", 0.1
+    ):
+        job.info("one")
+        assert sent.wait(5)
+        assert requests == [("task-id", "worker-hostname")]
 
 
 def test_success():
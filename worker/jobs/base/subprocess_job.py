@@ -103,6 +103,7 @@ class SubprocessJob(Job):
         Job has been terminated.
 
         Override of `Job.terminate` which kills the
-        subprocess.
+        subprocess (if any).
         """
-        self.process.kill()
+        if self.process:
+            self.process.kill()
@@ -1,4 +1,5 @@
 import json
+import logging
 import os
 import shutil
 import tempfile
@@ -9,18 +10,24 @@ from googleapiclient.http import MediaFileUpload
 from oauth2client.client import GoogleCredentials
 
 from config import get_content_root, get_node_modules_bin
+from jobs.base.job import INFO
 from jobs.base.subprocess_job import SubprocessJob
+from jobs.convert_pool import EncodaServerError, get_pool
 from jobs.pull.gdoc import pull_gdoc
 from util.files import Files, list_files, move_files, temp_dir
 from util.gapis import gdrive_service
 
+logger = logging.getLogger(__name__)
+
 
 class Convert(SubprocessJob):
     """
     A job that converts files from one format to another.
 
-    Delegates convertion the Encoda CLI https://github.com/stencila/encoda
+    Delegates convertion to Encoda https://github.com/stencila/encoda
     which should be installed globally within the worker's Docker container.
+    Conversions are done by a long-lived Encoda server, from a pool, where
+    possible (see `convert_pool.py`) and otherwise by the Encoda CLI.
     """
 
     name = "convert"
@@ -74,9 +81,7 @@ class Convert(SubprocessJob):
                     temp = temp_dir()
                 outputs[index] = os.path.join(temp, output)
 
-        # Generate arguments to Encoda and call it
-        args = encoda_args(input, outputs, options)
-        result = super().do(args, input=input if isinstance(input, bytes) else None)
+        result = self.encoda(input, outputs, options)
 
         # If the output is a stream then just return the bytes
         if len(outputs) == 1 and outputs[0] == "-":
@@ -110,24 +115,69 @@ class Convert(SubprocessJob):
         return files
 
 
-def encoda_args(  # type: ignore
-    input: Union[str, bytes], outputs: List[str], options: Dict[str, Union[str, bool]],
-) -> List[str]:
+    def encoda(
+        self,
+        input: Union[str, bytes],
+        outputs: List[str],
+        options: Dict[str, Union[str, bool]],
+    ) -> Optional[str]:
+        """
+        Run Encoda, preferably using a server from the pool.
+
+        Falls back to the Encoda CLI if the pool is disabled or full, or if
+        the server fails (in which case the CLI reports any errors in the
+        usual way). Because the server may be out of step with its responses
+        after it fails, it is not reused. Returns the content of any "-" output.
+        """
+        pool = get_pool()
+        server = pool.acquire() if pool else None
+        if pool and server:
+            result = None
+            # So that the server is killed if the job is terminated
+            self.process = server.process
+            try:
+                result = server.convert(input, outputs, encoda_options(options))
+            except EncodaServerError as exc:
+                logger.warning("Falling back to Encoda CLI: {}".format(exc))
+                pool.release(server, failed=True)
+            except UnicodeDecodeError as exc:
+                logger.warning("Falling back to Encoda CLI: {}".format(exc))
+                pool.release(server)
+            except BaseException:
+                pool.release(server, failed=True)
+                raise
+            else:
+                pool.release(server)
+            finally:
+                self.process = None
+
+            if result is not None:
+                # Jobs that use `Convert` directly (e.g. `Register`) do not `begin` it
+                # so there is no log to add entries to
+                if hasattr(self, "log_entries"):
+                    for entry in result["log"]:
+                        self.log(
+                            level=entry.get("level", INFO), message=entry["message"]
+                        )
+                streams = [output for output in result["outputs"] if output is not None]
+                return "".join(streams) if streams else None
+
+        args = encoda_args(input, outputs, options)
+        return super().do(args, input=input if isinstance(input, bytes) else None)
+
+
+def encoda_options(options: Dict[str, Union[str, bool]]) -> Dict[str, Union[str, bool]]:
     """
-    Create an array of Encoda arguments based on job inputs, outputs and options.
+    Normalize the options for an Encoda conversion.
+
+    Encoda currently does not allow for mimetypes in the `from` option.
+    This replaces some mimetypes with codec names for formats that are
+    not easily identifiable from their extension. This means that for other
+    files, the file extension will be used to determine the format (which
+    works in most cases).
     """
-    args = [
-        get_node_modules_bin("encoda"),
-        "convert",
-        "-" if isinstance(input, bytes) else input,
-    ] + outputs
+    result = {}
     for name, value in options.items():
-        # Determine --from option
-        # Encoda currently does not allow for mimetypes in the `from` option.
-        # This replaces some mimetypes with codec names for formats that are
-        # not easily identifiable from their extension. This means that for other
-        # files, the file extension will be used to determine the format (which
-        # works in most cases).
         if name == "from" and isinstance(value, str):
             value = {
                 "application/jats+xml": "jats",
@@ -135,9 +185,24 @@ def encoda_args(  # type: ignore
             }.get(value, value)
             # If the value has a slash in it, assume it's still a mimetype
             # and skip
-            if isinstance(value, str) and "/" in value:
+            if "/" in value:
                 continue
+        result[name] = value
+    return result
 
+
+def encoda_args(  # type: ignore
+    input: Union[str, bytes], outputs: List[str], options: Dict[str, Union[str, bool]],
+) -> List[str]:
+    """
+    Create an array of Encoda arguments based on job inputs, outputs and options.
+    """
+    args = [
+        get_node_modules_bin("encoda"),
+        "convert",
+        "-" if isinstance(input, bytes) else input,
+    ] + outputs
+    for name, value in encoda_options(options).items():
         # Transform boolean values
         if value is False:
             value = "false"
@@ -0,0 +1,302 @@
+"""
+A pool of long-lived Encoda conversion servers.
+
+Starting Node.js, and loading Encoda, takes longer than most conversions.
+Rather than spawning the Encoda CLI for every conversion, `Convert` sends
+conversions to a `convert_server.js` process (over a JSON-RPC protocol on
+its `stdin` and `stdout`) which is reused for subsequent conversions.
+
+Each worker process has its own pool (see `get_pool`). Servers are
+health checked if they have been idle for a while, and are recycled
+after a number of conversions, or if their memory usage grows too large.
+If the pool is disabled or full, or a server fails, `Convert` falls back
+to using the Encoda CLI.
+
+The pool is configured using environment variables:
+
+- `ENCODA_POOL_SIZE`: the maximum number of servers in each worker
+  process (defaults to 1, use 0 to disable the pool)
+- `ENCODA_POOL_MAX_CONVERSIONS`: the number of conversions after which
+  a server is recycled (defaults to 100)
+- `ENCODA_POOL_MAX_MEMORY`: the memory usage, in megabytes, above which
+  a server is recycled (defaults to 1024)
+- `ENCODA_POOL_HEALTH_INTERVAL`: the number of seconds a server can be
+  idle before it is health checked (defaults to 60)
+"""
+
+import atexit
+import json
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Union
+
+from config import NODE_MODULES
+
+logger = logging.getLogger(__name__)
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(__file__), "convert_server.js")
+
+# Number of seconds to wait for a health check response
+HEALTH_CHECK_TIMEOUT = 5
+
+# Number of seconds to wait before trying to start a server
+# again after one failed to start
+START_RETRY_INTERVAL = 60
+
+
+class EncodaServerError(Exception):
+    """
+    An Encoda server failed to handle a request.
+
+    e.g. because it crashed, timed out, or returned an error.
+    """
+
+
+class EncodaServer:
+    """
+    A long-lived Encoda process handling requests one at a time.
+    """
+
+    def __init__(self, command: List[str]):
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=dict(os.environ, NODE_PATH=NODE_MODULES),
+        )
+        self.requests = 0
+        self.conversions = 0
+        self.memory = 0
+        self.used = time.monotonic()
+
+    def request(self, method: str, params: Dict = {}, timeout=None) -> Dict:
+        """
+        Send a request to the server and wait for the result.
+
+        Raises an `EncodaServerError` if the server does not respond
+        within `timeout` seconds (if specified), exits, returns an error,
+        or its response can not be matched to the request (in which case
+        it should not be used for subsequent requests).
+        """
+        self.requests += 1
+        request = dict(jsonrpc="2.0", id=self.requests, method=method, params=params)
+        stdin, stdout = self.process.stdin, self.process.stdout
+        assert stdin is not None and stdout is not None
+        try:
+            stdin.write(json.dumps(request).encode() + b"\n")
+            stdin.flush()
+            if timeout is not None:
+                ready, _, _ = select.select([stdout], [], [], timeout)
+                if not ready:
+                    raise EncodaServerError("Timed out waiting for response")
+            line = stdout.readline()
+        except OSError as exc:
+            raise EncodaServerError(str(exc))
+
+        if not line:
+            raise EncodaServerError(
+                "Server exited with code {}".format(self.process.wait())
+            )
+        try:
+            response = json.loads(line)
+        except ValueError as exc:
+            raise EncodaServerError("Invalid response: {}".format(exc))
+        if response.get("id") != self.requests:
+            raise EncodaServerError("Unexpected response id")
+
+        self.used = time.monotonic()
+        error = response.get("error")
+        data = response.get("result") if error is None else error.get("data") or {}
+        self.memory = data.get("memory", self.memory)
+        if error:
+            raise EncodaServerError(error.get("message"))
+        return response["result"]
+
+    def convert(
+        self,
+        input: Union[str, bytes],
+        outputs: List[str],
+        options: Dict[str, Union[str, bool]] = {},
+    ) -> Dict:
+        """
+        Convert an input to one or more outputs.
+
+        The input is either a path or, if bytes, the content to convert (which
+        is sent as `content`, rather than `input`, so that it is not treated as
+        a path, and requires the `from` option). Relative paths are resolved
+        against the current working directory. Returns a dictionary with a list
+        of `outputs` (the content for each "-" output, otherwise `None`) and the
+        `log` entries of the conversion.
+        """
+        params: Dict = dict(cwd=os.getcwd(), outputs=outputs, options=options)
+        if isinstance(input, bytes):
+            params["content"] = input.decode()
+        else:
+            params["input"] = input
+        self.conversions += 1
+        return self.request("convert", params)
+
+    def alive(self) -> bool:
+        """
+        Is the server process still running?
+        """
+        return self.process.poll() is None
+
+    def stop(self):
+        """
+        Stop the server process.
+        """
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+
+
+class EncodaPool:
+    """
+    A pool of Encoda servers.
+
+    Thread safe, although with the default, `prefork`, Celery pool
+    each worker process only does one job at a time.
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        max_conversions: int = 100,
+        max_memory: int = 1024,
+        health_interval: float = 60,
+        command: Optional[List[str]] = None,
+    ):
+        self.size = size
+        self.max_conversions = max_conversions
+        self.max_memory = max_memory
+        self.health_interval = health_interval
+        self.command = command or ["node", SERVER_SCRIPT]
+
+        self.lock = threading.Lock()
+        self.idle: List[EncodaServer] = []
+        self.busy = 0
+        self.failed: Optional[float] = None
+
+    def acquire(self) -> Optional[EncodaServer]:
+        """
+        Acquire a server from the pool.
+
+        Reuses an idle server, if there is a healthy one, otherwise
+        starts a new server. Returns `None` if the pool is full, or if a
+        server recently failed to start.
+        """
+        while True:
+            with self.lock:
+                server = self.idle.pop() if self.idle else None
+                if server is None:
+                    if self.busy >= self.size or (
+                        self.failed is not None
+                        and time.monotonic() - self.failed < START_RETRY_INTERVAL
+                    ):
+                        return None
+                self.busy += 1
+
+            if server is None:
+                try:
+                    return EncodaServer(self.command)
+                except OSError as exc:
+                    logger.warning("Unable to start Encoda server: {}".format(exc))
+                    with self.lock:
+                        self.busy -= 1
+                        self.failed = time.monotonic()
+                    return None
+
+            if self.healthy(server):
+                return server
+
+            server.stop()
+            with self.lock:
+                self.busy -= 1
+
+    def release(self, server: EncodaServer, failed: bool = False):
+        """
+        Release a server back to the pool.
+
+        The server is stopped, rather than returned to the pool, if it
+        failed (e.g. was interrupted part way through a request), has
+        exited, or is due for recycling.
+        """
+        exited = not server.alive()
+        recycle = (
+            failed
+            or exited
+            or server.conversions >= self.max_conversions
+            or server.memory > self.max_memory * 1024 * 1024
+        )
+
+        with self.lock:
+            self.busy -= 1
+            if exited and server.conversions <= 1:
+                # Exited on first use so servers may not be able to start at all
+                # (e.g. Encoda is not installed)
+                self.failed = time.monotonic()
+            if not recycle and len(self.idle) < self.size:
+                self.idle.append(server)
+                return
+        server.stop()
+
+    def healthy(self, server: EncodaServer) -> bool:
+        """
+        Check that a server is healthy.
+
+        Only servers that have been idle for more than `health_interval`
+        are sent a request to check that they are responsive.
+        """
+        if not server.alive():
+            return False
+        if time.monotonic() - server.used < self.health_interval:
+            return True
+        try:
+            server.request("ping", timeout=HEALTH_CHECK_TIMEOUT)
+            return True
+        except EncodaServerError as exc:
+            logger.warning("Encoda server failed health check: {}".format(exc))
+            return False
+
+    def stop(self):
+        """
+        Stop all idle servers.
+        """
+        with self.lock:
+            servers, self.idle = self.idle, []
+        for server in servers:
+            server.stop()
+
+
+_pool: Optional[EncodaPool] = None
+_pool_pid: Optional[int] = None
+
+
+def get_pool() -> Optional[EncodaPool]:
+    """
+    Get the pool of Encoda servers for the current process.
+
+    Returns `None` if the pool is disabled. Each process has its own pool
+    so that servers are not shared by forked worker processes.
+    """
+    global _pool, _pool_pid
+
+    size = int(os.getenv("ENCODA_POOL_SIZE", 1))
+    if size < 1:
+        return None
+
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = EncodaPool(
+            size=size,
+            max_conversions=int(os.getenv("ENCODA_POOL_MAX_CONVERSIONS", 100)),
+            max_memory=int(os.getenv("ENCODA_POOL_MAX_MEMORY", 1024)),
+            health_interval=float(os.getenv("ENCODA_POOL_HEALTH_INTERVAL", 60)),
+        )
+        _pool_pid = os.getpid()
+        atexit.register(_pool.stop)
+    return _pool
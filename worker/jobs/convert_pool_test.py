@@ -0,0 +1,176 @@
+import json
+import os
+import shutil
+import sys
+from unittest import mock
+
+import pytest
+
+from .convert import Convert
+from .convert_pool import SERVER_SCRIPT, EncodaPool, EncodaServerError
+
+# A fake Encoda server which "converts" inputs to upper case
+FAKE_SERVER = """
+import json, os, sys
+for line in sys.stdin:
+    request = json.loads(line)
+    params = request["params"]
+    input = params.get("input", params.get("content"))
+    if input == "crash":
+        sys.exit(1)
+    elif input == "garbage":
+        print("not json", flush=True)
+        continue
+    elif input == "error":
+        response = dict(error=dict(code=-32000, message="Bad input"))
+    else:
+        response = dict(
+            result=dict(
+                outputs=[input.upper() if output == "-" else None for output in params.get("outputs", [])],
+                options=params.get("options"),
+                log=[dict(level=2, message="Converted")],
+                memory=int(input) if input and input.isdigit() else 1000,
+            )
+        )
+    print(json.dumps(dict(jsonrpc="2.0", id=request["id"], **response)), flush=True)
+"""
+
+
+def fake_pool(**kwargs) -> EncodaPool:
+    """Create a pool of fake servers."""
+    return EncodaPool(command=[sys.executable, "-c", FAKE_SERVER], **kwargs)
+
+
+def test_reuse_and_recycle():
+    """Servers are reused until they reach the maximum conversions or memory."""
+    pool = fake_pool(max_conversions=2, max_memory=1)
+
+    first = pool.acquire()
+    assert first.convert("a", ["-"])["outputs"] == ["A"]
+    pool.release(first)
+    assert pool.acquire() is first
+    first.convert("b", ["-"])
+    pool.release(first)
+    assert not first.alive()
+
+    second = pool.acquire()
+    assert second is not first
+    assert pool.acquire() is None, "pool is full"
+    second.convert(str(2 * 1024 * 1024), ["-"])
+    pool.release(second)
+    assert not second.alive()
+
+    pool.stop()
+
+
+def test_failures():
+    """Servers that crash are not reused, but those that return an error are."""
+    pool = fake_pool()
+
+    server = pool.acquire()
+    with pytest.raises(EncodaServerError, match="Bad input"):
+        server.convert("error", ["-"])
+    pool.release(server)
+    assert pool.acquire() is server
+
+    server.convert("a", ["-"])
+    with pytest.raises(EncodaServerError, match="Server exited with code 1"):
+        server.convert("crash", ["-"])
+    pool.release(server)
+    other = pool.acquire()
+    assert other is not server
+
+    # Responses that are not JSON are errors
+    with pytest.raises(EncodaServerError, match="Invalid response"):
+        other.convert("garbage", ["-"])
+    pool.release(other, failed=True)
+
+    # A server exiting on first use stops further servers being started
+    server = pool.acquire()
+    with pytest.raises(EncodaServerError):
+        server.convert("crash", ["-"])
+    pool.release(server)
+    assert pool.acquire() is None
+
+
+def test_health_check():
+    """Idle servers that are no longer running are replaced."""
+    pool = fake_pool(health_interval=0)
+
+    server = pool.acquire()
+    pool.release(server)
+    assert pool.acquire() is server
+    pool.release(server)
+
+    server.process.kill()
+    server.process.wait()
+    other = pool.acquire()
+    assert other is not server
+    assert other.convert("a", ["-"])["outputs"] == ["A"]
+    pool.release(other)
+
+    pool.stop()
+
+
+def test_convert_with_pool():
+    """The `Convert` job uses the pool and falls back to the CLI."""
+    pool = fake_pool()
+    job = Convert()
+    job.begin()
+    with mock.patch("jobs.convert.get_pool", return_value=pool):
+        assert job.do(b"hello", "-", {"from": "md", "to": "json"}) == "HELLO"
+        assert job.log_entries[-1]["message"] == "Converted"
+        assert job.process is None
+
+        with mock.patch(
+            "jobs.base.subprocess_job.SubprocessJob.do", return_value="CLI"
+        ) as cli:
+            assert job.do("error", "-", {"from": "text/markdown"}) == "CLI"
+            assert cli.call_args[0][0][1:] == ["convert", "error", "-"]
+
+            # Servers that fail are not reused (they may be out of step
+            # with their responses)
+            assert pool.idle == []
+            server = pool.acquire()
+            assert server is not None
+            pool.release(server)
+            assert job.do("garbage", "-", {"from": "md"}) == "CLI"
+            assert pool.idle == []
+            assert not server.alive()
+
+    pool.stop()
+
+
+# A fake Encoda package, for testing the real server, which
+# returns how each node was read
+FAKE_ENCODA = """
+exports.read = async (path, format) => ({ read: path, format })
+exports.load = async (content, format) => ({ load: content, format })
+exports.dump = async (node, format) => JSON.stringify(node)
+exports.write = async (node, path, options) => {}
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="Node.js is not available")
+def test_server_input_and_content(tmp_path):
+    """The server reads paths and loads content."""
+    modules = tmp_path / "node_modules" / "@stencila"
+    for name, script in (
+        ("encoda", FAKE_ENCODA),
+        ("logga", "exports.replaceHandlers = () => {}"),
+    ):
+        os.makedirs(modules / name)
+        (modules / name / "index.js").write_text(script)
+
+    with mock.patch("jobs.convert_pool.NODE_MODULES", str(tmp_path / "node_modules")):
+        pool = EncodaPool(command=["node", SERVER_SCRIPT])
+        server = pool.acquire()
+
+        result = server.convert("doc.md", ["-"], {"from": "md"})
+        assert json.loads(result["outputs"][0]) == dict(read="doc.md", format="md")
+
+        result = server.convert(b"# Heading", ["-"], {"from": "md"})
+        assert json.loads(result["outputs"][0]) == dict(load="# Heading", format="md")
+
+        pool.release(server)
+        pool.stop()
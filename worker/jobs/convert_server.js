@@ -0,0 +1,135 @@
+/**
+ * A long-lived Encoda conversion server.
+ *
+ * Reads JSON-RPC 2.0 requests, one per line, from `stdin` and writes
+ * responses, one per line, to `stdout`. Used by `convert_pool.py` to avoid
+ * the cost of starting Node.js, and loading Encoda, for every conversion.
+ *
+ * Methods:
+ *
+ * - `ping`: does nothing (used for health checks)
+ * - `convert`: converts `input` (a path), or `content` (in the `from` format),
+ *   to each of `outputs` (paths, or "-" for the content to be returned in the
+ *   result)
+ *
+ * All results include the log entries emitted while handling the request
+ * and the current memory usage of the process (used to decide when to
+ * recycle it).
+ */
+
+const readline = require('readline')
+
+// Ensure that nothing other than responses is written to stdout
+const respond = (response) =>
+  stdoutWrite(JSON.stringify({ jsonrpc: '2.0', ...response }) + '\n')
+const stdoutWrite = process.stdout.write.bind(process.stdout)
+process.stdout.write = process.stderr.write.bind(process.stderr)
+console.log = console.error
+
+const encoda = require('@stencila/encoda')
+// Use the same instance of Logga as Encoda so that its log entries are captured
+const logga = require(require.resolve('@stencila/logga', {
+  paths: [require.resolve('@stencila/encoda')],
+}))
+
+// Log entries emitted while handling the current request
+let entries = []
+logga.replaceHandlers((data) =>
+  entries.push({ level: data.level, message: data.message })
+)
+
+// Encode options which have different names to the CLI options
+// (as used by `encoda_args` in `convert.py`)
+const OPTION_NAMES = {
+  standalone: 'isStandalone',
+  bundle: 'isBundle',
+  zip: 'shouldZip',
+}
+
+/**
+ * Convert CLI style options to Encoda encode options.
+ */
+function encodeOptions(options) {
+  const result = {}
+  for (const [name, value] of Object.entries(options)) {
+    if (name === 'from' || name === 'to') continue
+    result[name in OPTION_NAMES ? OPTION_NAMES[name] : name] =
+      value === 'true' ? true : value === 'false' ? false : value
+  }
+  return result
+}
+
+/**
+ * Convert an input to one or more outputs.
+ *
+ * Changes to `cwd` first so that relative paths are resolved
+ * as they would be by the CLI.
+ */
+async function convert({ cwd, input, content, outputs, options = {} }) {
+  if (cwd) process.chdir(cwd)
+
+  const { from, to } = options
+  const node =
+    content !== undefined
+      ? await encoda.load(content, from)
+      : await encoda.read(input, from)
+  const results = []
+  for (const output of outputs) {
+    const encode = { ...encodeOptions(options), format: to }
+    if (output === '-') {
+      results.push(await encoda.dump(node, to, encode))
+    } else {
+      await encoda.write(node, output, encode)
+      results.push(null)
+    }
+  }
+  return { outputs: results }
+}
+
+/**
+ * Handle a request.
+ */
+async function handle(line) {
+  let request
+  try {
+    request = JSON.parse(line)
+  } catch (error) {
+    return respond({ id: null, error: { code: -32700, message: 'Parse error' } })
+  }
+
+  const { id, method, params } = request
+  entries = []
+  try {
+    let result
+    if (method === 'ping') result = {}
+    else if (method === 'convert') result = await convert(params)
+    else
+      return respond({
+        id,
+        error: { code: -32601, message: `Method not found: ${method}` },
+      })
+    respond({
+      id,
+      result: { ...result, log: entries, memory: process.memoryUsage().rss },
+    })
+  } catch (error) {
+    respond({
+      id,
+      error: {
+        code: -32000,
+        message: error.message,
+        data: { log: entries, memory: process.memoryUsage().rss },
+      },
+    })
+  }
+}
+
+// Handle requests one at a time, in the order received, and exit
+// once `stdin` is closed
+let queue = Promise.resolve()
+readline
+  .createInterface({ input: process.stdin })
+  .on('line', (line) => {
+    queue = queue.then(() => handle(line))
+  })
+  .on('close', () => queue.then(() => process.exit(0)))
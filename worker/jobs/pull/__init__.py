@@ -1,10 +1,10 @@
 import os
 from collections import OrderedDict
-from typing import Callable, Dict, List
+from typing import Callable, Dict, List, Optional
 
 import config
 from jobs.base.job import Job
-from util.files import Files, assert_within
+from util.files import FileInfo, Files, assert_within
 
 from .elife import pull_elife
 from .gdoc import pull_gdoc
@@ -41,17 +41,29 @@ class Pull(Job):
 
     name = "pull"
 
-    def do(self, source: dict, path: str, secrets: Dict = {}, **kwargs):  # type: ignore
+    def do(  # type: ignore
+        self,
+        source: dict,
+        path: str,
+        secrets: Dict = {},
+        manifest: Optional[Files] = None,
+        **kwargs,
+    ):
         """
         Pull `source` to `path` within `project`.
 
-        :param source:  A dictionary with `type` and any other keys required to
-                        pull the source (e.g. urls, authentication tokens).
-        :param path:    The path, within the project, to pull the source to;
-                        could be the path of a directory or file; may not yet exist.
-        :param secrets: Authentication credentials, API keys and other secrets needed
-                        to pull the source. Secrets are not displayed in job listings.
-        :returns:       A list of paths, with the project, created by the pull.
+        :param source:   A dictionary with `type` and any other keys required to
+                         pull the source (e.g. urls, authentication tokens).
+        :param path:     The path, within the project, to pull the source to;
+                         could be the path of a directory or file; may not yet exist.
+        :param secrets:  Authentication credentials, API keys and other secrets needed
+                         to pull the source. Secrets are not displayed in job listings.
+        :param manifest: The info (e.g. `fingerprint`, `size`, `modified`, `etag`)
+                         of the files previously pulled from the source. Pull
+                         functions use this to avoid pulling unchanged files.
+        :returns:        A dictionary of paths, within the project, to file info.
+                         If a `manifest` was provided, only includes files that
+                         have changed, with `None` for files that have been removed.
         """
         assert isinstance(source, dict), "source must be a dictionary"
         assert "type" in source, "source must have a type"
@@ -66,7 +78,34 @@ class Pull(Job):
         pull_func = PULL_FUNCS[typ]
 
         # Call the function to get a dictionary of files
-        files = pull_func(source=source, path=path, secrets=secrets)
+        files = pull_func(source=source, path=path, secrets=secrets, manifest=manifest)
+        if manifest is not None:
+            files = changed_files(files, manifest)
 
         # Sort the dictionary by file path
         return OrderedDict(sorted(files.items()))
+
+
+def changed_files(files: Files, manifest: Files) -> Dict[str, Optional[FileInfo]]:
+    """
+    Get the files that have changed since those in the `manifest` were pulled.
+
+    Files are considered changed if they are new, or if their size,
+    fingerprint or etag (if any) are different. Files in the manifest
+    that were not pulled (i.e. have been removed from the source)
+    are included with `None` info.
+    """
+    changed: Dict[str, Optional[FileInfo]] = {}
+    for path, info in files.items():
+        previous = manifest.get(path)
+        if (
+            not previous
+            or info.get("size") != previous.get("size")
+            or info.get("fingerprint") != previous.get("fingerprint")
+            or info.get("etag", previous.get("etag")) != previous.get("etag")
+        ):
+            changed[path] = info
+    for path in manifest.keys():
+        if path not in files:
+            changed[path] = None
+    return changed
@@ -1,6 +1,6 @@
 import pytest
 
-from . import Pull
+from . import Pull, changed_files
 
 
 def test_missing_type():
@@ -15,3 +15,24 @@ def test_unknown_type():
     with pytest.raises(ValueError) as excinfo:
         pull.do({"type": "foo"}, "path")
     assert "Unknown source type: foo" in str(excinfo.value)
+
+
+def test_changed_files():
+    manifest = {
+        "same.txt": dict(size=1, fingerprint="a", etag="1"),
+        "changed.txt": dict(size=1, fingerprint="b"),
+        "etag.txt": dict(size=1, fingerprint="c", etag="1"),
+        "removed.txt": dict(size=1, fingerprint="d"),
+    }
+    files = {
+        "same.txt": dict(size=1, fingerprint="a", etag="1"),
+        "changed.txt": dict(size=2, fingerprint="e"),
+        "etag.txt": dict(size=1, fingerprint="c", etag="2"),
+        "new.txt": dict(size=1, fingerprint="f"),
+    }
+    assert changed_files(files, manifest) == {
+        "changed.txt": files["changed.txt"],
+        "etag.txt": files["etag.txt"],
+        "new.txt": files["new.txt"],
+        "removed.txt": None,
+    }
@@ -1,4 +1,3 @@
-import io
 import os
 import re
 import shutil
@@ -7,6 +6,7 @@ from typing import List, Optional
 
 from lxml import etree
 
+from config import get_cache_root
 from util.files import Files, ensure_dir, file_info
 from util.http import HttpSession
 
@@ -29,15 +29,23 @@ def pull_elife(source: dict, path: Optional[str] = None, **kwargs) -> Files:
     ensure_dir(folder)
 
     files = {}
-    session = HttpSession()
+    session = HttpSession(cache_dir=os.path.join(get_cache_root(), "http"))
 
-    # Get the article JATS XML
-    response = session.fetch_url(f"https://elifesciences.org/articles/{article}.xml")
-    tree = etree.parse(io.BytesIO(response.content))
+    # Get the article JATS XML (revalidating any cached version in case
+    # there is a new version of the article)
+    if os.path.exists(path) and os.path.isdir(path):
+        shutil.rmtree(path)
+    session.pull(
+        f"https://elifesciences.org/articles/{article}.xml", path, revalidate=True
+    )
+    tree = etree.parse(path)
     root = tree.getroot()
     xlinkns = "http://www.w3.org/1999/xlink"
 
-    # Get the figures and rewrite hrefs
+    # Get the figures and rewrite hrefs. Images are cached by their
+    # URL (which is unique to the version of the article) and are pulled
+    # concurrently
+    pulls = []
     for graphic in root.iterdescendants(tag="graphic"):
         href = graphic.attrib.get("{%s}href" % xlinkns)
         if not href.startswith("elife"):
@@ -53,15 +61,15 @@ def pull_elife(source: dict, path: Optional[str] = None, **kwargs) -> Files:
         image_path = os.path.join(folder, new_href)
 
         os.makedirs(os.path.join(folder, f"{file}.media"), exist_ok=True)
-        session.pull(url, image_path)
+        pulls.append((url, image_path))
 
         graphic.attrib["{%s}href" % xlinkns] = new_href
         graphic.attrib["mime-subtype"] = "jpeg"
 
+    session.pull_all(pulls)
+    for url, image_path in pulls:
         files[image_path] = file_info(image_path)
 
-    if os.path.exists(path) and os.path.isdir(path):
-        shutil.rmtree(path)
     tree.write(open(path, "wb"))
     files[path] = file_info(path, mimetype="application/jats+xml")
 
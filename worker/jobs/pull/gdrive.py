@@ -1,20 +1,42 @@
 import os
 import shutil
+import threading
 import typing
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
-from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 
-from util.files import Files, file_info
-from util.gapis import gdrive_service
+from util.files import Files, file_unchanged, pulled_file_info
+from util.gapis import gdrive_service, google_http
+
+# Number of threads used to list folders, and download files, concurrently
+PULL_GDRIVE_THREADS = int(os.getenv("PULL_GDRIVE_THREADS", 4))
+
+# Number of times to retry a request (with exponential backoff) if it
+# fails because of rate limiting (or other retryable errors)
+PULL_GDRIVE_RETRIES = int(os.getenv("PULL_GDRIVE_RETRIES", 5))
+
+# Size of chunks when downloading files
+CHUNK_SIZE = 100 * 1024 * 1024
+
+# The fields of files to request (to avoid getting every field)
+FILE_FIELDS = "id, name, mimeType, md5Checksum, modifiedTime"
 
 
 def pull_gdrive(
-    source: dict, path: Optional[str] = None, secrets: dict = {}, **kwargs
+    source: dict,
+    path: Optional[str] = None,
+    secrets: dict = {},
+    manifest: Optional[Files] = None,
+    **kwargs,
 ) -> Files:
     """
     Pull a Google Drive folder
+
+    Files in the `manifest` of previously pulled files that have the
+    same MD5 checksum (or, if they do not have one, modification time)
+    on Google Drive, and are unchanged on disk, are not downloaded again.
     """
     assert source.get("kind") in (
         "file",
@@ -25,54 +47,142 @@ def pull_gdrive(
     kind = source["kind"]
     google_id = source["google_id"]
 
-    files_resource = gdrive_service(secrets).files()
+    drive = Drive(secrets)
     if kind == "file":
-        return pull_file(files_resource, google_id, path or "google-" + google_id)
+        path = path or "google-" + google_id
+        etag = None
+        if manifest is not None:
+            etag = file_etag(
+                drive.execute(drive.files.get(fileId=google_id, fields=FILE_FIELDS))
+            )
+        return pull_file(drive, google_id, path, etag, manifest)
     else:
-        return pull_folder(files_resource, google_id, path or "")
+        return pull_folder(drive, google_id, path or "", manifest)
+
+
+class Drive:
+    """
+    A Google Drive API client that can be shared between threads.
+
+    The service client is built once (which requires fetching its
+    discovery document) but, because `httplib2` is not thread safe,
+    requests are executed using a HTTP object for each thread.
+    """
 
+    def __init__(self, secrets: Dict):
+        self.files = gdrive_service(secrets).files()
+        self.secrets = secrets
+        self.local = threading.local()
+
+    def http(self):
+        """
+        Get the HTTP object for the current thread.
+        """
+        if not hasattr(self.local, "http"):
+            self.local.http = google_http(self.secrets)
+        return self.local.http
+
+    def execute(self, request) -> Dict:
+        """
+        Execute a request, retrying if rate limited.
+        """
+        return request.execute(http=self.http(), num_retries=PULL_GDRIVE_RETRIES)
+
+    def download(self, file_id: str, path: str):
+        """
+        Download a file, retrying chunks if rate limited.
+        """
+        request = self.files.get_media(fileId=file_id)
+        request.http = self.http()
+        with open(path, "wb") as file:
+            downloader = MediaIoBaseDownload(file, request, chunksize=CHUNK_SIZE)
+            done = False
+            while done is False:
+                status, done = downloader.next_chunk(num_retries=PULL_GDRIVE_RETRIES)
+
+
+def file_etag(file: Dict) -> Optional[str]:
+    """
+    Get an identifier for the version of a file on Google Drive.
+    """
+    return file.get("md5Checksum") or file.get("modifiedTime")
 
-def pull_file(files_resource, file_id: str, path: str) -> Files:
+
+def pull_file(
+    drive: Drive,
+    file_id: str,
+    path: str,
+    etag: Optional[str] = None,
+    manifest: Optional[Files] = None,
+) -> Files:
     """
     Pull a file from Google Drive.
+
+    If the file's `etag` is the same as in the `manifest`,
+    and it is unchanged on disk, then it is not downloaded.
     """
+    previous = manifest.get(path) if manifest else None
+    if etag and file_unchanged(path, previous, etag):
+        return {path: previous}
+
     if os.path.exists(path) and os.path.isdir(path):
         shutil.rmtree(path)
 
-    with open(path, "wb") as file:
-        request = files_resource.get_media(fileId=file_id)
-        downloader = MediaIoBaseDownload(file, request)
-        done = False
-        while done is False:
-            status, done = downloader.next_chunk()
+    drive.download(file_id, path)
 
-    return {path: file_info(path)}
+    return {path: pulled_file_info(path, previous, etag)}
 
 
-def pull_folder(files_resource, folder_id: str, path: str) -> Files:
+def pull_folder(
+    drive: Drive, folder_id: str, path: str, manifest: Optional[Files] = None
+) -> Files:
     """
     Pull a folder from Google Drive.
+
+    Folders are listed breadth first, with all the folders at each level
+    listed concurrently. Files are then downloaded concurrently.
     """
-    if path:
-        if os.path.exists(path):
-            if not os.path.isdir(path):
-                os.unlink(path)
-        else:
-            os.makedirs(path, exist_ok=True)
-
-    files = {}
-    for child in list_folder(files_resource, folder_id):
-        child_path = os.path.join(path, child["name"])
-        if child["mimeType"] == "application/vnd.google-apps.folder":
-            files.update(pull_folder(files_resource, child["id"], child_path))
-        else:
-            if child["mimeType"].startswith("application/vnd.google-apps."):
-                continue
-            files.update(pull_file(files_resource, child["id"], child_path))
+    downloads: Dict[str, Dict] = {}
+    with ThreadPoolExecutor(PULL_GDRIVE_THREADS) as executor:
+        folders = [(folder_id, path)]
+        while folders:
+            for _, folder_path in folders:
+                if folder_path:
+                    if os.path.exists(folder_path):
+                        if not os.path.isdir(folder_path):
+                            os.unlink(folder_path)
+                    else:
+                        os.makedirs(folder_path, exist_ok=True)
+
+            subfolders = []
+            for (_, folder_path), children in zip(
+                folders,
+                executor.map(lambda folder: list_folder(drive, folder[0]), folders),
+            ):
+                for child in children:
+                    child_path = os.path.join(folder_path, child["name"])
+                    if child["mimeType"] == "application/vnd.google-apps.folder":
+                        subfolders.append((child["id"], child_path))
+                    elif not child["mimeType"].startswith(
+                        "application/vnd.google-apps."
+                    ):
+                        # If there is more than one file with the same name, the last
+                        # one listed is pulled (as it would overwrite the others)
+                        downloads[child_path] = child
+            folders = subfolders
+
+        files = {}
+        for pulled in executor.map(
+            lambda item: pull_file(
+                drive, item[1]["id"], item[0], file_etag(item[1]), manifest
+            ),
+            downloads.items(),
+        ):
+            files.update(pulled)
     return files
 
 
-def list_folder(files_resource, folder_id: str):
+def list_folder(drive: Drive, folder_id: str) -> List[Dict]:
     """
     List the files or sub-folders within a Google Drive folder.
     """
@@ -81,7 +191,13 @@ def list_folder(files_resource, folder_id: str):
     query = "'{}' in parents".format(folder_id)
 
     while True:
-        resp = files_resource.list(q=query, pageToken=next_page_token).execute()
+        resp = drive.execute(
+            drive.files.list(
+                q=query,
+                pageToken=next_page_token,
+                fields="nextPageToken, files({})".format(FILE_FIELDS),
+            )
+        )
         files += list(resp["files"])
         next_page_token = resp.get("nextPageToken")
 
@@ -2,7 +2,9 @@ import os
 
 import pytest
 
-from .gdrive import pull_gdrive
+from util.working_directory import working_directory
+
+from .gdrive import pull_folder, pull_gdrive
 
 # The following access token is expired, but was valid when this test
 # was recorded. To re-record this test, get a new google token, and
@@ -29,3 +31,56 @@ def test_folder(tempdir):
         "sub/test-2.txt",
     ):
         assert os.path.exists(os.path.join(tempdir.path, expected))
+
+
+class MockedDrive:
+    """
+    Mimics a `Drive` with a tree of folders and files.
+
+    Counts the number of files downloaded.
+    """
+
+    def __init__(self, folders):
+        self.files = self
+        self.folders = folders
+        self.downloaded = []
+
+    def list(self, q, pageToken, fields):
+        return self.folders[q.split("'")[1]]
+
+    def execute(self, request):
+        return dict(files=request)
+
+    def download(self, file_id, path):
+        self.downloaded.append(file_id)
+        with open(path, "w") as file:
+            file.write(file_id)
+
+
+def test_folder_manifest(tempdir):
+    """Files with the same checksum as in the manifest are not downloaded again."""
+    folder = "application/vnd.google-apps.folder"
+    drive = MockedDrive(
+        {
+            "root": [
+                dict(id="a", name="a.txt", mimeType="text/plain", md5Checksum="1"),
+                dict(id="sub", name="sub", mimeType=folder),
+                dict(id="doc", name="doc", mimeType="application/vnd.google-apps.doc"),
+            ],
+            "sub": [
+                dict(id="b", name="b.txt", mimeType="text/plain", md5Checksum="2"),
+                dict(id="c", name="c.txt", mimeType="text/plain", modifiedTime="3"),
+            ],
+        }
+    )
+    with working_directory(tempdir.path):
+        manifest = pull_folder(drive, "root", "")
+        assert sorted(manifest.keys()) == ["a.txt", "sub/b.txt", "sub/c.txt"]
+        assert manifest["sub/c.txt"]["etag"] == "3"
+        assert sorted(drive.downloaded) == ["a", "b", "c"]
+
+        drive.folders["sub"][0]["md5Checksum"] = "4"
+        files = pull_folder(drive, "root", "", manifest)
+        assert files["a.txt"] is manifest["a.txt"]
+        assert files["sub/b.txt"]["etag"] == "4"
+        assert sorted(drive.downloaded) == ["a", "b", "b", "c"]
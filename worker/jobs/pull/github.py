@@ -1,31 +1,58 @@
+import base64
+import hashlib
 import os
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import List, Optional
 from zipfile import ZipFile, ZipInfo
 
 import httpx
+from github import Github, RateLimitExceededException
 
+from config import get_cache_root
+from util.file_cache import FileCache
 from util.files import (
     Files,
     bytes_fingerprint,
+    copy_fingerprint,
     ensure_parent,
     file_fingerprint,
     file_info,
     file_mimetype,
+    file_unchanged,
+    pulled_file_info,
 )
 from util.github_api import github_client
 
 
+# Number of threads used to extract files from Zip archives
+PULL_ZIP_THREADS = int(os.getenv("PULL_ZIP_THREADS", min(8, os.cpu_count() or 1)))
+
+# Maximum number of blobs to fetch when pulling a subpath of a repo
+# using the Git trees API (more than this and the zipball is used instead;
+# use 0 to always use the zipball)
+PULL_GITHUB_TREE_MAX_BLOBS = int(os.getenv("PULL_GITHUB_TREE_MAX_BLOBS", 200))
+
+# Number of threads used to fetch blobs
+PULL_GITHUB_BLOB_THREADS = int(os.getenv("PULL_GITHUB_BLOB_THREADS", 8))
+
+
 def pull_github(
-    source: dict, path: Optional[str] = None, secrets: dict = {}, **kwargs
+    source: dict,
+    path: Optional[str] = None,
+    secrets: dict = {},
+    manifest: Optional[Files] = None,
+    **kwargs,
 ) -> Files:
     """
     Pull a GitHub repo/subpath.
 
     If a user token is provided in `secrets` it will be used to authenticate
-    as that user.
+    as that user. Files in the `manifest` of previously pulled files that
+    are unchanged are not extracted again.
     """
     assert source.get("repo"), "GitHub source must have a repo"
 
@@ -35,9 +62,22 @@ def pull_github(
 
     path = path or "."
 
+    client = github_client(secrets.get("token"))
+
+    # If only a subpath is being pulled, try to avoid downloading
+    # the entire repo by only fetching the blobs within it
+    if subpath and PULL_GITHUB_TREE_MAX_BLOBS > 0:
+        try:
+            files = pull_tree(
+                client, source["repo"], subpath, path, secrets.get("token"), manifest
+            )
+        except RateLimitExceededException:
+            files = None
+        if files is not None:
+            return files
+
     # Get the possibly token protected link for the repo archive
     # See https://developer.github.com/v3/repos/contents/#download-a-repository-archive
-    client = github_client(secrets.get("token"))
     repo_resource = client.get_repo(source["repo"])
     archive_link = repo_resource.get_archive_link("zipball")
 
@@ -49,22 +89,148 @@ def pull_github(
             zip_file.write(data)
     zip_file.close()
 
-    return pull_zip(zip_file.name, subpath=subpath, path=path)
+    return pull_zip(zip_file.name, subpath=subpath, path=path, manifest=manifest)
+
+
+def pull_tree(
+    client: Github,
+    repo: str,
+    subpath: str,
+    path: str,
+    token: Optional[str] = None,
+    manifest: Optional[Files] = None,
+) -> Optional[Files]:
+    """
+    Pull files within a subpath of a GitHub repo using the Git trees and blobs API.
+
+    Lists the repo's tree and fetches the blobs within the `subpath`, using a
+    pool of threads. Blobs are cached in the worker's local cache (which has a
+    size budget, see `util.file_cache`), by their SHA, so that they do not need
+    to be fetched again for subsequent pulls (e.g. of another source with an
+    overlapping subpath, or of a changed file back to a previous version). Files
+    in the `manifest` with the same blob SHA, and that are unchanged on disk, are
+    not written again.
+
+    Returns `None` if the zipball should be used instead i.e. if the tree is
+    too large to be listed in one request, if there are more than
+    `PULL_GITHUB_TREE_MAX_BLOBS` blobs to fetch, or there are not enough
+    requests remaining in the client's rate limit to fetch them.
+    """
+    tree = client.get_repo(repo, lazy=True).get_git_tree("HEAD", recursive=True)
+    if tree.raw_data.get("truncated"):
+        return None
+
+    files: Files = {}
+    fetches = []
+    for element in tree.tree:
+        if element.type != "blob":
+            continue
+
+        remainder_path = subpath_remainder(element.path, subpath)
+        if not remainder_path:
+            continue
+
+        dest_path = os.path.join(path, remainder_path)
+        previous = manifest.get(remainder_path) if manifest else None
+        etag = "git-{}".format(element.sha)
+        if file_unchanged(dest_path, previous, etag):
+            files[remainder_path] = previous
+            continue
+
+        # Placeholder to retain the order of files
+        files[remainder_path] = {}
+        fetches.append((element.sha, remainder_path, dest_path, previous, etag))
+
+    cache = FileCache(os.path.join(get_cache_root(), "github-blobs"))
+    shas = list(dict.fromkeys(fetch[0] for fetch in fetches))
+    cached = cache.get_many(shas)
+    uncached = [sha for sha in shas if sha not in cached]
+    if uncached:
+        remaining = client.rate_limiting[0]
+        if len(uncached) > min(PULL_GITHUB_TREE_MAX_BLOBS, remaining):
+            return None
+
+    # Each thread uses its own client since they are not thread safe
+    local = threading.local()
+
+    def fetch(sha: str):
+        if not hasattr(local, "repo"):
+            local.repo = github_client(token).get_repo(repo, lazy=True)
+        blob = local.repo.get_git_blob(sha)
+        cache_blob(cache, sha, base64.b64decode(blob.content))
+
+    threads = min(PULL_GITHUB_BLOB_THREADS, len(uncached))
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(fetch, uncached))
+    else:
+        list(map(fetch, uncached))
+
+    for sha, remainder_path, dest_path, previous, etag in fetches:
+        ensure_parent(dest_path)
+        with open(cache.path(sha), "rb") as source:
+            fingerprint = copy_fingerprint(source, dest_path)
+        files[remainder_path] = pulled_file_info(dest_path, previous, etag, fingerprint)
+
+    return files
+
+
+def cache_blob(cache: FileCache, sha: str, content: bytes):
+    """
+    Add a Git blob to the cache.
+
+    Checks that the content matches the SHA before adding it.
+    """
+    digest = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+    if digest != sha:
+        raise RuntimeError("Content of blob {} has SHA {}".format(sha, digest))
+
+    cache.add(sha, lambda file: file.write(content))
+
+
+def subpath_remainder(inner_path: str, subpath: str) -> Optional[str]:
+    """
+    Get the path of a file relative to a subpath of a repo.
+
+    Returns `None` if the file is not within the subpath.
+    """
+    if subpath == "":
+        return inner_path
+    elif inner_path.startswith(subpath + "/"):
+        return inner_path[len(subpath) + 1 :]
+    elif inner_path == subpath:
+        return inner_path
+    return None
 
 
 def pull_zip(
-    zip_file: str, subpath: str = "", path: str = ".", strip: int = 1
+    zip_file: str,
+    subpath: str = "",
+    path: str = ".",
+    strip: int = 1,
+    manifest: Optional[Files] = None,
+    threads: Optional[int] = None,
 ) -> Files:
     """
     Pull files from a Zip file.
 
+    Files are extracted concurrently, using a pool of threads (decompression
+    and hashing release the GIL), with each file's fingerprint generated
+    as it is written rather than by reading it back from disk.
+
     :param zip_file: The path to the zip file.
     :param subpath: The file or directory in the zip file to extract.
     :param path: The destination path
     :param strip: Number of leading components from filenames to ignore.
                   Similar to `tar`'s `--strip-components` option.
+    :param manifest: Info on previously pulled files. Files with the same
+                     CRC-32 checksum and size in the Zip file, and that are
+                     unchanged on disk, are not extracted.
+    :param threads: The number of threads to extract files with.
+                    Defaults to `PULL_ZIP_THREADS`.
     """
-    files = {}
+    files: Files = {}
+    extracts = []
 
     with ZipFile(zip_file, "r") as zip_archive:
         for zip_info in zip_archive.infolist():
@@ -75,29 +241,48 @@ def pull_zip(
                 continue
 
             # Remove the first element of the path (the repo name + hash)
-            inner_path = os.path.join(*(zip_path.split("/")[strip:]))
+            # and skip any paths that would be outside of the destination
+            parts = zip_path.split("/")[strip:]
+            if not parts or ".." in parts:
+                continue
+            inner_path = os.path.join(*parts)
 
             # Save if in the subpath
-            remainder_path = None
-            if subpath == "":
-                remainder_path = inner_path
-            elif inner_path.startswith(subpath + "/"):
-                chars = len(subpath) + 1
-                remainder_path = inner_path[chars:]
-            elif inner_path == subpath:
-                remainder_path = inner_path
-
+            remainder_path = subpath_remainder(inner_path, subpath)
             if remainder_path:
                 dest_path = os.path.join(path, remainder_path)
 
-                # Using `extract` is much much faster than reading bytes
-                # and then writing them to file. Also it maintains other file info
-                # such as modified time in the file written to disk. This speed up
-                # is much more important for real world zips than any speed advantage
-                # due to not reading bytes twice for fingerprint generation.
-                zip_info.filename = dest_path
-                zip_archive.extract(zip_info)
+                previous = manifest.get(remainder_path) if manifest else None
+                etag = "crc32-{:08x}-{}".format(zip_info.CRC, zip_info.file_size)
+                if file_unchanged(dest_path, previous, etag):
+                    files[remainder_path] = previous
+                    continue
+
+                # Placeholder to retain the order of files
+                files[remainder_path] = {}
+                extracts.append((zip_info, remainder_path, dest_path, previous, etag))
+
+    # Each thread uses its own `ZipFile` instance since they are not thread safe
+    def extract(batch) -> Files:
+        extracted = {}
+        with ZipFile(zip_file, "r") as zip_archive:
+            for zip_info, remainder_path, dest_path, previous, etag in batch:
+                ensure_parent(dest_path)
+                with zip_archive.open(zip_info) as source:
+                    fingerprint = copy_fingerprint(source, dest_path)
+                extracted[remainder_path] = pulled_file_info(
+                    dest_path, previous, etag, fingerprint
+                )
+        return extracted
 
-                files[remainder_path] = file_info(dest_path)
+    threads = min(threads or PULL_ZIP_THREADS, len(extracts))
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            for extracted in executor.map(
+                extract, [extracts[index::threads] for index in range(threads)]
+            ):
+                files.update(extracted)
+    elif extracts:
+        files.update(extract(extracts))
 
     return files
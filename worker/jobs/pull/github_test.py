@@ -1,12 +1,16 @@
+import base64
+import hashlib
 import os
 from contextlib import ContextDecorator
+from types import SimpleNamespace
 from unittest import mock
 
 import pytest
 
+from util.files import copy_fingerprint, file_fingerprint
 from util.working_directory import working_directory
 
-from .github import pull_github, pull_zip
+from .github import pull_github, pull_tree, pull_zip
 
 
 class MockedHttpxStreamResponse(ContextDecorator):
@@ -41,6 +45,7 @@ class MockedHttpxStreamResponse(ContextDecorator):
 
 @pytest.mark.vcr
 @mock.patch("httpx.stream", MockedHttpxStreamResponse)
+@mock.patch("jobs.pull.github.PULL_GITHUB_TREE_MAX_BLOBS", 0)
 def test_public_repo(tempdir):
     with working_directory(tempdir.path):
         files = pull_github(source=dict(repo="stencila/test", subpath="sub"))
@@ -73,6 +78,7 @@ def test_subdirectory(tempdir):
 
 @pytest.mark.vcr
 @mock.patch("httpx.stream", MockedHttpxStreamResponse)
+@mock.patch("jobs.pull.github.PULL_GITHUB_TREE_MAX_BLOBS", 0)
 def test_single_file(tempdir):
     with working_directory(tempdir.path):
         pull_github(
@@ -85,6 +91,94 @@ def test_single_file(tempdir):
     assert os.path.exists(os.path.join(tempdir.path, "sub_README.md"))
 
 
+class MockedGithubClient:
+    """
+    Mimics a GitHub client for a repo with a tree of blobs.
+
+    Counts the number of blobs fetched.
+    """
+
+    def __init__(self, blobs, truncated=False):
+        self.blobs = dict(
+            (hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest(), content)
+            for content in blobs.values()
+        )
+        self.tree = SimpleNamespace(
+            raw_data=dict(truncated=truncated),
+            tree=[SimpleNamespace(type="tree", path="docs", sha="-")]
+            + [
+                SimpleNamespace(
+                    type="blob",
+                    path=path,
+                    sha=hashlib.sha1(
+                        b"blob %d\0" % len(content) + content
+                    ).hexdigest(),
+                )
+                for path, content in blobs.items()
+            ],
+        )
+        self.fetched = []
+        self.rate_limiting = (5000, 5000)
+
+    def get_repo(self, name, lazy=False):
+        return self
+
+    def get_git_tree(self, sha, recursive=False):
+        return self.tree
+
+    def get_git_blob(self, sha):
+        self.fetched.append(sha)
+        return SimpleNamespace(content=base64.b64encode(self.blobs[sha]))
+
+
+def test_tree(tempdir):
+    """Subpaths are pulled using blobs from the tree, which are cached."""
+    client = MockedGithubClient(
+        {
+            "README.md": b"Readme",
+            "docs/a.md": b"A",
+            "docs/b/c.md": b"C",
+            "docs/b/d.md": b"A",
+        }
+    )
+    source = dict(repo="org/repo", subpath="docs")
+    with mock.patch.dict(
+        os.environ, CACHE_ROOT=os.path.join(tempdir.path, "cache")
+    ), mock.patch(
+        "jobs.pull.github.github_client", return_value=client
+    ), working_directory(
+        tempdir.path
+    ):
+        files = pull_github(source, path="one")
+        assert list(files.keys()) == ["a.md", "b/c.md", "b/d.md"]
+        sha = client.tree.tree[2].sha
+        assert files["a.md"]["etag"] == "git-" + sha
+        assert len(client.fetched) == 2
+        with open(os.path.join("one", "b", "c.md")) as file:
+            assert file.read() == "C"
+
+        # Pulling to another path uses the cached blobs
+        files = pull_github(source, path="two")
+        assert len(files) == 3
+        assert len(client.fetched) == 2
+
+        # Unchanged files in the manifest are not written again
+        with mock.patch(
+            "jobs.pull.github.copy_fingerprint", wraps=copy_fingerprint
+        ) as copy:
+            assert pull_github(source, path="two", manifest=files) == files
+        assert copy.call_count == 0
+
+        # Cached blobs do not count towards the maximum number to fetch, but
+        # if there are not enough API requests remaining the zipball is used
+        with mock.patch("jobs.pull.github.PULL_GITHUB_TREE_MAX_BLOBS", 2):
+            assert pull_tree(client, "org/repo", "docs", "three") is not None
+            assert pull_tree(client, "org/repo", "", "three") is not None
+            os.remove(os.path.join("cache", "github-blobs", sha[:2], sha))
+            client.rate_limiting = (0, 5000)
+            assert pull_tree(client, "org/repo", "", "three") is None
+
+
 def test_large_zip(tempdir):
     with working_directory(tempdir.path):
         zip_file = os.path.join(
@@ -98,12 +192,53 @@ def test_large_zip(tempdir):
     del info["modified"]
     assert info == {
         "encoding": None,
+        "etag": "crc32-9558f941-6",
         "fingerprint": "7f8cafc8690f2707d1b7e8a40a59d8299e1af8f862576ba896acaca287fd4006",
         "mimetype": "text/plain",
         "size": 6,
     }
 
 
+def test_zip_manifest(tempdir):
+    """Files that are unchanged since the previous pull are not extracted."""
+    zip_file = os.path.join(os.path.dirname(__file__), "fixtures", "1000-maniacs.zip")
+    with working_directory(tempdir.path):
+        manifest = pull_zip(zip_file, strip=0)
+
+        # Change a file on disk and remove one from the manifest
+        with open("2.txt", "w") as file:
+            file.write("changed")
+        del manifest["3.txt"]
+
+        with mock.patch(
+            "jobs.pull.github.copy_fingerprint", wraps=copy_fingerprint
+        ) as extract:
+            files = pull_zip(zip_file, strip=0, manifest=manifest)
+        assert sorted(call[0][1] for call in extract.call_args_list) == [
+            "./2.txt",
+            "./3.txt",
+        ]
+        assert files["1.txt"] is manifest["1.txt"]
+        assert files["2.txt"]["size"] == 6
+
+
+def test_zip_threads(tempdir):
+    """Extracting with multiple threads gives the same result as with one."""
+    zip_file = os.path.join(os.path.dirname(__file__), "fixtures", "1000-maniacs.zip")
+    with working_directory(tempdir.path):
+        single = pull_zip(zip_file, strip=0, path="single", threads=1)
+        multi = pull_zip(zip_file, strip=0, path="multi", threads=4)
+
+    assert list(single.keys()) == list(multi.keys())
+    for path, info in single.items():
+        del info["modified"]
+        del multi[path]["modified"]
+        assert info == multi[path]
+        assert info["fingerprint"] == file_fingerprint(
+            os.path.join(tempdir.path, "multi", path)
+        )
+
+
 def test_huge_zip(tempdir):
     """
     A performance test using a huge repository archive.
@@ -5,22 +5,52 @@ from typing import Optional
 
 import httpx
 
-from util.files import Files, ensure_parent, file_ext, file_info, remove_if_dir
+from util.files import (
+    Files,
+    ensure_parent,
+    file_ext,
+    file_unchanged,
+    pulled_file_info,
+    remove_if_dir,
+)
 
 GIGABYTE = 1073741824.0
 MAX_SIZE = 1  # Maximum file size in Gigabytes
 
 
 def pull_http(
-    source: dict, path: Optional[str] = None, secrets: dict = {}, **kwargs
+    source: dict,
+    path: Optional[str] = None,
+    secrets: dict = {},
+    manifest: Optional[Files] = None,
+    **kwargs,
 ) -> Files:
     """
     Pull a file from a HTTP source.
+
+    If the file was previously pulled (i.e. is in the `manifest`) then a
+    conditional request is made, using its `ETag` or `Last-Modified` header.
+    If the server responds that it is not modified, and the file is
+    unchanged on disk, then it is not fetched again.
     """
     url = source.get("url")
     assert url, "Source must have a URL"
 
-    with httpx.stream("GET", url) as response:
+    previous_path, previous = (
+        list(manifest.items())[0] if manifest and len(manifest) == 1 else (None, None)
+    )
+    etag = previous.get("etag") if previous else None
+    headers = {}
+    if etag:
+        strong_or_weak = etag.startswith('"') or etag.startswith("W/")
+        headers["If-None-Match" if strong_or_weak else "If-Modified-Since"] = etag
+
+    with httpx.stream("GET", url, headers=headers) as response:
+        if response.status_code == 304:
+            if previous_path and file_unchanged(previous_path, previous):
+                return {previous_path: previous}
+            return pull_http(source, path, secrets)
+
         if response.status_code != 200:
             raise RuntimeError(f"Error when fetching {url}: {response.status_code}")
 
@@ -43,6 +73,7 @@ def pull_http(
             for data in response.iter_bytes():
                 file.write(data)
 
-        return {path: file_info(path)}
+        etag = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        return {path: pulled_file_info(path, previous, etag)}
 
     return {}
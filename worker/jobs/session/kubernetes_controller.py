@@ -0,0 +1,278 @@
+"""
+A controller for the session pods launched by a worker.
+
+Rather than each session job polling the Kubernetes API for the state of
+its pod (and occupying a worker slot while doing so), the controller, running
+in the worker's main process, uses a single watch of all the session pods
+launched by the worker's jobs and updates the jobs accordingly:
+
+- when a pod is ready, its job is updated with the URLs of the session (`RUNNING`)
+- when a pod stops running, or is deleted, the pod is deleted and the result
+  of its job is stored before it is updated as having succeeded (`SUCCESS`)
+- when a job is cancelled (i.e. revoked by the `manager`), its pod is terminated
+
+Session jobs release their worker slot as soon as their pod has been
+created (see `KubernetesSession.release`).
+
+When a worker is replaced (e.g. during a deployment) the session pods that it
+launched would be orphaned. So, each controller periodically adopts the pods of
+workers that are no longer alive by relabelling them with its own worker's
+hostname (after which they are included in its watch).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Set
+
+import kubernetes
+from celery import states
+from celery.worker import state as worker_state
+
+from .kubernetes_session import api_instance, label_value, namespace, pod_ready
+
+logger = logging.getLogger(__name__)
+
+# Number of seconds between checks for cancelled jobs
+SESSION_CONTROLLER_INTERVAL = float(os.getenv("SESSION_CONTROLLER_INTERVAL", 1))
+
+# Number of seconds between checks for the pods of workers that are no longer alive
+SESSION_CONTROLLER_ADOPT_INTERVAL = float(
+    os.getenv("SESSION_CONTROLLER_ADOPT_INTERVAL", 60)
+)
+
+# Number of seconds to wait for replies when pinging workers
+SESSION_CONTROLLER_PING_TIMEOUT = 5
+
+# Number of seconds after which the watch is restarted (so that the
+# controller can be stopped)
+SESSION_CONTROLLER_WATCH_TIMEOUT = 60
+
+# Number of seconds to wait before re-establishing the watch after an error
+SESSION_CONTROLLER_RETRY_WAIT = 1
+
+
+class SessionController:
+    """
+    Watches the session pods launched by a worker and updates their jobs.
+    """
+
+    def __init__(self, app, hostname: str):
+        self.app = app
+        self.hostname = hostname
+        self.label = label_value(hostname)
+        # The jobs of session pods, and the pods that are ready,
+        # or have ended (and been reported as such)
+        self.jobs: Dict[str, str] = {}
+        self.ready: Set[str] = set()
+        self.ended: Set[str] = set()
+        self.stopped = threading.Event()
+
+    def start(self):
+        """
+        Start watching pods, and checking for cancelled jobs and
+        orphaned pods, in background threads.
+        """
+        for target in (self.watch, self.check_revoked, self.check_orphaned):
+            threading.Thread(target=target, daemon=True).start()
+
+    def stop(self):
+        """
+        Stop the controller.
+        """
+        self.stopped.set()
+
+    def watch(self):
+        """
+        Watch the session pods launched by the worker.
+
+        The watch is resumed from the last resource version seen, so
+        that events are not missed, unless it is too old. After any other
+        error (e.g. a dropped connection, or an error sending an event) the
+        watch is re-established, after a short wait, from a new listing of
+        the pods so that events that were not handled are retried.
+        """
+        watch = kubernetes.watch.Watch()
+        while not self.stopped.is_set():
+            try:
+                for event in watch.stream(
+                    api_instance.list_namespaced_pod,
+                    namespace=namespace,
+                    label_selector="method=session,worker={}".format(self.label),
+                    timeout_seconds=SESSION_CONTROLLER_WATCH_TIMEOUT,
+                    **(
+                        {"resource_version": watch.resource_version}
+                        if watch.resource_version
+                        else {}
+                    ),
+                ):
+                    self.handle(event["type"], event["object"])
+            except kubernetes.client.rest.ApiException as exc:
+                if exc.status == 410:
+                    watch = kubernetes.watch.Watch()
+                else:
+                    logger.exception(exc)
+                    self.stopped.wait(SESSION_CONTROLLER_RETRY_WAIT)
+            except Exception as exc:
+                logger.exception(exc)
+                self.stopped.wait(SESSION_CONTROLLER_RETRY_WAIT)
+                watch = kubernetes.watch.Watch()
+
+    def handle(self, type: str, pod):
+        """
+        Handle an event for a pod.
+
+        The state of a pod is only recorded after its job has been updated
+        so that, if that fails, the update is retried when the pod is next seen.
+        """
+        name = pod.metadata.name
+        job = (pod.metadata.labels or {}).get("job")
+        if not job:
+            return
+
+        if type == "DELETED":
+            self.jobs.pop(name, None)
+            self.ready.discard(name)
+            if name in self.ended:
+                self.ended.discard(name)
+            elif pod.metadata.labels.get("worker") != self.label:
+                # The pod no longer matches the watch because it has
+                # been adopted by another worker's controller
+                pass
+            else:
+                self.succeed(job)
+            return
+
+        if name in self.ended:
+            return
+        self.jobs[name] = job
+
+        if pod.status.phase not in ("Pending", "Running"):
+            # Clean up the pod otherwise finished pods just end up
+            # polluting the namespace
+            self.succeed(job)
+            self.ended.add(name)
+            self.delete(name)
+        elif name not in self.ready and pod_ready(pod):
+            annotations = pod.metadata.annotations or {}
+            ports = json.loads(annotations.get("stencila.io/ports", "{}"))
+            ip = pod.status.pod_ip
+            self.send(
+                job,
+                "RUNNING",
+                urls=dict(
+                    (protocol, f"{protocol}://{ip}:{port}")
+                    for protocol, port in ports.items()
+                ),
+                session_pool=annotations.get("stencila.io/pool"),
+                session_ready_seconds=time.time()
+                - float(annotations.get("stencila.io/launched", time.time())),
+            )
+            self.ready.add(name)
+
+    def check_revoked(self):
+        """
+        Periodically terminate the pods of jobs that have been cancelled.
+        """
+        while not self.stopped.wait(SESSION_CONTROLLER_INTERVAL):
+            try:
+                self.terminate_revoked()
+            except Exception as exc:
+                logger.exception(exc)
+
+    def terminate_revoked(self):
+        """
+        Terminate the pods of jobs that have been cancelled.
+
+        When a job is cancelled, the `manager` revokes it and the revocation
+        is broadcast to all workers (and recorded in their state) even though
+        the session job itself has already released its worker slot.
+        """
+        for name, job in list(self.jobs.items()):
+            if job in worker_state.revoked and name not in self.ended:
+                logger.info("Terminating pod {}".format(name))
+                self.ended.add(name)
+                self.delete(name)
+
+    def check_orphaned(self):
+        """
+        Periodically adopt the pods of workers that are no longer alive.
+        """
+        while not self.stopped.wait(SESSION_CONTROLLER_ADOPT_INTERVAL):
+            try:
+                self.adopt_orphaned()
+            except Exception as exc:
+                logger.exception(exc)
+
+    def adopt_orphaned(self):
+        """
+        Adopt the session pods of workers that are no longer alive.
+
+        Workers are alive if they reply to a ping. The patch of a pod's labels
+        includes its resource version so that, if several controllers try to adopt
+        the same pod, only one succeeds (the others get a 409 Conflict).
+        """
+        pods = api_instance.list_namespaced_pod(
+            namespace=namespace,
+            label_selector="method=session,job,worker,worker!={}".format(self.label),
+        ).items
+        if not pods:
+            return
+
+        alive = {self.label}
+        for reply in self.app.control.ping(timeout=SESSION_CONTROLLER_PING_TIMEOUT):
+            alive.update(label_value(hostname) for hostname in reply.keys())
+
+        for pod in pods:
+            worker = pod.metadata.labels.get("worker")
+            if worker in alive:
+                continue
+            logger.info(
+                "Adopting pod {} of worker {}".format(pod.metadata.name, worker)
+            )
+            try:
+                api_instance.patch_namespaced_pod(
+                    name=pod.metadata.name,
+                    namespace=namespace,
+                    body={
+                        "metadata": {
+                            "labels": {"worker": self.label},
+                            "resourceVersion": pod.metadata.resource_version,
+                        }
+                    },
+                )
+            except kubernetes.client.rest.ApiException as exc:
+                if exc.status not in (404, 409):
+                    logger.exception(exc)
+
+    def delete(self, name: str):
+        """
+        Delete a pod.
+        """
+        try:
+            api_instance.delete_namespaced_pod(name=name, namespace=namespace)
+        except kubernetes.client.rest.ApiException as exc:
+            if exc.status != 404:
+                logger.exception(exc)
+
+    def succeed(self, job: str):
+        """
+        Store the result of a job, now that its pod has ended, and update it
+        as having succeeded.
+
+        The job's log has already been sent to the `manager` (as the job
+        flushes it before releasing its worker slot), so it is not included.
+        """
+        self.app.backend.store_result(job, dict(result=None), states.SUCCESS)
+        self.send(job, "SUCCESS")
+
+    def send(self, job: str, state: str, **kwargs):
+        """
+        Send a `task-updated` event for a job (as `Job.notify` does).
+        """
+        with self.app.events.default_dispatcher(hostname=self.hostname) as dispatcher:
+            dispatcher.send(
+                "task-updated", uuid=job, task_id=job, state=state, **kwargs,
+            )
@@ -0,0 +1,199 @@
+import json
+import time
+from unittest import mock
+
+import kubernetes
+import urllib3
+
+from . import kubernetes_controller
+from .kubernetes_controller import SessionController
+
+
+def make_pod(
+    name="session-1",
+    job="job-1",
+    phase="Running",
+    ready=False,
+    worker="celery-worker-1",
+):
+    """Make a mock of a watched session pod."""
+    pod = mock.Mock(
+        metadata=mock.Mock(
+            labels={"method": "session", "job": job, "worker": worker},
+            resource_version="42",
+            annotations={
+                "stencila.io/ports": json.dumps({"ws": 10001}),
+                "stencila.io/launched": str(time.time() - 2),
+                "stencila.io/pool": "hit",
+            },
+        ),
+        status=mock.Mock(phase=phase, pod_ip="10.0.0.1"),
+    )
+    status = mock.Mock(ready=ready)
+    status.name = "session"
+    pod.status.container_statuses = [status]
+    # `Mock` uses the `name` argument itself so set it afterwards
+    pod.metadata.name = name
+    return pod
+
+
+def make_controller():
+    """Make a controller that records the events that it sends."""
+    controller = SessionController(mock.MagicMock(), "celery@worker-1")
+    controller.sent = []
+    controller.send = lambda job, state, **kwargs: controller.sent.append(
+        (job, state, kwargs)
+    )
+    return controller
+
+
+@mock.patch.object(kubernetes_controller, "api_instance")
+def test_lifecycle(api):
+    """
+    Test that jobs are updated when their pods are ready, and finish,
+    and that finished pods are deleted.
+    """
+    controller = make_controller()
+
+    controller.handle("ADDED", make_pod(phase="Pending"))
+    assert controller.sent == []
+
+    controller.handle("MODIFIED", make_pod(ready=True))
+    controller.handle("MODIFIED", make_pod(ready=True))
+    assert len(controller.sent) == 1
+    job, state, kwargs = controller.sent[0]
+    assert (job, state) == ("job-1", "RUNNING")
+    assert kwargs["urls"] == {"ws": "ws://10.0.0.1:10001"}
+    assert kwargs["session_pool"] == "hit"
+    assert kwargs["session_ready_seconds"] >= 2
+
+    # The result is only stored once the pod ends
+    controller.app.backend.store_result.assert_not_called()
+    controller.handle("MODIFIED", make_pod(phase="Succeeded"))
+    assert controller.sent[1][:2] == ("job-1", "SUCCESS")
+    controller.app.backend.store_result.assert_called_once_with(
+        "job-1", dict(result=None), "SUCCESS"
+    )
+    api.delete_namespaced_pod.assert_called_once_with(
+        name="session-1", namespace="jobs"
+    )
+
+    # The deletion of the pod is not reported again
+    controller.handle("DELETED", make_pod(phase="Succeeded"))
+    assert len(controller.sent) == 2
+    assert controller.jobs == {}
+
+    # But the deletion of a pod by something else is
+    controller.handle("ADDED", make_pod(name="session-2", job="job-2", ready=True))
+    controller.handle("DELETED", make_pod(name="session-2", job="job-2"))
+    assert controller.sent[3][:2] == ("job-2", "SUCCESS")
+
+    # Unless the pod was adopted by another worker
+    controller.handle("ADDED", make_pod(name="session-3", job="job-3", ready=True))
+    controller.handle(
+        "DELETED", make_pod(name="session-3", job="job-3", worker="celery-worker-2")
+    )
+    assert len(controller.sent) == 5
+    assert controller.jobs == {}
+
+
+@mock.patch.object(kubernetes_controller, "api_instance")
+def test_revoked(api):
+    """
+    Test that the pods of cancelled jobs are terminated.
+    """
+    controller = make_controller()
+    controller.handle("ADDED", make_pod(name="session-1", job="job-1", ready=True))
+    controller.handle("ADDED", make_pod(name="session-2", job="job-2", ready=True))
+
+    with mock.patch.object(kubernetes_controller.worker_state, "revoked", {"job-2"}):
+        controller.terminate_revoked()
+        controller.terminate_revoked()
+    api.delete_namespaced_pod.assert_called_once_with(
+        name="session-2", namespace="jobs"
+    )
+
+    # The job has already been cancelled so the deletion is not reported
+    controller.handle("DELETED", make_pod(name="session-2", job="job-2"))
+    assert [state for job, state, kwargs in controller.sent] == ["RUNNING", "RUNNING"]
+
+
+@mock.patch.object(kubernetes_controller, "api_instance")
+def test_adopt_orphaned(api):
+    """
+    Test that the pods of workers that are no longer alive are adopted.
+    """
+    controller = make_controller()
+    controller.app.control.ping.return_value = [
+        {"celery@worker-1": {"ok": "pong"}},
+        {"celery@worker-2": {"ok": "pong"}},
+    ]
+    api.list_namespaced_pod.return_value.items = [
+        make_pod(name="session-2", job="job-2", worker="celery-worker-2"),
+        make_pod(name="session-3", job="job-3", worker="celery-worker-3"),
+    ]
+
+    controller.adopt_orphaned()
+    api.list_namespaced_pod.assert_called_once_with(
+        namespace="jobs",
+        label_selector="method=session,job,worker,worker!=celery-worker-1",
+    )
+    api.patch_namespaced_pod.assert_called_once_with(
+        name="session-3",
+        namespace="jobs",
+        body={
+            "metadata": {
+                "labels": {"worker": "celery-worker-1"},
+                "resourceVersion": "42",
+            }
+        },
+    )
+
+    # Conflicts (another controller adopted the pod first) are ignored
+    api.patch_namespaced_pod.side_effect = kubernetes.client.rest.ApiException(
+        status=409
+    )
+    controller.adopt_orphaned()
+
+    # Workers are not pinged if there are no pods of other workers
+    controller.app.control.ping.reset_mock()
+    api.list_namespaced_pod.return_value.items = []
+    controller.adopt_orphaned()
+    controller.app.control.ping.assert_not_called()
+
+
+@mock.patch.object(kubernetes_controller, "SESSION_CONTROLLER_RETRY_WAIT", 0)
+@mock.patch.object(kubernetes_controller, "api_instance")
+def test_watch_errors(api):
+    """
+    Test that the watch is re-established after errors (e.g. a dropped
+    connection, or an error sending an event) and that events are retried.
+    """
+    controller = make_controller()
+    controller.send = mock.Mock(side_effect=[ConnectionError("Broker error"), None])
+    pod = make_pod(ready=True)
+
+    def dropped():
+        raise urllib3.exceptions.ProtocolError("Connection broken")
+        yield
+
+    def ready():
+        yield dict(type="ADDED", object=pod)
+
+    def ready_then_stop():
+        yield dict(type="ADDED", object=pod)
+        controller.stop()
+
+    streams = iter([dropped(), ready(), ready_then_stop()])
+    watch = mock.Mock(resource_version=None)
+    watch.stream.side_effect = lambda *args, **kwargs: next(streams)
+    with mock.patch.object(kubernetes_controller.kubernetes.watch, "Watch") as Watch:
+        Watch.return_value = watch
+        controller.watch()
+
+    assert watch.stream.call_count == 3
+    assert [call.args[:2] for call in controller.send.call_args_list] == [
+        ("job-1", "RUNNING"),
+        ("job-1", "RUNNING"),
+    ]
+    assert controller.ready == {"session-1"}
@@ -0,0 +1,509 @@
+"""
+A pool of warm session pods for `KubernetesSession`.
+
+Creating a session pod from scratch requires pulling the container image,
+fetching the snapshot (if any) and starting Executa. To avoid users having
+to wait for all of that, the pool keeps a number of pre-started ("warm") pods
+for each session "profile" (the container image, resources, node pool and
+network policy which can not be changed once a pod is created).
+
+A warm pod waits until it is claimed by a session job. The job claims it by
+changing its `state` label from `idle` to `claimed` (using the pod's resource
+version so that only one job can claim each pod) and then hands it the session's
+key, project and snapshot (by writing them to a "claim" file in the pod's
+trusted sidecar container). The sidecar fetches the snapshot (if necessary) and
+mounts the snapshot, or project working directory, at `/work` before Executa is
+started in the session container.
+
+All state is kept in the cluster (so that it is shared by all worker processes):
+pod labels indicate whether pods are idle or claimed, and a `ConfigMap` records
+the recent session start times for each profile. The number of warm pods for a
+profile is the number of sessions started with it in the last `SESSION_POOL_WINDOW`
+seconds (but at least `SESSION_POOL_MIN` for the images in `SESSION_POOL_IMAGES`
+with default resources, and at most `SESSION_POOL_MAX`).
+
+The pool is replenished in a background thread after each claim and can
+also be maintained continuously by running this module:
+
+    python3 -m jobs.session.kubernetes_pool
+"""
+
+import hashlib
+import json
+import logging
+import os
+import random
+import secrets
+import shlex
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+
+import kubernetes
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of warm pods for each profile (use 0 to disable the pool)
+SESSION_POOL_MAX = int(os.getenv("SESSION_POOL_MAX", 2))
+
+# Minimum number of warm pods for the container images in `SESSION_POOL_IMAGES`
+SESSION_POOL_MIN = int(os.getenv("SESSION_POOL_MIN", 0))
+
+# Container images that have a minimum number of warm pods
+SESSION_POOL_IMAGES = [
+    image
+    for image in os.getenv(
+        "SESSION_POOL_IMAGES",
+        os.getenv("SESSION_CONTAINER_IMAGE", "stencila/executa-midi"),
+    ).split(",")
+    if image
+]
+
+# Number of seconds over which to count session starts to determine demand
+SESSION_POOL_WINDOW = int(os.getenv("SESSION_POOL_WINDOW", 900))
+
+# Number of seconds after which idle warm pods are replaced (e.g. so that
+# updated images are used)
+SESSION_POOL_MAX_AGE = int(os.getenv("SESSION_POOL_MAX_AGE", 3600))
+
+# Name of the `ConfigMap` used to record demand for each profile
+DEMAND_CONFIG_MAP = "session-pool-demand"
+
+# Host paths of the snapshots and project working directories
+SNAPSHOTS_PATH = "/var/lib/stencila/hub/snapshots"
+WORKING_PATH = "/var/lib/stencila/hub/storage/working"
+
+# Script run in the sidecar container of warm pods.
+# Waits to be claimed and then makes the snapshot, or project working directory,
+# available at `/work` (an overlay of the snapshot so that the session can write
+# temporary files, or a read only bind mount of the working directory).
+SIDECAR_SCRIPT = """
+while [ ! -f /semaphores/claim ]; do sleep 0.1; done
+. /semaphores/claim
+if [ -n "$SNAPSHOT" ]; then
+    sh /groundsman.sh "$SNAPSHOT" "$SNAPSHOT_URL"
+    mkdir -p /overlay/upper /overlay/work
+    mount -t overlay overlay \
+        -o lowerdir=/snapshots/$SNAPSHOT,upperdir=/overlay/upper,workdir=/overlay/work \
+        /work
+    chown 1000:1000 /work
+else
+    mount -o bind /working/$PROJECT /work
+    mount -o remount,bind,ro /work
+fi
+
+touch /semaphores/ready
+while [ ! -f /semaphores/finished ]
+do
+    sleep 1
+done
+"""
+
+# Script run in the session container of warm pods.
+# Waits until the sidecar has prepared `/work` and then starts Executa
+# with the key etc of the session.
+SESSION_SCRIPT = """
+while [ ! -f /semaphores/ready ]; do sleep 0.1; done
+. /semaphores/claim
+touch /semaphores/started
+cd /work
+executa serve --key="$KEY" --timeout="$TIMEOUT" --timelimit="$TIMELIMIT" {ports}
+touch /semaphores/finished
+"""
+
+
+Profile = Dict[str, str]
+
+
+def profile_hash(profile: Profile) -> str:
+    """
+    Get a hash of a profile to use as a label value.
+    """
+    return hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class SessionPool:
+    """
+    A pool of warm session pods in a Kubernetes namespace.
+    """
+
+    def __init__(self, api, namespace: str, default_profile: Profile):
+        self.api = api
+        self.namespace = namespace
+        self.default_profile = default_profile
+
+    def claim(
+        self,
+        profile: Profile,
+        params: Dict[str, str],
+        labels: Dict[str, str] = {},
+        annotations: Dict[str, str] = {},
+    ) -> Optional[Tuple[str, Dict[str, int]]]:
+        """
+        Claim a warm pod for a session.
+
+        Records the demand for the profile and then tries to claim one of its
+        idle pods and hand it the session `params` (`KEY`, `TIMEOUT`,
+        `TIMELIMIT`, `PROJECT`, `SNAPSHOT` and `SNAPSHOT_URL`). The `labels`
+        and `annotations` are added to the claimed pod.
+
+        Returns the name and ports of the pod, or `None` if no pod could be claimed.
+        """
+        try:
+            self.record_demand(profile)
+        except kubernetes.client.rest.ApiException as exc:
+            logger.warning("Unable to record session pool demand: {}".format(exc))
+
+        pods = self.api.list_namespaced_pod(
+            namespace=self.namespace,
+            label_selector="pool=warm,state=idle,profile={}".format(
+                profile_hash(profile)
+            ),
+            field_selector="status.phase=Running",
+        ).items
+        for pod in pods:
+            try:
+                self.api.patch_namespaced_pod(
+                    name=pod.metadata.name,
+                    namespace=self.namespace,
+                    body={
+                        "metadata": {
+                            "labels": dict(labels, state="claimed"),
+                            "annotations": annotations,
+                            "resourceVersion": pod.metadata.resource_version,
+                        }
+                    },
+                )
+            except kubernetes.client.rest.ApiException as exc:
+                if exc.status in (404, 409):
+                    # Claimed by another job, or deleted, since it was listed
+                    continue
+                raise exc
+
+            try:
+                self.hand_over(pod.metadata.name, params)
+            except Exception as exc:
+                logger.warning("Unable to hand over warm pod: {}".format(exc))
+                self.delete(pod.metadata.name)
+                continue
+
+            return (
+                pod.metadata.name,
+                json.loads(pod.metadata.annotations["stencila.io/ports"]),
+            )
+
+        return None
+
+    def hand_over(self, name: str, params: Dict[str, str]):
+        """
+        Hand over a claimed pod to a session.
+
+        Writes the session parameters to the claim file in the pod's
+        sidecar container. They are sent via `stdin`, rather than in the
+        command, so that the key is not recorded in the cluster's audit logs.
+        """
+        content = "".join(
+            "{}={}\n".format(name, shlex.quote(str(value or "")))
+            for name, value in params.items()
+        )
+        response = kubernetes.stream.stream(
+            self.api.connect_get_namespaced_pod_exec,
+            name=name,
+            namespace=self.namespace,
+            container="sidecar",
+            command=[
+                "sh",
+                "-c",
+                "cat > /semaphores/claim.tmp "
+                "&& mv /semaphores/claim.tmp /semaphores/claim",
+            ],
+            stdin=True,
+            stdout=True,
+            stderr=True,
+            tty=False,
+            _preload_content=False,
+        )
+        response.write_stdin(content)
+        response.update(timeout=1)
+        response.close()
+
+    def record_demand(self, profile: Profile):
+        """
+        Record the start of a session with a profile.
+        """
+        key = profile_hash(profile)
+        for attempt in range(5):
+            config_map, data = self.read_demand()
+            now = time.time()
+            entry = json.loads(data.get(key, "{}"))
+            entry["profile"] = profile
+            entry["starts"] = [
+                start
+                for start in entry.get("starts", [])
+                if now - start < SESSION_POOL_WINDOW
+            ] + [now]
+            data[key] = json.dumps(entry)
+
+            try:
+                if config_map is None:
+                    self.api.create_namespaced_config_map(
+                        namespace=self.namespace,
+                        body={"metadata": {"name": DEMAND_CONFIG_MAP}, "data": data},
+                    )
+                else:
+                    config_map.data = data
+                    self.api.replace_namespaced_config_map(
+                        name=DEMAND_CONFIG_MAP,
+                        namespace=self.namespace,
+                        body=config_map,
+                    )
+                return
+            except kubernetes.client.rest.ApiException as exc:
+                # Conflict due to concurrent update so try again
+                if exc.status != 409:
+                    raise exc
+
+    def read_demand(self) -> Tuple[Optional[object], Dict[str, str]]:
+        """
+        Read the `ConfigMap` recording the demand for each profile.
+        """
+        try:
+            config_map = self.api.read_namespaced_config_map(
+                name=DEMAND_CONFIG_MAP, namespace=self.namespace
+            )
+        except kubernetes.client.rest.ApiException as exc:
+            if exc.status == 404:
+                return None, {}
+            raise exc
+        return config_map, dict(config_map.data or {})
+
+    def demand(self) -> Dict[str, Tuple[Profile, int]]:
+        """
+        Get the profiles, and the number of recent session starts,
+        that warm pods should be maintained for.
+        """
+        now = time.time()
+        profiles: Dict[str, Tuple[Profile, int]] = {}
+        for image in SESSION_POOL_IMAGES:
+            profile = dict(self.default_profile, image=image)
+            profiles[profile_hash(profile)] = (profile, 0)
+
+        config_map, data = self.read_demand()
+        for key, value in data.items():
+            entry = json.loads(value)
+            starts = [
+                start
+                for start in entry.get("starts", [])
+                if now - start < SESSION_POOL_WINDOW
+            ]
+            if starts or key in profiles:
+                profiles[key] = (entry["profile"], len(starts))
+
+        return profiles
+
+    def target(self, profile: Profile, starts: int) -> int:
+        """
+        Get the number of warm pods to maintain for a profile.
+        """
+        minimum = (
+            SESSION_POOL_MIN
+            if profile == dict(self.default_profile, image=profile["image"])
+            and profile["image"] in SESSION_POOL_IMAGES
+            else 0
+        )
+        return min(SESSION_POOL_MAX, max(minimum, starts))
+
+    def replenish(self, profile: Profile, starts: Optional[int] = None):
+        """
+        Create, or delete, warm pods for a profile so that it is at its target size.
+
+        Idle pods older than `SESSION_POOL_MAX_AGE` are replaced.
+        """
+        key = profile_hash(profile)
+        if starts is None:
+            starts = self.demand().get(key, (profile, 0))[1]
+        target = self.target(profile, starts)
+
+        now = datetime.now(timezone.utc)
+        idle = []
+        for pod in self.api.list_namespaced_pod(
+            namespace=self.namespace,
+            label_selector="pool=warm,state=idle,profile={}".format(key),
+        ).items:
+            age = (now - pod.metadata.creation_timestamp).total_seconds()
+            if pod.status.phase in ("Failed", "Succeeded") or (
+                age > SESSION_POOL_MAX_AGE
+            ):
+                self.delete(pod.metadata.name)
+            else:
+                idle.append(pod)
+
+        if len(idle) > target:
+            idle.sort(key=lambda pod: pod.metadata.creation_timestamp)
+            for pod in idle[: len(idle) - target]:
+                self.delete(pod.metadata.name)
+        else:
+            for index in range(target - len(idle)):
+                self.create(profile)
+
+    def replenish_in_background(self, profile: Profile):
+        """
+        Replenish the pool for a profile in a background thread.
+        """
+
+        def replenish():
+            try:
+                self.replenish(profile)
+            except Exception as exc:
+                logger.warning("Unable to replenish session pool: {}".format(exc))
+
+        threading.Thread(target=replenish, daemon=True).start()
+
+    def run(self, interval: int = 30):
+        """
+        Maintain the pool for all profiles that are in demand.
+        """
+        while True:
+            try:
+                for profile, starts in self.demand().values():
+                    self.replenish(profile, starts)
+            except kubernetes.client.rest.ApiException as exc:
+                logger.exception(exc)
+            time.sleep(interval)
+
+    def create(self, profile: Profile) -> str:
+        """
+        Create a warm pod for a profile.
+        """
+        name = "session-warm-" + secrets.token_hex(8)
+        # See `KubernetesSession` regarding the choice of ports
+        ports = {
+            "ws": random.randint(10000, 65535),
+            "http": random.randint(10000, 65535),
+        }
+        self.api.create_namespaced_pod(
+            namespace=self.namespace, body=warm_pod(name, profile, ports)
+        )
+        return name
+
+    def delete(self, name: str):
+        """
+        Delete a warm pod.
+        """
+        try:
+            self.api.delete_namespaced_pod(name=name, namespace=self.namespace)
+        except kubernetes.client.rest.ApiException as exc:
+            if exc.status != 404:
+                raise exc
+
+
+def warm_pod(name: str, profile: Profile, ports: Dict[str, int]) -> Dict:
+    """
+    Create the manifest for a warm pod.
+    """
+    return {
+        "apiVersion": "v1",
+        "kind": "Pod",
+        "metadata": {
+            "name": name,
+            "labels": {
+                "method": "session",
+                "networkPolicy": profile["network_policy"],
+                "pool": "warm",
+                "state": "idle",
+                "profile": profile_hash(profile),
+            },
+            "annotations": {"stencila.io/ports": json.dumps(ports)},
+        },
+        "spec": {
+            "nodeSelector": {"cloud.google.com/gke-nodepool": profile["node_pool"]},
+            "containers": [
+                {
+                    "name": "sidecar",
+                    "image": "stencila/hub-groundsman",
+                    "imagePullPolicy": "IfNotPresent",
+                    "securityContext": {"privileged": True},
+                    "command": ["sh", "-c", "--"],
+                    "args": [SIDECAR_SCRIPT],
+                    # Unmount otherwise this container will never terminate.
+                    "lifecycle": {
+                        "preStop": {"exec": {"command": ["umount", "/work"]}}
+                    },
+                    "volumeMounts": [
+                        {"name": "snapshots", "mountPath": "/snapshots"},
+                        {"name": "working", "mountPath": "/working", "readOnly": True},
+                        {"name": "overlay", "mountPath": "/overlay"},
+                        {
+                            "name": "work",
+                            "mountPath": "/work",
+                            "mountPropagation": "Bidirectional",
+                        },
+                        {"name": "semaphores", "mountPath": "/semaphores"},
+                    ],
+                },
+                {
+                    "name": "session",
+                    "image": profile["image"],
+                    "command": [
+                        "/bin/bash",
+                        "-c",
+                        "--",
+                        SESSION_SCRIPT.format(
+                            ports=" ".join(
+                                f"--{protocol}=0.0.0.0:{port}"
+                                for protocol, port in ports.items()
+                            )
+                        ),
+                    ],
+                    "securityContext": {"runAsUser": 1000, "runAsGroup": 1000},
+                    "ports": [{"containerPort": port} for port in ports.values()],
+                    "readinessProbe": {
+                        "tcpSocket": {"port": ports["ws"]},
+                        "initialDelaySeconds": 2,
+                        "periodSeconds": 1,
+                        # Executa is not started until the pod is claimed
+                        # so do not fail the probe
+                        "failureThreshold": 1000000,
+                    },
+                    "volumeMounts": [
+                        {
+                            "name": "work",
+                            "mountPath": "/work",
+                            "mountPropagation": "HostToContainer",
+                        },
+                        {"name": "semaphores", "mountPath": "/semaphores"},
+                    ],
+                    "workingDir": "/work",
+                    "resources": {
+                        "requests": {
+                            "cpu": profile["cpu_request"],
+                            "memory": "{}Mi".format(profile["mem_request"]),
+                        },
+                        "limits": {
+                            "cpu": profile["cpu_limit"],
+                            "memory": "{}Mi".format(profile["mem_limit"]),
+                        },
+                    },
+                },
+            ],
+            "volumes": [
+                {"name": "snapshots", "hostPath": {"path": SNAPSHOTS_PATH}},
+                {"name": "working", "hostPath": {"path": WORKING_PATH}},
+                {"name": "overlay", "emptyDir": {}},
+                {"name": "work", "emptyDir": {}},
+                {"name": "semaphores", "emptyDir": {}},
+            ],
+            # Do not restart this pod when it stops
+            "restartPolicy": "Never",
+            # Do not automatically mount a token for K8s API access
+            "automountServiceAccountToken": False,
+        },
+    }
+
+
+if __name__ == "__main__":
+    from .kubernetes_session import api_instance, default_profile, namespace
+
+    logging.basicConfig(level=logging.INFO)
+    SessionPool(api_instance, namespace, default_profile()).run()
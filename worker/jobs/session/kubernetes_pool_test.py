@@ -0,0 +1,160 @@
+import json
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import kubernetes
+
+from . import kubernetes_pool
+from .kubernetes_pool import SessionPool, profile_hash, warm_pod
+
+PROFILE = dict(
+    image="stencila/executa-midi",
+    node_pool="sessions",
+    cpu_request="0.1",
+    cpu_limit="1",
+    mem_request="600",
+    mem_limit="600",
+    network_policy="jobs-network-policy-1",
+)
+
+
+def make_pod(name, age=0, ports={"ws": 10001, "http": 10002}):
+    """Make a mock of a listed warm pod."""
+    pod = mock.Mock(
+        metadata=mock.Mock(
+            resource_version="1",
+            annotations={"stencila.io/ports": json.dumps(ports)},
+            creation_timestamp=datetime.now(timezone.utc) - timedelta(seconds=age),
+        ),
+        status=mock.Mock(phase="Running"),
+    )
+    # `Mock` uses the `name` argument itself so set it afterwards
+    pod.metadata.name = name
+    return pod
+
+
+def make_pool(pods):
+    """Make a pool with a mock API that lists the pods and has no demand recorded."""
+    api = mock.Mock()
+    api.list_namespaced_pod.return_value.items = pods
+    api.read_namespaced_config_map.side_effect = kubernetes.client.rest.ApiException(
+        status=404
+    )
+    return SessionPool(api, "jobs", PROFILE)
+
+
+def test_claim():
+    """
+    Test that a pod claimed by another job is skipped and that
+    the session parameters are handed over to the claimed pod.
+    """
+    pods = [make_pod("session-warm-1"), make_pod("session-warm-2")]
+    pool = make_pool(pods)
+    pool.api.patch_namespaced_pod.side_effect = [
+        kubernetes.client.rest.ApiException(status=409),
+        None,
+    ]
+
+    with mock.patch("kubernetes.stream.stream") as stream:
+        claimed = pool.claim(PROFILE, dict(KEY="a key", PROJECT=1, SNAPSHOT=None))
+
+    assert claimed == ("session-warm-2", {"ws": 10001, "http": 10002})
+
+    # Claims are made using the resource version of each pod
+    assert pool.api.patch_namespaced_pod.call_count == 2
+    body = pool.api.patch_namespaced_pod.call_args[1]["body"]
+    assert body["metadata"] == {
+        "labels": {"state": "claimed"},
+        "annotations": {},
+        "resourceVersion": "1",
+    }
+
+    # Parameters are sent via stdin to the sidecar container
+    assert stream.call_args[1]["name"] == "session-warm-2"
+    assert stream.call_args[1]["container"] == "sidecar"
+    stream.return_value.write_stdin.assert_called_with(
+        "KEY='a key'\nPROJECT=1\nSNAPSHOT=''\n"
+    )
+
+    # Demand is recorded
+    data = pool.api.create_namespaced_config_map.call_args[1]["body"]["data"]
+    entry = json.loads(data[profile_hash(PROFILE)])
+    assert entry["profile"] == PROFILE
+    assert len(entry["starts"]) == 1
+
+
+def test_claim_miss():
+    """
+    Test that if there are no warm pods, or the hand over fails, then
+    `None` is returned (and the pod is deleted).
+    """
+    assert make_pool([]).claim(PROFILE, {}) is None
+
+    pool = make_pool([make_pod("session-warm-1")])
+    with mock.patch("kubernetes.stream.stream", side_effect=RuntimeError):
+        assert pool.claim(PROFILE, {}) is None
+    pool.api.delete_namespaced_pod.assert_called_with(
+        name="session-warm-1", namespace="jobs"
+    )
+
+
+def test_target():
+    """
+    Test that the target size of the pool is within limits.
+    """
+    pool = make_pool([])
+    other = dict(PROFILE, image="stencila/executa-r")
+    custom = dict(PROFILE, mem_limit="2000")
+    with mock.patch.multiple(
+        kubernetes_pool,
+        SESSION_POOL_MIN=1,
+        SESSION_POOL_MAX=3,
+        SESSION_POOL_IMAGES=[PROFILE["image"]],
+    ):
+        assert pool.target(PROFILE, 0) == 1
+        assert pool.target(PROFILE, 2) == 2
+        assert pool.target(PROFILE, 10) == 3
+        assert pool.target(other, 0) == 0
+        assert pool.target(other, 2) == 2
+        assert pool.target(custom, 0) == 0
+
+
+def test_replenish():
+    """
+    Test that old pods are replaced and the pool is filled to its target size.
+    """
+    pods = [make_pod("young"), make_pod("old", age=7200)]
+    pool = make_pool(pods)
+
+    with mock.patch.object(kubernetes_pool, "SESSION_POOL_MAX", 3):
+        pool.replenish(PROFILE, starts=3)
+
+    pool.api.delete_namespaced_pod.assert_called_once_with(
+        name="old", namespace="jobs"
+    )
+    assert pool.api.create_namespaced_pod.call_count == 2
+    body = pool.api.create_namespaced_pod.call_args[1]["body"]
+    assert body["metadata"]["labels"]["profile"] == profile_hash(PROFILE)
+    assert body["metadata"]["labels"]["state"] == "idle"
+
+    # Excess pods are deleted
+    pool = make_pool(pods[:1])
+    pool.replenish(PROFILE, starts=0)
+    pool.api.delete_namespaced_pod.assert_called_once_with(
+        name="young", namespace="jobs"
+    )
+    assert pool.api.create_namespaced_pod.call_count == 0
+
+
+def test_warm_pod():
+    """
+    Test that the warm pod's session container listens on its annotated ports.
+    """
+    pod = warm_pod("session-warm-1", PROFILE, {"ws": 10001, "http": 10002})
+    assert json.loads(pod["metadata"]["annotations"]["stencila.io/ports"]) == {
+        "ws": 10001,
+        "http": 10002,
+    }
+    session = pod["spec"]["containers"][1]
+    assert "--ws=0.0.0.0:10001 --http=0.0.0.0:10002" in session["command"][3]
+    assert session["resources"]["limits"]["memory"] == "600Mi"
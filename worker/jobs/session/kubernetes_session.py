@@ -1,6 +1,8 @@
+import json
 import logging
 import os
 import random
+import re
 import secrets
 import subprocess
 import sys
@@ -11,10 +13,15 @@ from celery.exceptions import Ignore, SoftTimeLimitExceeded
 
 from config import get_snapshot_dir, get_working_dir
 from jobs.base.job import Job
+from jobs.session.kubernetes_pool import SESSION_POOL_MAX, Profile, SessionPool
 
 # Kubernetes namespace to put job pods in
 namespace = "jobs"
 
+# Should session jobs release their worker slot once their pod is created
+# and leave it to the worker's `SessionController` to update the job?
+SESSION_CONTROLLER = bool(int(os.getenv("SESSION_CONTROLLER", 1)))
+
 logger = logging.getLogger(__name__)
 
 api_client = None
@@ -66,6 +73,73 @@ else:
             logger.warning("Could not find Minikube. Is it installed?")
 
 
+def default_profile() -> Profile:
+    """
+    Get the default profile of session pods.
+
+    Defaults are set as environment variables or the values hard coded below.
+    """
+    return dict(
+        image=os.getenv("SESSION_CONTAINER_IMAGE", "stencila/executa-midi"),
+        node_pool=os.getenv("SESSION_NODE_POOL_DEFAULT", "sessions"),
+        # 10% of a vCPU / core
+        cpu_request=str(os.getenv("SESSION_CPU_REQUEST_DEFAULT", 0.1)),
+        # 100% of a vCPU / core
+        cpu_limit=str(os.getenv("SESSION_CPU_LIMIT_DEFAULT", 1)),
+        # 600MiB
+        mem_request=str(os.getenv("SESSION_MEM_REQUEST_DEFAULT", 600)),
+        # 600MiB
+        mem_limit=str(os.getenv("SESSION_MEM_LIMIT_DEFAULT", 600)),
+        network_policy=os.getenv(
+            "SESSION_NETWORK_POLICY_DEFAULT", "jobs-network-policy-1"
+        ),
+    )
+
+
+def label_value(value: str) -> str:
+    """
+    Convert a string into a valid label value (e.g. a worker's hostname).
+    """
+    return re.sub(r"[^A-Za-z0-9_.-]", "-", value)[-63:].strip("-_.")
+
+
+def pod_ready(pod) -> bool:
+    """
+    Is a session pod running and ready?
+
+    The Python API `V1ContainerStatus` does not expose `started`
+    so we use `ready` and a `readinessProbe` on the session container.
+    """
+    return pod.status.phase == "Running" and any(
+        status.name == "session" and status.ready
+        for status in pod.status.container_statuses or []
+    )
+
+
+def watch_pod(name: str):
+    """
+    Watch a pod, generating its state each time it changes.
+
+    Uses a watch (a single long running request), rather than polling,
+    to avoid load on the Kubernetes API server.
+    """
+    watch = kubernetes.watch.Watch()
+    for event in watch.stream(
+        api_instance.list_namespaced_pod,
+        namespace=namespace,
+        field_selector="metadata.name={}".format(name),
+    ):
+        yield event["type"], event["object"]
+
+
+# Pool of warm session pods (if enabled)
+pool = (
+    SessionPool(api_instance, namespace, default_profile())
+    if api_instance and SESSION_POOL_MAX > 0
+    else None
+)
+
+
 class KubernetesSession(Job):
     """
     Runs a session as a pod in a Kubernetes cluster.
@@ -73,6 +147,14 @@ class KubernetesSession(Job):
     This class in intended for scalably provisioning untrusted sessions.
     It uses the K8s API to create a new pod inside a cluster, usually but
     not necessarily, the same cluster this process is in.
+
+    If possible, a warm pod is claimed from the `pool` rather than
+    creating a new one (see `kubernetes_pool.py`).
+
+    Once the pod has been created, the job releases its worker slot and
+    the worker's `SessionController` updates the job when the pod is ready,
+    or has finished, and terminates the pod if the job is cancelled
+    (see `kubernetes_controller.py`).
     """
 
     def do(self, *args, **kwargs):
@@ -100,9 +182,17 @@ class KubernetesSession(Job):
         key = kwargs.get("key")
         assert key is not None, "A job key is required for a session"
 
-        # Container image to use
-        container_image = kwargs.get("container_image") or os.getenv(
-            "SESSION_CONTAINER_IMAGE", "stencila/executa-midi"
+        # Container image, node pool, CPU and memory requests and limits,
+        # and network policy applied to the session
+        defaults = default_profile()
+        profile = dict(
+            image=kwargs.get("container_image") or defaults["image"],
+            node_pool=kwargs.get("node_pool") or defaults["node_pool"],
+            cpu_request=str(kwargs.get("cpu_request") or defaults["cpu_request"]),
+            cpu_limit=str(kwargs.get("cpu_limit") or defaults["cpu_limit"]),
+            mem_request=str(kwargs.get("mem_request") or defaults["mem_request"]),
+            mem_limit=str(kwargs.get("mem_limit") or defaults["mem_limit"]),
+            network_policy=kwargs.get("network_policy") or defaults["network_policy"],
         )
 
         # Session timeout and timelimit defaults
@@ -113,51 +203,65 @@ class KubernetesSession(Job):
             "SESSION_TIMELIMIT_DEFAULT", 3600  # 1 hour
         )
 
-        # Node pool
-        node_pool = kwargs.get("node_pool") or os.getenv(
-            "SESSION_NODE_POOL_DEFAULT", "sessions"
-        )
-
-        # Session CPU and memory requests and limits
-        cpu_request = kwargs.get("cpu_request") or os.getenv(
-            "SESSION_CPU_REQUEST_DEFAULT", 0.1  # 10% of a vCPU / core
-        )
-        cpu_limit = kwargs.get("cpu_limit") or os.getenv(
-            "SESSION_CPU_LIMIT_DEFAULT", 1  # 100% of a vCPU / core
-        )
-        mem_request = kwargs.get("mem_request") or os.getenv(
-            "SESSION_MEM_REQUEST_DEFAULT", 600  # 600MiB
-        )
-        mem_limit = kwargs.get("mem_limit") or os.getenv(
-            "SESSION_MEM_LIMIT_DEFAULT", 600  # 600MiB
-        )
-
-        # Network policy applied to sessions
-        network_policy = kwargs.get("network_policy") or os.getenv(
-            "SESSION_NETWORK_POLICY_DEFAULT", "jobs-network-policy-1"
-        )
-
         # Update the job with a custom state to indicate
         # that we are waiting for the pod to start.
         self.notify(state="LAUNCHING")
+        launched = time.time()
+
+        # Labels and annotations used by the `SessionController`
+        labels = {}
+        if SESSION_CONTROLLER and self.task_id:
+            labels = {
+                "job": self.task_id,
+                "worker": label_value(self.request.hostname or ""),
+            }
+        annotations = {
+            "stencila.io/launched": str(launched),
+            "stencila.io/pool": "miss",
+        }
 
-        # Create a session name which we can use to terminate the pod
-        # (use `pod_name` to avoid clash with `Job.name`)
-        self.pod_name = "session-" + (self.task_id or secrets.token_hex(16))
+        # Try to claim a warm pod from the pool and replenish the pool
+        # in the background (whether or not one was claimed).
+        claimed = None
+        if pool:
+            try:
+                claimed = pool.claim(
+                    profile,
+                    dict(
+                        KEY=key,
+                        TIMEOUT=timeout,
+                        TIMELIMIT=timelimit,
+                        PROJECT=project,
+                        SNAPSHOT=snapshot,
+                        SNAPSHOT_URL=snapshot_url,
+                    ),
+                    labels,
+                    dict(annotations, **{"stencila.io/pool": "hit"}),
+                )
+            except kubernetes.client.rest.ApiException as exc:
+                logger.warning("Unable to claim a warm pod: {}".format(exc))
+            pool.replenish_in_background(profile)
+
+        if claimed:
+            self.pod_name, ports = claimed
+        else:
+            # Create a session name which we can use to terminate the pod
+            # (use `pod_name` to avoid clash with `Job.name`)
+            self.pod_name = "session-" + (self.task_id or secrets.token_hex(16))
+
+            # Protocols and ports that the session will listen on.
+            # Note that random is about the best we can do (we do not
+            # know which ports are already in use because we do not
+            # know which machine this pod will be assigned to).
+            # There is a small probability of clashes.
+            ports = {
+                "ws": random.randint(10000, 65535),
+                "http": random.randint(10000, 65535),
+            }
 
         # Add pod name to logger's extra contextual info
         self.logger = logging.LoggerAdapter(logger, {"pod_name": self.pod_name})
 
-        # Protocols and ports that the session will listen on.
-        # Note that random is about the best we can do (we do not
-        # know which ports are already in use because we do not
-        # know which machine this pod will be assigned to).
-        # There is a small probability of clashes.
-        ports = {
-            "ws": random.randint(10000, 65535),
-            "http": random.randint(10000, 65535),
-        }
-
         # Construct the command to run in the session container
         executa_args = (
             f"--key={key} --timeout={timeout} --timelimit={timelimit} "
@@ -292,16 +396,24 @@ class KubernetesSession(Job):
             "kind": "Pod",
             "metadata": {
                 "name": self.pod_name,
-                "labels": {"method": "session", "networkPolicy": network_policy},
+                "labels": {
+                    "method": "session",
+                    "networkPolicy": profile["network_policy"],
+                    **labels,
+                },
+                "annotations": {
+                    "stencila.io/ports": json.dumps(ports),
+                    **annotations,
+                },
             },
             "spec": {
-                "nodeSelector": {"cloud.google.com/gke-nodepool": node_pool},
+                "nodeSelector": {"cloud.google.com/gke-nodepool": profile["node_pool"]},
                 "initContainers": init_containers,
                 "containers": sidecar_containers
                 + [
                     {
                         "name": "session",
-                        "image": container_image,
+                        "image": profile["image"],
                         "command": command,
                         "securityContext": {"runAsUser": 1000, "runAsGroup": 1000},
                         "ports": [{"containerPort": port} for port in ports.values()],
@@ -315,12 +427,12 @@ class KubernetesSession(Job):
                         "workingDir": "/work",
                         "resources": {
                             "requests": {
-                                "cpu": cpu_request,
-                                "memory": "{}Mi".format(mem_request),
+                                "cpu": profile["cpu_request"],
+                                "memory": "{}Mi".format(profile["mem_request"]),
                             },
                             "limits": {
-                                "cpu": cpu_limit,
-                                "memory": "{}Mi".format(mem_limit),
+                                "cpu": profile["cpu_limit"],
+                                "memory": "{}Mi".format(profile["mem_limit"]),
                             },
                         },
                     }
@@ -336,43 +448,43 @@ class KubernetesSession(Job):
         # Try to create the pod, but it it already exists then ignore
         # the job (do not record any state from here but remove it from the queue).
         # See https://docs.celeryproject.org/en/latest/userguide/tasks.html#ignore
-        try:
-            self.logger.debug("Creating pod")
-            api_instance.create_namespaced_pod(
-                body=pod, namespace=namespace,
-            )
-        except kubernetes.client.rest.ApiException as exc:
-            if exc.reason == "Conflict":
-                raise Ignore()
-            else:
-                raise exc
+        if claimed:
+            self.logger.debug("Claimed warm pod")
+        else:
+            try:
+                self.logger.debug("Creating pod")
+                api_instance.create_namespaced_pod(
+                    body=pod, namespace=namespace,
+                )
+            except kubernetes.client.rest.ApiException as exc:
+                if exc.reason == "Conflict":
+                    raise Ignore()
+                else:
+                    raise exc
+
+        # Leave it to the session controller to update the job, if possible
+        if labels:
+            self.release()
 
         # Wait for pod to be ready so that we can get its IP address
         self.logger.debug("Waiting for pod")
-        while True:
-            pod = api_instance.read_namespaced_pod(
-                name=self.pod_name, namespace=namespace
-            )
-            # Check readiness of the container
-            # The Python API `V1ContainerStatus` does not expose `started`
-            # so we use `ready` and a `readinessProbe` (above).
-            phase = pod.status.phase
-            ready = (
-                pod.status.container_statuses
-                and len(pod.status.container_statuses)
-                and pod.status.container_statuses[0].ready
-                or False
-            )
-            if phase == "Running" and ready:
+        for type, pod in watch_pod(self.pod_name):
+            if type == "DELETED" or pod.status.phase not in ("Pending", "Running"):
+                raise RuntimeError("Session pod stopped before it was ready")
+            if pod_ready(pod):
                 break
-            time.sleep(0.25)
         ip = pod.status.pod_ip
 
         # Update the job state with the internal URLs of the pod
         urls = dict(
             (protocol, f"{protocol}://{ip}:{port}") for protocol, port in ports.items()
         )
-        self.notify(state="RUNNING", urls=urls)
+        self.notify(
+            state="RUNNING",
+            urls=urls,
+            session_pool="hit" if claimed else "miss",
+            session_ready_seconds=time.time() - launched,
+        )
 
         self.logger.debug("Started pod")
 
@@ -416,17 +528,25 @@ class KubernetesSession(Job):
         else:
             self.info(response)
 
+    def release(self):
+        """
+        Release the worker slot while the session runs.
+
+        The log is flushed and the job is ignored (so that Celery does not
+        record a result, or send a `task-succeeded` event, for it). The result
+        is stored by the `SessionController` when the pod ends.
+        """
+        self.logger.debug("Releasing pod to session controller")
+        self.flush()
+        raise Ignore()
+
     def poll(self):
         """
-        Poll the session until it stops running.
+        Wait for the session to stop running.
         """
-        while True:
-            pod = api_instance.read_namespaced_pod(
-                name=self.pod_name, namespace=namespace
-            )
-            if pod.status.phase != "Running":
+        for type, pod in watch_pod(self.pod_name):
+            if type == "DELETED" or pod.status.phase != "Running":
                 return
-            time.sleep(3)
 
     def terminated(self):
         """
@@ -0,0 +1,389 @@
+"""
+A node-local cache of snapshot directories for sessions.
+
+Session pods for a snapshot use the snapshot's directory on the node's
+`/snapshots` host path. This module ensures that the directory is present
+(fetching and extracting the snapshot's Zip archive if it is not) and keeps the
+total size of the cache within a budget by evicting the least recently used
+snapshots.
+
+The cache is shared by all the pods on a node so:
+
+- an index of cached snapshots, with their sizes and last access times, is kept
+  in a SQLite database in the cache directory; evicting the least recently used
+  snapshot is a lookup on an index of access times (rather than re-measuring the
+  size of the cache after each deletion)
+
+- fetches are "single-flight": a lock file for each snapshot ensures that only
+  one process on the node downloads a snapshot, with others waiting for it to finish
+
+- counts of hits, misses, and bytes fetched and evicted are recorded in the database
+  and can be output in the Prometheus text format (e.g. for the node exporter's
+  textfile collector)
+
+This module only uses the standard library so that it can be run
+in the `groundsman` container (see `groundsman.sh`):
+
+    python3 snapshot_cache.py fetch <snapshot> <url>
+"""
+
+import argparse
+import contextlib
+import fcntl
+import logging
+import os
+import shutil
+import sqlite3
+import time
+import urllib.request
+import uuid
+import zipfile
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Maximum total size of the cached snapshots (bytes)
+SNAPSHOT_CACHE_BUDGET = int(os.getenv("SNAPSHOT_CACHE_BUDGET", 10 * 1024 ** 3))
+
+# Minimum number of seconds since a snapshot was last accessed before it
+# can be evicted (so that the snapshots of running sessions are not removed)
+SNAPSHOT_CACHE_MIN_AGE = int(os.getenv("SNAPSHOT_CACHE_MIN_AGE", 24 * 3600))
+
+# Name of the index database within the cache directory
+INDEX_NAME = ".index.sqlite3"
+
+# Name of the directory of lock files within the cache directory
+LOCKS_NAME = ".locks"
+
+# Names of the counters recorded in the index
+COUNTERS = ("hits", "misses", "fetched_bytes", "evictions", "evicted_bytes")
+
+
+class SnapshotCache:
+    """
+    A cache of snapshot directories.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        budget: int = SNAPSHOT_CACHE_BUDGET,
+        min_age: int = SNAPSHOT_CACHE_MIN_AGE,
+    ):
+        self.root = root
+        self.budget = budget
+        self.min_age = min_age
+        os.makedirs(os.path.join(root, LOCKS_NAME), exist_ok=True)
+
+        # Write ahead logging allows snapshots to be looked up while
+        # others are being added or evicted
+        db = sqlite3.connect(os.path.join(root, INDEX_NAME), timeout=60)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.close()
+
+        with self.connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS snapshots_accessed ON snapshots (accessed)"
+            )
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS counters (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+                """
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO counters VALUES (?, 0)",
+                [(name,) for name in COUNTERS + ("cached_bytes",)],
+            )
+
+    @contextlib.contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connect to the index and start an (immediate) transaction.
+
+        Transactions are serialized across all processes using the cache.
+        """
+        db = sqlite3.connect(
+            os.path.join(self.root, INDEX_NAME), timeout=60, isolation_level=None
+        )
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    @contextlib.contextmanager
+    def lock(self, snapshot: str) -> Iterator[None]:
+        """
+        Hold the lock for a snapshot (across all processes on the node).
+        """
+        with open(os.path.join(self.root, LOCKS_NAME, snapshot), "w") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def fetch(self, snapshot: str, url: str) -> str:
+        """
+        Ensure that a snapshot is in the cache and return its directory.
+
+        If the snapshot is not cached then its Zip archive is downloaded
+        from `url` and extracted, and snapshots are evicted to keep the
+        cache within budget.
+        """
+        assert snapshot and "/" not in snapshot and not snapshot.startswith(
+            "."
+        ), "Invalid snapshot id"
+        path = os.path.join(self.root, snapshot)
+
+        if self.touch(snapshot, path):
+            return path
+
+        with self.lock(snapshot):
+            # Another process may have fetched the snapshot while waiting for the lock
+            if self.touch(snapshot, path):
+                return path
+
+            size = self.download(url, path)
+            with self.connect() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?)",
+                    (snapshot, size, time.time()),
+                )
+                increment(db, misses=1, fetched_bytes=size, cached_bytes=size)
+
+        self.evict()
+        return path
+
+    def touch(self, snapshot: str, path: str) -> bool:
+        """
+        Update the access time of a snapshot, if it is cached.
+
+        Snapshot directories that are not in the index (e.g. fetched before
+        the index was used) are added to it.
+        """
+        if not os.path.isdir(path):
+            return False
+
+        with self.connect() as db:
+            # Check again, within the transaction, in case it has just been evicted
+            if not os.path.isdir(path):
+                return False
+
+            updated = db.execute(
+                "UPDATE snapshots SET accessed = ? WHERE id = ?",
+                (time.time(), snapshot),
+            ).rowcount
+            if not updated:
+                size = directory_size(path)
+                db.execute(
+                    "INSERT INTO snapshots VALUES (?, ?, ?)",
+                    (snapshot, size, time.time()),
+                )
+                increment(db, cached_bytes=size)
+            increment(db, hits=1)
+        return True
+
+    def download(self, url: str, path: str) -> int:
+        """
+        Download and extract a snapshot archive into a directory.
+
+        The archive is extracted into a temporary directory which is then
+        renamed so that a partially extracted snapshot is never used.
+        Returns the total size of the extracted files.
+        """
+        temp = os.path.join(self.root, ".{}".format(uuid.uuid4().hex))
+        archive = temp + ".zip"
+        try:
+            with urllib.request.urlopen(url) as response, open(archive, "wb") as file:
+                shutil.copyfileobj(response, file, 1024 * 1024)
+
+            size = 0
+            with zipfile.ZipFile(archive) as zip_file:
+                for info in zip_file.infolist():
+                    parts = info.filename.split("/")
+                    if info.filename.startswith("/") or ".." in parts:
+                        continue
+                    zip_file.extract(info, temp)
+                    size += info.file_size
+            os.makedirs(temp, exist_ok=True)
+
+            if os.path.exists(path):
+                # An unindexed partial directory e.g. from an interrupted download
+                shutil.rmtree(path)
+            os.rename(temp, path)
+            return size
+        finally:
+            if os.path.exists(archive):
+                os.unlink(archive)
+            shutil.rmtree(temp, ignore_errors=True)
+
+    def evict(self, budget: Optional[int] = None):
+        """
+        Evict the least recently used snapshots until the cache is within budget.
+
+        Each eviction looks up the oldest snapshot using the index on access times
+        and the running total of the size of the cache is maintained (rather than
+        being measured). Snapshots are renamed, within the transaction, and then
+        removed from disk after it.
+        """
+        budget = self.budget if budget is None else budget
+        removed = []
+        with self.connect() as db:
+            cached_bytes = counter(db, "cached_bytes")
+            while cached_bytes > budget:
+                row = db.execute(
+                    "SELECT id, size FROM snapshots WHERE accessed < ? "
+                    "ORDER BY accessed LIMIT 1",
+                    (time.time() - self.min_age,),
+                ).fetchone()
+                if row is None:
+                    logger.warning(
+                        "Snapshot cache is over budget but all snapshots are in use"
+                    )
+                    break
+
+                snapshot, size = row
+                path = os.path.join(self.root, snapshot)
+                trash = os.path.join(self.root, ".{}".format(uuid.uuid4().hex))
+                if os.path.exists(path):
+                    os.rename(path, trash)
+                    removed.append(trash)
+                db.execute("DELETE FROM snapshots WHERE id = ?", (snapshot,))
+                increment(db, evictions=1, evicted_bytes=size, cached_bytes=-size)
+                cached_bytes -= size
+
+        for path in removed:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def scan(self):
+        """
+        Reconcile the index with the snapshot directories on disk.
+
+        Removes snapshots that are no longer on disk from the index, and
+        adds directories that are not in it.
+        """
+        with self.connect() as db:
+            indexed = dict(db.execute("SELECT id, size FROM snapshots").fetchall())
+            on_disk = set(
+                name
+                for name in os.listdir(self.root)
+                if not name.startswith(".")
+                and os.path.isdir(os.path.join(self.root, name))
+            )
+            for snapshot in set(indexed) - on_disk:
+                db.execute("DELETE FROM snapshots WHERE id = ?", (snapshot,))
+            for snapshot in on_disk - set(indexed):
+                db.execute(
+                    "INSERT INTO snapshots VALUES (?, ?, ?)",
+                    (
+                        snapshot,
+                        directory_size(os.path.join(self.root, snapshot)),
+                        os.stat(os.path.join(self.root, snapshot)).st_atime,
+                    ),
+                )
+            db.execute(
+                "UPDATE counters SET value = "
+                "(SELECT COALESCE(SUM(size), 0) FROM snapshots) "
+                "WHERE name = 'cached_bytes'"
+            )
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the counters, and the number and size of cached snapshots.
+        """
+        with self.connect() as db:
+            stats = dict(db.execute("SELECT name, value FROM counters").fetchall())
+            (stats["snapshots"],) = db.execute(
+                "SELECT COUNT(*) FROM snapshots"
+            ).fetchone()
+        return stats
+
+    def metrics(self) -> str:
+        """
+        Get the stats of the cache in the Prometheus text format.
+        """
+        stats = self.stats()
+        lines = []
+        for name, value in sorted(stats.items()):
+            kind = "gauge" if name in ("cached_bytes", "snapshots") else "counter"
+            metric = "snapshot_cache_{}{}".format(
+                name, "_total" if kind == "counter" else ""
+            )
+            lines.append("# TYPE {} {}".format(metric, kind))
+            lines.append("{} {}".format(metric, value))
+        return "\n".join(lines) + "\n"
+
+
+def increment(db: sqlite3.Connection, **amounts: int):
+    """
+    Increment counters in the index.
+    """
+    db.executemany(
+        "UPDATE counters SET value = value + ? WHERE name = ?",
+        [(amount, name) for name, amount in amounts.items()],
+    )
+
+
+def counter(db: sqlite3.Connection, name: str) -> int:
+    """
+    Get the value of a counter in the index.
+    """
+    (value,) = db.execute(
+        "SELECT value FROM counters WHERE name = ?", (name,)
+    ).fetchone()
+    return value
+
+
+def directory_size(path: str) -> int:
+    """
+    Get the total size of the files in a directory.
+    """
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for dirpath, dirnames, filenames in os.walk(path)
+        for filename in filenames
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--root", default="/snapshots", help="The directory to cache snapshots in"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fetch = subparsers.add_parser("fetch", help="Fetch a snapshot, if necessary")
+    fetch.add_argument("snapshot", help="The id of the snapshot")
+    fetch.add_argument("url", help="The URL of the snapshot's Zip archive")
+    subparsers.add_parser("evict", help="Evict snapshots to keep within budget")
+    subparsers.add_parser("scan", help="Reconcile the index with the cache directory")
+    subparsers.add_parser("metrics", help="Output metrics in Prometheus text format")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    cache = SnapshotCache(args.root)
+    if args.command == "fetch":
+        cache.fetch(args.snapshot, args.url)
+    elif args.command == "evict":
+        cache.evict()
+    elif args.command == "scan":
+        cache.scan()
+    else:
+        print(cache.metrics(), end="")
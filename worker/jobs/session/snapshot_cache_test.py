@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from unittest import mock
+from zipfile import ZipFile
+
+from .snapshot_cache import SnapshotCache
+
+
+def make_archive(path, size):
+    """Make a snapshot archive with a single file of the given size."""
+    with ZipFile(path, "w") as zip_file:
+        zip_file.writestr("index.html", "x" * size)
+    return "file://" + path
+
+
+def test_fetch(tempdir):
+    """
+    Test that snapshots are fetched on a miss, but not a hit, and
+    that the index and counters are updated.
+    """
+    url = make_archive(tempdir.path + "/snapshot.zip", 1000)
+    cache = SnapshotCache(tempdir.path + "/snapshots", budget=10000, min_age=0)
+
+    path = cache.fetch("snap1", url)
+    assert os.path.isfile(os.path.join(path, "index.html"))
+    assert cache.stats() == {
+        "hits": 0,
+        "misses": 1,
+        "fetched_bytes": 1000,
+        "evictions": 0,
+        "evicted_bytes": 0,
+        "cached_bytes": 1000,
+        "snapshots": 1,
+    }
+
+    with mock.patch.object(cache, "download") as download:
+        assert cache.fetch("snap1", url) == path
+        download.assert_not_called()
+    assert cache.stats()["hits"] == 1
+
+    metrics = cache.metrics()
+    assert "snapshot_cache_hits_total 1\n" in metrics
+    assert "# TYPE snapshot_cache_cached_bytes gauge\n" in metrics
+
+
+def test_evict(tempdir):
+    """
+    Test that the least recently used snapshots are evicted
+    to keep the cache within budget.
+    """
+    url = make_archive(tempdir.path + "/snapshot.zip", 1000)
+    cache = SnapshotCache(tempdir.path + "/snapshots", budget=2500, min_age=0)
+
+    for snapshot in ("snap1", "snap2"):
+        cache.fetch(snapshot, url)
+        time.sleep(0.01)
+    # Access the first snapshot so that the second is the least recently used
+    cache.fetch("snap1", url)
+    time.sleep(0.01)
+    cache.fetch("snap3", url)
+
+    assert sorted(
+        name for name in os.listdir(cache.root) if not name.startswith(".")
+    ) == ["snap1", "snap3"]
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["evicted_bytes"] == 1000
+    assert stats["cached_bytes"] == 2000
+
+    # Recently accessed snapshots are not evicted
+    cache.min_age = 3600
+    cache.evict(budget=0)
+    assert cache.stats()["snapshots"] == 2
+
+
+def test_single_flight(tempdir):
+    """
+    Test that concurrent fetches of the same snapshot only download it once.
+    """
+    url = make_archive(tempdir.path + "/snapshot.zip", 1000)
+    cache = SnapshotCache(tempdir.path + "/snapshots")
+
+    download = cache.download
+
+    def slow_download(*args):
+        time.sleep(0.2)
+        return download(*args)
+
+    with mock.patch.object(cache, "download", side_effect=slow_download) as mocked:
+        threads = [
+            threading.Thread(target=cache.fetch, args=("snap1", url)) for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert mocked.call_count == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 3
+
+
+def test_scan(tempdir):
+    """
+    Test that existing directories are added to the index and missing ones removed.
+    """
+    url = make_archive(tempdir.path + "/snapshot.zip", 1000)
+    cache = SnapshotCache(tempdir.path + "/snapshots")
+    cache.fetch("snap1", url)
+
+    os.makedirs(os.path.join(cache.root, "snap2"))
+    with open(os.path.join(cache.root, "snap2", "file.txt"), "w") as file:
+        file.write("x" * 500)
+    os.rename(os.path.join(cache.root, "snap1"), os.path.join(cache.root, ".snap1"))
+
+    cache.scan()
+    stats = cache.stats()
+    assert stats["snapshots"] == 1
+    assert stats["cached_bytes"] == 500
@@ -0,0 +1,238 @@
+"""
+A cache of files, on the worker's local disk, with a size budget.
+
+Used to cache files pulled from sources (e.g. Git blobs from GitHub, and the
+images and XML of articles from eLife and PLOS) so that they are only
+downloaded once for each worker node.
+
+Like the `SnapshotCache` used for sessions, an index of cached files, with
+their sizes and last access times, is kept in a SQLite database in the cache
+directory (so that it can be shared by the worker's processes) and the least
+recently used files are evicted to keep the total size of the cache within
+a budget.
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from .files import ensure_parent
+
+logger = logging.getLogger(__name__)
+
+# Maximum total size of the files in each cache (bytes)
+FILE_CACHE_BUDGET = int(os.getenv("FILE_CACHE_BUDGET", 2 * 1024 ** 3))
+
+# Minimum number of seconds since a file was last accessed before it
+# can be evicted (so that files are not removed while being copied from the cache)
+FILE_CACHE_MIN_AGE = int(os.getenv("FILE_CACHE_MIN_AGE", 600))
+
+# Name of the index database within the cache directory
+INDEX_NAME = ".index.sqlite3"
+
+
+class FileCache:
+    """
+    A cache of files, each identified by a key (e.g. a hash).
+    """
+
+    def __init__(
+        self,
+        root: str,
+        budget: int = FILE_CACHE_BUDGET,
+        min_age: int = FILE_CACHE_MIN_AGE,
+        suffixes: Tuple[str, ...] = (),
+    ):
+        """
+        Create a file cache.
+
+        :param root: The directory to cache files in.
+        :param budget: The maximum total size of the cached files.
+        :param min_age: The minimum number of seconds since a file was last
+                        accessed before it can be evicted.
+        :param suffixes: The suffixes of other files associated with each cached
+                         file (e.g. validators) which are removed with it.
+        """
+        self.root = root
+        self.budget = budget
+        self.min_age = min_age
+        self.suffixes = suffixes
+        os.makedirs(root, exist_ok=True)
+
+        # Write ahead logging allows files to be looked up while
+        # others are being added or evicted
+        db = sqlite3.connect(os.path.join(root, INDEX_NAME), timeout=60)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.close()
+
+        with self.connect() as db:
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    key TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS files_accessed ON files (accessed)")
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS totals (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+                """
+            )
+            db.execute("INSERT OR IGNORE INTO totals VALUES ('cached_bytes', 0)")
+
+    @contextlib.contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Connect to the index and start an (immediate) transaction.
+
+        Transactions are serialized across all processes using the cache.
+        The index is not synced to disk on every commit because, if it is
+        lost, it is rebuilt as files are accessed.
+        """
+        db = sqlite3.connect(
+            os.path.join(self.root, INDEX_NAME), timeout=60, isolation_level=None
+        )
+        try:
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("BEGIN IMMEDIATE")
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+
+    def path(self, key: str) -> str:
+        """
+        Get the path of a file in the cache.
+        """
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get the path of a file, if it is cached, and update its access time.
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """
+        Get the paths of the files that are cached, and update their access times.
+
+        Files that are not in the index (e.g. cached before the index was used)
+        are added to it.
+        """
+        paths = {}
+        with self.connect() as db:
+            now = time.time()
+            for key in keys:
+                path = self.path(key)
+                try:
+                    size = os.path.getsize(path)
+                except FileNotFoundError:
+                    continue
+                updated = db.execute(
+                    "UPDATE files SET accessed = ? WHERE key = ?", (now, key)
+                ).rowcount
+                if not updated:
+                    db.execute("INSERT INTO files VALUES (?, ?, ?)", (key, size, now))
+                    increment(db, size)
+                paths[key] = path
+        return paths
+
+    def add(self, key: str, write: Callable[[BinaryIO], None]) -> str:
+        """
+        Add a file to the cache and return its path.
+
+        The file is written, using the `write` function, to a temporary file
+        which is then renamed so that concurrent users of the cache never see
+        a partially written file. Files are then evicted, if necessary, to keep
+        the cache within budget.
+        """
+        path = self.path(key)
+        ensure_parent(path)
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), delete=False
+        ) as file:
+            write(file)
+        size = os.path.getsize(file.name)
+        os.replace(file.name, path)
+
+        with self.connect() as db:
+            row = db.execute("SELECT size FROM files WHERE key = ?", (key,)).fetchone()
+            db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (key, size, time.time()),
+            )
+            increment(db, size - (row[0] if row else 0))
+            self.evict_within(db, self.budget)
+        return path
+
+    def evict(self, budget: Optional[int] = None):
+        """
+        Evict the least recently used files until the cache is within budget.
+
+        Each eviction looks up the oldest file using the index on access times
+        and the running total of the size of the cache is maintained (rather than
+        being measured).
+        """
+        with self.connect() as db:
+            self.evict_within(db, self.budget if budget is None else budget)
+
+    def evict_within(self, db: sqlite3.Connection, budget: int):
+        """
+        Evict files, within a transaction, until the cache is within budget.
+        """
+        (cached_bytes,) = db.execute(
+            "SELECT value FROM totals WHERE name = 'cached_bytes'"
+        ).fetchone()
+        while cached_bytes > budget:
+            row = db.execute(
+                "SELECT key, size FROM files WHERE accessed < ? "
+                "ORDER BY accessed LIMIT 1",
+                (time.time() - self.min_age,),
+            ).fetchone()
+            if row is None:
+                logger.warning(
+                    "File cache is over budget but all files are in use",
+                    extra=dict(root=self.root),
+                )
+                break
+
+            key, size = row
+            for suffix in ("",) + self.suffixes:
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(self.path(key) + suffix)
+            db.execute("DELETE FROM files WHERE key = ?", (key,))
+            increment(db, -size)
+            cached_bytes -= size
+
+    def cached_bytes(self) -> int:
+        """
+        Get the total size of the cached files.
+        """
+        with self.connect() as db:
+            (value,) = db.execute(
+                "SELECT value FROM totals WHERE name = 'cached_bytes'"
+            ).fetchone()
+        return value
+
+
+def increment(db: sqlite3.Connection, amount: int):
+    """
+    Increment the total size of the cached files in the index.
+    """
+    db.execute(
+        "UPDATE totals SET value = value + ? WHERE name = 'cached_bytes'", (amount,)
+    )
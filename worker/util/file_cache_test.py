@@ -0,0 +1,75 @@
+import os
+import time
+
+from .file_cache import FileCache
+
+
+def add(cache, key, size):
+    """Add a file of the given size to the cache."""
+    return cache.add(key, lambda file: file.write(b"x" * size))
+
+
+def test_add_and_get(tempdir):
+    """
+    Test that files are added to, and got from, the cache and that
+    files that are not in the index are added to it.
+    """
+    cache = FileCache(tempdir.path + "/cache", budget=10000, min_age=0)
+    assert cache.get("aaaa") is None
+
+    path = add(cache, "aaaa", 1000)
+    assert path == os.path.join(tempdir.path, "cache", "aa", "aaaa")
+    assert cache.get("aaaa") == path
+    assert cache.cached_bytes() == 1000
+
+    # Replacing a file updates the total size
+    add(cache, "aaaa", 500)
+    assert cache.cached_bytes() == 500
+
+    # An unindexed file
+    os.makedirs(tempdir.path + "/cache/bb")
+    with open(tempdir.path + "/cache/bb/bbbb", "wb") as file:
+        file.write(b"x" * 100)
+    assert cache.get_many(["aaaa", "bbbb", "cccc"]) == {
+        "aaaa": path,
+        "bbbb": cache.path("bbbb"),
+    }
+    assert cache.cached_bytes() == 600
+
+
+def test_evict(tempdir):
+    """
+    Test that the least recently used files are evicted
+    to keep the cache within budget.
+    """
+    cache = FileCache(tempdir.path + "/cache", budget=2500, min_age=0)
+
+    for key in ("aaaa", "bbbb"):
+        add(cache, key, 1000)
+        time.sleep(0.01)
+    # Access the first file so that the second is the least recently used
+    cache.get("aaaa")
+    time.sleep(0.01)
+
+    add(cache, "cccc", 1000)
+    assert cache.get("bbbb") is None
+    assert not os.path.exists(cache.path("bbbb"))
+    assert cache.get("aaaa") is not None
+    assert cache.get("cccc") is not None
+    assert cache.cached_bytes() == 2000
+
+    cache.evict(budget=0)
+    assert cache.cached_bytes() == 0
+    assert os.listdir(tempdir.path + "/cache/aa") == []
+
+
+def test_evict_min_age(tempdir):
+    """
+    Test that recently accessed files are not evicted, even if over budget.
+    """
+    cache = FileCache(tempdir.path + "/cache", budget=1500, min_age=60)
+    add(cache, "aaaa", 1000)
+    add(cache, "bbbb", 1000)
+    assert cache.get("aaaa") is not None
+    assert cache.get("bbbb") is not None
+    assert cache.cached_bytes() == 2000
@@ -4,7 +4,7 @@ import os
 import shutil
 import tempfile
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, BinaryIO, Dict, Optional, Tuple
 
 import filetype
 
@@ -43,9 +43,14 @@ def list_files(directory: str = ".") -> Files:
     return files
 
 
-def file_info(path: str, mimetype: Optional[str] = None) -> FileInfo:
+def file_info(
+    path: str, mimetype: Optional[str] = None, fingerprint: Optional[str] = None
+) -> FileInfo:
     """
     Get info on a file.
+
+    If the `fingerprint` of the file is already known (e.g. it was generated
+    by `copy_fingerprint` as it was written) then it is not generated again.
     """
     if mimetype:
         encoding = None
@@ -57,10 +62,58 @@ def file_info(path: str, mimetype: Optional[str] = None) -> FileInfo:
         "mimetype": mimetype,
         "encoding": encoding,
         "modified": os.path.getmtime(path),
-        "fingerprint": file_fingerprint(path),
+        "fingerprint": fingerprint or file_fingerprint(path),
     }
 
 
+def file_unchanged(
+    path: str, previous: Optional[FileInfo], etag: Optional[str] = None
+) -> bool:
+    """
+    Is a file unchanged since it was previously pulled?
+
+    The file must be on disk with the same size and modification time as
+    recorded in the `previous` info (i.e. from the manifest of previously
+    pulled files sent with a `Pull` job). If an `etag` for the upstream version
+    of the file is provided, it must be the same as that previously recorded.
+    """
+    if not previous or not os.path.isfile(path):
+        return False
+    if etag is not None and etag != previous.get("etag"):
+        return False
+    stat = os.stat(path)
+    return (
+        stat.st_size == previous.get("size")
+        and abs(stat.st_mtime - (previous.get("modified") or 0)) < 0.001
+    )
+
+
+def pulled_file_info(
+    path: str,
+    previous: Optional[FileInfo],
+    etag: Optional[str] = None,
+    fingerprint: Optional[str] = None,
+) -> FileInfo:
+    """
+    Get info on a file that has just been pulled.
+
+    If the content of the file is the same as when previously pulled, its
+    modification time is reset to that previously recorded so that it is
+    seen as unchanged by `file_unchanged` in subsequent pulls.
+    """
+    info = file_info(path, fingerprint=fingerprint)
+    if etag is not None:
+        info["etag"] = etag
+    if (
+        previous
+        and previous.get("modified")
+        and info["fingerprint"] == previous.get("fingerprint")
+    ):
+        os.utime(path, (previous["modified"], previous["modified"]))
+        info["modified"] = previous["modified"]
+    return info
+
+
 def file_ext(path: str) -> Optional[str]:
     """
     Get the extension of a file.
@@ -93,6 +146,23 @@ def file_fingerprint(path: str) -> str:
     return h.hexdigest()
 
 
+def copy_fingerprint(source: BinaryIO, path: str) -> str:
+    """
+    Copy a stream to a file, generating a SHA256 fingerprint of its contents.
+
+    An alternative to writing a file and then calling `file_fingerprint`
+    which avoids reading the file back from disk.
+    """
+    h = hashlib.sha256()
+    b = bytearray(128 * 1024)
+    mv = memoryview(b)
+    with open(path, "wb") as f:
+        for n in iter(lambda: source.readinto(mv), 0):  # type: ignore
+            h.update(mv[:n])
+            f.write(mv[:n])
+    return h.hexdigest()
+
+
 def bytes_fingerprint(data: bytes) -> str:
     """
     Generate a SHA256 fingerprint of bytes.
@@ -2,6 +2,7 @@ import json
 import os
 from typing import Dict
 
+import httplib2
 from googleapiclient.discovery import build
 from oauth2client.client import GoogleCredentials
 
@@ -26,6 +27,16 @@ def google_credentials(secrets: Dict) -> GoogleCredentials:
     )
 
 
+def google_http(secrets: Dict) -> httplib2.Http:
+    """
+    Create an authorized HTTP object to use with Google APIs.
+
+    Service clients are not thread safe but can be shared between threads
+    if each thread executes requests using its own HTTP object.
+    """
+    return google_credentials(secrets).authorize(httplib2.Http())
+
+
 def gdocs_service(secrets: Dict):
     """
     Build a Google Docs API service client.
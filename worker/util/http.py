@@ -1,22 +1,46 @@
+import hashlib
 import ipaddress
+import json
 import mimetypes
 import os
 import re
 import shutil
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from socket import gethostbyname
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from .cache import expiring_lru_cache
+from .file_cache import FileCache
+
+# Number of threads used to pull files concurrently
+HTTP_PULL_THREADS = int(os.getenv("HTTP_PULL_THREADS", 8))
 
 
 class HttpSession(requests.sessions.Session):
-    def __init__(self):
+    def __init__(self, cache_dir: Optional[str] = None):
+        """
+        Create a HTTP session.
+
+        :param cache_dir: A directory to cache pulled files in. If provided,
+                          files are only pulled once for each URL (unless
+                          revalidated or evicted from the cache, which has
+                          a size budget, see `util.file_cache`).
+        """
         super().__init__()
         self.max_redirects = 5
         self.headers = {"User-Agent": "Stencila Hub HTTP Client"}
+        self.cache_dir = cache_dir
+        self.cache = FileCache(cache_dir, suffixes=(".json",)) if cache_dir else None
+
+        # Allow a connection per thread to be reused when pulling concurrently
+        adapter = HTTPAdapter(pool_maxsize=HTTP_PULL_THREADS)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
 
     def get_redirect_target(self, resp):
         # Override to run each redirect target through the malicious
@@ -41,12 +65,78 @@ class HttpSession(requests.sessions.Session):
         self.check_host(url)
         return self.get(url, stream=stream, allow_redirects=True)
 
-    def pull(self, url, sink):
-        with self.fetch_url(url, stream=True) as response:
-            assert response.status_code == 200
-            with open(sink, "wb") as file:
-                for chunk in response:
-                    file.write(chunk)
+    def pull(self, url, sink, revalidate=False):
+        """
+        Pull a URL to a file.
+
+        If the session has a cache directory, the file is copied from
+        the cache if it has previously been pulled. If `revalidate` is true,
+        a conditional request is made to check that the cached file is still
+        current (use for URLs whose content may change).
+        """
+        if not self.cache:
+            with self.fetch_url(url, stream=True) as response:
+                assert response.status_code == 200
+                with open(sink, "wb") as file:
+                    for chunk in response:
+                        file.write(chunk)
+            return
+
+        key = hashlib.sha256(url.encode()).hexdigest()
+        cache_path = self.cache.path(key)
+        validators_path = cache_path + ".json"
+
+        cached = self.cache.get(key) is not None
+        if not cached or revalidate:
+            headers = {}
+            if cached and os.path.exists(validators_path):
+                with open(validators_path) as file:
+                    headers = json.load(file)
+
+            self.check_host(url)
+            with self.get(
+                url, headers=headers, stream=True, allow_redirects=True
+            ) as response:
+                if not (headers and response.status_code == 304):
+                    assert response.status_code == 200
+                    self.cache_response(response, key)
+
+        shutil.copyfile(cache_path, sink)
+
+    def cache_response(self, response, key):
+        """
+        Write a response to the cache.
+
+        Also records the validators of the response (if any) for revalidation.
+        """
+
+        def write(file):
+            for chunk in response:
+                file.write(chunk)
+
+        cache_path = self.cache.add(key, write)
+
+        validators = {}
+        if response.headers.get("ETag"):
+            validators["If-None-Match"] = response.headers["ETag"]
+        if response.headers.get("Last-Modified"):
+            validators["If-Modified-Since"] = response.headers["Last-Modified"]
+        with open(cache_path + ".json", "w") as file:
+            json.dump(validators, file)
+
+    def pull_all(self, pulls: List[Tuple[str, str]]):
+        """
+        Pull several URLs to files, concurrently.
+
+        :param pulls: A list of URL and file path pairs.
+        """
+        threads = min(HTTP_PULL_THREADS, len(pulls))
+        if threads > 1:
+            with ThreadPoolExecutor(threads) as executor:
+                list(executor.map(lambda pull: self.pull(*pull), pulls))
+        else:
+            for url, sink in pulls:
+                self.pull(url, sink)
 
     @classmethod
     def is_malicious_host(cls, hostname):
@@ -66,6 +156,17 @@ class HttpSession(requests.sessions.Session):
         else:
             return True  # Trying to access a site by IP
 
-        address = gethostbyname(hostname)
-        ip = ipaddress.ip_address(address)
-        return ip.is_loopback or ip.is_private
+        return is_private_host(hostname)
+
+
+@expiring_lru_cache(seconds=300, maxsize=1024)
+def is_private_host(hostname: str) -> bool:
+    """
+    Does a hostname resolve to a loopback or private IP address?
+
+    Caches the result to avoid a DNS lookup for every request
+    to the same host (e.g. when pulling the images of an article).
+    """
+    address = gethostbyname(hostname)
+    ip = ipaddress.ip_address(address)
+    return ip.is_loopback or ip.is_private
@@ -1,3 +1,8 @@
+import hashlib
+import os
+import time
+from unittest import mock
+
 import pytest
 
 from .http import HttpSession
@@ -15,3 +20,81 @@ def test_malicious_host(tempdir):
     with pytest.raises(ValueError) as excinfo:
         HttpSession().fetch_url("https://localhost/abc")
     assert "localhost is not a valid hostname" in str(excinfo.value)
+
+
+class MockedResponse:
+    """Mimics a streamed `requests` response."""
+
+    def __init__(self, status_code, content=b"", headers={}):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def __iter__(self):
+        return iter([self.content])
+
+
+def test_pull_cache(tempdir):
+    """Pulled files are cached, and revalidated if requested."""
+    session = HttpSession(cache_dir=os.path.join(tempdir.path, "cache"))
+    url = "https://example.org/image.png"
+    sink = os.path.join(tempdir.path, "image.png")
+
+    def pull(revalidate=False, response=None):
+        with mock.patch.object(
+            HttpSession, "is_malicious_host", return_value=False
+        ), mock.patch.object(session, "get", return_value=response) as get:
+            session.pull(url, sink, revalidate)
+        with open(sink, "rb") as file:
+            return file.read(), get.call_args
+
+    content, call = pull(response=MockedResponse(200, b"v1", {"ETag": '"1"'}))
+    assert content == b"v1"
+
+    content, call = pull()
+    assert content == b"v1"
+    assert call is None
+
+    content, call = pull(True, MockedResponse(304))
+    assert content == b"v1"
+    assert call[1]["headers"] == {"If-None-Match": '"1"'}
+
+    content, call = pull(True, MockedResponse(200, b"v2"))
+    assert content == b"v2"
+
+    session.pull_all([(url, sink + str(index)) for index in range(3)])
+    for index in range(3):
+        with open(sink + str(index), "rb") as file:
+            assert file.read() == b"v2"
+
+
+def test_pull_cache_evict(tempdir):
+    """Cached files, and their validators, are evicted when over budget."""
+    session = HttpSession(cache_dir=os.path.join(tempdir.path, "cache"))
+    session.cache.min_age = 0
+    sink = os.path.join(tempdir.path, "file")
+
+    paths = []
+    for url in ("https://example.org/a", "https://example.org/b"):
+        response = MockedResponse(200, b"x" * 1000, {"ETag": '"1"'})
+        with mock.patch.object(
+            HttpSession, "is_malicious_host", return_value=False
+        ), mock.patch.object(session, "get", return_value=response):
+            session.pull(url, sink)
+        paths.append(session.cache.path(hashlib.sha256(url.encode()).hexdigest()))
+        time.sleep(0.01)
+    assert all(os.path.exists(path + ".json") for path in paths)
+    assert session.cache.cached_bytes() == 2000
+
+    session.cache.evict(budget=1000)
+    assert session.cache.cached_bytes() == 1000
+    assert not os.path.exists(paths[0])
+    assert not os.path.exists(paths[0] + ".json")
+    assert os.path.exists(paths[1])
+    assert os.path.exists(paths[1] + ".json")
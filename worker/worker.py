@@ -7,7 +7,7 @@ A Celery app for running jobs.
 import os
 from typing import Type
 
-from celery import Celery
+from celery import Celery, bootsteps
 from kombu import Queue
 
 from jobs.archive import Archive
@@ -18,6 +18,8 @@ from jobs.extract import Extract
 from jobs.pin import Pin
 from jobs.pull import Pull
 from jobs.register import Register
+from jobs.session.kubernetes_controller import SessionController
+from jobs.session.kubernetes_session import SESSION_CONTROLLER, api_instance
 from jobs.session.session import Session
 from jobs.sleep import Sleep
 
@@ -88,3 +90,31 @@ def register(cls: Type[Job]):
 
 for job in JOBS:
     register(job)
+
+
+class SessionControllerStep(bootsteps.StartStopStep):
+    """
+    A worker boot step that runs a `SessionController`.
+
+    The controller is run in the worker's main process (rather than in the
+    child processes that run jobs) so that it can watch the pods of all of
+    the sessions launched by the worker and so that it receives the revocations
+    of cancelled jobs. It is only run if sessions are run on Kubernetes
+    (see `jobs/session/session.py`).
+    """
+
+    def __init__(self, worker, **kwargs):
+        super().__init__(worker, **kwargs)
+        self.controller = None
+
+    def start(self, worker):
+        if SESSION_CONTROLLER and api_instance is not None:
+            self.controller = SessionController(worker.app, worker.hostname)
+            self.controller.start()
+
+    def stop(self, worker):
+        if self.controller:
+            self.controller.stop()
+
+
+app.steps["worker"].add(SessionControllerStep)